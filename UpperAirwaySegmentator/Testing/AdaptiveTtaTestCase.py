@@ -0,0 +1,63 @@
+import importlib.util
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+from UpperAirwaySegmentatorInference.Parameter import InferenceParameter
+from UpperAirwaySegmentatorInference.Predictor import AirwayPredictor
+
+
+def cumulativeSumNetwork(tile):
+    """
+    Two label network which isn't mirroring invariant : cumulative sum along the last axis.
+    """
+    import torch
+    return torch.cat([tile, -tile], dim=1).cumsum(dim=-1)
+
+
+class AdaptiveTtaTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        Path(self.tmpDir.name).joinpath("dataset.json").write_text("{}")
+        self.airwayPredictor = AirwayPredictor(self.tmpDir.name, adaptiveTta=True)
+        self.airwayPredictor._predictor = SimpleNamespace(
+            network=cumulativeSumNetwork, allowed_mirroring_axes=(0, 1, 2)
+        )
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    @unittest.skipUnless(importlib.util.find_spec("torch"), "torch is not installed")
+    def test_only_tiles_with_uncertain_voxels_are_uncertain(self):
+        import torch
+
+        confident = torch.zeros((2, 8, 8, 8))
+        confident[0] = 10
+        self.assertFalse(self.airwayPredictor.isTileUncertain(confident))
+
+        uncertain = confident.clone()
+        uncertain[0, :2] = 0.1
+        self.assertTrue(self.airwayPredictor.isTileUncertain(uncertain))
+
+        self.airwayPredictor.ttaUncertainFraction = 0.5
+        self.assertFalse(self.airwayPredictor.isTileUncertain(uncertain))
+
+    @unittest.skipUnless(importlib.util.find_spec("torch"), "torch is not installed")
+    def test_mirrored_tile_blends_all_mirroring_combinations(self):
+        import torch
+
+        tile = torch.rand((1, 1, 4, 6, 8))
+        plain = cumulativeSumNetwork(tile)[0]
+        expected = plain.clone()
+        for axes in [(2,), (3,), (4,), (2, 3), (2, 4), (3, 4), (2, 3, 4)]:
+            expected += torch.flip(cumulativeSumNetwork(torch.flip(tile, axes)), axes)[0]
+        expected /= 8
+
+        torch.testing.assert_close(self.airwayPredictor.predictMirroredTile(tile, plain), expected)
+        self.assertNotEqual(float((expected - plain).abs().max()), 0.0)
+
+    def test_adaptive_tta_is_forwarded_to_worker(self):
+        args = InferenceParameter(modelPath="model", adaptiveTta=True).toWorkerArgs()
+        self.assertIn("--adaptive-tta", args)
+        self.assertNotIn("--adaptive-tta", InferenceParameter(modelPath="model").toWorkerArgs())
@@ -0,0 +1,34 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from UpperAirwaySegmentatorInference.Cancellation import CancelFile, InferenceCancelled
+
+
+class CancellationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpDir.name).joinpath("job", "cancel")
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_cancel_request_is_seen_by_worker(self):
+        workerCancelFile = CancelFile(self.path, checkInterval_s=0)
+        workerCancelFile.check()
+        self.assertFalse(workerCancelFile.isRequested())
+
+        CancelFile(self.path).request()
+        self.assertTrue(workerCancelFile.isRequested())
+        with self.assertRaises(InferenceCancelled):
+            workerCancelFile.check()
+
+    def test_cancel_file_is_checked_at_most_once_per_interval(self):
+        workerCancelFile = CancelFile(self.path, checkInterval_s=60)
+        self.assertFalse(workerCancelFile.isRequested())
+        CancelFile(self.path).request()
+        self.assertFalse(workerCancelFile.isRequested())
+
+    def test_cancel_is_not_a_runtime_error(self):
+        # nnU-Net catches RuntimeError during the sliding window prediction to retry it on CPU
+        self.assertFalse(issubclass(InferenceCancelled, RuntimeError))
@@ -0,0 +1,103 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from UpperAirwaySegmentatorInference.Checkpoint import (
+    WEIGHTS_FOLDER_NAME,
+    convertCheckpoint,
+    loadCheckpoint,
+    loadNetworkWeights,
+    readResidentMemory,
+    weightsPath,
+)
+from UpperAirwaySegmentatorInference.Parameter import InferenceParameter
+from UpperAirwaySegmentatorInference.PreprocessingCache import fileHash
+
+
+class CheckpointTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.checkpointPath = Path(self.tmpDir.name).joinpath("fold_0", "checkpoint_final.pth")
+        self.checkpointPath.parent.mkdir()
+        self.cacheFolder = Path(self.tmpDir.name).joinpath("cache")
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_weights_file_is_in_cache_and_named_after_checkpoint_hash(self):
+        self.checkpointPath.write_bytes(b"checkpoint")
+        self.cacheFolder.mkdir()
+        path = weightsPath(self.checkpointPath, self.cacheFolder)
+        self.assertEqual(path.parent, self.cacheFolder / WEIGHTS_FOLDER_NAME)
+        self.assertEqual(path.name, fileHash(self.checkpointPath) + ".weights.pth")
+
+        # Same content at another path, for instance a copy of a model store entry
+        copyPath = self.checkpointPath.with_name("copy.pth")
+        copyPath.write_bytes(b"checkpoint")
+        self.assertEqual(weightsPath(copyPath, self.cacheFolder), path)
+
+        self.checkpointPath.write_bytes(b"updated checkpoint")
+        self.assertNotEqual(weightsPath(self.checkpointPath, self.cacheFolder), path)
+
+    def test_resident_memory_is_read_from_process_status(self):
+        statusPath = Path(self.tmpDir.name).joinpath("status")
+        statusPath.write_text("Name:\tpython\nVmRSS:\t  204800 kB\nRssAnon:\t  102400 kB\nRssFile:\t  102400 kB\n")
+        self.assertEqual(
+            readResidentMemory(statusPath), {"rss_MB": 200.0, "anonymous_MB": 100.0, "file_MB": 100.0}
+        )
+        self.assertIsNone(readResidentMemory(statusPath.with_name("missing")))
+
+    @unittest.skipUnless(importlib.util.find_spec("torch"), "torch is not installed")
+    def test_converted_weights_are_memory_mapped_and_shared_with_network(self):
+        import torch
+
+        network = torch.nn.Linear(64, 2)
+        torch.save({
+            "network_weights": network.state_dict(),
+            "optimizer_state": {"state": {0: torch.rand(64, 64)}},
+            "trainer_name": "nnUNetTrainer",
+            "init_args": {"configuration": "3d_fullres"},
+        }, self.checkpointPath)
+
+        convertedPath = convertCheckpoint(self.checkpointPath, self.cacheFolder)
+        self.assertEqual(convertedPath, weightsPath(self.checkpointPath, self.cacheFolder))
+        self.assertLess(convertedPath.stat().st_size, self.checkpointPath.stat().st_size)
+
+        # Model folders may be shared model store entries and are left unchanged
+        self.assertEqual(list(self.checkpointPath.parent.iterdir()), [self.checkpointPath])
+
+        # Converted once
+        mtime = convertedPath.stat().st_mtime_ns
+        self.assertEqual(convertCheckpoint(self.checkpointPath, self.cacheFolder), convertedPath)
+        self.assertEqual(convertedPath.stat().st_mtime_ns, mtime)
+
+        checkpoint = loadCheckpoint(convertedPath)
+        self.assertNotIn("optimizer_state", checkpoint)
+        self.assertEqual(checkpoint["trainer_name"], "nnUNetTrainer")
+
+        loaded = torch.nn.Linear(64, 2)
+        loadNetworkWeights(loaded, checkpoint["network_weights"])
+        self.assertTrue(torch.equal(loaded.weight, network.weight))
+        self.assertEqual(loaded.weight.data_ptr(), checkpoint["network_weights"]["weight"].data_ptr())
+
+    @unittest.skipUnless(importlib.util.find_spec("torch"), "torch is not installed")
+    def test_updated_checkpoint_is_converted_again(self):
+        import torch
+
+        torch.save({"network_weights": {"weight": torch.zeros(2)}}, self.checkpointPath)
+        convertedPath = convertCheckpoint(self.checkpointPath, self.cacheFolder)
+        torch.save({"network_weights": {"weight": torch.ones(2)}}, self.checkpointPath)
+        stat = self.checkpointPath.stat()
+        os.utime(self.checkpointPath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        updatedPath = convertCheckpoint(self.checkpointPath, self.cacheFolder)
+        self.assertNotEqual(updatedPath, convertedPath)
+        weights = loadCheckpoint(updatedPath)["network_weights"]
+        self.assertTrue(torch.equal(weights["weight"], torch.ones(2)))
+
+    def test_parameter_forwards_model_cache_to_worker(self):
+        args = InferenceParameter(modelPath="model", modelCacheFolder="cache").toWorkerArgs()
+        self.assertEqual(args[args.index("--model-cache") + 1], "cache")
+        self.assertNotIn("--model-cache", InferenceParameter(modelPath="model").toWorkerArgs())
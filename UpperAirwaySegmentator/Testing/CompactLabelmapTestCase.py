@@ -0,0 +1,56 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from UpperAirwaySegmentatorInference.CompactLabelmap import (
+    CompactLabelmap,
+    labelmapBoundingBox,
+    runLengthDecode,
+    runLengthEncode,
+)
+
+
+class CompactLabelmapTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.labelmap = np.zeros((60, 80, 100), dtype=np.uint8)
+        self.labelmap[10:40, 30:50, 20:25] = 1
+        self.labelmap[12:20, 35:38, 60:70] = 2
+        self.ijkToRas = [[-0.3, 0, 0, 10], [0, -0.3, 0, 20], [0, 0, 0.3, -5], [0, 0, 0, 1]]
+        self.segments = [{"id": "Segment_1", "name": "Airway", "color": [0.1, 0.5, 0.9], "label": 1}]
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_bounding_box_covers_non_zero_voxels(self):
+        self.assertEqual(labelmapBoundingBox(self.labelmap), [(10, 40), (30, 50), (20, 70)])
+        self.assertIsNone(labelmapBoundingBox(np.zeros((4, 4, 4), dtype=np.uint8)))
+
+    def test_run_length_encoding_is_lossless(self):
+        values, lengths = runLengthEncode(self.labelmap)
+        self.assertLess(values.nbytes + lengths.nbytes, self.labelmap.nbytes / 10)
+        np.testing.assert_array_equal(runLengthDecode(values, lengths, self.labelmap.shape), self.labelmap)
+
+    def test_round_trips_through_file_with_geometry(self):
+        for runLength in [True, False]:
+            compact = CompactLabelmap.fromArray(self.labelmap, self.ijkToRas, self.segments, runLength=runLength)
+            self.assertEqual(compact.isRunLengthEncoded, runLength)
+            self.assertLess(compact.nbytes, self.labelmap.nbytes)
+
+            path = Path(self.tmpDir.name).joinpath(f"case_{runLength}.seg.npz")
+            compact.save(path)
+            self.assertTrue(path.exists())
+
+            loaded = CompactLabelmap.load(path)
+            np.testing.assert_array_equal(loaded.toArray(), self.labelmap)
+            self.assertEqual(loaded.toArray().dtype, self.labelmap.dtype)
+            self.assertEqual(loaded.ijkToRas, self.ijkToRas)
+            self.assertEqual(loaded.segments, self.segments)
+
+    def test_empty_labelmap_keeps_its_shape(self):
+        empty = np.zeros((5, 6, 7), dtype=np.uint16)
+        path = Path(self.tmpDir.name).joinpath("empty.seg.npz")
+        CompactLabelmap.fromArray(empty).save(path)
+        np.testing.assert_array_equal(CompactLabelmap.load(path).toArray(), empty)
@@ -0,0 +1,55 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from UpperAirwaySegmentatorInference.FieldOfView import FieldOfView, findFieldOfView
+
+
+def cbctPhantom(shape=(80, 100, 100), background=-1000):
+    """
+    Noisy cylinder of air containing a block of tissue, padded with empty slices.
+    """
+    rng = np.random.default_rng(0)
+    array = np.full(shape, background, dtype=np.int16)
+    k, j, i = np.ogrid[:shape[0], :shape[1], :shape[2]]
+    cylinder = ((j - shape[1] / 2) ** 2 + (i - shape[2] / 2) ** 2 < (0.45 * shape[1]) ** 2) & (k >= 10)
+    array[cylinder] = rng.integers(-900, -700, size=int(cylinder.sum()))
+    array[20:60, 30:70, 35:65] = rng.integers(0, 1500, size=(40, 40, 30))
+    return array
+
+
+class FieldOfViewTestCase(unittest.TestCase):
+    def test_dead_margins_are_trimmed_around_tissue(self):
+        array = cbctPhantom()
+        fieldOfView = findFieldOfView(array, margin_mm=2.0)
+        self.assertTrue(fieldOfView.isTrimmed)
+        self.assertGreater(fieldOfView.voxelReduction, 0.5)
+        for axisSlice, (start, stop) in zip(fieldOfView.region, [(20, 60), (30, 70), (35, 65)]):
+            self.assertLessEqual(axisSlice.start, start)
+            self.assertGreaterEqual(axisSlice.stop, stop)
+            self.assertGreaterEqual(axisSlice.start, start - 4)
+            self.assertLessEqual(axisSlice.stop, stop + 4)
+
+    def test_uniform_volume_is_kept(self):
+        array = np.zeros((20, 20, 20), dtype=np.int16)
+        self.assertFalse(findFieldOfView(array).isTrimmed)
+
+    def test_small_reductions_are_ignored(self):
+        array = np.random.default_rng(0).integers(0, 1000, size=(40, 40, 40)).astype(np.int16)
+        array[0] = 0
+        self.assertFalse(findFieldOfView(array, minReduction=0.5).isTrimmed)
+
+    def test_restore_pads_region_to_original_shape(self):
+        fieldOfView = FieldOfView((slice(1, 3), slice(0, 4), slice(2, 4)), (4, 4, 4))
+        restored = fieldOfView.restore(np.ones(fieldOfView.shape, dtype=np.uint8))
+        self.assertEqual(restored.shape, (4, 4, 4))
+        self.assertEqual(int(restored.sum()), 16)
+        self.assertTrue(restored[1:3, :, 2:4].all())
+
+        with tempfile.TemporaryDirectory() as tmpDir:
+            inputPath, outputPath = Path(tmpDir, "region.npy"), Path(tmpDir, "restored.npy")
+            np.save(inputPath, np.ones(fieldOfView.shape, dtype=np.uint8))
+            fieldOfView.restoreNpy(inputPath, outputPath)
+            np.testing.assert_array_equal(np.load(outputPath), restored)
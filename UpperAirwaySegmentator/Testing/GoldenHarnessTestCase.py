@@ -0,0 +1,170 @@
+import importlib.util
+import json
+import math
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from UpperAirwaySegmentatorInference.GoldenHarness import (
+    ExecutionMode,
+    LabelmapComparison,
+    Tolerance,
+    GoldenHarness,
+    compareLabelmaps,
+    defaultModes,
+    loadTolerances,
+    runInterruptedAndResumed,
+    runTrimmedFieldOfView,
+)
+
+# Copies the input volume as its segmentation. With an interrupt marker, the first run reports a tile checkpoint and
+# waits to be killed, the next runs report resuming from it.
+COPY_WORKER_SCRIPT = """
+import shutil, sys, time
+from pathlib import Path
+volumePath, outputFolder, interruptMarker = sys.argv[1:4]
+output = Path(outputFolder)
+output.mkdir(parents=True, exist_ok=True)
+if interruptMarker:
+    marker = Path(interruptMarker)
+    if not marker.exists():
+        marker.touch()
+        print("Fold 0 : 1 / 4 tiles done.", flush=True)
+        time.sleep(60)
+    print("Resuming fold 0 from tile 1 / 4.", flush=True)
+case = Path(volumePath).name.split("_0000.nii")[0]
+shutil.copyfile(volumePath, output / (case + ".nii.gz"))
+"""
+
+
+class CopyGoldenHarness(GoldenHarness):
+    """
+    Golden harness copying the inputs instead of running the model.
+    """
+
+    def __init__(self, *args, interruptMarker="", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.interruptMarker = interruptMarker
+        self.workerRuns = []
+
+    def workerCommand(self, mode, volumePath, outputFolder):
+        self.workerRuns.append((mode.name, Path(volumePath)))
+        interruptMarker = self.interruptMarker if mode.name != "fp32" else ""
+        return [sys.executable, "-c", COPY_WORKER_SCRIPT, Path(volumePath).as_posix(), Path(outputFolder).as_posix(),
+                interruptMarker]
+
+
+class GoldenHarnessTestCase(unittest.TestCase):
+    def test_tolerance_reports_each_exceeded_metric(self):
+        tolerance = Tolerance(minDice=0.98, maxHausdorff_mm=2.0, maxVoxelDifferences=10)
+        self.assertEqual(tolerance.violations(LabelmapComparison(0.99, 1.0, 1.0, 5)), [])
+        self.assertEqual(len(tolerance.violations(LabelmapComparison(0.9, 3.0, 2.5, 50))), 3)
+
+    def test_empty_labelmaps_are_identical(self):
+        empty = np.zeros((4, 4, 4), dtype=np.uint8)
+        self.assertEqual(compareLabelmaps(empty, empty), LabelmapComparison(1.0, 0.0, 0.0, 0))
+
+    def test_single_empty_labelmap_has_infinite_hausdorff(self):
+        golden = np.zeros((4, 4, 4), dtype=np.uint8)
+        golden[1:3, 1:3, 1:3] = 1
+        comparison = compareLabelmaps(np.zeros_like(golden), golden)
+        self.assertEqual(comparison.dice, 0.0)
+        self.assertTrue(math.isinf(comparison.hausdorff_mm))
+        self.assertEqual(comparison.voxelDifferences, 8)
+
+    def test_mismatching_shapes_raise(self):
+        with self.assertRaises(ValueError):
+            compareLabelmaps(np.zeros((2, 2, 2)), np.zeros((2, 2, 3)))
+
+    @unittest.skipUnless(importlib.util.find_spec("scipy"), "scipy is not installed")
+    def test_hausdorff_distance_uses_spacing(self):
+        golden = np.zeros((10, 10, 10), dtype=np.uint8)
+        golden[2:6, 2:6, 2:6] = 1
+        shifted = np.roll(golden, 2, axis=0)
+        comparison = compareLabelmaps(shifted, golden, spacing=(0.5, 1.0, 1.0))
+        self.assertAlmostEqual(comparison.hausdorff_mm, 1.0)
+        self.assertAlmostEqual(comparison.dice, 0.5)
+        self.assertEqual(comparison.voxelDifferences, 64)
+
+    def test_tolerances_can_be_overridden_from_file(self):
+        modes = [ExecutionMode("fp32"), ExecutionMode("bf16", tolerance=Tolerance(minDice=0.97))]
+        with tempfile.TemporaryDirectory() as tmpDir:
+            tolerancesFile = Path(tmpDir).joinpath("tolerances.json")
+            tolerancesFile.write_text(json.dumps({"bf16": {"maxVoxelDifferences": 100}}))
+            loadTolerances(modes, tolerancesFile)
+
+        self.assertEqual(modes[0].tolerance, Tolerance())
+        self.assertEqual(modes[1].tolerance, Tolerance(minDice=0.97, maxVoxelDifferences=100))
+
+    def test_reference_cases_pair_volumes_and_golden_labelmaps(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            for name in ["a_0000.nii.gz", "a.nii.gz", "b_0000.nii"]:
+                Path(tmpDir).joinpath(name).touch()
+            harness = GoldenHarness("model", tmpDir, Path(tmpDir) / "output", modes=[])
+            cases = [(case, volume.name, golden.name if golden else None)
+                     for case, volume, golden in harness.referenceCases()]
+
+        self.assertEqual(cases, [("a", "a_0000.nii.gz", "a.nii.gz"), ("b", "b_0000.nii", None)])
+
+    def test_default_modes_include_trimming_server_and_resumed_tile_checkpoints(self):
+        modes = {mode.name: mode for mode in defaultModes(cacheFolder="cache")}
+        self.assertIn("fov_trimming", modes)
+        self.assertIn("remote_server", modes)
+
+        tileMode = modes["tile_checkpoints"]
+        self.assertIs(tileMode.runner, runInterruptedAndResumed)
+        self.assertEqual(tileMode.referenceMode, "fp32")
+        self.assertEqual(tileMode.tolerance.maxVoxelDifferences, 0)
+
+    def writeReferenceCase(self, folder, array):
+        import SimpleITK as sitk
+
+        image = sitk.GetImageFromArray(array)
+        sitk.WriteImage(image, Path(folder, "case_0000.nii.gz").as_posix())
+        sitk.WriteImage(image, Path(folder, "case.nii.gz").as_posix())
+
+    @unittest.skipUnless(importlib.util.find_spec("SimpleITK"), "SimpleITK is not installed")
+    def test_tile_checkpoint_mode_is_interrupted_resumed_and_compared_against_fp32(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            array = np.zeros((8, 8, 8), dtype=np.uint8)
+            array[2:6, 2:6, 2:6] = 1
+            self.writeReferenceCase(tmpDir, array)
+            mode = ExecutionMode("tile_checkpoints", runner=runInterruptedAndResumed, referenceMode="fp32",
+                                 tolerance=Tolerance(maxVoxelDifferences=0))
+            harness = CopyGoldenHarness("model", tmpDir, Path(tmpDir) / "output", modes=[mode],
+                                        interruptMarker=Path(tmpDir, "interrupted").as_posix())
+            results = harness.run()
+
+        self.assertTrue(results[0].passed, results[0].violations)
+        self.assertEqual(results[0].comparison.voxelDifferences, 0)
+        self.assertEqual([name for name, _ in harness.workerRuns], ["tile_checkpoints", "tile_checkpoints", "fp32"])
+
+    @unittest.skipUnless(importlib.util.find_spec("SimpleITK"), "SimpleITK is not installed")
+    def test_tile_checkpoint_mode_fails_when_the_run_is_not_interrupted(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            self.writeReferenceCase(tmpDir, np.ones((4, 4, 4), dtype=np.uint8))
+            mode = ExecutionMode("tile_checkpoints", runner=runInterruptedAndResumed, referenceMode="fp32")
+            results = CopyGoldenHarness("model", tmpDir, Path(tmpDir) / "output", modes=[mode]).run()
+
+        self.assertFalse(results[0].passed)
+        self.assertIn("wasn't interrupted", results[0].violations[0])
+
+    @unittest.skipUnless(importlib.util.find_spec("SimpleITK"), "SimpleITK is not installed")
+    def test_field_of_view_trimming_mode_restores_the_full_volume_geometry(self):
+        import SimpleITK as sitk
+
+        with tempfile.TemporaryDirectory() as tmpDir:
+            array = np.zeros((40, 40, 40), dtype=np.int16)
+            array[10:30, 12:28, 8:32] = 1000
+            self.writeReferenceCase(tmpDir, array)
+            mode = ExecutionMode("fov_trimming", runner=runTrimmedFieldOfView, tolerance=Tolerance(minDice=1.0))
+            harness = CopyGoldenHarness("model", tmpDir, Path(tmpDir) / "output", modes=[mode])
+            results = harness.run()
+            trimmedShape = sitk.GetArrayFromImage(sitk.ReadImage(harness.workerRuns[0][1].as_posix())).shape
+
+        self.assertTrue(results[0].passed, results[0].violations)
+        self.assertEqual(results[0].comparison.voxelDifferences, 0)
+        self.assertLess(np.prod(trimmedShape), array.size)
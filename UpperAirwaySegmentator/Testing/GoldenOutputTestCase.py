@@ -0,0 +1,55 @@
+import shutil
+
+import pytest
+import qt
+import slicer
+
+from UpperAirwaySegmentatorInference.GoldenHarness import (
+    ExecutionMode,
+    GoldenHarness,
+    Tolerance,
+    defaultModes,
+    readLabelmap,
+)
+from UpperAirwaySegmentatorLib import PythonDependencyChecker, SegmentationWidget
+from UpperAirwaySegmentatorLib.PostProcessing import minimumIslandSizeInVoxels, removeSmallIslands
+from .Utils import UpperAirwaySegmentatorTestCase, get_test_label_path, load_test_CT_volume
+
+
+def removeSmallIslandsPostProcess(labelmap, outputFile):
+    _, spacing = readLabelmap(outputFile)
+    return removeSmallIslands(labelmap, minimumIslandSizeInVoxels(0.3 * 0.3 * 0.3 * 200, spacing))
+
+
+@pytest.mark.slow
+class GoldenOutputTestCase(UpperAirwaySegmentatorTestCase):
+    """
+    Runs every available inference execution mode on the dental sample volume and compares the results against the
+    stored airway labelmap.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.tmpDir = qt.QTemporaryDir()
+        self.referenceFolder = self.tmpDir.filePath("reference")
+        qt.QDir().mkpath(self.referenceFolder)
+
+        self.assertTrue(PythonDependencyChecker().downloadWeightsIfNeeded(lambda *_: None, askForUpdate=False))
+        slicer.util.saveNode(load_test_CT_volume(), f"{self.referenceFolder}/dental_0000.nii.gz")
+        shutil.copyfile(get_test_label_path(), f"{self.referenceFolder}/dental.nii.gz")
+
+    def test_execution_modes_match_golden_labelmaps(self):
+        outputFolder = self.tmpDir.filePath("output")
+        modes = defaultModes(cacheFolder=self.tmpDir.filePath("cache"))
+        modes.append(ExecutionMode("remove_small_islands", postProcess=removeSmallIslandsPostProcess))
+
+        # The stored labelmap was exported from Slicer after post-processing
+        for mode in modes:
+            mode.tolerance = Tolerance(minDice=min(mode.tolerance.minDice, 0.95))
+
+        harness = GoldenHarness(SegmentationWidget.nnUnetFolder(), self.referenceFolder, outputFolder, modes)
+        results = harness.run()
+
+        failures = [result.summary() for result in results if not result.passed]
+        self.assertEqual(failures, [])
+        self.assertTrue(all(result.runtime_s > 0 for result in results if not result.skipped))
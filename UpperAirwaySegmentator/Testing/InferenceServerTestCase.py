@@ -0,0 +1,179 @@
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from UpperAirwaySegmentatorInference.Client import InferenceClient
+from UpperAirwaySegmentatorInference.Parameter import InferenceParameter
+from UpperAirwaySegmentatorInference.Server import (
+    CANCELLED,
+    DONE,
+    PARAMETER_HEADER,
+    RUNNING,
+    InferenceServer,
+    createHttpServer,
+    parameterFromRequest,
+)
+
+# Copies each input to the output folder the way the inference worker names its outputs
+COPY_WORKER_SCRIPT = """
+import shutil, sys, time
+from pathlib import Path
+args = sys.argv[1:]
+inputs = [args[i + 1] for i, arg in enumerate(args) if arg == "--input"]
+output = Path(args[args.index("--output") + 1])
+delay_s = float(args[args.index("--delay") + 1])
+print(f"Loading model from {output}...", flush=True)
+for inputFile in inputs:
+    print(f"Preprocessing {inputFile}...", flush=True)
+    time.sleep(delay_s)
+    name = Path(inputFile).name.replace("_0000.nii.gz", ".nii.gz")
+    shutil.copyfile(inputFile, output / name)
+    print(f"Done with {output / name}", flush=True)
+"""
+
+
+class CopyInferenceServer(InferenceServer):
+    """
+    Inference server copying the inputs instead of running the model.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batchSizes = []
+        self.delay_s = 0.0
+
+    def workerCommand(self, batch, outputFolder, slot):
+        self.batchSizes.append(len(batch))
+        inputArgs = [arg for job in batch for arg in ("--input", job.inputPath.as_posix())]
+        return [
+            sys.executable, "-c", COPY_WORKER_SCRIPT, *inputArgs,
+            "--output", Path(outputFolder).as_posix(),
+            "--delay", str(self.delay_s),
+        ]
+
+
+class InferenceServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.tmpPath = Path(self.tmpDir.name)
+        self.server = CopyInferenceServer("model", self.tmpPath / "server", maxBatchSize=4)
+        self.httpServer = createHttpServer(self.server, port=0)
+        self.httpThread = threading.Thread(target=self.httpServer.serve_forever, daemon=True)
+        self.httpThread.start()
+        self.client = InferenceClient(f"http://127.0.0.1:{self.httpServer.server_address[1]}")
+
+        self.inputFile = self.tmpPath / "input.nii.gz"
+        self.inputFile.write_bytes(b"compressed volume")
+
+    def tearDown(self):
+        self.server.stop()
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+        self.tmpDir.cleanup()
+
+    def test_job_is_segmented_and_streams_progress(self):
+        self.server.start()
+        jobId = self.client.submit(self.inputFile, InferenceParameter())
+        events = list(self.client.events(jobId))
+
+        self.assertEqual(events[-1]["state"], DONE)
+        self.assertTrue(any("Done with" in event.get("progress", "") for event in events))
+
+        outputFile = self.tmpPath / "output.nii.gz"
+        self.assertTrue(self.client.download(jobId, outputFile))
+        self.assertEqual(outputFile.read_bytes(), b"compressed volume")
+        self.assertFalse(self.client.download(jobId, self.tmpPath / "probabilities.npy", "probabilities"))
+
+        self.client.cancel(jobId)
+        self.assertIsNone(self.client.cancel(jobId))
+        self.assertFalse(self.server.workFolder.joinpath("jobs", jobId).exists())
+
+    def test_queued_jobs_with_same_parameters_are_batched(self):
+        jobIds = [self.client.submit(self.inputFile, InferenceParameter()) for _ in range(3)]
+        otherJobId = self.client.submit(self.inputFile, InferenceParameter(folds="1"))
+        self.assertEqual(self.client.status(jobIds[1])["position"], 1)
+        self.assertEqual(self.client.health()["queued"], 4)
+
+        self.server.start()
+        for jobId in [*jobIds, otherJobId]:
+            self.assertEqual(list(self.client.events(jobId))[-1]["state"], DONE)
+        self.assertEqual(self.server.batchSizes, [3, 1])
+
+    def test_queued_job_can_be_cancelled(self):
+        jobId = self.client.submit(self.inputFile, InferenceParameter())
+        self.assertEqual(self.client.cancel(jobId)["state"], "cancelled")
+        self.assertEqual(self.client.health()["queued"], 0)
+
+    def test_client_cannot_choose_server_settings(self):
+        parameter = parameterFromRequest({"folds": "0,1", "modelPath": "/etc", "device": "cuda"}, "model", "cpu")
+        self.assertEqual((parameter.folds, Path(parameter.modelPath), parameter.device), ("0,1", Path("model"), "cpu"))
+
+        for requested in [{"folds": "0;rm"}, {"precision": "int4"}, {"checkPointName": "../checkpoint.pth"}]:
+            with self.assertRaises(ValueError):
+                parameterFromRequest(requested, "model", "cpu")
+
+        for requested in [[], "0", {"stepSize": None}, {"stepSize": "0.5"}, {"disableTta": "no"}, {"folds": True}]:
+            with self.assertRaises(ValueError):
+                parameterFromRequest(requested, "model", "cpu")
+
+    def test_invalid_parameter_header_is_rejected(self):
+        for header in ["[1]", '{"stepSize": null}', "not json"]:
+            request = urllib.request.Request(
+                f"{self.client.serverUrl}/jobs", data=b"volume", method="POST", headers={PARAMETER_HEADER: header}
+            )
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(request)
+            self.assertEqual(context.exception.code, 400)
+
+    def waitForState(self, jobId, state, timeout_s=10.0):
+        start = time.time()
+        while self.client.status(jobId)["state"] != state:
+            self.assertLess(time.time() - start, timeout_s)
+            time.sleep(0.01)
+
+    def test_cancelling_a_job_of_a_running_batch_keeps_the_other_jobs(self):
+        self.server.delay_s = 0.5
+        jobIds = [self.client.submit(self.inputFile, InferenceParameter()) for _ in range(3)]
+        self.server.start()
+        self.waitForState(jobIds[0], RUNNING)
+
+        self.assertEqual(self.client.cancel(jobIds[0])["state"], CANCELLED)
+        for jobId in jobIds[1:]:
+            self.assertEqual(list(self.client.events(jobId))[-1]["state"], DONE)
+        self.assertEqual(self.server.batchSizes, [3])
+
+        # Removed once the batch worker has exited
+        start = time.time()
+        while self.server.workFolder.joinpath("jobs", jobIds[0]).exists():
+            self.assertLess(time.time() - start, 10.0)
+            time.sleep(0.01)
+
+    def test_progress_is_routed_to_each_job_without_paths_or_job_ids(self):
+        jobIds = [self.client.submit(self.inputFile, InferenceParameter()) for _ in range(2)]
+        self.server.start()
+        for jobId in jobIds:
+            messages = [event.get("progress", "") for event in self.client.events(jobId)]
+            loadingMessages = [message for message in messages if message.startswith("Loading model from ")]
+            self.assertEqual(len(loadingMessages), 1)
+            self.assertNotIn("/", loadingMessages[0])
+            self.assertIn("Preprocessing input_0000.nii.gz...", messages)
+            self.assertEqual(sum("Done with" in message for message in messages), 1)
+            for message in messages:
+                self.assertNotIn(self.server.workFolder.as_posix(), message)
+                self.assertFalse(any(otherId in message for otherId in jobIds))
+
+    def test_expired_jobs_are_removed_while_jobs_keep_coming(self):
+        self.server.retention_s = 0.0
+        self.server.start()
+        expiredJobId = self.client.submit(self.inputFile, InferenceParameter())
+        self.assertEqual(list(self.client.events(expiredJobId))[-1]["state"], DONE)
+
+        jobId = self.client.submit(self.inputFile, InferenceParameter())
+        self.assertEqual(list(self.client.events(jobId))[-1]["state"], DONE)
+        self.assertIsNone(self.server.job(expiredJobId))
+        self.assertFalse(self.server.workFolder.joinpath("jobs", expiredJobId).exists())
@@ -1,6 +1,10 @@
+import threading
+
 import slicer
 
+from UpperAirwaySegmentatorInference.Server import InferenceServer, createHttpServer
 from UpperAirwaySegmentatorLib import PythonDependencyChecker, SegmentationWidget
+from UpperAirwaySegmentatorLib.RemoteSegmentationLogic import RemoteSegmentationLogic
 from .Utils import UpperAirwaySegmentatorTestCase, load_test_CT_volume
 import qt
 import pytest
@@ -34,5 +38,26 @@ class IntegrationTestCase(UpperAirwaySegmentatorTestCase):
         self.widget.applyButton.clicked()
         self.widget.logic.waitForSegmentationFinished()
         slicer.app.processEvents()
+        self.widget.waitForPostProcessingFinished()
+        segmentations = list(slicer.mrmlScene.GetNodesByClass("vtkMRMLSegmentationNode"))
+        self.assertEqual(len(segmentations), 1)
+
+    def test_upperairway_segmentator_can_run_segmentation_on_inference_server(self):
+        PythonDependencyChecker().downloadWeightsIfNeeded(lambda *_: None, askForUpdate=False)
+        inferenceServer = InferenceServer(SegmentationWidget.nnUnetFolder(), workFolder=self.tmpDir.path())
+        inferenceServer.start()
+        httpServer = createHttpServer(inferenceServer, port=0)
+        threading.Thread(target=httpServer.serve_forever, daemon=True).start()
+        self.addCleanup(inferenceServer.stop)
+        self.addCleanup(httpServer.server_close)
+        self.addCleanup(httpServer.shutdown)
+
+        serverUrl = f"http://127.0.0.1:{httpServer.server_address[1]}"
+        self.widget = SegmentationWidget(logic=RemoteSegmentationLogic(serverUrl))
+        self.widget.inputSelector.setCurrentNode(load_test_CT_volume())
+        self.widget.applyButton.clicked()
+        self.widget.logic.waitForSegmentationFinished()
+        slicer.app.processEvents()
+        self.widget.waitForPostProcessingFinished()
         segmentations = list(slicer.mrmlScene.GetNodesByClass("vtkMRMLSegmentationNode"))
         self.assertEqual(len(segmentations), 1)
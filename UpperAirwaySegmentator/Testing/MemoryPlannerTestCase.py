@@ -0,0 +1,133 @@
+import json
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from UpperAirwaySegmentatorInference.MemoryPlanner import (
+    GB,
+    MemoryPlanner,
+    PeakMemorySampler,
+    parsePeakMemory,
+    readModelPlans,
+    residentMemory_MB,
+)
+from UpperAirwaySegmentatorInference.Parameter import InferenceParameter
+
+
+class MemoryPlannerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.planner = MemoryPlanner(Path(self.tmpDir.name).joinpath("memory_history.jsonl"))
+        self.parameter = InferenceParameter(modelPath="model", folds="0,1", foldProcesses=2, device="cpu")
+        self.plans = {
+            "spacing": [0.6, 0.6, 0.6],
+            "patch_size": [128, 128, 128],
+            "channels": 1,
+            "classes": 2,
+            "checkpoint_sizes": {"0": 200 * 1024 ** 2, "1": 200 * 1024 ** 2},
+        }
+        self.shape, self.spacing = [400, 400, 400], [0.3, 0.3, 0.3]
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def estimatePeak(self, parameter):
+        return self.planner.estimate(parameter, self.shape, self.spacing, self.plans).peak
+
+    def test_model_plans_are_read_from_model_folder(self):
+        modelFolder = Path(self.tmpDir.name).joinpath("Dataset001__nnUNetPlans__3d_fullres")
+        modelFolder.joinpath("fold_0").mkdir(parents=True)
+        modelFolder.joinpath("fold_0", "checkpoint_final.pth").write_bytes(b"0" * 10)
+        modelFolder.joinpath("dataset.json").write_text(json.dumps({
+            "channel_names": {"0": "CT"}, "labels": {"background": 0, "airway": 1}, "file_ending": ".nii.gz"
+        }))
+        modelFolder.joinpath("plans.json").write_text(json.dumps({"configurations": {
+            "2d": {"spacing": [1.0, 1.0], "patch_size": [256, 256]},
+            "3d_fullres": {"spacing": [0.6, 0.6, 0.6], "patch_size": [128, 128, 128]},
+        }}))
+
+        plans = readModelPlans(self.tmpDir.name)
+        self.assertEqual(plans["spacing"], [0.6, 0.6, 0.6])
+        self.assertEqual((plans["channels"], plans["classes"]), (1, 2))
+        self.assertEqual(plans["checkpoint_sizes"], {"0": 10})
+
+    def test_peak_grows_with_input_size_and_fold_processes(self):
+        peak = self.estimatePeak(self.parameter)
+        self.shape = [200, 400, 400]
+        self.assertLess(self.estimatePeak(self.parameter), peak)
+
+        self.parameter.foldProcesses = 1
+        self.assertLess(self.estimatePeak(self.parameter), self.estimatePeak(InferenceParameter(
+            modelPath="model", folds="0,1", foldProcesses=2
+        )))
+
+    def test_low_memory_strategies_reduce_the_peak(self):
+        strategies = self.planner.strategies(self.parameter)
+        self.assertEqual([name for name, _ in strategies], ["default", "single fold process", "low memory"])
+        peaks = [self.estimatePeak(parameter) for _, parameter in strategies]
+        self.assertEqual(peaks, sorted(peaks, reverse=True))
+        self.assertTrue(strategies[-1][1].lowMemory)
+        self.assertFalse(self.parameter.lowMemory)
+
+    def test_plan_picks_fastest_strategy_fitting_in_memory(self):
+        plan = self.planner.plan(self.parameter, self.shape, self.spacing, available=256 * GB, plans=self.plans)
+        self.assertEqual(plan.strategy, "default")
+        self.assertIs(plan.parameter, self.parameter)
+
+        lowMemoryPeak = self.estimatePeak(InferenceParameter(modelPath="model", folds="0,1", lowMemory=True))
+        available = 1.01 * lowMemoryPeak / self.planner.usableMemoryFraction
+        plan = self.planner.plan(self.parameter, self.shape, self.spacing, available=available, plans=self.plans)
+        self.assertEqual(plan.strategy, "low memory")
+        self.assertFalse(plan.isRefused)
+        self.assertEqual(plan.parameter.foldProcesses, 1)
+        self.assertIn("low memory", plan.summary())
+
+    def test_plan_is_refused_when_leanest_strategy_does_not_fit(self):
+        plan = self.planner.plan(self.parameter, self.shape, self.spacing, available=1 * GB, plans=self.plans)
+        self.assertTrue(plan.isRefused)
+        self.assertIn("too large", plan.summary())
+
+    def test_unknown_available_memory_runs_requested_settings(self):
+        plan = self.planner.plan(self.parameter, self.shape, self.spacing, available=0, plans=self.plans)
+        self.assertFalse(plan.isRefused)
+        self.assertIs(plan.parameter, self.parameter)
+
+    def test_measured_runs_calibrate_the_estimate(self):
+        estimate = self.planner.estimate(self.parameter, self.shape, self.spacing, self.plans)
+        self.assertEqual(estimate.calibrationFactor, 1.0)
+
+        measured_MB = 1.5 * estimate.peak / 1024 ** 2
+        self.planner.logRun(self.parameter, estimate, measured_MB)
+        calibrated = self.planner.estimate(self.parameter, self.shape, self.spacing, self.plans)
+        self.assertAlmostEqual(calibrated.calibrationFactor, 1.5)
+        self.assertAlmostEqual(calibrated.peak, 1.5 * estimate.peak)
+
+        # Runs on other devices don't calibrate the estimate
+        self.parameter.device = "cuda"
+        self.assertEqual(self.planner.calibrationFactor(self.parameter), 1.0)
+
+    def test_peak_memory_is_parsed_from_worker_output(self):
+        self.assertEqual(parsePeakMemory("Peak memory : 2048 MB."), 2048.0)
+        self.assertIsNone(parsePeakMemory("Predicting fold 0 (1 / 1)..."))
+
+    def test_failed_runs_only_raise_the_estimate(self):
+        estimate = self.planner.estimate(self.parameter, self.shape, self.spacing, self.plans)
+        self.planner.logRun(self.parameter, estimate, 0.5 * estimate.peak / 1024 ** 2, failed=True)
+        self.assertEqual(self.planner.calibrationFactor(self.parameter), 1.0)
+
+        self.planner.logRun(self.parameter, estimate, 2.0 * estimate.peak / 1024 ** 2, failed=True)
+        self.assertAlmostEqual(self.planner.calibrationFactor(self.parameter), 2.0)
+
+    @unittest.skipIf(residentMemory_MB() is None, "resident memory is not reported on this platform")
+    def test_sampled_peak_includes_child_processes(self):
+        reports = []
+        child_MB = 200
+        with PeakMemorySampler(reports.append, interval_s=0.05):
+            subprocess.run([sys.executable, "-c", f"import time; x = bytearray({child_MB} * 1024 ** 2); time.sleep(1)"])
+
+        self.assertGreater(len(reports), 1)
+        peaks = [parsePeakMemory(report) for report in reports]
+        self.assertEqual(peaks, sorted(peaks))
+        self.assertGreater(peaks[-1], child_MB)
@@ -0,0 +1,82 @@
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+from unittest.mock import patch
+
+from UpperAirwaySegmentatorInference.ModelStore import ModelStore, resolveModelFolder
+
+
+class ModelStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmpDir = tempfile.TemporaryDirectory()
+        self.tmpPath = Path(self._tmpDir.name)
+        self.store = ModelStore(self.tmpPath / "store")
+
+    def tearDown(self):
+        self._tmpDir.cleanup()
+
+    def createArchive(self, name, content):
+        archivePath = self.tmpPath / f"{name}.zip"
+        with zipfile.ZipFile(archivePath, "w") as f:
+            f.writestr("Dataset/dataset.json", content)
+        return archivePath
+
+    def test_identical_archives_are_stored_once(self):
+        hashA = self.store.install(self.createArchive("a", "{}"), self.tmpPath / "installA", "urlA")
+        hashB = self.store.install(self.createArchive("b", "{}"), self.tmpPath / "installB", "urlB")
+        self.assertEqual(hashA, hashB)
+        self.assertEqual(len(list(self.store.objectsFolder.iterdir())), 1)
+
+        for install in ["installA", "installB"]:
+            modelFolder = resolveModelFolder(self.tmpPath / install)
+            self.assertEqual(modelFolder.joinpath("Dataset", "dataset.json").read_text(), "{}")
+
+    def test_known_urls_are_installed_without_archive(self):
+        modelHash = self.store.install(self.createArchive("a", "{}"), self.tmpPath / "installA", "url")
+        self.assertEqual(self.store.installFromUrl("url", self.tmpPath / "installB"), modelHash)
+        self.assertIsNone(self.store.installFromUrl("unknown", self.tmpPath / "installC"))
+        self.assertEqual(len(self.store.references()), 2)
+
+    def test_unreferenced_models_are_garbage_collected(self):
+        oldHash = self.store.install(self.createArchive("old", "old"), self.tmpPath / "install", "oldUrl")
+        newHash = self.store.install(self.createArchive("new", "new"), self.tmpPath / "install", "newUrl")
+
+        self.assertEqual(self.store.collectGarbage(), [oldHash])
+        self.assertTrue(self.store.hasModel(newHash))
+        self.assertIsNone(self.store.hashForUrl("oldUrl"))
+
+    def test_inaccessible_installs_are_kept_until_their_lease_expires(self):
+        sharedHash = self.store.install(self.createArchive("shared", "shared"), self.tmpPath / "installA", "sharedUrl")
+        self.store.installFromUrl("sharedUrl", self.tmpPath / "installB")
+        self.store.install(self.createArchive("new", "new"), self.tmpPath / "installA", "newUrl")
+
+        # Install B is on an unmounted drive, then in a folder this process can't read
+        unmountedPath = self.tmpPath / "unmounted"
+        (self.tmpPath / "installB").rename(unmountedPath)
+        self.assertEqual(self.store.collectGarbage(), [])
+        unmountedPath.rename(self.tmpPath / "installB")
+
+        openFile = open
+
+        def deniedOpen(path, *args, **kwargs):
+            if Path(path).parent.name == "installB":
+                raise PermissionError(path)
+            return openFile(path, *args, **kwargs)
+
+        with patch("builtins.open", deniedOpen):
+            self.assertEqual(self.store.collectGarbage(), [])
+        self.assertEqual(self.store.hashForUrl("sharedUrl"), sharedHash)
+        self.assertEqual(
+            resolveModelFolder(self.tmpPath / "installB").joinpath("Dataset", "dataset.json").read_text(), "shared"
+        )
+
+        self.store.referenceLease_s = 0
+        (self.tmpPath / "installB").rename(unmountedPath)
+        self.assertEqual(self.store.collectGarbage(), [sharedHash])
+
+    def test_installs_no_longer_using_the_store_are_unregistered(self):
+        modelHash = self.store.install(self.createArchive("a", "a"), self.tmpPath / "install", "url")
+        (self.tmpPath / "install" / "model_store.json").unlink()
+        self.assertEqual(self.store.collectGarbage(), [modelHash])
+        self.assertEqual(self.store.references(), {})
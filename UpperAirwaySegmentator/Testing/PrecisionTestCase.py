@@ -0,0 +1,74 @@
+import importlib.util
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from UpperAirwaySegmentatorInference.Precision import (
+    PRECISION_CHECKS_FOLDER_NAME,
+    diceCoefficient,
+    isPrecisionSupported,
+    resolvePrecision,
+)
+from UpperAirwaySegmentatorInference.Predictor import AirwayPredictor
+
+
+class PrecisionTestCase(unittest.TestCase):
+    def test_reduced_precision_requires_cpu_support(self):
+        self.assertTrue(isPrecisionSupported("bf16", {"avx512f", "avx512_bf16"}))
+        self.assertFalse(isPrecisionSupported("bf16", {"avx512f"}))
+        self.assertTrue(isPrecisionSupported("fp32", set()))
+
+    def test_unsupported_precision_falls_back_to_fp32(self):
+        messages = []
+        self.assertEqual(resolvePrecision("bf16", "cpu", {"avx2"}, messages.append), "fp32")
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(resolvePrecision("bf16", "cpu", {"amx_bf16"}), "bf16")
+
+    def test_auto_precision_prefers_bf16(self):
+        self.assertEqual(resolvePrecision("auto", "cpu", {"avx512_bf16", "avx512_fp16"}), "bf16")
+        self.assertEqual(resolvePrecision("auto", "cpu", {"avx512_fp16"}), "fp16")
+        self.assertEqual(resolvePrecision("auto", "cpu", set()), "fp32")
+
+    def test_gpu_inference_is_unchanged(self):
+        self.assertEqual(resolvePrecision("bf16", "cuda", {"avx512_bf16"}), "fp32")
+
+    def test_unknown_precision_raises(self):
+        with self.assertRaises(ValueError):
+            resolvePrecision("int8")
+
+    def test_dice_coefficient(self):
+        a = np.zeros((4, 4), dtype=np.uint8)
+        b = np.zeros((4, 4), dtype=np.uint8)
+        self.assertEqual(diceCoefficient(a, b), 1.0)
+        a[:2] = 1
+        b[1:3] = 1
+        self.assertAlmostEqual(diceCoefficient(a, b), 0.5)
+
+    @unittest.skipUnless(importlib.util.find_spec("torch"), "torch is not installed")
+    def test_precision_checks_are_cached_per_model_outside_model_folder(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            modelFolder = Path(tmpDir, "model")
+            modelFolder.joinpath("fold_0").mkdir(parents=True)
+            modelFolder.joinpath("dataset.json").write_text("{}")
+            modelFolder.joinpath("plans.json").write_text("{}")
+            modelFolder.joinpath("fold_0", "checkpoint_final.pth").write_bytes(b"checkpoint")
+            cacheFolder = Path(tmpDir, "cache")
+
+            predictor = AirwayPredictor(modelFolder, modelCacheFolder=cacheFolder)
+            predictor._writePrecisionCheck("bf16", 0.99)
+            self.assertEqual(predictor.precisionCheckFile.parent, cacheFolder / PRECISION_CHECKS_FOLDER_NAME)
+            self.assertEqual(list(predictor._readPrecisionChecks().values()), [0.99])
+            self.assertFalse(any(path.name.startswith("precision") for path in modelFolder.rglob("*")))
+
+            # Copies of the model share the checks, updated models are checked again
+            copyFolder = Path(tmpDir, "copy")
+            copyFolder.joinpath("fold_0").mkdir(parents=True)
+            for name in ["dataset.json", "plans.json", "fold_0/checkpoint_final.pth"]:
+                copyFolder.joinpath(name).write_bytes(modelFolder.joinpath(name).read_bytes())
+            copyPredictor = AirwayPredictor(copyFolder, modelCacheFolder=cacheFolder)
+            self.assertEqual(copyPredictor.precisionCheckFile, predictor.precisionCheckFile)
+
+            copyFolder.joinpath("fold_0", "checkpoint_final.pth").write_bytes(b"retrained checkpoint")
+            self.assertEqual(AirwayPredictor(copyFolder, modelCacheFolder=cacheFolder)._readPrecisionChecks(), {})
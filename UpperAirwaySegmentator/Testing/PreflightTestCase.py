@@ -0,0 +1,79 @@
+import time
+import unittest
+
+import numpy as np
+
+from UpperAirwaySegmentatorInference.Preflight import Severity, analyzeVolume
+
+
+def createHead(shape=(200, 200, 200), background=-1000.0, tissue=40.0, bone=1200.0):
+    """
+    Synthetic CBCT like volume : a tissue ellipsoid with a bone shell and a vertical air tube in its center.
+    """
+    k, j, i = np.ogrid[tuple(slice(0, size) for size in shape)]
+    center = [size / 2 for size in shape]
+    radius = ((k - center[0]) / (0.45 * shape[0])) ** 2 + ((j - center[1]) / (0.4 * shape[1])) ** 2 + \
+        ((i - center[2]) / (0.4 * shape[2])) ** 2
+    array = np.full(shape, background, dtype=np.float32)
+    array[radius < 1.0] = tissue
+    array[(radius > 0.8) & (radius < 1.0)] = bone
+    airway = ((j - center[1]) ** 2 + (i - center[2]) ** 2 < (0.05 * shape[1]) ** 2) & (radius < 0.6)
+    array[np.broadcast_to(airway, shape)] = background
+    return array
+
+
+class PreflightTestCase(unittest.TestCase):
+    def setUp(self):
+        self.array = createHead()
+        self.spacing = [0.4, 0.4, 0.4]
+        # Array axes in (k, j, i) order, the first axis is the superior - inferior axis
+        self.directions = np.eye(3)[:, ::-1]
+
+    def issueCodes(self, report):
+        return {issue.code for issue in report.issues}
+
+    def test_cbct_like_volume_passes(self):
+        report = analyzeVolume(self.array, self.spacing, self.directions)
+        self.assertEqual(report.issues, [])
+        self.assertTrue(report.isAccepted(strict=True))
+
+    def test_mr_like_intensities_are_flagged(self):
+        mr = np.clip(self.array + 1000.0, 0, None) / 10.0
+        report = analyzeVolume(mr, self.spacing)
+        self.assertIn("modality", self.issueCodes(report))
+        self.assertFalse(report.isBlocking)
+        self.assertFalse(report.isAccepted(strict=True))
+
+    def test_broken_spacing_blocks(self):
+        report = analyzeVolume(self.array, [0.0, 0.4, 0.4])
+        self.assertTrue(report.isBlocking)
+        self.assertEqual(report.errors[0].severity, Severity.ERROR)
+        self.assertIn("spacing", self.issueCodes(report))
+
+    def test_too_few_slices_and_constant_volumes_block(self):
+        self.assertTrue(analyzeVolume(self.array[:8], self.spacing).isBlocking)
+        self.assertTrue(analyzeVolume(np.zeros((64, 64, 64)), self.spacing).isBlocking)
+
+    def test_broken_and_oblique_orientations_are_flagged(self):
+        self.assertIn("orientation", self.issueCodes(analyzeVolume(self.array, self.spacing, np.ones((3, 3)))))
+
+        angle = np.deg2rad(30)
+        oblique = np.array([[np.cos(angle), -np.sin(angle), 0], [np.sin(angle), np.cos(angle), 0], [0, 0, 1]])
+        report = analyzeVolume(self.array, self.spacing, oblique)
+        self.assertIn("oblique", self.issueCodes(report))
+        self.assertFalse(report.isBlocking)
+
+    def test_short_field_of_view_is_flagged(self):
+        report = analyzeVolume(self.array[80:140], self.spacing, self.directions)
+        self.assertIn("fieldOfView", self.issueCodes(report))
+
+    def test_volume_without_internal_air_is_flagged(self):
+        solid = np.where(self.array > -1000.0, self.array, 40.0)
+        solid[:, :5] = -1000.0
+        self.assertIn("airway", self.issueCodes(analyzeVolume(solid, self.spacing)))
+
+    def test_large_volumes_are_checked_in_under_a_second(self):
+        array = np.tile(self.array, (3, 3, 3)).astype(np.int16)
+        start = time.time()
+        analyzeVolume(array, self.spacing)
+        self.assertLess(time.time() - start, 1.0)
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from UpperAirwaySegmentatorInference.Parameter import InferenceParameter
+from UpperAirwaySegmentatorInference.PreprocessingCache import PreprocessingCache, fileHash
+
+
+class PreprocessingCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmpDir = tempfile.TemporaryDirectory()
+        self.tmpPath = Path(self._tmpDir.name)
+        self.cache = PreprocessingCache(self.tmpPath / "cache")
+
+    def tearDown(self):
+        self._tmpDir.cleanup()
+
+    def test_saved_entries_are_loaded_memory_mapped(self):
+        data = np.random.rand(1, 4, 5, 6).astype(np.float32)
+        self.cache.save("key", data, {"spacing": [1, 1, 1]})
+
+        loaded, properties = self.cache.load("key")
+        self.assertIsInstance(loaded, np.memmap)
+        np.testing.assert_array_equal(loaded, data)
+        self.assertEqual(properties, {"spacing": [1, 1, 1]})
+
+    def test_missing_entries_return_none(self):
+        self.assertIsNone(self.cache.load("missing"))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        data = np.zeros((1, 64, 64, 64), dtype=np.float32)
+        self.cache.maxSize_bytes = int(data.nbytes * 2.5)
+        for i, key in enumerate(["a", "b"]):
+            self.cache.save(key, data, {})
+            os.utime(self.cache.entryFolder(key), (i, i))
+
+        self.cache.load("a")
+        self.cache.save("c", data, {})
+        self.assertEqual(sorted(entry.name for entry in self.cache.entries()), ["a", "c"])
+
+    def test_identical_files_have_identical_hashes(self):
+        for name in ["a.nii", "b.nii"]:
+            self.tmpPath.joinpath(name).write_bytes(b"volume")
+        self.assertEqual(fileHash(self.tmpPath / "a.nii"), fileHash(self.tmpPath / "b.nii"))
+
+    def test_cache_folder_is_passed_to_the_worker(self):
+        args = InferenceParameter(modelPath="model", preprocessingCacheFolder="cache").toWorkerArgs()
+        self.assertIn("--preprocessing-cache", args)
+        self.assertNotIn("--preprocessing-cache", InferenceParameter(modelPath="model").toWorkerArgs())
@@ -0,0 +1,68 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from UpperAirwaySegmentatorInference.ProbabilityMap import probabilityLevel, quantizeProbabilities, saveProbabilityMap
+from UpperAirwaySegmentatorLib.ProbabilityMap import ProbabilityMap
+
+
+class ProbabilityMapTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmpDir = tempfile.TemporaryDirectory()
+        self.path = Path(self._tmpDir.name, "probabilities.npy")
+
+        probabilities = np.zeros((20, 30, 40), dtype=np.float32)
+        probabilities[5:15, 10:20, 10:30] = 0.9
+        probabilities[8:12, 12:18, 15:25] = 1.0
+        probabilities[1, 1, 1] = 0.9
+        saveProbabilityMap(self.path, probabilities)
+        self.probabilityMap = ProbabilityMap(self.path)
+
+    def tearDown(self):
+        del self.probabilityMap
+        self._tmpDir.cleanup()
+
+    def test_probabilities_are_quantized_to_uint8(self):
+        quantized = quantizeProbabilities(np.array([0.0, 0.5, 1.0, 1.2]))
+        self.assertEqual(quantized.dtype, np.uint8)
+        np.testing.assert_array_equal(quantized, [0, 128, 255, 255])
+        self.assertEqual(probabilityLevel(0.5), 128)
+
+    def test_map_is_memory_mapped(self):
+        self.assertIsInstance(self.probabilityMap.array, np.memmap)
+
+    def test_bounding_box_depends_on_threshold(self):
+        self.assertEqual(self.probabilityMap.boundingBox(probabilityLevel(0.95)),
+                         (slice(8, 12), slice(12, 18), slice(15, 25)))
+        self.assertEqual(self.probabilityMap.boundingBox(probabilityLevel(0.5)),
+                         (slice(1, 15), slice(1, 20), slice(1, 30)))
+
+    def test_labelmap_removes_small_islands(self):
+        labelmap = self.probabilityMap.labelmap(0.5, minimumIslandSize=10)
+        self.assertEqual(labelmap.shape, (20, 30, 40))
+        self.assertEqual(labelmap[1, 1, 1], 0)
+        self.assertEqual(labelmap.sum(), 10 * 10 * 20)
+        self.assertEqual(self.probabilityMap.labelmap(0.95).sum(), 4 * 6 * 10)
+
+    def test_labelmaps_are_cached_per_level(self):
+        croppedLabelmap = MagicMock(wraps=self.probabilityMap._croppedLabelmap)
+        self.probabilityMap._croppedLabelmap = croppedLabelmap
+
+        labelmap = self.probabilityMap.labelmap(0.5)
+        np.testing.assert_array_equal(self.probabilityMap.labelmap(0.5), labelmap)
+        croppedLabelmap.assert_called_once()
+
+        # Thresholds quantized to the same level share the cached labelmap
+        self.assertEqual(probabilityLevel(0.501), probabilityLevel(0.5))
+        self.probabilityMap.labelmap(0.501)
+        croppedLabelmap.assert_called_once()
+
+        # Least recently used levels are evicted and computed again
+        self.probabilityMap.maxCachedLevels = 2
+        for threshold in [0.2, 0.95, 0.95, 0.5]:
+            self.probabilityMap.labelmap(threshold)
+        self.assertEqual(len(self.probabilityMap._cache), 2)
+        self.assertEqual(croppedLabelmap.call_count, 4)
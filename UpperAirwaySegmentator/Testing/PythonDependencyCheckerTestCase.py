@@ -0,0 +1,39 @@
+from unittest.mock import MagicMock, patch
+
+import qt
+
+from UpperAirwaySegmentatorLib import PythonDependencyChecker
+from .Utils import UpperAirwaySegmentatorTestCase
+
+
+class PythonDependencyCheckerTestCase(UpperAirwaySegmentatorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpDir = qt.QTemporaryDir()
+        self.recordPath = f"{self.tmpDir.path()}/dependency_verification.json"
+        self.verify = MagicMock(return_value=True)
+
+    def createChecker(self):
+        return PythonDependencyChecker(destWeightFolder=self.tmpDir.path(), verificationRecordPath=self.recordPath)
+
+    def test_dependencies_are_verified_once_per_environment(self):
+        self.assertTrue(self.createChecker().verifyDependenciesIfNeeded(self.verify))
+        self.assertTrue(self.createChecker().verifyDependenciesIfNeeded(self.verify))
+        self.verify.assert_called_once()
+
+    def test_package_update_invalidates_verification(self):
+        self.createChecker().verifyDependenciesIfNeeded(self.verify)
+        with patch.object(PythonDependencyChecker, "installedPackageVersions", return_value={"torch": "0.0.1"}):
+            self.createChecker().verifyDependenciesIfNeeded(self.verify)
+        self.assertEqual(self.verify.call_count, 2)
+
+    def test_verification_can_be_forced(self):
+        checker = self.createChecker()
+        checker.verifyDependenciesIfNeeded(self.verify)
+        checker.verifyDependenciesIfNeeded(self.verify, forceCheck=True)
+        self.assertEqual(self.verify.call_count, 2)
+
+    def test_failed_verification_is_not_recorded(self):
+        self.verify.return_value = False
+        self.assertFalse(self.createChecker().verifyDependenciesIfNeeded(self.verify))
+        self.assertFalse(self.createChecker().isVerificationRecordValid())
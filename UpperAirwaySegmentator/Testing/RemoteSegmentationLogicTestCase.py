@@ -0,0 +1,43 @@
+from unittest.mock import MagicMock
+
+from UpperAirwaySegmentatorInference.Parameter import InferenceParameter
+from UpperAirwaySegmentatorLib.RemoteSegmentationLogic import RemoteJob, RemoteSegmentationLogic
+from .Utils import UpperAirwaySegmentatorTestCase
+
+
+class RemoteSegmentationLogicTestCase(UpperAirwaySegmentatorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.logic = RemoteSegmentationLogic("http://127.0.0.1:0")
+        self.logic.client = MagicMock()
+        self.onErrorOccurred = MagicMock()
+        self.onInferenceFinished = MagicMock()
+        self.logic.errorOccurred.connect(self.onErrorOccurred)
+        self.logic.inferenceFinished.connect(self.onInferenceFinished)
+
+    def test_job_stopped_before_a_new_job_still_cancels_its_server_job(self):
+        stoppedJob, newJob = RemoteJob(), RemoteJob()
+        stoppedJob.isStopped = True
+        self.logic._job = newJob
+        self.logic.client.submit.return_value = "stopped-job"
+
+        self.assertIsNone(self.logic._runJob(stoppedJob, "input.nii.gz", InferenceParameter(), self.logic.outputFolder))
+        self.logic.client.cancel.assert_called_once_with("stopped-job")
+        self.assertEqual(stoppedJob.id, "stopped-job")
+        self.assertIsNone(newJob.id)
+        self.assertFalse(newJob.isStopped)
+
+    def test_callbacks_of_replaced_jobs_are_ignored(self):
+        from UpperAirwaySegmentatorInference.Server import DONE
+
+        replacedJob, newJob = RemoteJob(), RemoteJob()
+        self.logic._job = newJob
+        self.logic._onJobError(replacedJob, "Connection reset")
+        self.logic._onJobFinished(replacedJob, DONE)
+        self.onErrorOccurred.assert_not_called()
+        self.onInferenceFinished.assert_not_called()
+        self.assertIs(self.logic._job, newJob)
+
+        self.logic._onJobFinished(newJob, DONE)
+        self.onInferenceFinished.assert_called_once()
+        self.assertIsNone(self.logic._job)
@@ -0,0 +1,88 @@
+import importlib.util
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from UpperAirwaySegmentatorInference.Parameter import InferenceParameter, resolveDevice
+from UpperAirwaySegmentatorInference.RuntimeEstimator import (
+    RuntimeEstimator,
+    RuntimeTracker,
+    formatDuration,
+    resampledShape,
+    slidingWindowTileCount,
+)
+
+
+class RuntimeEstimatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.estimator = RuntimeEstimator(Path(self.tmpDir.name).joinpath("runtime_calibration.json"))
+        self.parameter = InferenceParameter(modelPath="model", folds="0,1", device="cpu")
+        self.benchmark = {"tiles": 10, "seconds_per_tile": 2.0, "patch_size": [64, 64, 64], "spacing": [0.6, 0.6, 0.6]}
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_tile_count_follows_sliding_window_steps(self):
+        self.assertEqual(slidingWindowTileCount([64, 64, 64], [64, 64, 64], 0.5), 1)
+        self.assertEqual(slidingWindowTileCount([32, 64, 64], [64, 64, 64], 0.5), 1)
+        self.assertEqual(slidingWindowTileCount([128, 64, 96], [64, 64, 64], 0.5), 3 * 1 * 2)
+
+    def test_shape_is_resampled_to_target_spacing(self):
+        self.assertEqual(resampledShape([100, 200, 300], [0.3, 0.3, 0.6], [0.6, 0.6, 0.6]), [50, 100, 300])
+
+    @unittest.skipUnless(importlib.util.find_spec("torch"), "torch is not installed")
+    def test_unavailable_cuda_device_uses_the_cpu_calibration(self):
+        self.estimator.setCalibration(self.parameter, self.benchmark)
+        with patch("torch.cuda.is_available", return_value=False):
+            parameter = InferenceParameter(modelPath="model", folds="0,1", device=resolveDevice("cuda"))
+        self.assertEqual(parameter.device, "cpu")
+        self.assertEqual(self.estimator.calibration(parameter), self.benchmark)
+
+        with patch("torch.cuda.is_available", return_value=True):
+            self.assertEqual(resolveDevice("cuda:1"), "cuda:1")
+        self.assertEqual(resolveDevice("cpu"), "cpu")
+
+    def test_estimate_requires_calibration(self):
+        self.assertIsNone(self.estimator.estimate(self.parameter, [128, 128, 128], [0.6, 0.6, 0.6]))
+
+        self.estimator.setCalibration(self.parameter, self.benchmark)
+        estimate = self.estimator.estimate(self.parameter, [256, 128, 128], [0.3, 0.6, 0.6])
+        self.assertEqual(estimate.nTiles, 27)
+        self.assertEqual(estimate.nFolds, 2)
+        self.assertAlmostEqual(estimate.inference_s, 27 * 2 * 2.0)
+        self.assertGreater(estimate.total_s, estimate.inference_s)
+
+    def test_calibration_depends_on_inference_settings(self):
+        self.estimator.setCalibration(self.parameter, self.benchmark)
+        self.parameter.disableTta = False
+        self.assertIsNone(self.estimator.calibration(self.parameter))
+
+    def test_tracker_refines_estimate_from_progress(self):
+        self.estimator.setCalibration(self.parameter, self.benchmark)
+        estimate = self.estimator.estimate(self.parameter, [128, 128, 128], [0.6, 0.6, 0.6])
+        tracker = RuntimeTracker(self.estimator, self.parameter, estimate, [128, 128, 128], [0.6, 0.6, 0.6])
+
+        tracker.onProgress("Predicting (64, 64, 64) voxels...")
+        self.assertAlmostEqual(tracker.predicted_s, 2 * 2.0, delta=1.0)
+
+        tracker.onProgress("Fold 0 done in 100.0 s (1 / 2).")
+        self.assertAlmostEqual(tracker.predicted_s, 100.0, delta=1.0)
+
+    def test_runs_are_logged_with_predicted_and_actual_times(self):
+        self.estimator.setCalibration(self.parameter, self.benchmark)
+        estimate = self.estimator.estimate(self.parameter, [128, 128, 128], [0.6, 0.6, 0.6])
+        self.estimator.logRun(self.parameter, [128, 128, 128], [0.6, 0.6, 0.6], estimate, 42.0)
+
+        with open(self.estimator.historyFile, "r") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["actual_s"], 42.0)
+        self.assertAlmostEqual(records[0]["predicted_s"], estimate.total_s)
+
+    def test_durations_are_formatted(self):
+        self.assertEqual(formatDuration(42), "42 s")
+        self.assertEqual(formatDuration(125), "2 min 05 s")
+        self.assertEqual(formatDuration(3 * 3600 + 60), "3 h 01 min")
@@ -3,9 +3,16 @@ from tempfile import TemporaryDirectory
 from unittest.mock import MagicMock
 
 import SampleData
+import numpy as np
+import qt
 import slicer
 
+from UpperAirwaySegmentatorInference.CompactLabelmap import COMPACT_LABELMAP_EXTENSION
+from UpperAirwaySegmentatorInference.MemoryPlanner import GB, MemoryEstimate, MemoryPlan
+from UpperAirwaySegmentatorInference.Parameter import InferenceParameter
+from UpperAirwaySegmentatorInference.ProbabilityMap import saveProbabilityMap
 from UpperAirwaySegmentatorLib import SegmentationWidget, Signal, ExportFormat
+from UpperAirwaySegmentatorLib.WorkerSegmentationLogic import WorkerSegmentationLogic
 from .Utils import (
     UpperAirwaySegmentatorTestCase, get_test_label_path,
     load_test_CT_volume
@@ -21,6 +28,7 @@ class MockLogic:
         self.stopSegmentation = MagicMock()
         self.setParameter = MagicMock()
         self.waitForSegmentationFinished = MagicMock()
+        self.runBenchmark = MagicMock(return_value=None)
         self.loadSegmentation = MagicMock()
         self.loadSegmentation.side_effect = self.load_segmentation
 
@@ -56,6 +64,10 @@ class SegmentationWidgetTestCase(UpperAirwaySegmentatorTestCase):
         self.node = load_test_CT_volume()
         self.widget = SegmentationWidget(logic=self.logic)
         self.widget.inputSelector.setCurrentNode(self.node)
+        # Field of view trimming is covered by test_trimmed_volume_is_segmented_in_full_volume_geometry
+        self.widget.trimFieldOfViewCheckBox.setChecked(False)
+        # Input checks are covered by test_invalid_input_volume_is_not_segmented
+        self.widget.inputCheckCheckBox.setChecked(False)
         # self.widget.show()
         slicer.app.processEvents()
 
@@ -88,6 +100,7 @@ class SegmentationWidgetTestCase(UpperAirwaySegmentatorTestCase):
         self.logic.startSegmentation.assert_called_once_with(self.node)
         self.logic.inferenceFinished()
         slicer.app.processEvents()
+        self.widget.waitForPostProcessingFinished()
 
         self.assertTrue(self.widget.inputSelector.isEnabled())
         self.assertTrue(self.widget.segmentationNodeSelector.isEnabled())
@@ -98,15 +111,95 @@ class SegmentationWidgetTestCase(UpperAirwaySegmentatorTestCase):
         self.logic.startSegmentation.assert_called_once()
         self.widget.stopButton.click()
         self.logic.stopSegmentation.assert_called_once()
-        self.logic.waitForSegmentationFinished.assert_called_once()
+        self.logic.waitForSegmentationFinished.assert_not_called()
+        self.assertTrue(self.widget.applyWidget.isVisibleTo(self.widget))
         # self.assertTrue(self.widget.applyButton.isVisible())
         self.assertFalse(self.widget.stopButton.isVisible())
 
+    def test_segmentation_is_refused_when_memory_is_insufficient(self):
+        estimate = MemoryEstimate(runtime=2 * GB, preprocessing=0, prediction=60 * GB, export=0)
+        self.widget.memoryPlanner.plan = MagicMock(
+            return_value=MemoryPlan(InferenceParameter(lowMemory=True), estimate, 8 * GB, "low memory", isRefused=True)
+        )
+        self.widget.isInteractive = False
+        self.widget.applyButton.click()
+        self.logic.startSegmentation.assert_not_called()
+        self.assertFalse(self.widget.stopButton.isVisible())
+        self.assertTrue(self.widget.inputSelector.isEnabled())
+
+    def test_invalid_input_volume_is_not_segmented(self):
+        volumeNode = slicer.util.addVolumeFromArray(np.full((8, 64, 64), -1000, dtype=np.int16))
+        self.widget.inputSelector.setCurrentNode(volumeNode)
+        self.widget.inputCheckCheckBox.setChecked(True)
+        self.widget.isInteractive = False
+
+        report = SegmentationWidget.analyzeInputVolume(volumeNode)
+        self.assertTrue(report.isBlocking)
+
+        self.widget.applyButton.click()
+        self.logic.startSegmentation.assert_not_called()
+        self.assertTrue(self.widget.inputSelector.isEnabled())
+
+    def test_input_volume_warnings_are_logged_in_non_interactive_mode(self):
+        self.widget.inputCheckCheckBox.setChecked(True)
+        self.widget.isInteractive = False
+        self.widget.currentInfoTextEdit.insertPlainText("Previous run log\n")
+        self.widget.applyButton.click()
+        self.logic.startSegmentation.assert_called_once()
+
+        report = SegmentationWidget.analyzeInputVolume(self.widget.getCurrentVolumeNode())
+        log = self.widget.currentInfoTextEdit.toPlainText()
+        self.assertIn(report.summary(), log)
+        self.assertNotIn("Previous run log", log)
+
+    def test_dependency_check_reports_missing_nnunet_module(self):
+        self.widget.isNNUNetModuleInstalled = MagicMock(return_value=False)
+        self.widget.isInteractive = False
+        self.widget.onForceDependencyCheckClicked()
+        self.assertIn("Please install the NNUNet module", self.widget.currentInfoTextEdit.toPlainText())
+        self.assertTrue(self.widget.applyWidget.isVisibleTo(self.widget))
+
+    def test_slicer_nnunet_is_the_default_backend_and_the_worker_is_opt_in(self):
+        if not SegmentationWidget.isNNUNetModuleInstalled():
+            self.skipTest("NNUNet module is not installed.")
+
+        from SlicerNNUNetLib import Parameter, SegmentationLogic
+
+        settings = qt.QSettings()
+        previousValues = {
+            key: settings.value(key)
+            for key in [SegmentationWidget.inferenceBackendSettingsKey, SegmentationWidget.inferenceServerSettingsKey]
+        }
+        for key in previousValues:
+            settings.remove(key)
+        try:
+            widget = SegmentationWidget()
+            self.assertIsInstance(widget.logic, SegmentationLogic)
+            self.assertFalse(widget.precisionComboBox.isEnabled())
+
+            parameter = widget._logicParameter(InferenceParameter(folds="0,1", modelPath="model", disableTta=False))
+            self.assertIsInstance(parameter, Parameter)
+            self.assertEqual((parameter.folds, parameter.modelPath, parameter.disableTta), ("0,1", "model", False))
+
+            comboBox = widget.inferenceBackendComboBox
+            comboBox.setCurrentIndex(comboBox.findData(SegmentationWidget.workerBackend))
+            self.assertIsInstance(widget.logic, WorkerSegmentationLogic)
+            self.assertTrue(widget.precisionComboBox.isEnabled())
+            self.assertEqual(SegmentationWidget.inferenceBackend(), SegmentationWidget.workerBackend)
+            widget.deleteLater()
+        finally:
+            for key, value in previousValues.items():
+                if value is None:
+                    settings.remove(key)
+                else:
+                    settings.setValue(key, value)
+
     def test_loading_replaces_existing_segmentation_node(self):
         self.logic.inferenceFinished()
         slicer.app.processEvents()
         self.logic.inferenceFinished()
         slicer.app.processEvents()
+        self.widget.waitForPostProcessingFinished()
         self.assertEqual(self.logic.loadSegmentation.call_count, 2)
         self.assertEqual(len(list(slicer.mrmlScene.GetNodesByClass("vtkMRMLSegmentationNode"))), 1)
 
@@ -123,9 +216,37 @@ class SegmentationWidgetTestCase(UpperAirwaySegmentatorTestCase):
         
         self.assertEqual(segmentName, "Airway")
 
+    def test_display_refresh_is_deferred_until_surfaces_are_ready(self):
+        self.logic.inferenceFinished()
+        slicer.app.processEvents()
+        self.widget.waitForPostProcessingFinished()
+        self.widget.surfaceCache.waitForPending()
+        slicer.app.processEvents()
+        self.assertTrue(self.widget.show3DButton.isChecked())
+
+        segmentation = self.widget.getCurrentSegmentationNode().GetSegmentation()
+        closedSurfaceName = slicer.vtkSegmentationConverter.GetSegmentationClosedSurfaceRepresentationName()
+        self.assertIsNotNone(segmentation.GetSegment("Segment_1").GetRepresentation(closedSurfaceName))
+
+    def test_surface_smoothing_reuses_cached_surfaces(self):
+        self.logic.inferenceFinished()
+        slicer.app.processEvents()
+        self.widget.waitForPostProcessingFinished()
+        self.widget.surfaceCache.waitForPending()
+        nCachedSurfaces = len(self.widget.surfaceCache)
+
+        self.widget.surfaceSmoothingSlider.setValue(0.5)
+        self.widget.surfaceCache.waitForPending()
+        self.assertEqual(len(self.widget.surfaceCache), nCachedSurfaces + 1)
+
+        self.widget.surfaceSmoothingSlider.setValue(0)
+        self.assertFalse(self.widget.surfaceCache.isPending())
+        self.assertEqual(len(self.widget.surfaceCache), nCachedSurfaces + 1)
+
     def test_can_export_segmentation_to_file(self):
         self.logic.inferenceFinished()
         slicer.app.processEvents()
+        self.widget.waitForPostProcessingFinished()
         self.widget.objCheckBox.setChecked(True)
         self.widget.stlCheckBox.setChecked(True)
         self.widget.niftiCheckBox.setChecked(True)
@@ -144,10 +265,112 @@ class SegmentationWidgetTestCase(UpperAirwaySegmentatorTestCase):
             self.assertEqual(len(list(tmpPath.glob("*.obj"))), 1)
             self.assertEqual(len(list(tmpPath.glob("*.nii.gz"))), 1)
 
+    def test_compact_labelmap_export_round_trips_losslessly(self):
+        self.logic.inferenceFinished()
+        slicer.app.processEvents()
+        self.widget.waitForPostProcessingFinished()
+        segmentationNode = self.widget.getCurrentSegmentationNode()
+        self.assertTrue(segmentationNode.GetStorageNode().GetCropToMinimumExtent())
+
+        with TemporaryDirectory() as tmp:
+            self.widget.exportSegmentation(segmentationNode, tmp, ExportFormat.COMPACT)
+            compactFiles = list(Path(tmp).glob("*" + COMPACT_LABELMAP_EXTENSION))
+            self.assertEqual(len(compactFiles), 1)
+            loadedNode = slicer.util.loadNodeFromFile(
+                compactFiles[0].as_posix(), "UpperAirwaySegmentatorCompactSegmentation"
+            )
+
+        segmentation = segmentationNode.GetSegmentation()
+        loadedSegmentation = loadedNode.GetSegmentation()
+        self.assertEqual(loadedSegmentation.GetNumberOfSegments(), segmentation.GetNumberOfSegments())
+        for iSegment in range(segmentation.GetNumberOfSegments()):
+            segmentId = segmentation.GetNthSegmentID(iSegment)
+            self.assertEqual(
+                loadedSegmentation.GetSegment(segmentId).GetName(), segmentation.GetSegment(segmentId).GetName()
+            )
+            np.testing.assert_array_equal(
+                slicer.util.arrayFromSegmentBinaryLabelmap(loadedNode, segmentId, self.node),
+                slicer.util.arrayFromSegmentBinaryLabelmap(segmentationNode, segmentId, self.node),
+            )
+
+    def test_probability_threshold_re_derives_airway_labelmap(self):
+        segmentationNode = self.logic.load_segmentation()
+        airwayMask = slicer.util.arrayFromSegmentBinaryLabelmap(segmentationNode, "Segment_1", self.node)
+        slicer.mrmlScene.RemoveNode(segmentationNode)
+
+        with TemporaryDirectory() as tmp:
+            probabilityMapPath = Path(tmp, "input_probabilities.npy")
+            saveProbabilityMap(probabilityMapPath, airwayMask * 0.6)
+            self.logic.probabilityMapPath = MagicMock(return_value=probabilityMapPath)
+            self.logic.inferenceFinished()
+            slicer.app.processEvents()
+            self.widget.waitForPostProcessingFinished()
+
+            segmentationNode = self.widget.getCurrentSegmentationNode()
+            self.assertTrue(self.widget.probabilityThresholdSlider.isEnabled())
+            self.assertEqual(segmentationNode.GetAttribute(SegmentationWidget.probabilityThresholdAttribute), "0.50")
+
+            self.widget.probabilityThresholdSlider.value = 0.7
+            self.widget._applyProbabilityThreshold()
+            labelmap = slicer.util.arrayFromSegmentBinaryLabelmap(segmentationNode, "Segment_1", self.node)
+            self.assertFalse(labelmap.any())
+            self.assertEqual(segmentationNode.GetAttribute(SegmentationWidget.probabilityThresholdAttribute), "0.70")
+
+            self.widget.exportSegmentation(segmentationNode, tmp, ExportFormat.NIFTI)
+            self.assertEqual(len(list(Path(tmp).glob("*_info.json"))), 1)
+
+    def test_probability_map_is_released_when_its_volume_is_removed(self):
+        segmentationNode = self.logic.load_segmentation()
+        airwayMask = slicer.util.arrayFromSegmentBinaryLabelmap(segmentationNode, "Segment_1", self.node)
+        slicer.mrmlScene.RemoveNode(segmentationNode)
+
+        with TemporaryDirectory() as tmp:
+            probabilityMapPath = Path(tmp, "input_probabilities.npy")
+            saveProbabilityMap(probabilityMapPath, airwayMask * 0.6)
+            self.logic.probabilityMapPath = MagicMock(return_value=probabilityMapPath)
+            self.logic.inferenceFinished()
+            slicer.app.processEvents()
+            self.widget.waitForPostProcessingFinished()
+
+        storedPath = self.widget.probabilityMaps[self.node].path
+        self.assertTrue(storedPath.exists())
+        self.assertIn(self.node, self.widget.processedVolumes)
+
+        slicer.mrmlScene.RemoveNode(self.node)
+        self.assertFalse(storedPath.exists())
+        self.assertEqual(self.widget.probabilityMaps, {})
+        self.assertNotIn(self.node, self.widget.processedVolumes)
+
+    def test_trimmed_volume_is_segmented_in_full_volume_geometry(self):
+        array = slicer.util.arrayFromVolume(self.node)
+        background = array.min()
+        array[:array.shape[0] // 4] = background
+        array[:, :2] = background
+        array[:, :, :2] = background
+        slicer.util.arrayFromVolumeModified(self.node)
+
+        self.widget.trimFieldOfViewCheckBox.setChecked(True)
+        self.widget.applyButton.click()
+        trimmedNode = self.logic.startSegmentation.call_args[0][0]
+        self.assertNotEqual(trimmedNode, self.node)
+        self.assertTrue(trimmedNode.GetHideFromEditors())
+        self.assertLess(trimmedNode.GetImageData().GetDimensions()[2], array.shape[0])
+
+        self.logic.inferenceFinished()
+        slicer.app.processEvents()
+        self.widget.waitForPostProcessingFinished()
+
+        self.assertFalse(slicer.mrmlScene.IsNodePresent(trimmedNode))
+        segmentationNode = self.widget.getCurrentSegmentationNode()
+        labelmap = slicer.util.arrayFromSegmentBinaryLabelmap(segmentationNode, "Segment_1", self.node)
+        self.assertEqual(labelmap.shape, array.shape)
+        self.assertTrue(labelmap.any())
+
     def test_synchronises_segmentation_selector_to_processed_volume(self):
         self.assertIsNone(self.widget.getCurrentSegmentationNode())
         self.logic.inferenceFinished()
         slicer.app.processEvents()
+        self.widget.waitForPostProcessingFinished()
         self.assertIsNotNone(self.widget.getCurrentSegmentationNode())
 
         otherNode = SampleData.SampleDataLogic().downloadMRHead()
@@ -160,6 +383,7 @@ class SegmentationWidgetTestCase(UpperAirwaySegmentatorTestCase):
     def test_handles_deleted_segmentations(self):
         self.logic.inferenceFinished()
         slicer.app.processEvents()
+        self.widget.waitForPostProcessingFinished()
 
         otherNode = SampleData.SampleDataLogic().downloadMRHead()
         self.widget.inputSelector.setCurrentNode(otherNode)
@@ -194,3 +418,15 @@ class SegmentationWidgetTestCase(UpperAirwaySegmentatorTestCase):
         slicer.app.processEvents()
         # self.assertTrue(self.widget.applyButton.isVisible())
         self.logic.stopSegmentation.assert_called_once()
+
+    def test_stopping_during_post_processing_restores_apply(self):
+        self.widget.applyButton.click()
+        slicer.app.processEvents()
+        self.logic.inferenceFinished()
+        self.assertTrue(self.widget.resultsPipeline.isRunning())
+
+        self.widget.stopButton.click()
+        slicer.app.processEvents()
+        self.assertFalse(self.widget.resultsPipeline.isRunning())
+        self.assertTrue(self.widget.resultsPipeline.isCancelled)
+        self.assertTrue(self.widget.inputSelector.isEnabled())
@@ -0,0 +1,84 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, call
+
+from UpperAirwaySegmentatorLib.Signal import QueuedSignal, Signal, SignalDispatcher
+
+
+def emitFromThread(signal, values):
+    thread = threading.Thread(target=lambda: [signal(value) for value in values])
+    thread.start()
+    thread.join()
+
+
+class SignalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.slot = MagicMock()
+
+    def test_slots_disconnected_during_emit_are_still_called_once(self):
+        signal = Signal("int")
+        otherSlot = MagicMock()
+        otherId = None
+
+        def disconnectOther(value):
+            signal.disconnect(otherId)
+
+        signal.connect(disconnectOther)
+        otherId = signal.connect(otherSlot)
+        signal(1)
+        signal(2)
+        otherSlot.assert_called_once_with(1)
+
+    def test_queued_signal_is_synchronous_on_main_thread(self):
+        signal = QueuedSignal("int")
+        signal.connect(self.slot)
+        signal(1)
+        self.slot.assert_called_once_with(1)
+
+    def test_queued_signal_delivers_thread_emissions_on_drain_in_order(self):
+        signal = QueuedSignal("int")
+        signal.connect(self.slot)
+        emitFromThread(signal, range(5))
+        self.slot.assert_not_called()
+
+        SignalDispatcher.instance().drain()
+        self.assertEqual(self.slot.call_args_list, [call(i) for i in range(5)])
+
+    def test_dispatcher_timer_only_runs_while_emissions_are_pending(self):
+        dispatcher = SignalDispatcher.instance()
+        dispatcher.drain()
+        self.assertFalse(dispatcher.isActive())
+
+        signal = QueuedSignal("int", isDirectOnMainThread=False)
+        signal.connect(self.slot)
+        signal(1)
+        self.assertTrue(dispatcher.isActive())
+
+        dispatcher.drain()
+        self.slot.assert_called_once_with(1)
+        self.assertFalse(dispatcher.isActive())
+
+    def test_thread_emissions_wake_the_dispatcher(self):
+        import qt
+
+        signal = QueuedSignal("int")
+        signal.connect(self.slot)
+        emitFromThread(signal, [1, 2])
+
+        start = time.time()
+        while self.slot.call_count < 2 and time.time() - start < 5.0:
+            qt.QCoreApplication.processEvents()
+            time.sleep(0.01)
+        self.assertEqual(self.slot.call_args_list, [call(1), call(2)])
+        self.assertFalse(SignalDispatcher.instance().isActive())
+
+    def test_blocked_queued_signal_drops_emissions(self):
+        signal = QueuedSignal("int")
+        signal.connect(self.slot)
+        signal.blockSignals(True)
+        emitFromThread(signal, [1])
+        signal(2)
+
+        SignalDispatcher.instance().drain()
+        self.slot.assert_not_called()
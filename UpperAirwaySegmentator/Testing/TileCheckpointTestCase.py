@@ -0,0 +1,139 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from UpperAirwaySegmentatorInference.Parameter import InferenceParameter
+from UpperAirwaySegmentatorInference.TileCheckpoint import TileCheckpoint, TileCheckpointStore, arrayHash
+
+
+class TileCheckpointTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.folder = Path(self.tmpDir.name).joinpath("checkpoint")
+        self.shape = (2, 24, 24, 24)
+
+        # Overlapping tiles of a sliding window with a step of half a tile
+        self.tiles = [
+            [(z, z + 12), (y, y + 12), (x, x + 12)]
+            for z in range(0, 13, 6) for y in range(0, 13, 6) for x in range(0, 13, 6)
+        ]
+        rng = np.random.default_rng(0)
+        self.predictions = [rng.random((2, 12, 12, 12), dtype=np.float32) for _ in self.tiles]
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def openCheckpoint(self):
+        return TileCheckpoint(self.folder, self.shape, len(self.tiles))
+
+    def accumulate(self, checkpoint, tiles):
+        for iTile in tiles:
+            if iTile not in checkpoint.completed:
+                checkpoint.accumulate(iTile, self.tiles[iTile], self.predictions[iTile])
+
+    def expectedLogits(self):
+        logits = np.zeros(self.shape, dtype=np.float32)
+        for bounds, prediction in zip(self.tiles, self.predictions):
+            logits[(slice(None), *(slice(*bound) for bound in bounds))] += prediction
+        return logits
+
+    def test_committed_tiles_are_resumed(self):
+        checkpoint = self.openCheckpoint()
+        self.accumulate(checkpoint, range(10))
+        checkpoint.commit()
+        checkpoint.close()
+
+        checkpoint = self.openCheckpoint()
+        self.assertEqual(checkpoint.completed, set(range(10)))
+        self.assertFalse(checkpoint.isComplete)
+        self.accumulate(checkpoint, range(len(self.tiles)))
+        checkpoint.commit()
+        self.assertTrue(checkpoint.isComplete)
+        np.testing.assert_allclose(checkpoint.logits, self.expectedLogits(), rtol=1e-6)
+
+    def test_tiles_accumulated_after_last_commit_are_rolled_back(self):
+        checkpoint = self.openCheckpoint()
+        self.accumulate(checkpoint, range(10))
+        checkpoint.commit()
+
+        # Process stopped after accumulating tiles without committing them
+        self.accumulate(checkpoint, range(10, 20))
+        checkpoint.logits.flush()
+        checkpoint.close()
+
+        checkpoint = self.openCheckpoint()
+        self.assertEqual(checkpoint.completed, set(range(10)))
+        self.assertEqual(list(self.folder.glob("undo_*")), [])
+        self.accumulate(checkpoint, range(len(self.tiles)))
+        checkpoint.commit()
+        np.testing.assert_allclose(checkpoint.logits, self.expectedLogits(), rtol=1e-6)
+
+    def test_partially_written_undo_log_is_rolled_back(self):
+        checkpoint = self.openCheckpoint()
+        self.accumulate(checkpoint, range(5))
+        checkpoint.commit()
+        self.accumulate(checkpoint, range(5, 8))
+        checkpoint.logits.flush()
+        undoPath = checkpoint.undoPath(checkpoint.generation + 1)
+        checkpoint.close()
+        with open(undoPath, "ab") as f:
+            f.write(b"\x93NUMPY")
+
+        checkpoint = self.openCheckpoint()
+        self.assertEqual(checkpoint.completed, set(range(5)))
+        self.accumulate(checkpoint, range(len(self.tiles)))
+        checkpoint.commit()
+        np.testing.assert_allclose(checkpoint.logits, self.expectedLogits(), rtol=1e-6)
+
+    def test_checkpoint_of_another_geometry_is_reset(self):
+        checkpoint = self.openCheckpoint()
+        self.accumulate(checkpoint, range(3))
+        checkpoint.commit()
+        checkpoint.close()
+
+        checkpoint = TileCheckpoint(self.folder, (2, 30, 24, 24), len(self.tiles))
+        self.assertEqual(checkpoint.completed, set())
+        self.assertFalse(np.any(checkpoint.logits))
+
+
+class TileCheckpointStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.store = TileCheckpointStore(self.tmpDir.name, maxSize_GB=0)
+        self.parameters = {"fold": "0", "stepSize": 0.5}
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_array_hash_depends_on_content_and_shape(self):
+        array = np.arange(64, dtype=np.float32).reshape(4, 4, 4)
+        self.assertEqual(arrayHash(array), arrayHash(array.copy()))
+        self.assertNotEqual(arrayHash(array), arrayHash(array.reshape(4, 16)))
+        changed = array.copy()
+        changed[1, 2, 3] += 1
+        self.assertNotEqual(arrayHash(array), arrayHash(changed))
+
+    def test_entries_are_keyed_by_volume_and_parameters(self):
+        first = self.store.open("a" * 64, self.parameters, (2, 4, 4, 4), 1)
+        second = self.store.open("a" * 64, {**self.parameters, "fold": "1"}, (2, 4, 4, 4), 1)
+        self.assertNotEqual(first.folder, second.folder)
+        self.assertEqual(self.store.open("a" * 64, self.parameters, (2, 4, 4, 4), 1).folder, first.folder)
+
+        self.store.remove("a" * 64)
+        self.assertEqual(self.store.entries(), [])
+
+    def test_eviction_keeps_the_checkpoints_of_current_volume(self):
+        old = self.store.open("b" * 64, self.parameters, (2, 4, 4, 4), 1)
+        os.utime(old.folder, (0, 0))
+        current = self.store.open("c" * 64, self.parameters, (2, 4, 4, 4), 1)
+        self.assertFalse(old.folder.exists())
+        self.assertTrue(current.folder.exists())
+
+    def test_parameter_forwards_tile_checkpoints_to_worker(self):
+        args = InferenceParameter(modelPath="model", tileCheckpointFolder="tiles").toWorkerArgs()
+        self.assertEqual(args[args.index("--tile-checkpoints") + 1], "tiles")
+        self.assertEqual(args[args.index("--tile-checkpoint-interval") + 1], "30.0")
+        self.assertNotIn("--tile-checkpoints", InferenceParameter(modelPath="model").toWorkerArgs())
@@ -0,0 +1,118 @@
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import slicer
+
+from UpperAirwaySegmentatorLib import ExportFormat, FolderScanner, Job, JobJournal, JobState, SegmentationWidget, \
+    WatchFolderService
+from .SegmentationWidgetTestCase import MockLogic
+from .Utils import UpperAirwaySegmentatorTestCase, load_test_CT_volume
+
+
+class WatchFolderServiceTestCase(UpperAirwaySegmentatorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpDir = TemporaryDirectory()
+        self.inputDir = Path(self.tmpDir.name, "input")
+        self.outputDir = Path(self.tmpDir.name, "output")
+        self.inputDir.mkdir()
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+        super().tearDown()
+
+    def test_journal_restores_latest_job_state(self):
+        journal = JobJournal(self.outputDir / "journal.jsonl")
+        job = Job(jobId="abc", inputPath="volume.nii.gz", isDicom=False)
+        journal.write(job)
+        job.state = JobState.DONE
+        journal.write(job)
+
+        with open(journal.journalPath, "a") as f:
+            f.write('{"jobId": "partial", "inpu')
+
+        jobs = journal.read()
+        self.assertEqual(list(jobs.keys()), ["abc"])
+        self.assertEqual(jobs["abc"].state, JobState.DONE)
+
+    def test_scanner_waits_for_settle_time(self):
+        now = [0.0]
+        scanner = FolderScanner([self.inputDir], settleTime_s=10, clock=lambda: now[0])
+        volumePath = self.inputDir / "volume.nii.gz"
+        volumePath.write_bytes(b"0" * 10)
+        now[0] = volumePath.stat().st_mtime
+
+        self.assertEqual(scanner.scan(), [])
+        now[0] += 5
+        self.assertEqual(scanner.scan(), [])
+        now[0] += 6
+        self.assertEqual([path for path, _, _ in scanner.scan()], [volumePath])
+
+    def test_scanner_detects_dicom_series_folders(self):
+        seriesDir = self.inputDir / "series"
+        seriesDir.mkdir()
+        (seriesDir / "IM0001").write_bytes(b"\0" * 128 + b"DICM")
+        (self.inputDir / "notes.txt").write_text("not an input")
+
+        scanner = FolderScanner([self.inputDir], settleTime_s=0)
+        self.assertEqual([(path, isDicom) for path, isDicom, _ in scanner.scan()], [(seriesDir, True)])
+
+    def test_service_segments_and_exports_new_volumes(self):
+        slicer.util.saveNode(load_test_CT_volume(), (self.inputDir / "volume.nii.gz").as_posix())
+        logic = MockLogic()
+        widget = SegmentationWidget(logic=logic)
+        service = WatchFolderService(widget, [self.inputDir], self.outputDir, ExportFormat.NIFTI, settleTime_s=0)
+        service.start()
+        logic.startSegmentation.assert_called_once()
+        self.assertIsNotNone(service.currentJob)
+        self.assertFalse(widget.isInteractive)
+
+        logic.inferenceFinished()
+        widget.waitForPostProcessingFinished()
+        slicer.app.processEvents()
+        self.assertTrue(widget.isInteractive)
+        service.stop()
+
+        jobs = service.journal.read()
+        self.assertEqual([job.state for job in jobs.values()], [JobState.DONE])
+        caseFolder = self.outputDir / next(iter(jobs.values())).caseName
+        self.assertEqual(len(list(caseFolder.glob("*.nii.gz"))), 1)
+        with open(caseFolder / service.statusFileName) as f:
+            self.assertEqual(json.load(f)["state"], "done")
+
+    def test_widget_interactive_mode_is_restored_when_a_job_fails(self):
+        slicer.util.saveNode(load_test_CT_volume(), (self.inputDir / "volume.nii.gz").as_posix())
+        logic = MockLogic()
+        widget = SegmentationWidget(logic=logic)
+        service = WatchFolderService(widget, [self.inputDir], self.outputDir, ExportFormat.NIFTI, settleTime_s=0)
+        service.start()
+        self.assertFalse(widget.isInteractive)
+
+        logic.errorOccurred("Inference failed")
+        slicer.app.processEvents()
+        self.assertTrue(widget.isInteractive)
+        service.stop()
+
+        jobs = service.journal.read()
+        self.assertEqual([job.state for job in jobs.values()], [JobState.FAILED])
+
+    def test_service_restores_interrupted_jobs(self):
+        journal = JobJournal(self.outputDir / WatchFolderService.journalFileName)
+        journal.write(Job(jobId="abc", inputPath="missing.nii.gz", isDicom=False, state=JobState.RUNNING, attempts=1))
+
+        service = WatchFolderService(MockWidget(), [self.inputDir], self.outputDir, ExportFormat.NIFTI)
+        service.start()
+        service.stop()
+
+        job = service.journal.read()["abc"]
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(job.state, JobState.FAILED)
+
+
+class MockWidget:
+    def __init__(self):
+        from UpperAirwaySegmentatorLib import Signal
+        self.segmentationFinished = Signal("object")
+        self.segmentationFailed = Signal("str")
+        self.isInteractive = True
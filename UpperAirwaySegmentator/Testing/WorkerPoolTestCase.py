@@ -0,0 +1,101 @@
+import importlib.util
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+from UpperAirwaySegmentatorInference.FoldEnsemble import mergePartialSums, splitFolds
+from UpperAirwaySegmentatorInference.Predictor import AirwayPredictor
+from UpperAirwaySegmentatorInference.Worker import parseCpuList, formatCpuList
+from UpperAirwaySegmentatorInference.WorkerPool import (
+    BatchReport,
+    CpuWorkerPool,
+    candidateWorkerCounts,
+    splitCpus,
+)
+
+
+class WorkerPoolTestCase(unittest.TestCase):
+    def test_cpus_are_split_in_contiguous_groups(self):
+        slots = splitCpus(3, cpus=list(range(8)))
+        self.assertEqual([slot.cpus for slot in slots], [[0, 1, 2], [3, 4, 5], [6, 7]])
+        self.assertEqual([slot.intraOpThreads for slot in slots], [3, 3, 2])
+
+    def test_worker_count_is_limited_to_cpu_count(self):
+        self.assertEqual(len(splitCpus(8, cpus=[0, 1])), 2)
+        self.assertEqual(len(splitCpus(0, cpus=[0, 1])), 1)
+
+    def test_worker_environment_limits_threads(self):
+        environment = splitCpus(4, cpus=list(range(32)))[0].environment({})
+        self.assertEqual(environment["OMP_NUM_THREADS"], "8")
+        self.assertEqual(environment["nnUNet_def_n_proc"], "8")
+        self.assertIn("PYTHONPATH", environment)
+
+    def test_candidate_worker_counts_keep_two_cpus_per_worker(self):
+        self.assertEqual(candidateWorkerCounts(1), [1])
+        self.assertEqual(candidateWorkerCounts(32), [1, 2, 4, 8, 16])
+
+    def test_cpu_list_round_trip(self):
+        self.assertEqual(parseCpuList("0-3,8"), [0, 1, 2, 3, 8])
+        self.assertEqual(parseCpuList(formatCpuList([4, 5])), [4, 5])
+        self.assertEqual(parseCpuList(""), [])
+
+    def test_report_computes_cases_per_hour(self):
+        report = BatchReport(nWorkers=2, wallTime_s=1800, caseDurations_s={"a": 900, "b": 900})
+        self.assertAlmostEqual(report.casesPerHour, 4.0)
+
+    def test_calibration_is_cached_outside_the_model_folder(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            modelFolder, cacheFolder = Path(tmpDir, "model"), Path(tmpDir, "cache")
+            modelFolder.mkdir()
+            messages = []
+            pool = CpuWorkerPool(
+                modelFolder, cpus=[0, 1], progressCallback=messages.append, modelCacheFolder=cacheFolder
+            )
+            self.assertEqual(pool.calibrationFile.parent, cacheFolder)
+            self.assertIn(cacheFolder.as_posix(), pool.workerCommand(splitCpus(1, [0, 1])[0], []))
+
+            pool._writeCalibration({"key": {"nWorkers": 2}})
+            self.assertEqual(pool._readCalibration(), {"key": {"nWorkers": 2}})
+            self.assertEqual(list(modelFolder.iterdir()), [])
+
+            # Failing writes are reported without stopping the inference
+            pool.calibrationFile = modelFolder / "missing" / "file" / "worker_calibration.json"
+            modelFolder.joinpath("missing").write_text("")
+            pool._writeCalibration({})
+            self.assertEqual(len(messages), 1)
+
+    def test_folds_are_split_across_processes(self):
+        self.assertEqual(splitFolds(["0", "1", "2", "3", "4"], 2), [["0", "2", "4"], ["1", "3"]])
+        self.assertEqual(splitFolds(["0"], 4), [["0"]])
+
+    def test_partial_sums_are_merged_in_half_precision(self):
+        with tempfile.TemporaryDirectory() as tmpDir:
+            partialFiles = [Path(tmpDir, f"{i}.npy") for i in range(3)]
+            for i, partialFile in enumerate(partialFiles):
+                np.save(partialFile, np.full((2, 3, 4, 5), i + 1, dtype=np.float16))
+
+            logitSum = mergePartialSums(partialFiles)
+            self.assertEqual(logitSum.dtype, np.float16)
+            np.testing.assert_array_equal(logitSum, np.full((2, 3, 4, 5), 6, dtype=np.float16))
+
+    @unittest.skipUnless(importlib.util.find_spec("torch"), "torch is not installed")
+    def test_only_multi_fold_logits_are_summed_in_half_precision(self):
+        import torch
+
+        data = torch.rand((2, 4, 6, 8))
+        with tempfile.TemporaryDirectory() as tmpDir:
+            Path(tmpDir).joinpath("dataset.json").write_text("{}")
+            for folds, dtype in [("0", torch.float32), ("0,1", torch.half)]:
+                predictor = AirwayPredictor(tmpDir, folds=folds)
+                predictor._predictor = SimpleNamespace(
+                    network=torch.nn.Identity(),
+                    list_of_parameters=[{} for _ in predictor.folds],
+                    device=torch.device("cpu"),
+                    predict_sliding_window_return_logits=lambda tile: tile.clone(),
+                )
+                logitSum, nFolds = predictor.predictLogitSum(data)
+                self.assertEqual(nFolds, len(predictor.folds))
+                self.assertEqual(logitSum.dtype, dtype)
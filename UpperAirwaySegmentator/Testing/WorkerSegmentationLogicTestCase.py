@@ -0,0 +1,124 @@
+import time
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import qt
+import slicer
+
+from UpperAirwaySegmentatorInference.Cancellation import CANCELLED_EXIT_CODE
+from UpperAirwaySegmentatorLib.WorkerSegmentationLogic import WorkerSegmentationLogic
+from .Utils import UpperAirwaySegmentatorTestCase
+
+# Worker stand ins running until stopped. The cooperative worker checks the cancel file between its "tiles".
+COOPERATIVE_WORKER = f"""
+import sys, time
+from UpperAirwaySegmentatorInference.Cancellation import CancelFile, InferenceCancelled
+cancelFile = CancelFile(sys.argv[1])
+print("started", flush=True)
+try:
+    while True:
+        time.sleep(0.05)
+        cancelFile.check()
+except InferenceCancelled:
+    sys.exit({CANCELLED_EXIT_CODE})
+"""
+
+UNRESPONSIVE_WORKER = """
+import time
+print("started", flush=True)
+while True:
+    time.sleep(1)
+"""
+
+
+class WorkerSegmentationLogicTestCase(UpperAirwaySegmentatorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.logic = WorkerSegmentationLogic()
+        self.onErrorOccurred = MagicMock()
+        self.onInferenceFinished = MagicMock()
+        self.logic.errorOccurred.connect(self.onErrorOccurred)
+        self.logic.inferenceFinished.connect(self.onInferenceFinished)
+
+    def tearDown(self):
+        self.logic.waitForSegmentationFinished()
+        super().tearDown()
+
+    def startWorker(self, script):
+        self.logic._tmpDir = qt.QTemporaryDir()
+        self.logic._startWorker(["-c", script, self.logic.cancelFile.as_posix()])
+        process = self.logic.inferenceProcess
+        self.assertTrue(process.waitForReadyRead(30000))
+        return process, Path(self.logic._tmpDir.path())
+
+    def stopAndMeasureResponsiveness(self, timeout_s=15.0):
+        """
+        Stops the worker and runs the event loop until the worker is stopped and its files are removed.
+
+        :returns: duration of the stop call, longest interval between two ticks of a 10 ms timer while stopping and
+            total stop duration, in seconds
+        """
+        ticks = []
+        timer = qt.QTimer()
+        timer.setInterval(10)
+        timer.timeout.connect(lambda: ticks.append(time.perf_counter()))
+
+        start = time.perf_counter()
+        self.logic.stopSegmentation()
+        stopCall_s = time.perf_counter() - start
+
+        timer.start()
+        ticks.append(time.perf_counter())
+        while self.logic.hasStoppingWorkers() and time.perf_counter() - start < timeout_s:
+            slicer.app.processEvents(qt.QEventLoop.AllEvents, 10)
+        timer.stop()
+        ticks.append(time.perf_counter())
+
+        self.assertFalse(self.logic.hasStoppingWorkers())
+        return stopCall_s, max(b - a for a, b in zip(ticks, ticks[1:])), time.perf_counter() - start
+
+    def test_stop_returns_immediately_and_worker_stops_cooperatively(self):
+        process, tmpFolder = self.startWorker(COOPERATIVE_WORKER)
+
+        stopCall_s, longestTick_s, stop_s = self.stopAndMeasureResponsiveness()
+        self.assertLess(stopCall_s, 0.1)
+        self.assertLess(longestTick_s, 0.25)
+        self.assertLess(stop_s, self.logic.stopTimeout_s)
+        self.assertEqual(process.exitStatus(), qt.QProcess.NormalExit)
+        self.assertEqual(process.exitCode(), CANCELLED_EXIT_CODE)
+        self.assertFalse(tmpFolder.exists())
+
+        self.onErrorOccurred.assert_not_called()
+        self.onInferenceFinished.assert_not_called()
+
+    def test_unresponsive_worker_is_killed_after_timeout(self):
+        self.logic.stopTimeout_s = 0.5
+        process, tmpFolder = self.startWorker(UNRESPONSIVE_WORKER)
+
+        stopCall_s, longestTick_s, stop_s = self.stopAndMeasureResponsiveness()
+        self.assertLess(stopCall_s, 0.1)
+        self.assertLess(longestTick_s, 0.25)
+        self.assertGreaterEqual(stop_s, self.logic.stopTimeout_s)
+        self.assertEqual(process.exitStatus(), qt.QProcess.CrashExit)
+        self.assertFalse(tmpFolder.exists())
+        self.onErrorOccurred.assert_not_called()
+
+    def test_restarting_kills_the_stopping_worker(self):
+        process, _ = self.startWorker(UNRESPONSIVE_WORKER)
+        self.logic.stopSegmentation()
+        self.assertTrue(self.logic.hasStoppingWorkers())
+
+        self.logic._killStoppedWorkers()
+        self.assertEqual(process.state(), qt.QProcess.NotRunning)
+
+    def test_crashed_worker_reports_an_error(self):
+        process, _ = self.startWorker(UNRESPONSIVE_WORKER)
+
+        # Worker killed by the system, for instance after running out of memory
+        process.kill()
+        self.assertTrue(process.waitForFinished(30000))
+
+        self.onErrorOccurred.assert_called_once()
+        self.assertIn("crashed", self.onErrorOccurred.call_args[0][0])
+        self.onInferenceFinished.assert_not_called()
+        self.assertIsNone(self.logic.inferenceProcess)
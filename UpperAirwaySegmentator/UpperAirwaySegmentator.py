@@ -1,7 +1,10 @@
+import logging
+
 import slicer
 from slicer.ScriptedLoadableModule import *
 
-from UpperAirwaySegmentatorLib import SegmentationWidget
+from UpperAirwaySegmentatorLib import SegmentationWidget, WatchFolderWidget
+from UpperAirwaySegmentatorLib.Utils import addInCollapsibleLayout
 
 
 class UpperAirwaySegmentator(ScriptedLoadableModule):
@@ -39,9 +42,46 @@ class UpperAirwaySegmentatorWidget(ScriptedLoadableModuleWidget):
         widget = SegmentationWidget()
         self.logic = widget.logic
         self.layout.addWidget(widget)
+        addInCollapsibleLayout(WatchFolderWidget(widget), self.layout, "Watch folder service", isCollapsed=True)
         self.layout.addStretch()
 
 
+class UpperAirwaySegmentatorFileReader:
+    """
+    Loads the compact labelmaps exported by the module (.seg.npz) from drag and drop or the Add Data dialog.
+    """
+
+    def __init__(self, parent):
+        self.parent = parent
+
+    def description(self):
+        return "Compact airway segmentation"
+
+    def fileType(self):
+        return "UpperAirwaySegmentatorCompactSegmentation"
+
+    def extensions(self):
+        from UpperAirwaySegmentatorInference.CompactLabelmap import COMPACT_LABELMAP_EXTENSION
+        return [f"Compact airway segmentation (*{COMPACT_LABELMAP_EXTENSION})"]
+
+    def canLoadFile(self, filePath):
+        from UpperAirwaySegmentatorInference.CompactLabelmap import COMPACT_LABELMAP_EXTENSION
+        return filePath.endswith(COMPACT_LABELMAP_EXTENSION)
+
+    def load(self, properties):
+        from UpperAirwaySegmentatorLib.CompactSegmentation import loadCompactSegmentation
+
+        try:
+            segmentationNode = loadCompactSegmentation(properties["fileName"], properties.get("name"))
+        except Exception as e:
+            logging.error(f"Failed to load compact segmentation {properties['fileName']} : {e}")
+            self.parent.loadedNodes = []
+            return False
+
+        self.parent.loadedNodes = [segmentationNode.GetID()]
+        return True
+
+
 class UpperAirwaySegmentatorTest(ScriptedLoadableModuleTest):
     def runTest(self):
         try:
@@ -0,0 +1,40 @@
+import time
+from pathlib import Path
+
+# Exit code of the workers stopped by a cancel request
+CANCELLED_EXIT_CODE = 3
+
+
+class InferenceCancelled(Exception):
+    """
+    Raised in the worker when a cancel was requested. Not a RuntimeError which nnU-Net catches to retry the sliding
+    window prediction on CPU.
+    """
+
+
+class CancelFile:
+    """
+    Cooperative cancellation of the inference workers. The requesting process creates the cancel file and the worker
+    checks for it between two sliding window tiles, folds and inputs. The file existence is checked at most every
+    checkInterval_s seconds.
+    """
+
+    def __init__(self, path, checkInterval_s=0.2):
+        self.path = Path(path)
+        self.checkInterval_s = checkInterval_s
+        self._lastCheck = 0.0
+        self._isRequested = False
+
+    def request(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.touch()
+
+    def isRequested(self):
+        if not self._isRequested and time.time() - self._lastCheck >= self.checkInterval_s:
+            self._lastCheck = time.time()
+            self._isRequested = self.path.exists()
+        return self._isRequested
+
+    def check(self):
+        if self.isRequested():
+            raise InferenceCancelled(f"Inference cancelled by {self.path}.")
@@ -0,0 +1,312 @@
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+WEIGHTS_SUFFIX = ".weights.pth"
+WEIGHTS_FOLDER_NAME = "Weights"
+CHECKPOINT_HASHES_FILE_NAME = "checkpoint_hashes.json"
+
+# Checkpoint entries used for inference. The optimizer state and training logs are left out of the weights file.
+INFERENCE_KEYS = ["network_weights", "trainer_name", "init_args", "inference_allowed_mirroring_axes"]
+
+
+def userCacheFolder():
+    """
+    Per user folder of the files derived from the models, such as the converted weights files. Model folders are never
+    written as they can be read only entries of the shared model store.
+    """
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or Path.home().joinpath("AppData", "Local")
+    elif sys.platform == "darwin":
+        base = Path.home().joinpath("Library", "Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or Path.home().joinpath(".cache")
+    return Path(base).joinpath("UpperAirwaySegmentator")
+
+
+def readJson(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def writeJson(path, content):
+    """
+    Writes the json file through a temporary file as other processes may be reading the same file.
+    """
+    tmpPath = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmpPath, "w") as f:
+        json.dump(content, f, indent=2)
+    os.replace(tmpPath, path)
+
+
+def checkpointHash(checkpointPath, cacheFolder):
+    """
+    SHA-256 of the checkpoint content. Hashes are recorded in the cache folder per checkpoint path, size and
+    modification time for each checkpoint version to be read once.
+    """
+    from .PreprocessingCache import fileHash
+
+    checkpointPath = Path(checkpointPath).resolve()
+    stat = checkpointPath.stat()
+    pathKey = checkpointPath.as_posix() + "|"
+    key = f"{pathKey}{stat.st_size}|{stat.st_mtime_ns}"
+    hashesPath = Path(cacheFolder) / CHECKPOINT_HASHES_FILE_NAME
+    hashes = readJson(hashesPath)
+    if key not in hashes:
+        # Hashes of the previous versions of the checkpoint are replaced
+        hashes = {entry: value for entry, value in hashes.items() if not entry.startswith(pathKey)}
+        hashes[key] = fileHash(checkpointPath)
+        hashesPath.parent.mkdir(parents=True, exist_ok=True)
+        writeJson(hashesPath, hashes)
+    return hashes[key]
+
+
+def weightsPath(checkpointPath, cacheFolder):
+    """
+    Path of the inference weights file converted from the checkpoint, in the cache folder and named after the checkpoint
+    hash.
+    """
+    return Path(cacheFolder) / WEIGHTS_FOLDER_NAME / f"{checkpointHash(checkpointPath, cacheFolder)}{WEIGHTS_SUFFIX}"
+
+
+def modelHash(modelFolder, folds, checkpointName, cacheFolder):
+    """
+    SHA-256 of the model plans and of the checkpoints of the folds. Identical models share the same hash whatever their
+    folder.
+    """
+    modelFolder = Path(modelFolder)
+    hashes = [checkpointHash(modelFolder / "plans.json", cacheFolder)]
+    hashes += [checkpointHash(modelFolder.joinpath(f"fold_{fold}", checkpointName), cacheFolder) for fold in folds]
+    return hashlib.sha256("|".join(hashes).encode()).hexdigest()
+
+
+def loadCheckpoint(path, mmap=True):
+    """
+    Loads the checkpoint with its tensors memory mapped from the file. Mapped pages are read from disk when first used
+    and shared by all the processes loading the same file. Falls back to a regular load for torch versions or legacy
+    checkpoint files not supporting memory mapping.
+    """
+    import torch
+
+    if mmap:
+        try:
+            return torch.load(path, map_location="cpu", weights_only=False, mmap=True)
+        except (TypeError, RuntimeError):
+            pass
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+
+def convertCheckpoint(checkpointPath, cacheFolder=None, progressCallback=None):
+    """
+    Writes the inference entries of the checkpoint to its weights file in the cache folder, once per checkpoint content.
+    The weights file uses the torch zip format which supports memory mapping and is about a third of the checkpoint
+    size.
+
+    :param cacheFolder: folder of the weights files. Defaults to the user cache folder.
+    :returns: weights file path or the checkpoint path if the weights file can't be written
+    """
+    import torch
+
+    progressCallback = progressCallback or (lambda *_: None)
+    checkpointPath = Path(checkpointPath)
+    cacheFolder = Path(cacheFolder) if cacheFolder else userCacheFolder()
+    try:
+        cacheFolder.joinpath(WEIGHTS_FOLDER_NAME).mkdir(parents=True, exist_ok=True)
+        outputPath = weightsPath(checkpointPath, cacheFolder)
+    except OSError as e:
+        progressCallback(f"Failed to access the weights cache {cacheFolder}, loading the checkpoint instead : {e}")
+        return checkpointPath
+
+    if outputPath.exists():
+        return outputPath
+
+    start = time.time()
+    checkpoint = loadCheckpoint(checkpointPath)
+    weights = {key: checkpoint[key] for key in INFERENCE_KEYS if key in checkpoint}
+    weights["network_weights"] = {name: tensor.contiguous() for name, tensor in weights["network_weights"].items()}
+
+    # Written to a temporary file first as other processes may be loading the same model
+    tmpPath = outputPath.with_name(f"{outputPath.name}.{os.getpid()}.tmp")
+    try:
+        torch.save(weights, tmpPath)
+        os.replace(tmpPath, outputPath)
+    except OSError as e:
+        tmpPath.unlink(missing_ok=True)
+        progressCallback(f"Failed to write the weights file {outputPath}, loading the checkpoint instead : {e}")
+        return checkpointPath
+
+    progressCallback(f"Converted {checkpointPath.name} to {outputPath} in {time.time() - start:.1f} s.")
+    return outputPath
+
+
+def initializePredictor(predictor, modelFolder, folds, checkpointName, cacheFolder=None, progressCallback=None):
+    """
+    Initializes the nnU-Net predictor from the memory mapped weights files of the folds, converted in the cache folder.
+    Follows nnU-Net's initialize_from_trained_model_folder which reads the full checkpoints, optimizer state included,
+    into the private memory of each process.
+    """
+    import nnunetv2
+    from batchgenerators.utilities.file_and_folder_operations import load_json
+    from nnunetv2.utilities.find_class_by_name import recursive_find_python_class
+    from nnunetv2.utilities.label_handling.label_handling import determine_num_input_channels
+    from nnunetv2.utilities.plans_handling.plans_handler import PlansManager
+
+    modelFolder = Path(modelFolder)
+    datasetJson = load_json(modelFolder.joinpath("dataset.json").as_posix())
+    plansManager = PlansManager(load_json(modelFolder.joinpath("plans.json").as_posix()))
+
+    parameters, checkpoint = [], None
+    for fold in folds:
+        checkpointPath = modelFolder.joinpath(f"fold_{fold}", checkpointName)
+        checkpoint = loadCheckpoint(convertCheckpoint(checkpointPath, cacheFolder, progressCallback))
+        parameters.append(checkpoint["network_weights"])
+
+    trainerName = checkpoint["trainer_name"]
+    configurationManager = plansManager.get_configuration(checkpoint["init_args"]["configuration"])
+    trainerClass = recursive_find_python_class(
+        os.path.join(nnunetv2.__path__[0], "training", "nnUNetTrainer"),
+        trainerName,
+        "nnunetv2.training.nnUNetTrainer"
+    )
+    if trainerClass is None:
+        raise RuntimeError(f"Unable to find the nnU-Net trainer class {trainerName}.")
+
+    network = trainerClass.build_network_architecture(
+        configurationManager.network_arch_class_name,
+        configurationManager.network_arch_init_kwargs,
+        configurationManager.network_arch_init_kwargs_req_import,
+        determine_num_input_channels(plansManager, configurationManager, datasetJson),
+        plansManager.get_label_manager(datasetJson).num_segmentation_heads,
+        enable_deep_supervision=False
+    )
+    predictor.manual_initialization(
+        network,
+        plansManager,
+        configurationManager,
+        parameters,
+        datasetJson,
+        trainerName,
+        checkpoint.get("inference_allowed_mirroring_axes")
+    )
+
+
+def loadNetworkWeights(network, parameters, shareMemory=True):
+    """
+    Loads the fold weights in the network. When sharing memory, the network parameters are assigned the memory mapped
+    tensors instead of being copied to private memory. Only used on CPU where inference never writes the parameters.
+    """
+    if shareMemory:
+        try:
+            network.load_state_dict(parameters, assign=True)
+            return
+        except TypeError:
+            # assign requires torch 2.1
+            pass
+    network.load_state_dict(parameters)
+
+
+def readResidentMemory(statusPath="/proc/self/status"):
+    """
+    :returns: dict of the resident, anonymous (private) and file backed (shareable) memory of this process in MB or
+        None if the platform doesn't report it
+    """
+    fields = {"VmRSS:": "rss_MB", "RssAnon:": "anonymous_MB", "RssFile:": "file_MB"}
+    memory = {}
+    try:
+        with open(statusPath, "r") as f:
+            for line in f:
+                key, *values = line.split()
+                if key in fields:
+                    memory[fields[key]] = int(values[0]) / 1024
+    except OSError:
+        return None
+    return memory or None
+
+
+def measureLoad(modelPath, folds, checkpointName, mmap, cacheFolder=None):
+    """
+    Loads the fold weights the way the predictor does and reports the load time and the resident memory once loaded.
+    """
+    from .Predictor import findModelFolder, parseFolds
+
+    modelFolder = findModelFolder(modelPath)
+    start = time.time()
+    parameters = []
+    for fold in parseFolds(folds):
+        checkpointPath = modelFolder.joinpath(f"fold_{fold}", checkpointName)
+        if mmap:
+            parameters.append(loadCheckpoint(convertCheckpoint(checkpointPath, cacheFolder))["network_weights"])
+        else:
+            parameters.append(loadCheckpoint(checkpointPath, mmap=False)["network_weights"])
+
+    # Touch every weight as the inference does
+    for weights in parameters:
+        for tensor in weights.values():
+            float(tensor.float().sum())
+    return {"mmap": mmap, "load_s": time.time() - start, **(readResidentMemory() or {})}
+
+
+def compareLoading(modelPath, folds, checkpointName, nProcesses=2, cacheFolder=None):
+    """
+    Loads the weights in parallel processes, with and without memory mapping.
+
+    :returns: dict of per process measures for each loading mode
+    """
+    results = {}
+    for mode in ["torch.load", "mmap"]:
+        command = [
+            sys.executable, "-m", "UpperAirwaySegmentatorInference.Checkpoint",
+            "--model", Path(modelPath).as_posix(),
+            "--folds", str(folds),
+            "--checkpoint", checkpointName,
+            "--measure",
+        ]
+        if mode == "mmap":
+            command.append("--mmap")
+        if cacheFolder:
+            command += ["--model-cache", Path(cacheFolder).as_posix()]
+
+        processes = [subprocess.Popen(command, stdout=subprocess.PIPE, text=True) for _ in range(nProcesses)]
+        results[mode] = [json.loads(process.communicate()[0].strip().splitlines()[-1]) for process in processes]
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the nnU-Net weights loading with and without memory mapping.")
+    parser.add_argument("--model", required=True, help="Folder containing the nnU-Net model.")
+    parser.add_argument("--folds", default="0", help="Comma separated model folds.")
+    parser.add_argument("--checkpoint", default="checkpoint_final.pth", help="Model checkpoint file name.")
+    parser.add_argument("--processes", type=int, default=2, help="Number of processes loading the weights in parallel.")
+    parser.add_argument("--model-cache", default="", help="Converted weights folder. Defaults to the user cache.")
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--mmap", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        measure = measureLoad(args.model, args.folds, args.checkpoint, args.mmap, args.model_cache)
+        print(json.dumps(measure), flush=True)
+        return 0
+
+    # Converted once before the measures
+    measureLoad(args.model, args.folds, args.checkpoint, mmap=True, cacheFolder=args.model_cache)
+    comparison = compareLoading(args.model, args.folds, args.checkpoint, args.processes, args.model_cache)
+    for mode, measures in comparison.items():
+        for measure in measures:
+            print(
+                f"{mode:>10} : loaded in {measure['load_s']:.2f} s, resident {measure.get('rss_MB', 0):.0f} MB"
+                f" (private {measure.get('anonymous_MB', 0):.0f} MB,"
+                f" shared file pages {measure.get('file_MB', 0):.0f} MB)"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+import json
+import shutil
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from .Server import FINAL_STATES, PARAMETER_HEADER
+
+# Inference settings chosen by the client, the other settings are fixed by the server
+CLIENT_PARAMETER_FIELDS = [
+    "folds", "stepSize", "disableTta", "adaptiveTta", "checkPointName", "saveProbabilities", "precision"
+]
+
+
+class InferenceClient:
+    """
+    Client of the inference server. Calls are blocking and must be run outside of the Qt main thread.
+    """
+
+    def __init__(self, serverUrl, timeout_s=30.0):
+        self.serverUrl = serverUrl.rstrip("/")
+        self.timeout_s = timeout_s
+
+    def health(self):
+        return self._requestJson("GET", "/health")
+
+    def submit(self, inputFile, parameter):
+        """
+        Uploads the compressed volume and queues its segmentation.
+
+        :param parameter: InferenceParameter, only the client settings are sent
+        :returns: job id
+        """
+        inputFile = Path(inputFile)
+        requested = {name: getattr(parameter, name) for name in CLIENT_PARAMETER_FIELDS}
+        with open(inputFile, "rb") as f:
+            request = urllib.request.Request(
+                f"{self.serverUrl}/jobs",
+                data=f,
+                method="POST",
+                headers={
+                    "Content-Length": str(inputFile.stat().st_size),
+                    "Content-Type": "application/octet-stream",
+                    PARAMETER_HEADER: json.dumps(requested),
+                },
+            )
+            with self._open(request) as response:
+                return json.loads(response.read())["id"]
+
+    def status(self, jobId):
+        return self._requestJson("GET", f"/jobs/{jobId}")
+
+    def events(self, jobId):
+        """
+        Yields the job events streamed by the server until its final state event.
+        """
+        request = urllib.request.Request(f"{self.serverUrl}/jobs/{jobId}/events")
+        with urllib.request.urlopen(request) as response:
+            for line in response:
+                event = json.loads(line)
+                yield event
+                if event.get("state") in FINAL_STATES:
+                    return
+
+    def download(self, jobId, outputPath, resource="result"):
+        """
+        Downloads the job result or probability map.
+
+        :returns: False if the resource is not available
+        """
+        request = urllib.request.Request(f"{self.serverUrl}/jobs/{jobId}/{resource}")
+        try:
+            with self._open(request) as response, open(outputPath, "wb") as f:
+                shutil.copyfileobj(response, f)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return False
+            raise
+        return True
+
+    def cancel(self, jobId):
+        """
+        Cancels the job and removes its files from the server.
+        """
+        try:
+            return self._requestJson("DELETE", f"/jobs/{jobId}")
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def _requestJson(self, method, path):
+        request = urllib.request.Request(f"{self.serverUrl}{path}", method=method)
+        with self._open(request) as response:
+            return json.loads(response.read())
+
+    def _open(self, request):
+        return urllib.request.urlopen(request, timeout=self.timeout_s)
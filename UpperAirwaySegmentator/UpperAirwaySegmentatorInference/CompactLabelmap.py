@@ -0,0 +1,147 @@
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+COMPACT_LABELMAP_EXTENSION = ".seg.npz"
+FORMAT_VERSION = 1
+
+
+def labelmapBoundingBox(array):
+    """
+    :returns: list of (start, stop) per axis of the non zero voxels or None if the array is empty
+    """
+    bounds = []
+    for axis in range(array.ndim):
+        otherAxes = tuple(a for a in range(array.ndim) if a != axis)
+        indices = np.flatnonzero(np.any(array, axis=otherAxes))
+        if not len(indices):
+            return None
+        bounds.append((int(indices[0]), int(indices[-1]) + 1))
+    return bounds
+
+
+def runLengthEncode(array):
+    """
+    Encodes the array flattened in C order as the value and length of each run of equal values.
+    """
+    flat = np.ascontiguousarray(array).ravel()
+    if not flat.size:
+        return flat[:0], np.zeros(0, dtype=np.uint32)
+
+    starts = np.concatenate([[0], np.flatnonzero(flat[1:] != flat[:-1]) + 1])
+    lengths = np.diff(np.append(starts, flat.size))
+    return flat[starts], lengths.astype(np.uint32 if flat.size < 2 ** 32 else np.uint64)
+
+
+def runLengthDecode(values, lengths, shape):
+    return np.repeat(values, lengths.astype(np.int64)).reshape(shape)
+
+
+@dataclass
+class CompactLabelmap:
+    """
+    Labelmap stored as its bounding box, optionally run length encoded, with the geometry of the full labelmap.
+
+    The full extent shape and the IJK to RAS matrix are kept so the labelmap is restored losslessly in its original
+    geometry. Segments list the name, color and label value of each segment.
+    """
+    shape: Tuple[int, ...]
+    bounds: Optional[List[Tuple[int, int]]]
+    dtype: str
+    ijkToRas: List[List[float]] = field(default_factory=lambda: np.eye(4).tolist())
+    segments: List[dict] = field(default_factory=list)
+    data: Optional[np.ndarray] = None
+    values: Optional[np.ndarray] = None
+    lengths: Optional[np.ndarray] = None
+
+    @classmethod
+    def fromArray(cls, array, ijkToRas=None, segments=None, runLength=True):
+        array = np.asarray(array)
+        bounds = labelmapBoundingBox(array)
+        labelmap = cls(
+            shape=tuple(array.shape),
+            bounds=bounds,
+            dtype=array.dtype.str,
+            ijkToRas=np.asarray(ijkToRas if ijkToRas is not None else np.eye(4), dtype=float).tolist(),
+            segments=list(segments or []),
+        )
+        if bounds is None:
+            return labelmap
+
+        cropped = array[labelmap.region]
+        if runLength:
+            labelmap.values, labelmap.lengths = runLengthEncode(cropped)
+        else:
+            labelmap.data = np.ascontiguousarray(cropped)
+        return labelmap
+
+    @property
+    def region(self):
+        return tuple(slice(start, stop) for start, stop in self.bounds)
+
+    @property
+    def isRunLengthEncoded(self):
+        return self.values is not None
+
+    def toArray(self):
+        array = np.zeros(self.shape, dtype=np.dtype(self.dtype))
+        if self.bounds is None:
+            return array
+
+        regionShape = tuple(stop - start for start, stop in self.bounds)
+        array[self.region] = (
+            runLengthDecode(self.values, self.lengths, regionShape) if self.isRunLengthEncoded else self.data
+        )
+        return array
+
+    @property
+    def nbytes(self):
+        """
+        Size of the stored voxel data in bytes.
+        """
+        arrays = [self.values, self.lengths] if self.isRunLengthEncoded else [self.data]
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def save(self, path, compress=True):
+        """
+        Saves the labelmap to a .npz file. Metadata is stored as a JSON string next to the voxel arrays.
+        """
+        metadata = {
+            "version": FORMAT_VERSION,
+            "shape": list(self.shape),
+            "bounds": self.bounds,
+            "dtype": self.dtype,
+            "ijkToRas": self.ijkToRas,
+            "segments": self.segments,
+        }
+        arrays = {"metadata": np.array(json.dumps(metadata))}
+        if self.isRunLengthEncoded:
+            arrays.update(values=self.values, lengths=self.lengths)
+        elif self.data is not None:
+            arrays["data"] = self.data
+
+        # np.savez appends .npz to the paths not ending with it
+        with open(path, "wb") as f:
+            (np.savez_compressed if compress else np.savez)(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(Path(path), allow_pickle=False) as arrays:
+            metadata = json.loads(str(arrays["metadata"]))
+            if metadata.get("version", 0) > FORMAT_VERSION:
+                raise ValueError(f"Unsupported compact labelmap version {metadata['version']} in {path}.")
+
+            bounds = metadata["bounds"]
+            return cls(
+                shape=tuple(metadata["shape"]),
+                bounds=[tuple(b) for b in bounds] if bounds is not None else None,
+                dtype=metadata["dtype"],
+                ijkToRas=metadata["ijkToRas"],
+                segments=metadata["segments"],
+                data=arrays["data"] if "data" in arrays else None,
+                values=arrays["values"] if "values" in arrays else None,
+                lengths=arrays["lengths"] if "lengths" in arrays else None,
+            )
@@ -0,0 +1,124 @@
+from dataclasses import dataclass
+from typing import Tuple
+
+import numpy as np
+
+
+@dataclass
+class FieldOfView:
+    """
+    Informative region of a volume array, as one slice per array axis.
+    """
+    region: Tuple[slice, ...]
+    originalShape: Tuple[int, ...]
+
+    @property
+    def shape(self):
+        return tuple(axisSlice.stop - axisSlice.start for axisSlice in self.region)
+
+    @property
+    def voxelReduction(self):
+        """
+        Fraction of the original voxels outside the region.
+        """
+        return 1.0 - float(np.prod(self.shape)) / float(np.prod(self.originalShape))
+
+    @property
+    def isTrimmed(self):
+        return self.shape != tuple(self.originalShape)
+
+    def start(self):
+        return [axisSlice.start for axisSlice in self.region]
+
+    def summary(self):
+        return (
+            f"Field of view trimmed from {tuple(self.originalShape)} to {self.shape} voxels"
+            f" ({100 * self.voxelReduction:.0f} % fewer voxels)."
+        )
+
+    def restore(self, array, fillValue=0, out=None):
+        """
+        Pads an array of the region shape back to the original shape.
+        """
+        if out is None:
+            out = np.full(self.originalShape, fillValue, dtype=array.dtype)
+        else:
+            out[...] = fillValue
+        out[self.region] = array
+        return out
+
+    def restoreNpy(self, inputPath, outputPath, fillValue=0):
+        """
+        Pads the .npy array of the region shape saved at inputPath back to the original shape and saves it to
+        outputPath. The output is written through a memory map and never fully loaded in memory.
+        """
+        array = np.load(inputPath, mmap_mode="r")
+        out = np.lib.format.open_memmap(outputPath, mode="w+", dtype=array.dtype, shape=tuple(self.originalShape))
+        self.restore(array, fillValue, out)
+        out.flush()
+        del out, array
+
+
+def _backgroundValue(array):
+    """
+    Most frequent value of the volume corners. CBCT scanners fill the voxels outside the reconstruction cylinder and
+    the padded slices with a constant value which is found in the corners.
+    """
+    corners = array[:, [0, -1]][:, :, [0, -1]].ravel()
+    values, counts = np.unique(corners, return_counts=True)
+    return values[np.argmax(counts)]
+
+
+def _axisRange(counts, minCount):
+    indices = np.flatnonzero(counts >= minCount)
+    if not len(indices):
+        return None
+    return int(indices[0]), int(indices[-1]) + 1
+
+
+def findFieldOfView(array, spacing=(1.0, 1.0, 1.0), margin_mm=5.0, tissueFraction=0.2, minSliceFraction=0.002,
+                    minReduction=0.05, stride=2):
+    """
+    Finds the bounding region of the informative voxels of a CBCT volume array.
+
+    Voxels equal to the constant background of the scanner (outside the reconstruction cylinder, padded slices) and
+    low intensity voxels (air) are considered dead. The region is the bounding box of the slices containing enough
+    remaining tissue voxels along each axis, dilated by margin_mm. The airway being enclosed by tissue, it stays inside
+    the region. Statistics are computed on the array subsampled by stride to keep the search cheap.
+
+    :param array: volume array
+    :param spacing: array voxel spacing in the array axis order
+    :param tissueFraction: tissue threshold as a fraction of the 1st - 99th percentile intensity range
+    :param minSliceFraction: minimum fraction of tissue voxels for a slice to be considered informative
+    :param minReduction: the full volume is kept when the region removes a smaller fraction of the voxels
+    :returns: FieldOfView. The region covers the whole volume if no informative region was found.
+    """
+    originalShape = tuple(array.shape)
+    fullRegion = FieldOfView(tuple(slice(0, size) for size in originalShape), originalShape)
+    if array.ndim != 3 or min(originalShape) < 2:
+        return fullRegion
+
+    sampled = np.asarray(array[::stride, ::stride, ::stride])
+    background = _backgroundValue(sampled)
+    isAlive = sampled != background
+    if not isAlive.any():
+        return fullRegion
+
+    low, high = np.percentile(sampled[isAlive], [1, 99])
+    isTissue = isAlive & (sampled >= low + tissueFraction * (high - low))
+
+    region = []
+    for axis in range(3):
+        otherAxes = tuple(a for a in range(3) if a != axis)
+        sliceSize = np.prod([isTissue.shape[a] for a in otherAxes])
+        axisRange = _axisRange(isTissue.sum(axis=otherAxes), max(1, minSliceFraction * sliceSize))
+        if axisRange is None:
+            return fullRegion
+
+        margin = int(np.ceil(margin_mm / spacing[axis]))
+        start = max(0, axisRange[0] * stride - margin)
+        stop = min(originalShape[axis], axisRange[1] * stride + margin)
+        region.append(slice(start, stop))
+
+    fieldOfView = FieldOfView(tuple(region), originalShape)
+    return fieldOfView if fieldOfView.voxelReduction >= minReduction else fullRegion
@@ -0,0 +1,137 @@
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+PARTIAL_SUM_PREFIX = "partial_sum_"
+
+
+def splitFolds(folds, nProcesses):
+    """
+    Split the folds in at most nProcesses groups of (almost) equal size.
+    """
+    nProcesses = max(1, min(nProcesses, len(folds)))
+    groups = [[] for _ in range(nProcesses)]
+    for iFold, fold in enumerate(folds):
+        groups[iFold % nProcesses].append(fold)
+    return groups
+
+
+def mergePartialSums(partialFiles, dtype=np.float16):
+    """
+    Sum the partial logit sums written by the fold processes.
+    Partial sums are memory mapped and added one after the other to a single accumulator.
+    """
+    logitSum = None
+    for partialFile in partialFiles:
+        partialSum = np.load(partialFile, mmap_mode="r")
+        if logitSum is None:
+            logitSum = np.array(partialSum, dtype=dtype)
+        else:
+            logitSum += partialSum
+        del partialSum
+    return logitSum
+
+
+class FoldProcessEnsemble:
+    """
+    Splits the model folds across worker processes, each on its share of the CPUs.
+
+    Each process writes the half precision logit sum of its folds to disk and the partial sums are merged once all the
+    processes are done. Peak memory grows with the number of processes, use a single process to keep the peak memory
+    close to that of a single fold.
+    """
+
+    def __init__(self, predictor, nProcesses, pinCpus=True, progressCallback=None):
+        self.predictor = predictor
+        self.nProcesses = nProcesses
+        self.pinCpus = pinCpus
+        self.progressCallback = progressCallback or (lambda *_: None)
+
+    def workerArgs(self, folds):
+        predictor = self.predictor
+        args = [
+            "--model", predictor.modelFolder.as_posix(),
+            "--folds", ",".join(folds),
+            "--device", predictor.device,
+            "--step-size", str(predictor.stepSize),
+            "--checkpoint", predictor.checkpointName,
+            "--model-cache", predictor.modelCacheFolder.as_posix(),
+            "--precision", predictor.precision,
+            "--minimum-precision-dice", "0",
+        ]
+        if predictor.disableTta:
+            args.append("--disable-tta")
+        if predictor.adaptiveTta:
+            args += [
+                "--adaptive-tta",
+                "--tta-margin", str(predictor.ttaMargin),
+                "--tta-uncertain-fraction", str(predictor.ttaUncertainFraction),
+            ]
+        if predictor.tileCheckpointStore is not None:
+            args += [
+                "--tile-checkpoints", predictor.tileCheckpointStore.folder.as_posix(),
+                "--tile-checkpoint-interval", str(predictor.tileCheckpointInterval_s),
+            ]
+        if predictor.cancelFile is not None:
+            args += ["--cancel-file", predictor.cancelFile.path.as_posix()]
+        return args
+
+    def predictLogitSum(self, data):
+        """
+        :returns: half precision logit sum and number of folds
+        """
+        from UpperAirwaySegmentatorInference.WorkerPool import pythonExecutable, splitCpus
+
+        groups = splitFolds(self.predictor.folds, self.nProcesses)
+        slots = splitCpus(len(groups))
+        with tempfile.TemporaryDirectory() as tmpDir:
+            tmpDir = Path(tmpDir)
+            dataFile = tmpDir / "data.npy"
+            np.save(dataFile, np.asarray(data))
+
+            start = time.time()
+            processes = []
+            for iProcess, (folds, slot) in enumerate(zip(groups, slots)):
+                partialFile = tmpDir / f"{PARTIAL_SUM_PREFIX}{iProcess}.npy"
+                command = [
+                    pythonExecutable(), "-m", "UpperAirwaySegmentatorInference.Worker",
+                    *self.workerArgs(folds),
+                    *slot.workerArgs(self.pinCpus),
+                    "--preprocessed", dataFile.as_posix(),
+                    "--partial-sum", partialFile.as_posix(),
+                ]
+                self.progressCallback(f"Starting process for fold(s) {','.join(folds)}...")
+                processes.append((folds, partialFile, subprocess.Popen(
+                    command,
+                    env=slot.environment(),
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True
+                )))
+
+            # Outputs are read concurrently for the processes not to block on a full output pipe
+            threads = [threading.Thread(target=self._forwardOutput, args=(folds, process))
+                       for folds, _, process in processes]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            failedFolds = [fold for folds, _, process in processes if process.wait() != 0 for fold in folds]
+            self.predictor.checkCancelled()
+
+            if failedFolds:
+                raise RuntimeError(f"Inference failed for fold(s) {','.join(failedFolds)}.")
+
+            logitSum = mergePartialSums([partialFile for _, partialFile, _ in processes])
+            self.progressCallback(f"Merged {len(groups)} partial sum(s) in {time.time() - start:.1f} s.")
+
+        return logitSum, len(self.predictor.folds)
+
+    def _forwardOutput(self, folds, process):
+        for line in process.stdout:
+            self.progressCallback(f"[fold(s) {','.join(folds)}] {line.rstrip()}")
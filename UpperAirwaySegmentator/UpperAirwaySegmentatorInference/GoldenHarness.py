@@ -0,0 +1,567 @@
+"""
+Golden output equivalence harness of the inference execution modes.
+
+Usage :
+    PythonSlicer -m UpperAirwaySegmentatorInference.GoldenHarness --model <ML folder> --reference-folder <folder>
+        --output-folder <folder> [--modes fp32,bf16] [--tolerances <tolerances.json>] [--update-golden]
+
+The reference folder contains the reference volumes named <case>_0000.nii.gz and their golden labelmaps named
+<case>.nii.gz. Each available execution mode is run on each reference volume by the inference worker and its output is
+compared against the golden labelmap, or against the output of another mode of the same harness run. Runtime and peak
+memory of each run are reported next to the metrics in <output folder>/golden_report.json. The harness exits with an
+error code when a mode exceeds its tolerance.
+"""
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import numpy as np
+
+REPORT_FILE_NAME = "golden_report.json"
+REFERENCE_MODE = "fp32"
+
+
+@dataclass
+class LabelmapComparison:
+    dice: float
+    hausdorff_mm: float
+    hausdorff95_mm: float
+    voxelDifferences: int
+
+
+@dataclass
+class Tolerance:
+    """
+    Maximum deviation of a mode output from the golden labelmap.
+    """
+    minDice: float = 0.99
+    maxHausdorff_mm: float = math.inf
+    maxVoxelDifferences: Optional[int] = None
+
+    def violations(self, comparison):
+        violations = []
+        if comparison.dice < self.minDice:
+            violations.append(f"Dice {comparison.dice:.4f} < {self.minDice}")
+        if comparison.hausdorff_mm > self.maxHausdorff_mm:
+            violations.append(f"Hausdorff {comparison.hausdorff_mm:.2f} mm > {self.maxHausdorff_mm} mm")
+        if self.maxVoxelDifferences is not None and comparison.voxelDifferences > self.maxVoxelDifferences:
+            violations.append(f"{comparison.voxelDifferences} different voxels > {self.maxVoxelDifferences}")
+        return violations
+
+
+@dataclass
+class ExecutionMode:
+    """
+    Inference execution mode compared against the golden labelmaps.
+
+    :param workerArgs: worker arguments of the mode, added to the harness base arguments
+    :param runs: number of consecutive worker runs, the output of the last one is compared. Used by the modes reusing
+        the results of a previous run such as the preprocessing cache.
+    :param postProcess: optional callable (labelmap array, worker output file) -> labelmap array applied to the worker
+        output before the comparison
+    :param unavailableReason: optional callable returning why the mode can't run on this machine or None
+    :param runner: optional callable (harness, mode, volume path, output folder) -> (return code, runtime in seconds,
+        peak memory in MB or None) running the mode instead of a single worker run. Raises RuntimeError when the run
+        didn't behave as the mode expects.
+    :param referenceMode: name of the mode whose output is compared against instead of the golden labelmap
+    """
+    name: str
+    workerArgs: List[str] = field(default_factory=list)
+    tolerance: Tolerance = field(default_factory=Tolerance)
+    runs: int = 1
+    postProcess: Optional[Callable] = None
+    unavailableReason: Optional[Callable] = None
+    runner: Optional[Callable] = None
+    referenceMode: Optional[str] = None
+
+
+@dataclass
+class ModeResult:
+    mode: str
+    case: str
+    runtime_s: float
+    peakMemory_MB: Optional[float]
+    comparison: Optional[LabelmapComparison] = None
+    violations: List[str] = field(default_factory=list)
+    skipped: str = ""
+
+    @property
+    def passed(self):
+        return not self.violations
+
+    def summary(self):
+        if self.skipped:
+            return f"[{self.mode}] {self.case} : skipped ({self.skipped})"
+        status = "PASSED" if self.passed else "FAILED : " + ", ".join(self.violations)
+        memory = f"{self.peakMemory_MB:.0f} MB" if self.peakMemory_MB is not None else "n/a"
+        metrics = ""
+        if self.comparison is not None:
+            metrics = (
+                f"Dice {self.comparison.dice:.4f}, Hausdorff {self.comparison.hausdorff_mm:.2f} mm, "
+                f"{self.comparison.voxelDifferences} different voxels, "
+            )
+        return f"[{self.mode}] {self.case} : {metrics}{self.runtime_s:.1f} s, peak memory {memory} : {status}"
+
+
+def readLabelmap(path):
+    """
+    :returns: labelmap array and spacing in the array axis order
+    """
+    import SimpleITK as sitk
+
+    image = sitk.ReadImage(Path(path).as_posix())
+    return sitk.GetArrayFromImage(image), list(reversed(image.GetSpacing()))
+
+
+def _surfaceDistances(maskFrom, maskTo, spacing):
+    """
+    Distances from the surface voxels of maskFrom to the closest surface voxel of maskTo.
+    """
+    from scipy import ndimage
+
+    surfaceFrom = maskFrom & ~ndimage.binary_erosion(maskFrom)
+    surfaceTo = maskTo & ~ndimage.binary_erosion(maskTo)
+    distanceToSurface = ndimage.distance_transform_edt(~surfaceTo, sampling=spacing)
+    return distanceToSurface[surfaceFrom]
+
+
+def compareLabelmaps(labelmap, golden, spacing=(1.0, 1.0, 1.0)):
+    """
+    Compares the foreground (non zero) voxels of the labelmap against the golden labelmap.
+    Hausdorff distances are infinite when only one of the labelmaps is empty.
+    """
+    if labelmap.shape != golden.shape:
+        raise ValueError(f"Labelmap shape {labelmap.shape} doesn't match the golden shape {golden.shape}.")
+
+    mask, goldenMask = np.asarray(labelmap) > 0, np.asarray(golden) > 0
+    nMask, nGolden = int(mask.sum()), int(goldenMask.sum())
+    voxelDifferences = int(np.count_nonzero(mask != goldenMask))
+    if nMask + nGolden == 0:
+        return LabelmapComparison(dice=1.0, hausdorff_mm=0.0, hausdorff95_mm=0.0, voxelDifferences=0)
+
+    dice = 2.0 * int(np.logical_and(mask, goldenMask).sum()) / (nMask + nGolden)
+    if nMask == 0 or nGolden == 0:
+        return LabelmapComparison(dice, math.inf, math.inf, voxelDifferences)
+
+    distances = np.concatenate([
+        _surfaceDistances(mask, goldenMask, spacing),
+        _surfaceDistances(goldenMask, mask, spacing),
+    ])
+    return LabelmapComparison(
+        dice=dice,
+        hausdorff_mm=float(distances.max()),
+        hausdorff95_mm=float(np.percentile(distances, 95)),
+        voxelDifferences=voxelDifferences,
+    )
+
+
+def thresholdProbabilityMap(labelmap, outputFile, threshold=0.5):
+    """
+    Post processing re-deriving the labelmap from the probability map saved next to the worker output.
+    """
+    from .ProbabilityMap import PROBABILITY_MAP_SUFFIX, probabilityLevel
+
+    outputFile = Path(outputFile)
+    probabilityFile = next(outputFile.parent.glob("*" + PROBABILITY_MAP_SUFFIX))
+    return (np.load(probabilityFile) >= probabilityLevel(threshold)).astype(np.uint8)
+
+
+def caseName(volumePath):
+    return Path(volumePath).name.split("_0000.nii")[0]
+
+
+def _argumentValue(args, name, default):
+    """
+    :returns: value following name in the command line arguments or default
+    """
+    args = list(args)
+    return args[args.index(name) + 1] if name in args[:-1] else default
+
+
+def runTrimmedFieldOfView(harness, mode, volumePath, outputFolder):
+    """
+    Runner of the field of view trimming mode. The worker segments the informative region of the volume, as the module
+    does, and its segmentation is restored in the full volume geometry.
+    """
+    import SimpleITK as sitk
+
+    from .FieldOfView import findFieldOfView
+
+    start = time.time()
+    image = sitk.ReadImage(Path(volumePath).as_posix())
+    fieldOfView = findFieldOfView(sitk.GetArrayViewFromImage(image), list(reversed(image.GetSpacing())))
+    harness.progressCallback(f"[{mode.name}] {fieldOfView.summary()}")
+
+    trimmedFolder = Path(outputFolder) / "trimmed"
+    trimmedFolder.mkdir(parents=True, exist_ok=True)
+    trimmedPath = trimmedFolder / Path(volumePath).name
+    trimmed = sitk.RegionOfInterest(
+        image,
+        [int(size) for size in reversed(fieldOfView.shape)],
+        [int(index) for index in reversed(fieldOfView.start())]
+    )
+    sitk.WriteImage(trimmed, trimmedPath.as_posix())
+
+    returnCode, _, peakMemory_MB = harness.runWorker(mode, trimmedPath, trimmedFolder)
+    case = caseName(volumePath)
+    for trimmedOutput in trimmedFolder.glob(f"{case}.nii*"):
+        labelmap = sitk.ReadImage(trimmedOutput.as_posix())
+        restored = sitk.GetImageFromArray(fieldOfView.restore(sitk.GetArrayFromImage(labelmap)))
+        restored.CopyInformation(image)
+        sitk.WriteImage(restored, Path(outputFolder).joinpath(trimmedOutput.name).as_posix())
+    return returnCode, time.time() - start, peakMemory_MB
+
+
+def runRemoteServer(harness, mode, volumePath, outputFolder):
+    """
+    Runner of the inference server mode. The volume is segmented by a local inference server through the client the
+    module uses. Peak memory of the server worker isn't measured.
+    """
+    import threading
+
+    import SimpleITK as sitk
+
+    from .Client import InferenceClient
+    from .Parameter import InferenceParameter
+    from .Server import DONE, InferenceServer, createHttpServer
+
+    start = time.time()
+    outputFolder = Path(outputFolder)
+    outputFolder.mkdir(parents=True, exist_ok=True)
+    uploadPath = Path(volumePath)
+    if not uploadPath.name.endswith(".gz"):
+        # The server expects compressed volumes
+        uploadPath = outputFolder / f"{caseName(volumePath)}_0000.nii.gz"
+        sitk.WriteImage(sitk.ReadImage(Path(volumePath).as_posix()), uploadPath.as_posix(), True)
+
+    server = InferenceServer(
+        harness.modelPath,
+        outputFolder / "server",
+        device=_argumentValue(harness.baseArgs, "--device", "cpu"),
+        progressCallback=lambda msg: harness.progressCallback(f"[{mode.name}] {msg}")
+    )
+    httpServer = createHttpServer(server, port=0)
+    httpThread = threading.Thread(target=httpServer.serve_forever, daemon=True)
+    httpThread.start()
+    server.start()
+    try:
+        client = InferenceClient(f"http://127.0.0.1:{httpServer.server_address[1]}")
+        parameter = InferenceParameter(folds=_argumentValue(harness.baseArgs, "--folds", "0"))
+        jobId = client.submit(uploadPath, parameter)
+        state = None
+        for event in client.events(jobId):
+            state = event.get("state", state)
+            if event.get("progress"):
+                harness.progressCallback(f"[{mode.name}] {event['progress']}")
+        if state != DONE:
+            return 1, time.time() - start, None
+        client.download(jobId, outputFolder / f"{caseName(volumePath)}.nii.gz")
+    finally:
+        server.stop()
+        httpServer.shutdown()
+        httpServer.server_close()
+    return 0, time.time() - start, None
+
+
+def runInterruptedAndResumed(harness, mode, volumePath, outputFolder):
+    """
+    Runner of the tile checkpoint mode. The worker is killed once it checkpointed its first sliding window tiles and
+    run again, which must resume from the checkpoint.
+    """
+    start = time.time()
+
+    def isTileCheckpointLine(line):
+        return " tiles done." in line
+
+    returnCode, _, firstPeak_MB = harness.runWorker(mode, volumePath, outputFolder, stopWhen=isTileCheckpointLine)
+    if returnCode == 0:
+        raise RuntimeError("Worker finished before its first tile checkpoint and wasn't interrupted")
+
+    resumeLines = []
+
+    def isResumeLine(line):
+        if line.startswith("Resuming fold "):
+            resumeLines.append(line)
+        return False
+
+    returnCode, _, peakMemory_MB = harness.runWorker(mode, volumePath, outputFolder, stopWhen=isResumeLine)
+    if returnCode == 0 and not resumeLines:
+        raise RuntimeError("Interrupted run wasn't resumed from its tile checkpoint")
+
+    peaks = [peak for peak in [firstPeak_MB, peakMemory_MB] if peak is not None]
+    return returnCode, time.time() - start, max(peaks) if peaks else None
+
+
+def defaultModes(folds="0", cacheFolder=None):
+    """
+    Execution modes of the inference worker. Reduced precision modes are only available on CPUs supporting them.
+    """
+    from .Precision import isPrecisionSupported
+    from .Predictor import parseFolds
+
+    def precisionUnavailableReason(precision):
+        return lambda: None if isPrecisionSupported(precision) else f"CPU doesn't support {precision} natively"
+
+    modes = [
+        ExecutionMode(REFERENCE_MODE),
+        ExecutionMode(
+            "probability_map",
+            ["--save-probabilities"],
+            postProcess=thresholdProbabilityMap,
+        ),
+        ExecutionMode("low_memory", ["--low-memory"]),
+        ExecutionMode("adaptive_tta", ["--adaptive-tta"]),
+        ExecutionMode("fov_trimming", runner=runTrimmedFieldOfView),
+        ExecutionMode("remote_server", runner=runRemoteServer),
+    ]
+    if cacheFolder:
+        modes.append(ExecutionMode(
+            "preprocessing_cache",
+            ["--preprocessing-cache", Path(cacheFolder).as_posix()],
+            runs=2,
+        ))
+        # Checkpointed after each tile to interrupt the run early, resumed output must match the fp32 output
+        modes.append(ExecutionMode(
+            "tile_checkpoints",
+            [
+                "--tile-checkpoints", Path(cacheFolder).joinpath("tiles").as_posix(),
+                "--tile-checkpoint-interval", "0",
+            ],
+            tolerance=Tolerance(maxVoxelDifferences=0),
+            runner=runInterruptedAndResumed,
+            referenceMode=REFERENCE_MODE,
+        ))
+    for precision in ["bf16", "fp16"]:
+        modes.append(ExecutionMode(
+            precision,
+            ["--precision", precision, "--minimum-precision-dice", "0"],
+            tolerance=Tolerance(minDice=0.97),
+            unavailableReason=precisionUnavailableReason(precision),
+        ))
+    if len(parseFolds(folds)) > 1:
+        modes.append(ExecutionMode("fold_processes", ["--fold-processes", "2"]))
+    return modes
+
+
+def loadTolerances(modes, tolerancesFile):
+    """
+    Overrides the mode tolerances with the tolerances of the JSON file, for instance {"bf16": {"minDice": 0.95}}.
+    """
+    with open(tolerancesFile, "r") as f:
+        tolerances = json.load(f)
+    for mode in modes:
+        if mode.name in tolerances:
+            mode.tolerance = Tolerance(**{**asdict(mode.tolerance), **tolerances[mode.name]})
+    return modes
+
+
+class GoldenHarness:
+    """
+    Runs the execution modes on the reference volumes and compares their outputs against the golden labelmaps.
+    """
+
+    def __init__(self, modelPath, referenceFolder, outputFolder, modes=None, baseArgs=None, progressCallback=None):
+        self.modelPath = Path(modelPath)
+        self.referenceFolder = Path(referenceFolder)
+        self.outputFolder = Path(outputFolder)
+        self.baseArgs = list(baseArgs or [])
+        self.modes = modes if modes is not None else defaultModes(cacheFolder=self.outputFolder / "cache")
+        self.progressCallback = progressCallback or (lambda *_: None)
+        self._modeOutputs = {}
+
+    def referenceCases(self):
+        """
+        :returns: list of (case name, reference volume path, golden labelmap path or None)
+        """
+        cases = []
+        for volumePath in sorted(self.referenceFolder.glob("*_0000.nii*")):
+            case = caseName(volumePath)
+            goldenPath = next(iter(sorted(self.referenceFolder.glob(f"{case}.nii*"))), None)
+            cases.append((case, volumePath, goldenPath))
+        return cases
+
+    def run(self):
+        """
+        :returns: list of ModeResult. The report is also written to the output folder.
+        """
+        results = []
+        for mode in self.modes:
+            reason = mode.unavailableReason() if mode.unavailableReason else None
+            for case, volumePath, goldenPath in self.referenceCases():
+                if reason or goldenPath is None:
+                    result = ModeResult(mode.name, case, 0.0, None, skipped=reason or "no golden labelmap")
+                else:
+                    result = self.runMode(mode, case, volumePath, goldenPath)
+                self.progressCallback(result.summary())
+                results.append(result)
+
+        self.writeReport(results)
+        nFailed = sum(not result.passed for result in results)
+        self.progressCallback(f"{len(results) - nFailed} / {len(results)} run(s) within tolerance.")
+        return results
+
+    def runMode(self, mode, case, volumePath, goldenPath):
+        outputFolder = self.outputFolder / mode.name / case
+        runtime_s, peakMemory_MB = 0.0, None
+        start = time.time()
+        for _ in range(mode.runs):
+            try:
+                if mode.runner is not None:
+                    returnCode, runtime_s, peakMemory_MB = mode.runner(self, mode, volumePath, outputFolder)
+                else:
+                    returnCode, runtime_s, peakMemory_MB = self.runWorker(mode, volumePath, outputFolder)
+            except (OSError, RuntimeError) as e:
+                return ModeResult(mode.name, case, time.time() - start, peakMemory_MB, violations=[str(e)])
+            if returnCode != 0:
+                return ModeResult(mode.name, case, runtime_s, peakMemory_MB,
+                                  violations=[f"Worker failed with exit code {returnCode}"])
+
+        outputFile = self.outputFile(outputFolder, case)
+        if outputFile is None:
+            return ModeResult(mode.name, case, runtime_s, peakMemory_MB, violations=["No segmentation was written"])
+        self._modeOutputs[(mode.name, case)] = outputFile
+
+        if mode.referenceMode is not None:
+            goldenPath = self.referenceModeOutput(mode.referenceMode, case, volumePath)
+            if goldenPath is None:
+                return ModeResult(mode.name, case, runtime_s, peakMemory_MB,
+                                  violations=[f"No {mode.referenceMode} segmentation to compare against"])
+
+        labelmap, _ = readLabelmap(outputFile)
+        if mode.postProcess is not None:
+            labelmap = mode.postProcess(labelmap, outputFile)
+        golden, spacing = readLabelmap(goldenPath)
+        comparison = compareLabelmaps(labelmap, golden, spacing)
+        return ModeResult(mode.name, case, runtime_s, peakMemory_MB, comparison, mode.tolerance.violations(comparison))
+
+    @staticmethod
+    def outputFile(outputFolder, case):
+        return next(iter(sorted(Path(outputFolder).glob(f"{case}.nii*"))), None)
+
+    def referenceModeOutput(self, modeName, case, volumePath):
+        """
+        :returns: output of the mode for the case, run first if the mode wasn't run by this harness yet, or None if it
+            failed
+        """
+        if (modeName, case) not in self._modeOutputs:
+            outputFolder = self.outputFolder / modeName / case
+            mode = next((mode for mode in self.modes if mode.name == modeName), ExecutionMode(modeName))
+            returnCode, _, _ = self.runWorker(mode, volumePath, outputFolder)
+            outputFile = self.outputFile(outputFolder, case)
+            if returnCode != 0 or outputFile is None:
+                return None
+            self._modeOutputs[(modeName, case)] = outputFile
+        return self._modeOutputs[(modeName, case)]
+
+    def workerCommand(self, mode, volumePath, outputFolder):
+        from .WorkerPool import pythonExecutable
+
+        return [
+            pythonExecutable(), "-m", "UpperAirwaySegmentatorInference.Worker",
+            "--model", self.modelPath.as_posix(),
+            *self.baseArgs,
+            *mode.workerArgs,
+            "--input", Path(volumePath).as_posix(),
+            "--output", Path(outputFolder).as_posix(),
+        ]
+
+    def runWorker(self, mode, volumePath, outputFolder, stopWhen=None):
+        """
+        Runs the worker and measures its wall time and peak resident memory. Peak memory is only measured on systems
+        reporting the resource usage of child processes.
+
+        :param stopWhen: optional callable (output line) -> bool, the worker is killed when it returns True
+        :returns: return code, runtime in seconds and peak memory in MB or None
+        """
+        from .WorkerPool import splitCpus
+
+        start = time.time()
+        process = subprocess.Popen(
+            self.workerCommand(mode, volumePath, outputFolder),
+            env=splitCpus(1)[0].environment(),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True
+        )
+        for line in process.stdout:
+            self.progressCallback(f"[{mode.name}] {line.rstrip()}")
+            if stopWhen is not None and process.poll() is None and stopWhen(line.rstrip()):
+                self.progressCallback(f"[{mode.name}] Worker interrupted.")
+                process.kill()
+
+        peakMemory_MB = None
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is reported in bytes on macOS and in KB on Linux
+            peakMemory_MB = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+        else:
+            process.wait()
+        return process.returncode, time.time() - start, peakMemory_MB
+
+    def updateGolden(self):
+        """
+        Runs the reference mode on the reference volumes and stores its outputs as the golden labelmaps.
+        """
+        import shutil
+
+        mode = ExecutionMode(REFERENCE_MODE)
+        for case, volumePath, _ in self.referenceCases():
+            outputFolder = self.outputFolder / mode.name / case
+            returnCode, _, _ = self.runWorker(mode, volumePath, outputFolder)
+            outputFile = self.outputFile(outputFolder, case)
+            if returnCode != 0 or outputFile is None:
+                raise RuntimeError(f"Failed to segment reference volume {volumePath}.")
+            shutil.copyfile(outputFile, self.referenceFolder / outputFile.name)
+            self.progressCallback(f"Updated golden labelmap of {case}.")
+
+    def writeReport(self, results):
+        self.outputFolder.mkdir(parents=True, exist_ok=True)
+        report = [{**asdict(result), "passed": result.passed} for result in results]
+        with open(self.outputFolder / REPORT_FILE_NAME, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UpperAirwaySegmentator golden output equivalence harness.")
+    parser.add_argument("--model", required=True, help="Folder containing the nnU-Net model.")
+    parser.add_argument("--reference-folder", required=True,
+                        help="Folder of the <case>_0000.nii.gz reference volumes and <case>.nii.gz golden labelmaps.")
+    parser.add_argument("--output-folder", required=True, help="Output folder of the mode runs and of the report.")
+    parser.add_argument("--modes", default="", help="Comma separated modes to run. All available modes by default.")
+    parser.add_argument("--folds", default="0", help="Comma separated model folds.")
+    parser.add_argument("--tolerances", default="", help="JSON file overriding the mode tolerances.")
+    parser.add_argument("--update-golden", action="store_true",
+                        help="Store the fp32 outputs as the golden labelmaps instead of running the comparison.")
+    args, baseArgs = parser.parse_known_args(argv)
+
+    outputFolder = Path(args.output_folder)
+    modes = defaultModes(args.folds, cacheFolder=outputFolder / "cache")
+    if args.modes:
+        selected = args.modes.split(",")
+        modes = [mode for mode in modes if mode.name in selected]
+    if args.tolerances:
+        loadTolerances(modes, args.tolerances)
+
+    harness = GoldenHarness(
+        args.model, args.reference_folder, outputFolder, modes,
+        baseArgs=["--folds", args.folds, *baseArgs],
+        progressCallback=lambda msg: print(msg, flush=True)
+    )
+    if args.update_golden:
+        harness.updateGolden()
+        return 0
+
+    results = harness.run()
+    return 0 if all(result.passed for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
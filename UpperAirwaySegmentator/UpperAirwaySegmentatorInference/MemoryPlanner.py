@@ -0,0 +1,416 @@
+import json
+import math
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, replace
+from pathlib import Path
+
+GB = 1024 ** 3
+
+# Peak memory reported by the worker while it runs and at the end of each run
+PEAK_MEMORY_PATTERN = re.compile(r"Peak memory : ([0-9.]+) MB")
+
+
+def availableMemory():
+    """
+    :returns: memory available to new processes in bytes or None if it can't be read on this platform
+    """
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    if sys.platform == "win32":
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [
+                ("dwLength", ctypes.c_ulong),
+                ("dwMemoryLoad", ctypes.c_ulong),
+                ("ullTotalPhys", ctypes.c_ulonglong),
+                ("ullAvailPhys", ctypes.c_ulonglong),
+                ("ullTotalPageFile", ctypes.c_ulonglong),
+                ("ullAvailPageFile", ctypes.c_ulonglong),
+                ("ullTotalVirtual", ctypes.c_ulonglong),
+                ("ullAvailVirtual", ctypes.c_ulonglong),
+                ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+            ]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return int(status.ullAvailPhys)
+        return None
+
+    try:
+        import psutil
+        return int(psutil.virtual_memory().available)
+    except ImportError:
+        return None
+
+
+def _procResidentMemory_MB(pid):
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def _procDescendants(pid):
+    """
+    :returns: ids of the running child processes of the process and of their own children, read from /proc
+    """
+    parents = {}
+    for statPath in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # The process name between parentheses may contain spaces
+            fields = statPath.read_text().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        parents[int(statPath.parent.name)] = int(fields[1])
+
+    descendants, pending = [], [pid]
+    while pending:
+        parent = pending.pop()
+        children = [child for child, childParent in parents.items() if childParent == parent]
+        descendants += children
+        pending += children
+    return descendants
+
+
+def residentMemory_MB():
+    """
+    :returns: current resident memory of this process and of its running child processes in MB or None if the platform
+        doesn't report it
+    """
+    try:
+        import psutil
+
+        process = psutil.Process()
+        processes = [process, *process.children(recursive=True)]
+        total = 0
+        for child in processes:
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                continue
+        return total / (1024 * 1024)
+    except ImportError:
+        pass
+
+    if not Path("/proc/self/status").exists():
+        return None
+    pid = os.getpid()
+    return sum(_procResidentMemory_MB(process) for process in [pid, *_procDescendants(pid)])
+
+
+class PeakMemorySampler:
+    """
+    Samples the resident memory of the process and of its child processes in a background thread and reports the
+    running peak each time it grows, for the last peak to be known even if the process is killed for running out of
+    memory.
+    """
+
+    def __init__(self, reportCallback, interval_s=0.5, reportGrowth=0.1):
+        """
+        :param reportGrowth: relative growth of the peak triggering a new report
+        """
+        self.reportCallback = reportCallback
+        self.interval_s = interval_s
+        self.reportGrowth = reportGrowth
+        self.peak_MB = None
+        self._reported_MB = 0.0
+        self._stopEvent = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops sampling and reports the final peak.
+        """
+        self._stopEvent.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.sample()
+        if self.peak_MB is not None:
+            self.reportCallback(formatPeakMemory(self.peak_MB))
+
+    def sample(self):
+        memory_MB = residentMemory_MB()
+        if memory_MB is None:
+            return
+        self.peak_MB = max(self.peak_MB or 0.0, memory_MB)
+
+    def _run(self):
+        while not self._stopEvent.is_set():
+            self.sample()
+            if self.peak_MB is not None and self.peak_MB >= (1 + self.reportGrowth) * self._reported_MB:
+                self._reported_MB = self.peak_MB
+                self.reportCallback(formatPeakMemory(self.peak_MB))
+            self._stopEvent.wait(self.interval_s)
+
+
+def readModelPlans(modelPath, checkpointName="checkpoint_final.pth"):
+    """
+    Reads the model information driving the memory use without loading nnU-Net : target spacing, number of input
+    channels and output classes and the checkpoint size of each fold.
+    """
+    from .Predictor import findModelFolder
+
+    modelFolder = findModelFolder(modelPath)
+    with open(modelFolder / "plans.json", "r") as f:
+        plans = json.load(f)
+    with open(modelFolder / "dataset.json", "r") as f:
+        dataset = json.load(f)
+
+    # Model folders are named <trainer>__<plans>__<configuration>
+    configurationName = modelFolder.name.split("__")[-1]
+    configurations = plans["configurations"]
+    configuration = configurations.get(configurationName) or next(iter(configurations.values()))
+    checkpointSizes = {
+        checkpoint.parent.name[len("fold_"):]: checkpoint.stat().st_size
+        for checkpoint in modelFolder.glob(f"fold_*/{checkpointName}")
+    }
+    return {
+        "spacing": list(configuration["spacing"]),
+        "patch_size": list(configuration["patch_size"]),
+        "channels": len(dataset.get("channel_names", dataset.get("modality", {"0": ""}))),
+        "classes": len(dataset["labels"]),
+        "checkpoint_sizes": checkpointSizes,
+    }
+
+
+@dataclass
+class MemoryEstimate:
+    """
+    Peak memory of a segmentation in bytes, split by inference stage.
+    The peak is the runtime overhead plus the largest stage, scaled by the factor calibrated from the measured runs.
+    """
+    runtime: float
+    preprocessing: float
+    prediction: float
+    export: float
+    calibrationFactor: float = 1.0
+
+    @property
+    def peak(self):
+        return self.calibrationFactor * (self.runtime + max(self.preprocessing, self.prediction, self.export))
+
+    @property
+    def peak_GB(self):
+        return self.peak / GB
+
+
+@dataclass
+class MemoryPlan:
+    """
+    Parameter the segmentation runs with, its memory estimate and whether the run fits in the available memory.
+    """
+    parameter: object
+    estimate: MemoryEstimate
+    available: float = None
+    strategy: str = "default"
+    isRefused: bool = False
+
+    def summary(self):
+        available = f" / {self.available / GB:.1f} GB available" if self.available else ""
+        message = f"Estimated peak memory : {self.estimate.peak_GB:.1f} GB{available}."
+        if self.isRefused:
+            return (
+                message + " The volume is too large to be segmented on this computer, even with the low memory"
+                " inference. Close other applications, crop the volume or use an inference server."
+            )
+        if self.strategy != "default":
+            return message + f" Using {self.strategy} inference to reduce the memory use."
+        return message
+
+
+class MemoryPlanner:
+    """
+    Estimates the peak memory of a segmentation from the input volume and the model plans and picks the inference
+    strategy fitting in the available memory.
+
+    Strategies are tried from the fastest to the leanest : the requested settings, a single fold process and the low
+    memory export. The estimate is calibrated by the ratio of the measured to the predicted peak memory of the previous
+    runs, recorded in the history file.
+    """
+
+    # torch, nnU-Net and network activations for one tile
+    runtimeOverhead = 1.5 * GB
+    usableMemoryFraction = 0.9
+    maxCalibrationRuns = 20
+
+    def __init__(self, historyFile):
+        self.historyFile = Path(historyFile)
+        self._plans = {}
+
+    def modelPlans(self, parameter):
+        key = (Path(parameter.modelPath).as_posix(), parameter.checkPointName)
+        if key not in self._plans:
+            self._plans[key] = readModelPlans(parameter.modelPath, parameter.checkPointName)
+        return self._plans[key]
+
+    def estimate(self, parameter, shape, spacing, plans=None):
+        """
+        :param shape: input volume shape
+        :param spacing: input volume spacing in the same axis order as the shape
+        :param plans: model plans. Read from the parameter model path if None.
+        """
+        from .Predictor import parseFolds
+        from .RuntimeEstimator import resampledShape
+
+        plans = plans or self.modelPlans(parameter)
+        folds = parseFolds(parameter.folds)
+        nInput = math.prod(shape)
+        nResampled = math.prod(resampledShape(shape, spacing, plans["spacing"]))
+        nChannels, nClasses = plans["channels"], plans["classes"]
+        checkpointSize = max(plans["checkpoint_sizes"].values(), default=0)
+        nProcesses = max(1, min(parameter.foldProcesses, len(folds)))
+
+        # Input image and its float copy, resampled channels and the resampling buffers
+        preprocessing = nInput * (4 + 4) + nResampled * nChannels * 4 * 2
+
+        # Preprocessed data, sliding window logit and count buffers and the sum of the fold logits, in half precision
+        # for multi-fold ensembles. Each fold process adds its own runtime, model weights and sliding window buffers.
+        slidingWindow = nResampled * (nChannels * 4 + (nClasses + 1) * 4)
+        logitBytes = 2 if len(folds) > 1 else 4
+        logitSum = nResampled * nClasses * logitBytes
+        if nProcesses == 1:
+            prediction = slidingWindow + logitSum
+        else:
+            foldsPerProcess = math.ceil(len(folds) / nProcesses)
+            foldProcess = self.runtimeOverhead + foldsPerProcess * checkpointSize + slidingWindow
+            prediction = nResampled * nChannels * 4 + logitSum + nProcesses * foldProcess
+
+        # Logits, logits resampled to the input shape, probabilities and the segmentation
+        export = nResampled * nClasses * logitBytes + nInput * 2
+        if parameter.lowMemory and nClasses == 2:
+            export += nResampled * 4 + nInput * 4
+        else:
+            export += nInput * nClasses * 4 * 2
+        if parameter.saveProbabilities:
+            export += nInput * 4
+
+        return MemoryEstimate(
+            runtime=self.runtimeOverhead + len(folds) * checkpointSize,
+            preprocessing=preprocessing,
+            prediction=prediction,
+            export=export,
+            calibrationFactor=self.calibrationFactor(parameter),
+        )
+
+    def strategies(self, parameter):
+        """
+        :returns: list of (strategy name, parameter) from the requested parameter to the leanest one
+        """
+        strategies = [("default", parameter)]
+        if parameter.foldProcesses > 1:
+            parameter = replace(parameter, foldProcesses=1)
+            strategies.append(("single fold process", parameter))
+        if not parameter.lowMemory:
+            strategies.append(("low memory", replace(parameter, lowMemory=True)))
+        return strategies
+
+    def plan(self, parameter, shape, spacing, available=None, plans=None):
+        """
+        :param available: available memory in bytes. Read from the system if None.
+        :returns: MemoryPlan of the fastest strategy fitting in the available memory. The plan is refused when even the
+            leanest strategy doesn't fit. Memory isn't checked when the available memory is unknown.
+        """
+        available = availableMemory() if available is None else available
+        strategies = self.strategies(parameter)
+        if not available:
+            return MemoryPlan(parameter, self.estimate(parameter, shape, spacing, plans))
+
+        usable = self.usableMemoryFraction * available
+        for strategy, strategyParameter in strategies:
+            estimate = self.estimate(strategyParameter, shape, spacing, plans)
+            if estimate.peak <= usable:
+                return MemoryPlan(strategyParameter, estimate, available, strategy)
+        return MemoryPlan(strategyParameter, estimate, available, strategy, isRefused=True)
+
+    def calibrationFactor(self, parameter):
+        """
+        Median ratio of the measured to the predicted peak memory of the last runs on the same device. Failed runs
+        stopped before reaching their peak only calibrate the estimate when their last measured peak exceeds the
+        prediction.
+        """
+        ratios = [
+            record["measured"] / record["predicted"]
+            for record in self._readHistory()
+            if record.get("device") == parameter.device and record.get("predicted")
+            and (not record.get("failed") or record["measured"] > record["predicted"])
+        ][-self.maxCalibrationRuns:]
+        if not ratios:
+            return 1.0
+        return min(3.0, max(0.5, statistics.median(ratios)))
+
+    def logRun(self, parameter, estimate, measured_MB, failed=False):
+        """
+        Appends the measured peak memory of a run to the history. The uncalibrated prediction is recorded so the ratio
+        doesn't depend on the calibration at the time of the run.
+
+        :param failed: True if the run failed, its measured peak being the last peak reported before the failure
+        """
+        record = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "device": parameter.device,
+            "folds": str(parameter.folds),
+            "lowMemory": parameter.lowMemory,
+            "estimate": asdict(estimate),
+            "predicted": estimate.peak / estimate.calibrationFactor,
+            "measured": measured_MB * 1024 * 1024,
+            "failed": failed,
+        }
+        self.historyFile.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.historyFile, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _readHistory(self):
+        if not self.historyFile.exists():
+            return []
+
+        records = []
+        try:
+            with open(self.historyFile, "r") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            pass
+        return records
+
+
+def parsePeakMemory(message):
+    """
+    :returns: peak memory in MB reported in the worker progress message or None
+    """
+    match = PEAK_MEMORY_PATTERN.search(message)
+    return float(match.group(1)) if match else None
+
+
+def formatPeakMemory(peak_MB):
+    return f"Peak memory : {peak_MB:.0f} MB."
@@ -0,0 +1,295 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+
+POINTER_FILE_NAME = "model_store.json"
+
+
+def archiveHash(archivePath, chunkSize=16 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(archivePath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunkSize), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def resolveModelFolder(installFolder):
+    """
+    Returns the folder containing the model files of an install.
+    Installs referencing the store through a pointer file resolve to the store model folder, other installs resolve to
+    themselves.
+    """
+    installFolder = Path(installFolder)
+    try:
+        with open(installFolder / POINTER_FILE_NAME, "r") as f:
+            pointer = json.load(f)
+    except (OSError, ValueError):
+        return installFolder
+
+    if pointer.get("mode") != "pointer":
+        return installFolder
+    return Path(pointer["store"]).joinpath("objects", pointer["hash"])
+
+
+class FileLock:
+    """
+    Exclusive inter-process lock on a file, released when the process exits.
+    """
+
+    def __init__(self, lockPath, timeout_s=3600.0, pollInterval_s=0.5):
+        self.lockPath = Path(lockPath)
+        self.timeout_s = timeout_s
+        self.pollInterval_s = pollInterval_s
+        self._file = None
+
+    def acquire(self):
+        self.lockPath.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.lockPath, "a+")
+        start = time.time()
+        while not self._tryLock():
+            if time.time() - start > self.timeout_s:
+                self._file.close()
+                self._file = None
+                raise TimeoutError(f"Failed to acquire lock {self.lockPath} in {self.timeout_s} s.")
+            time.sleep(self.pollInterval_s)
+
+    def release(self):
+        if self._file is None:
+            return
+
+        if os.name == "nt":
+            import msvcrt
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+    def _tryLock(self):
+        try:
+            if os.name == "nt":
+                import msvcrt
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+
+class ModelStore:
+    """
+    Model weights store shared by the Slicer installs of one or several users.
+
+    Extracted archives are stored once under objects/<archive sha256>. Installs reference an entry either through
+    hardlinks of its files or, when hardlinks are not possible (different file system, permissions), through a pointer
+    file resolved by resolveModelFolder. Each install is registered in refs/ and entries no longer referenced by any
+    install are removed by collectGarbage.
+
+    Downloads of the same URL are serialized with a per URL lock. Adding, linking and garbage collecting entries are
+    serialized with a store wide lock.
+    """
+
+    # Seconds an install which can't be read is kept referenced
+    referenceLease_s = 90 * 24 * 3600.0
+
+    def __init__(self, storeFolder):
+        self.storeFolder = Path(storeFolder).resolve()
+
+    @property
+    def objectsFolder(self):
+        return self.storeFolder / "objects"
+
+    @property
+    def refsFolder(self):
+        return self.storeFolder / "refs"
+
+    @property
+    def urlIndexPath(self):
+        return self.storeFolder / "urls.json"
+
+    def modelFolder(self, modelHash):
+        return self.objectsFolder / modelHash
+
+    def hasModel(self, modelHash):
+        return bool(modelHash) and self.modelFolder(modelHash).joinpath(".complete").exists()
+
+    def storeLock(self):
+        return FileLock(self.storeFolder / "locks" / "store.lock")
+
+    @contextmanager
+    def downloadLock(self, sourceUrl):
+        urlKey = hashlib.sha1(sourceUrl.encode()).hexdigest()
+        with FileLock(self.storeFolder / "locks" / f"download_{urlKey}.lock"):
+            yield
+
+    def hashForUrl(self, sourceUrl):
+        modelHash = self._readJson(self.urlIndexPath).get(sourceUrl)
+        return modelHash if self.hasModel(modelHash) else None
+
+    def installFromUrl(self, sourceUrl, installFolder):
+        """
+        Links the model previously downloaded from sourceUrl to the install folder.
+
+        :returns: model hash or None if the URL was never downloaded to the store
+        """
+        with self.storeLock():
+            modelHash = self.hashForUrl(sourceUrl)
+            if modelHash:
+                self._link(modelHash, installFolder)
+        return modelHash
+
+    def install(self, archivePath, installFolder, sourceUrl=None):
+        """
+        Adds the archive to the store if its content is not already stored and links it to the install folder.
+
+        :returns: model hash
+        """
+        modelHash = archiveHash(archivePath)
+        with self.storeLock():
+            if not self.hasModel(modelHash):
+                self._extract(archivePath, modelHash)
+            if sourceUrl:
+                urls = self._readJson(self.urlIndexPath)
+                urls[sourceUrl] = modelHash
+                self._writeJson(self.urlIndexPath, urls)
+            self._link(modelHash, installFolder)
+        return modelHash
+
+    def references(self):
+        """
+        :returns: dict of install folder to the referenced model hash for the registered installs
+        """
+        if not self.refsFolder.exists():
+            return {}
+        refs = (self._readJson(refPath) for refPath in self.refsFolder.glob("*.json"))
+        return {ref["installFolder"]: ref["hash"] for ref in refs if "installFolder" in ref}
+
+    def collectGarbage(self):
+        """
+        Unregister the installs which now reference another model or no longer use the store and remove the
+        unreferenced models.
+
+        Installs this process can't read, for instance in the home of another user, on another workstation sharing the
+        store or on an unmounted drive, are kept until their reference lease expires. Leases are renewed each time the
+        install is linked or found live by a garbage collection.
+
+        :returns: list of removed model hashes
+        """
+        with self.storeLock():
+            liveHashes = set()
+            for refPath in self.refsFolder.glob("*.json") if self.refsFolder.exists() else []:
+                ref = self._readJson(refPath)
+                isLive = self._isReferenceLive(ref)
+                if isLive is None:
+                    isLive = time.time() - ref.get("leaseTime", 0) < self.referenceLease_s
+                elif isLive:
+                    self._writeJson(refPath, {**ref, "leaseTime": time.time()})
+
+                if isLive and "hash" in ref:
+                    liveHashes.add(ref["hash"])
+                else:
+                    refPath.unlink(missing_ok=True)
+
+            removed = []
+            for entry in self.objectsFolder.iterdir() if self.objectsFolder.exists() else []:
+                if entry.name not in liveHashes:
+                    shutil.rmtree(entry, ignore_errors=True)
+                    removed.append(entry.name)
+
+            urls = self._readJson(self.urlIndexPath)
+            self._writeJson(self.urlIndexPath, {url: h for url, h in urls.items() if h in liveHashes})
+        return [name for name in removed if not name.startswith(".")]
+
+    def _isReferenceLive(self, ref):
+        """
+        :returns: True if the install still references the model, False if it references another model or no longer
+            uses the store and None if the install can't be read by this process
+        """
+        installFolder = Path(ref.get("installFolder", ""))
+        try:
+            with open(installFolder / POINTER_FILE_NAME, "r") as f:
+                pointer = json.load(f)
+        except FileNotFoundError:
+            # Install folders without pointer don't use the store anymore, missing folders may be on unmounted drives
+            try:
+                os.listdir(installFolder)
+            except OSError:
+                return None
+            return False
+        except (OSError, ValueError):
+            return None
+        return pointer.get("hash") == ref.get("hash") and pointer.get("store") == self.storeFolder.as_posix()
+
+    def _extract(self, archivePath, modelHash):
+        self.objectsFolder.mkdir(parents=True, exist_ok=True)
+        tmpFolder = self.objectsFolder / f".{modelHash}_{os.getpid()}"
+        shutil.rmtree(tmpFolder, ignore_errors=True)
+        shutil.rmtree(self.modelFolder(modelHash), ignore_errors=True)
+        with zipfile.ZipFile(archivePath, "r") as f:
+            f.extractall(tmpFolder)
+        tmpFolder.joinpath(".complete").touch()
+        os.replace(tmpFolder, self.modelFolder(modelHash))
+
+    def _link(self, modelHash, installFolder):
+        """
+        Hardlinks the model files to the install folder or writes a pointer file when hardlinks are not possible.
+        """
+        installFolder = Path(installFolder).resolve()
+        modelFolder = self.modelFolder(modelHash)
+        if installFolder.exists():
+            shutil.rmtree(installFolder)
+        installFolder.mkdir(parents=True)
+
+        mode = "hardlink"
+        try:
+            for path in modelFolder.rglob("*"):
+                target = installFolder / path.relative_to(modelFolder)
+                if path.is_dir():
+                    target.mkdir(parents=True, exist_ok=True)
+                elif path.name != ".complete":
+                    os.link(path, target)
+        except OSError:
+            shutil.rmtree(installFolder)
+            installFolder.mkdir(parents=True)
+            mode = "pointer"
+
+        pointer = {"store": self.storeFolder.as_posix(), "hash": modelHash, "mode": mode}
+        self._writeJson(installFolder / POINTER_FILE_NAME, pointer)
+
+        refKey = hashlib.sha1(installFolder.as_posix().encode()).hexdigest()
+        ref = {"installFolder": installFolder.as_posix(), "hash": modelHash, "leaseTime": time.time()}
+        self._writeJson(self.refsFolder / f"{refKey}.json", ref)
+
+    @staticmethod
+    def _readJson(path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _writeJson(path, content):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmpPath = path.with_name(f".{path.name}_{os.getpid()}")
+        with open(tmpPath, "w") as f:
+            json.dump(content, f, indent=2)
+        os.replace(tmpPath, path)
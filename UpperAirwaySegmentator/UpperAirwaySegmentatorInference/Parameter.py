@@ -0,0 +1,73 @@
+from dataclasses import dataclass
+from pathlib import Path
+
+
+def resolveDevice(device):
+    """
+    :returns: device the inference actually runs on, CUDA devices fall back to the CPU when CUDA isn't available
+    """
+    if not str(device).startswith("cuda"):
+        return device
+
+    try:
+        import torch
+    except ImportError:
+        return "cpu"
+    return device if torch.cuda.is_available() else "cpu"
+
+
+@dataclass
+class InferenceParameter:
+    """
+    Inference settings shared by the segmentation logics and converted to the worker command line arguments.
+    Field names follow the SlicerNNUNet Parameter class to keep the logics interchangeable.
+    """
+    modelPath: Path = None
+    folds: str = "0"
+    device: str = "cuda"
+    stepSize: float = 0.5
+    disableTta: bool = True
+    adaptiveTta: bool = False
+    checkPointName: str = "checkpoint_final.pth"
+    modelCacheFolder: str = ""
+    foldProcesses: int = 1
+    saveProbabilities: bool = False
+    precision: str = "fp32"
+    preprocessingCacheFolder: str = ""
+    preprocessingCacheSize_GB: float = 20.0
+    lowMemory: bool = False
+    tileCheckpointFolder: str = ""
+    tileCheckpointInterval_s: float = 30.0
+
+    def toWorkerArgs(self):
+        args = [
+            "--model", Path(self.modelPath).as_posix(),
+            "--folds", str(self.folds),
+            "--device", self.device,
+            "--step-size", str(self.stepSize),
+            "--checkpoint", self.checkPointName,
+            "--precision", self.precision,
+        ]
+        if self.disableTta:
+            args.append("--disable-tta")
+        if self.adaptiveTta:
+            args.append("--adaptive-tta")
+        if self.saveProbabilities:
+            args.append("--save-probabilities")
+        if self.lowMemory:
+            args.append("--low-memory")
+        if self.foldProcesses > 1:
+            args += ["--fold-processes", str(self.foldProcesses)]
+        if self.modelCacheFolder:
+            args += ["--model-cache", Path(self.modelCacheFolder).as_posix()]
+        if self.preprocessingCacheFolder:
+            args += [
+                "--preprocessing-cache", Path(self.preprocessingCacheFolder).as_posix(),
+                "--preprocessing-cache-size", str(self.preprocessingCacheSize_GB),
+            ]
+        if self.tileCheckpointFolder:
+            args += [
+                "--tile-checkpoints", Path(self.tileCheckpointFolder).as_posix(),
+                "--tile-checkpoint-interval", str(self.tileCheckpointInterval_s),
+            ]
+        return args
@@ -0,0 +1,88 @@
+import platform
+from contextlib import nullcontext
+
+import numpy as np
+
+PRECISIONS = ["fp32", "bf16", "fp16", "auto"]
+
+# Model cache sub folder of the reduced precision Dice checks, one file per model
+PRECISION_CHECKS_FOLDER_NAME = "PrecisionChecks"
+
+# CPU flags reported by Linux for the native reduced precision matrix instructions
+PRECISION_CPU_FLAGS = {
+    "bf16": {"avx512_bf16", "amx_bf16"},
+    "fp16": {"avx512_fp16", "amx_fp16"},
+}
+
+
+def readCpuInfo(cpuInfoPath="/proc/cpuinfo"):
+    """
+    :returns: CPU model name and set of CPU flags. Flags are empty when /proc/cpuinfo is not available.
+    """
+    modelName, flags = platform.processor(), set()
+    try:
+        with open(cpuInfoPath, "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "model name":
+                    modelName = value.strip()
+                elif key == "flags":
+                    flags = set(value.split())
+                if modelName and flags:
+                    break
+    except OSError:
+        pass
+    return modelName, flags
+
+
+def isPrecisionSupported(precision, cpuFlags=None):
+    if precision == "fp32":
+        return True
+    if cpuFlags is None:
+        _, cpuFlags = readCpuInfo()
+    return bool(PRECISION_CPU_FLAGS.get(precision, set()) & cpuFlags)
+
+
+def resolvePrecision(precision, device="cpu", cpuFlags=None, progressCallback=None):
+    """
+    Returns the precision used for CPU inference. Reduced precisions fall back to fp32 when the CPU doesn't support
+    them natively as emulated bf16 / fp16 is slower than fp32. GPU inference already uses nnU-Net's fp16 autocast and
+    is left unchanged.
+    """
+    progressCallback = progressCallback or (lambda *_: None)
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}. Expected one of {PRECISIONS}.")
+
+    if precision == "fp32" or device != "cpu":
+        return "fp32"
+
+    if precision == "auto":
+        return next((p for p in ["bf16", "fp16"] if isPrecisionSupported(p, cpuFlags)), "fp32")
+
+    if not isPrecisionSupported(precision, cpuFlags):
+        progressCallback(f"CPU doesn't support {precision} natively, running inference in fp32.")
+        return "fp32"
+    return precision
+
+
+def precisionContext(precision):
+    """
+    Autocast context running the network operations supporting it in the input precision.
+    """
+    if precision == "fp32":
+        return nullcontext()
+
+    import torch
+    return torch.autocast("cpu", dtype={"bf16": torch.bfloat16, "fp16": torch.float16}[precision])
+
+
+def diceCoefficient(segmentationA, segmentationB):
+    """
+    Dice of the foreground (non zero) voxels of the two segmentations. 1 if both are empty.
+    """
+    maskA, maskB = np.asarray(segmentationA) > 0, np.asarray(segmentationB) > 0
+    total = int(maskA.sum()) + int(maskB.sum())
+    if total == 0:
+        return 1.0
+    return 2.0 * int(np.logical_and(maskA, maskB).sum()) / total
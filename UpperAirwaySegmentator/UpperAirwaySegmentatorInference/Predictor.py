@@ -0,0 +1,646 @@
+import json
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+
+def findModelFolder(modelPath):
+    """
+    Returns the nnU-Net trained model folder, ie the folder containing the model dataset.json file.
+    Model paths referencing the shared model store are resolved to the store model folder.
+    """
+    from .ModelStore import resolveModelFolder
+
+    modelPath = resolveModelFolder(modelPath)
+    if modelPath.joinpath("dataset.json").exists():
+        return modelPath
+
+    try:
+        return next(modelPath.rglob("dataset.json")).parent
+    except StopIteration:
+        raise RuntimeError(f"Failed to find nnU-Net model in {modelPath}.")
+
+
+def parseFolds(folds):
+    """
+    Converts a fold string such as "0" or "0,1,2" to the fold list expected by nnU-Net.
+    """
+    if isinstance(folds, (list, tuple)):
+        return [str(fold) for fold in folds]
+    return [fold.strip() for fold in str(folds).split(",") if fold.strip()]
+
+
+class AirwayPredictor:
+    """
+    Runs the nnU-Net model on input files without the nnU-Net multiprocessing data loaders.
+    Preprocessing, prediction and export run sequentially in the calling process which gives full control over the
+    number of threads used by each inference process.
+    """
+
+    def __init__(self, modelPath, folds="0", device="cpu", stepSize=0.5, disableTta=True,
+                 checkpointName="checkpoint_final.pth", preprocessingCache=None, foldProcesses=1,
+                 saveProbabilities=False, precision="fp32", minimumPrecisionDice=0.98, lowMemory=False,
+                 tileCheckpointStore=None, tileCheckpointInterval_s=30.0, cancelFile=None, adaptiveTta=False,
+                 ttaMargin=0.5, ttaUncertainFraction=0.001, modelCacheFolder=None, progressCallback=None):
+        """
+        :param modelCacheFolder: folder of the files derived from the model, such as the converted weights. Defaults to
+            the user cache folder.
+        """
+        from .Checkpoint import userCacheFolder
+
+        self.modelFolder = findModelFolder(modelPath)
+        self.modelCacheFolder = Path(modelCacheFolder) if modelCacheFolder else userCacheFolder()
+        self.folds = parseFolds(folds)
+        self.device = device
+        self.stepSize = stepSize
+        self.disableTta = disableTta
+        self.checkpointName = checkpointName
+        self.preprocessingCache = preprocessingCache
+        self.foldProcesses = foldProcesses
+        self.saveProbabilities = saveProbabilities
+        self.requestedPrecision = precision
+        self.precision = "fp32"
+        self.minimumPrecisionDice = minimumPrecisionDice
+        self.lowMemory = lowMemory
+        self.tileCheckpointStore = tileCheckpointStore
+        self.tileCheckpointInterval_s = tileCheckpointInterval_s
+        self.cancelFile = cancelFile
+        self.adaptiveTta = adaptiveTta
+        self.ttaMargin = ttaMargin
+        self.ttaUncertainFraction = ttaUncertainFraction
+        self.progressCallback = progressCallback or (lambda *_: None)
+        self._isPrecisionCheckPending = False
+        self._modelHash = None
+        self._predictor = None
+
+    @property
+    def predictor(self):
+        if self._predictor is None:
+            self.initialize()
+        return self._predictor
+
+    def initialize(self):
+        import torch
+        from nnunetv2.inference.predict_from_raw_data import nnUNetPredictor
+        from .Checkpoint import initializePredictor, readResidentMemory
+        from .Parameter import resolveDevice
+
+        device = resolveDevice(self.device)
+        if device != self.device:
+            self.progressCallback("CUDA is not available, running inference on CPU.")
+            self.device = device
+
+        start = time.time()
+        predictor = nnUNetPredictor(
+            tile_step_size=self.stepSize,
+            use_gaussian=True,
+            # Adaptive test time augmentation mirrors the uncertain tiles only
+            use_mirroring=not self.disableTta and not self.adaptiveTta,
+            perform_everything_on_device=self.device != "cpu",
+            device=torch.device(self.device),
+            verbose=False,
+            verbose_preprocessing=False,
+            allow_tqdm=False
+        )
+        try:
+            initializePredictor(
+                predictor,
+                self.modelFolder,
+                self.folds,
+                self.checkpointName,
+                self.modelCacheFolder,
+                self.progressCallback
+            )
+            loading = "memory mapped weights"
+        except (AttributeError, KeyError, TypeError) as e:
+            # nnU-Net versions with other initialization internals load the full checkpoints
+            self.progressCallback(f"Memory mapped weights loading not supported ({e}), loading the full checkpoints.")
+            predictor.initialize_from_trained_model_folder(
+                self.modelFolder.as_posix(),
+                use_folds=self.folds,
+                checkpoint_name=self.checkpointName
+            )
+            loading = "full checkpoints"
+        predictor.network.to(predictor.device)
+        predictor.network.eval()
+        if self.cancelFile is not None:
+            # Checked before each forward pass, ie between two sliding window tiles
+            predictor.network.register_forward_pre_hook(lambda *_: self.checkCancelled())
+        self._predictor = predictor
+        if self.adaptiveTta and not predictor.allowed_mirroring_axes:
+            self.progressCallback("Model doesn't allow mirroring, running inference without test time augmentation.")
+            self.adaptiveTta = False
+
+        memory = readResidentMemory()
+        memory = f", resident memory {memory['rss_MB']:.0f} MB" if memory and "rss_MB" in memory else ""
+        self.progressCallback(
+            f"Model loaded in {time.time() - start:.1f} s (folds : {','.join(self.folds)}, {loading}{memory})."
+        )
+        self._initializePrecision()
+
+    def checkCancelled(self):
+        """
+        :raises InferenceCancelled: if a cancel was requested through the cancel file
+        """
+        if self.cancelFile is not None:
+            self.cancelFile.check()
+
+    @property
+    def precisionCheckFile(self):
+        """
+        Precision checks of the model, in the model cache folder and named after the model hash. Model folders are never
+        written as they can be read only entries of the shared model store.
+        """
+        from .Checkpoint import modelHash
+        from .Precision import PRECISION_CHECKS_FOLDER_NAME
+
+        if self._modelHash is None:
+            self._modelHash = modelHash(self.modelFolder, self.folds, self.checkpointName, self.modelCacheFolder)
+        return self.modelCacheFolder / PRECISION_CHECKS_FOLDER_NAME / f"{self._modelHash}.json"
+
+    def _precisionCheckKey(self, precision):
+        import torch
+        from .Precision import readCpuInfo
+        return f"{readCpuInfo()[0]}|torch {torch.__version__}|{precision}"
+
+    def _readPrecisionChecks(self):
+        try:
+            with open(self.precisionCheckFile, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _writePrecisionCheck(self, precision, dice):
+        from .Checkpoint import writeJson
+
+        checks = self._readPrecisionChecks()
+        checks[self._precisionCheckKey(precision)] = dice
+        try:
+            self.precisionCheckFile.parent.mkdir(parents=True, exist_ok=True)
+            writeJson(self.precisionCheckFile, checks)
+        except OSError as e:
+            self.progressCallback(f"Failed to record the precision check in {self.modelCacheFolder} : {e}")
+
+    def _initializePrecision(self):
+        """
+        Resolve the requested precision for the current hardware. Reduced precisions which were previously measured
+        below the minimum Dice on this host fall back to fp32, unmeasured ones are checked on the first prediction.
+        """
+        from .Precision import resolvePrecision
+
+        self.precision = resolvePrecision(self.requestedPrecision, self.device, progressCallback=self.progressCallback)
+        if self.precision == "fp32":
+            return
+
+        # nnU-Net accumulates the tile predictions in its own dtypes, keep the network output in float32
+        self._predictor.network.register_forward_hook(lambda _module, _inputs, output: output.float())
+
+        if not self.minimumPrecisionDice:
+            self.progressCallback(f"Running inference in {self.precision}.")
+            return
+
+        dice = self._readPrecisionChecks().get(self._precisionCheckKey(self.precision))
+        if dice is None:
+            self._isPrecisionCheckPending = True
+            self.progressCallback(f"Running inference in {self.precision}, accuracy will be checked against fp32.")
+        elif dice < self.minimumPrecisionDice:
+            self.progressCallback(
+                f"WARNING : {self.precision} Dice against fp32 ({dice:.4f}) is below {self.minimumPrecisionDice} on"
+                f" this host. Running inference in fp32."
+            )
+            self.precision = "fp32"
+        else:
+            self.progressCallback(f"Running inference in {self.precision} (Dice against fp32 : {dice:.4f}).")
+
+    def predictLogitsWithPrecisionCheck(self, data, volumeHash=None):
+        """
+        Predict the logits in reduced precision and in fp32 and compare their segmentations.
+        The Dice is recorded for the host and the fp32 logits are returned. Inference falls back to fp32 if the Dice
+        is below the minimum Dice.
+        """
+        from .Precision import diceCoefficient
+
+        reducedPrecision = self.precision
+        start = time.time()
+        reducedSegmentation = self.predictLogits(data, volumeHash).argmax(0).numpy()
+        reducedDuration_s = time.time() - start
+
+        self.precision = "fp32"
+        start = time.time()
+        logits = self.predictLogits(data, volumeHash)
+        duration_s = time.time() - start
+
+        dice = diceCoefficient(reducedSegmentation, logits.argmax(0).numpy())
+        del reducedSegmentation
+        self._isPrecisionCheckPending = False
+
+        self._writePrecisionCheck(reducedPrecision, dice)
+
+        summary = f"{reducedPrecision} Dice against fp32 : {dice:.4f} ({reducedDuration_s:.1f} s vs {duration_s:.1f} s)"
+        if dice < self.minimumPrecisionDice:
+            self.progressCallback(
+                f"WARNING : {summary} is below {self.minimumPrecisionDice}. Running inference in fp32."
+            )
+        else:
+            self.progressCallback(summary)
+            self.precision = reducedPrecision
+        return logits
+
+    def preprocess(self, inputFile):
+        """
+        Preprocessed arrays are read from the preprocessing cache when available and added to it otherwise.
+
+        :returns: preprocessed data tensor and the nnU-Net properties required to export the prediction
+        """
+        import torch
+
+        start = time.time()
+        cacheKey = self.preprocessingCacheKey(inputFile)
+        cached = self.preprocessingCache.load(cacheKey) if cacheKey else None
+        if cached is not None:
+            data, properties = cached
+            self.progressCallback(f"Loaded preprocessed volume from cache in {time.time() - start:.1f} s.")
+        else:
+            predictor = self.predictor
+            preprocessor = predictor.configuration_manager.preprocessor_class(verbose=False)
+            data, _, properties = preprocessor.run_case(
+                [Path(inputFile).as_posix()],
+                None,
+                predictor.plans_manager,
+                predictor.configuration_manager,
+                predictor.dataset_json
+            )
+            self.progressCallback(f"Preprocessing done in {time.time() - start:.1f} s.")
+            if cacheKey:
+                self.preprocessingCache.save(cacheKey, data, properties)
+
+        return torch.from_numpy(data).to(dtype=torch.float32, memory_format=torch.contiguous_format), properties
+
+    def preprocessingCacheKey(self, inputFile):
+        if self.preprocessingCache is None:
+            return None
+
+        from .PreprocessingCache import fileHash, preprocessingFingerprint
+        predictor = self.predictor
+        fingerprint = preprocessingFingerprint(
+            predictor.plans_manager, predictor.configuration_manager, predictor.dataset_json
+        )
+        return self.preprocessingCache.cacheKey(fileHash(inputFile), fingerprint)
+
+    def predictLogits(self, data, volumeHash=None):
+        """
+        :param volumeHash: hash of the data keying the tile checkpoints, computed from the data if None
+        :returns: logits averaged over the model folds, in half precision for multi-fold ensembles
+        """
+        if self.foldProcesses > 1 and len(self.folds) > 1:
+            from .FoldEnsemble import FoldProcessEnsemble
+            import torch
+            ensemble = FoldProcessEnsemble(self, self.foldProcesses, progressCallback=self.progressCallback)
+            logitSum, nFolds = ensemble.predictLogitSum(data)
+            logitSum = torch.from_numpy(logitSum)
+        else:
+            logitSum, nFolds = self.predictLogitSum(data, volumeHash)
+
+        if nFolds > 1:
+            logitSum /= nFolds
+        return logitSum
+
+    def predictLogitSum(self, data, volumeHash=None):
+        """
+        Run the folds one after the other and accumulate their logits in a single half precision running sum.
+        Only one fold prediction is alive at a time on top of the running sum, keeping the peak memory close to that
+        of a single fold prediction. Single fold logits are returned in float32.
+
+        :returns: logit sum on CPU and number of folds
+        """
+        import torch
+        from .Checkpoint import loadNetworkWeights
+        from .Precision import precisionContext
+
+        predictor = self.predictor
+        if self.tileCheckpointStore is not None and volumeHash is None:
+            volumeHash = self.volumeHash(data)
+        network = getattr(predictor.network, "_orig_mod", predictor.network)
+        nFolds = len(predictor.list_of_parameters)
+        logitSum = None
+        for iFold, (fold, parameters) in enumerate(zip(self.folds, predictor.list_of_parameters)):
+            self.checkCancelled()
+            start = time.time()
+            self.progressCallback(f"Predicting fold {fold} ({iFold + 1} / {nFolds})...")
+            loadNetworkWeights(network, parameters, shareMemory=predictor.device.type == "cpu")
+            with precisionContext(self.precision):
+                if volumeHash is not None or self.adaptiveTta:
+                    foldLogits = self.predictSlidingWindow(data, fold, volumeHash)
+                else:
+                    foldLogits = predictor.predict_sliding_window_return_logits(data)
+            foldLogits = foldLogits.to(device="cpu", dtype=torch.half if nFolds > 1 else torch.float32)
+            if logitSum is None:
+                logitSum = foldLogits
+            else:
+                logitSum += foldLogits
+            del foldLogits
+            self.progressCallback(f"Fold {fold} done in {time.time() - start:.1f} s ({iFold + 1} / {nFolds}).")
+        return logitSum, nFolds
+
+    @staticmethod
+    def volumeHash(data):
+        from .TileCheckpoint import arrayHash
+        return arrayHash(data.numpy())
+
+    def tileCheckpointParameters(self, fold):
+        """
+        Inference parameters changing the fold tile predictions. The checkpoint file size and modification time identify
+        the model weights version.
+        """
+        weightsStat = self.modelFolder.joinpath(f"fold_{fold}", self.checkpointName).stat()
+        return {
+            "model": self.modelFolder.as_posix(),
+            "fold": fold,
+            "checkpoint": [self.checkpointName, weightsStat.st_size, weightsStat.st_mtime_ns],
+            "stepSize": self.stepSize,
+            "mirroring": "adaptive" if self.adaptiveTta else not self.disableTta,
+            "adaptiveTta": [self.ttaMargin, self.ttaUncertainFraction] if self.adaptiveTta else None,
+            "precision": self.precision,
+            "device": self.predictor.device.type,
+        }
+
+    def isTileUncertain(self, prediction):
+        """
+        A tile is uncertain when the fraction of its voxels whose softmax margin between the two most probable labels
+        is below ttaMargin exceeds ttaUncertainFraction.
+        """
+        import torch
+
+        probabilities = torch.softmax(prediction.float(), dim=0)
+        top2 = torch.topk(probabilities, 2, dim=0).values
+        uncertainFraction = ((top2[0] - top2[1]) < self.ttaMargin).float().mean().item()
+        return uncertainFraction > self.ttaUncertainFraction
+
+    def predictMirroredTile(self, tile, prediction):
+        """
+        Blends the plain prediction of the tile with the predictions of its mirrored versions, as nnU-Net's mirroring
+        test time augmentation does.
+        """
+        import itertools
+        import torch
+
+        predictor = self.predictor
+        mirrorAxes = [axis + 2 for axis in (predictor.allowed_mirroring_axes or ())]
+        combinations = [
+            axes for nAxes in range(1, len(mirrorAxes) + 1) for axes in itertools.combinations(mirrorAxes, nAxes)
+        ]
+        prediction = prediction.clone()
+        for axes in combinations:
+            prediction += torch.flip(predictor.network(torch.flip(tile, axes)), axes)[0]
+        return prediction / (len(combinations) + 1)
+
+    def predictSlidingWindow(self, data, fold, volumeHash=None):
+        """
+        Follows nnU-Net's sliding window prediction with two additions :
+
+        - With a tile checkpoint store, the tile predictions are accumulated in a memory mapped tile checkpoint,
+          committed every tileCheckpointInterval_s seconds. Predicting the same volume again with the same parameters
+          after an interruption only predicts the tiles which weren't committed.
+        - With adaptive test time augmentation, each tile is first predicted without mirroring and only the uncertain
+          tiles are predicted again mirrored. The fraction of augmented tiles is reported.
+
+        :returns: float32 fold logits on CPU
+        """
+        import numpy as np
+        import torch
+        from acvl_utils.cropping_and_padding.padding import pad_nd_image
+        from nnunetv2.inference.sliding_window_prediction import compute_gaussian
+        from .Cancellation import InferenceCancelled
+        from .TileCheckpoint import TileAccumulator
+
+        predictor = self.predictor
+        patchSize = tuple(predictor.configuration_manager.patch_size)
+        data, revertPadding = pad_nd_image(data, patchSize, "constant", {"value": 0}, True, None)
+        slicers = predictor._internal_get_sliding_window_slicers(data.shape[1:])
+        shape = (predictor.label_manager.num_segmentation_heads, *data.shape[1:])
+        if volumeHash is not None:
+            accumulator = self.tileCheckpointStore.open(
+                volumeHash, self.tileCheckpointParameters(fold), shape, len(slicers)
+            )
+            if accumulator.completed:
+                self.progressCallback(f"Resuming fold {fold} from tile {len(accumulator.completed)} / {len(slicers)}.")
+        else:
+            accumulator = TileAccumulator(shape, len(slicers))
+
+        gaussian = compute_gaussian(patchSize, sigma_scale=1. / 8, value_scaling_factor=10, device=predictor.device) \
+            if predictor.use_gaussian else torch.ones(patchSize, device=predictor.device)
+        autocast = torch.autocast(predictor.device.type) if predictor.device.type == "cuda" else nullcontext()
+        nPredicted, nAugmented = 0, 0
+        try:
+            lastCommit = time.time()
+            with torch.inference_mode(), autocast:
+                for iTile, slicer in enumerate(slicers):
+                    if iTile in accumulator.completed:
+                        continue
+
+                    tile = data[slicer][None].to(predictor.device)
+                    prediction = predictor._internal_maybe_mirror_and_predict(tile)[0]
+                    if self.adaptiveTta and self.isTileUncertain(prediction):
+                        prediction = self.predictMirroredTile(tile, prediction)
+                        nAugmented += 1
+                    nPredicted += 1
+
+                    bounds = [(region.start, region.stop) for region in slicer[1:]]
+                    accumulator.accumulate(iTile, bounds, (prediction * gaussian).float().cpu().numpy())
+                    if volumeHash is not None and time.time() - lastCommit >= self.tileCheckpointInterval_s:
+                        accumulator.commit()
+                        lastCommit = time.time()
+                        self.progressCallback(
+                            f"Fold {fold} : {len(accumulator.completed)} / {len(slicers)} tiles done."
+                        )
+            accumulator.commit()
+            if self.adaptiveTta and nPredicted:
+                self.progressCallback(
+                    f"Fold {fold} : adaptive TTA augmented {nAugmented} / {nPredicted} tiles"
+                    f" ({100 * nAugmented / nPredicted:.1f} %)."
+                )
+
+            # Gaussian weight of each voxel, summed over the tiles covering it
+            weights = torch.zeros(data.shape[1:], dtype=torch.float32)
+            gaussian = gaussian.float().cpu()
+            for slicer in slicers:
+                weights[slicer[1:]] += gaussian
+            region = tuple(revertPadding[1:])
+            weights = weights[region]
+
+            logits = torch.empty((shape[0], *weights.shape), dtype=torch.float32)
+            for channel in range(shape[0]):
+                logits[channel] = torch.from_numpy(np.asarray(accumulator.logits[(channel, *region)])) / weights
+            return logits
+        except InferenceCancelled:
+            # Tiles predicted before the cancel are resumed by the next run
+            accumulator.commit()
+            raise
+        finally:
+            accumulator.close()
+
+    def exportSegmentation(self, logits, properties, outputFile):
+        from nnunetv2.inference.export_prediction import export_prediction_from_logits
+
+        predictor = self.predictor
+        outputFile = Path(outputFile).as_posix()
+        fileEnding = predictor.dataset_json["file_ending"]
+        if self.lowMemory and self.isLogitMarginExportSupported():
+            self.exportSegmentationFromLogitMargin(logits, properties, outputFile)
+            return
+
+        if self.saveProbabilities:
+            self.exportSegmentationAndProbabilities(logits, properties, outputFile)
+            return
+
+        export_prediction_from_logits(
+            logits,
+            properties,
+            predictor.configuration_manager,
+            predictor.plans_manager,
+            predictor.dataset_json,
+            outputFile[:-len(fileEnding)] if outputFile.endswith(fileEnding) else outputFile,
+        )
+
+    def exportSegmentationAndProbabilities(self, logits, properties, outputFile):
+        """
+        Writes the segmentation and the airway probability map in the segmentation geometry as uint8 levels.
+        """
+        from nnunetv2.inference.export_prediction import convert_predicted_logits_to_segmentation_with_correct_shape
+        from .ProbabilityMap import probabilityMapPath, saveProbabilityMap
+
+        predictor = self.predictor
+        segmentation, probabilities = convert_predicted_logits_to_segmentation_with_correct_shape(
+            logits,
+            predictor.plans_manager,
+            predictor.configuration_manager,
+            predictor.label_manager,
+            properties,
+            return_probabilities=True
+        )
+        predictor.plans_manager.image_reader_writer_class().write_seg(segmentation, outputFile, properties)
+
+        # Channel 0 is the background, channel 1 the airway label
+        saveProbabilityMap(probabilityMapPath(outputFile, predictor.dataset_json["file_ending"]), probabilities[1])
+
+    def isLogitMarginExportSupported(self):
+        labelManager = self.predictor.label_manager
+        return labelManager.num_segmentation_heads == 2 and not labelManager.has_regions
+
+    def exportSegmentationFromLogitMargin(self, logits, properties, outputFile):
+        """
+        Low memory export of the two label segmentation. The airway wins the softmax argmax where its logit exceeds the
+        background logit, and the resampling being linear, resampling the single airway - background logit margin gives
+        the same segmentation as resampling the logits of both labels. The airway probability is the sigmoid of the
+        margin. Only one float channel is allocated at the input shape instead of the logits and probabilities of each
+        label.
+        """
+        import numpy as np
+        from .ProbabilityMap import probabilityMapPath, saveProbabilityMap
+
+        predictor = self.predictor
+        plans, configuration = predictor.plans_manager, predictor.configuration_manager
+        margin = (logits[1:2].float() - logits[0:1].float()).numpy()
+
+        shape = properties["shape_after_cropping_and_before_resampling"]
+        spacing = [properties["spacing"][i] for i in plans.transpose_forward]
+        currentSpacing = configuration.spacing if len(configuration.spacing) == len(shape) else \
+            [spacing[0], *configuration.spacing]
+        margin = np.asarray(configuration.resampling_fn_probabilities(margin, shape, currentSpacing, spacing))[0]
+
+        region = tuple(slice(*bounds) for bounds in properties["bbox_used_for_cropping"])
+        segmentation = np.zeros(properties["shape_before_cropping"], dtype=np.uint8)
+        segmentation[region] = margin > 0
+        plans.image_reader_writer_class().write_seg(
+            segmentation.transpose(plans.transpose_backward), outputFile, properties
+        )
+        del segmentation
+        if not self.saveProbabilities:
+            return
+
+        # In place sigmoid of the margin
+        np.negative(margin, out=margin)
+        np.exp(margin, out=margin)
+        margin += 1
+        np.reciprocal(margin, out=margin)
+        probabilities = np.zeros(properties["shape_before_cropping"], dtype=np.float32)
+        probabilities[region] = margin
+        del margin
+        saveProbabilityMap(
+            probabilityMapPath(outputFile, predictor.dataset_json["file_ending"]),
+            probabilities.transpose(plans.transpose_backward)
+        )
+
+    def outputFilePath(self, inputFile, outputFolder):
+        """
+        Output file named after the input file, without the nnU-Net channel suffix.
+        """
+        fileEnding = self.predictor.dataset_json["file_ending"]
+        name = Path(inputFile).name
+        for inputEnding in (fileEnding, ".nii.gz", ".nii"):
+            if name.endswith(inputEnding):
+                name = name[:-len(inputEnding)]
+                break
+        if name.endswith("_0000"):
+            name = name[:-len("_0000")]
+        return Path(outputFolder).joinpath(name + fileEnding)
+
+    def predictFile(self, inputFile, outputFolder):
+        self.checkCancelled()
+        outputFile = self.outputFilePath(inputFile, outputFolder)
+        Path(outputFolder).mkdir(parents=True, exist_ok=True)
+
+        start = time.time()
+        self.progressCallback(f"Preprocessing {inputFile}...")
+        data, properties = self.preprocess(inputFile)
+        volumeHash = self.volumeHash(data) if self.tileCheckpointStore is not None else None
+        self.progressCallback(f"Predicting {tuple(data.shape[1:])} voxels...")
+        if self._isPrecisionCheckPending:
+            logits = self.predictLogitsWithPrecisionCheck(data, volumeHash)
+        else:
+            logits = self.predictLogits(data, volumeHash)
+        del data
+        self.checkCancelled()
+        self.progressCallback("Exporting segmentation...")
+        self.exportSegmentation(logits, properties, outputFile)
+        if volumeHash is not None:
+            self.tileCheckpointStore.remove(volumeHash)
+        self.progressCallback(f"Done with {outputFile} in {time.time() - start:.1f} s.")
+        return outputFile
+
+    def benchmark(self, duration_s=10.0):
+        """
+        Runs forward passes on random patches of the model patch size for the input duration.
+
+        :returns: dict with the number of tiles run, the average time per tile in seconds, the patch size and the model
+            target spacing
+        """
+        import torch
+        from nnunetv2.utilities.label_handling.label_handling import determine_num_input_channels
+        from .Precision import precisionContext
+
+        predictor = self.predictor
+        nChannels = determine_num_input_channels(
+            predictor.plans_manager, predictor.configuration_manager, predictor.dataset_json
+        )
+        patchSize = tuple(predictor.configuration_manager.patch_size)
+        patch = torch.rand((1, nChannels, *patchSize), device=predictor.device)
+
+        with torch.inference_mode(), precisionContext(self.precision):
+            # Warm up run excluded from the timings
+            predictor._internal_maybe_mirror_and_predict(patch)
+
+            nTiles = 0
+            start = time.time()
+            while nTiles == 0 or time.time() - start < duration_s:
+                predictor._internal_maybe_mirror_and_predict(patch)
+                nTiles += 1
+            elapsed_s = time.time() - start
+
+        return {
+            "tiles": nTiles,
+            "seconds_per_tile": elapsed_s / nTiles,
+            "patch_size": list(patchSize),
+            "spacing": list(predictor.configuration_manager.spacing),
+            "precision": self.precision,
+        }
@@ -0,0 +1,235 @@
+import math
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import List
+
+import numpy as np
+
+
+class Severity(str, Enum):
+    WARNING = "warning"
+    ERROR = "error"
+
+
+@dataclass
+class PreflightIssue:
+    severity: Severity
+    code: str
+    message: str
+
+
+@dataclass
+class PreflightReport:
+    """
+    Issues found in an input volume before running the inference. Errors block the segmentation, warnings are
+    confirmed by the user in interactive mode.
+    """
+    issues: List[PreflightIssue] = field(default_factory=list)
+    elapsed_s: float = 0.0
+
+    @property
+    def errors(self):
+        return [issue for issue in self.issues if issue.severity == Severity.ERROR]
+
+    @property
+    def warnings(self):
+        return [issue for issue in self.issues if issue.severity == Severity.WARNING]
+
+    @property
+    def isBlocking(self):
+        return bool(self.errors)
+
+    def isAccepted(self, strict=False):
+        """
+        :param strict: if True, warnings also reject the input
+        """
+        return not self.issues if strict else not self.isBlocking
+
+    def add(self, severity, code, message):
+        self.issues.append(PreflightIssue(severity, code, message))
+
+    def summary(self):
+        if not self.issues:
+            return f"Input check passed in {self.elapsed_s:.2f} s."
+        return "\n".join(f"{issue.severity.value.capitalize()} : {issue.message}" for issue in self.issues)
+
+
+# Thresholds of the input checks. Spacings and extents in mm.
+MIN_SPACING = 0.05
+MAX_SPACING = 2.0
+MAX_SPACING_RATIO = 5.0
+MIN_SLICES = 16
+MIN_PHARYNX_EXTENT = 40.0
+MIN_INTENSITY_RANGE = 1000.0
+HOUNSFIELD_AIR = -500.0
+MIN_INTERNAL_AIR_FRACTION = 0.0005
+MAX_OBLIQUE_COSINE = 0.9
+MAX_SAMPLED_VOXELS = 2 ** 21
+
+
+def _superiorAxis(directions):
+    """
+    Array axis most aligned with the superior - inferior direction. Directions columns are the RAS directions of the
+    array axes.
+    """
+    if directions is None:
+        return 0
+    return int(np.argmax(np.abs(np.asarray(directions, dtype=float)[2, :])))
+
+
+def checkGeometry(report, shape, spacing, directions=None):
+    """
+    Checks the voxel spacing, the number of slices and the orientation of the volume.
+
+    :param spacing: spacing in the array axis order
+    :param directions: 3x3 matrix which columns are the RAS directions of the array axes, None if unknown
+    """
+    spacing = np.asarray(spacing, dtype=float)
+    if not np.all(np.isfinite(spacing)) or np.any(spacing < MIN_SPACING):
+        report.add(Severity.ERROR, "spacing", f"Invalid voxel spacing {tuple(spacing.round(4))} mm.")
+        return
+
+    if np.any(spacing > MAX_SPACING):
+        report.add(
+            Severity.WARNING, "resolution",
+            f"Voxel spacing {tuple(spacing.round(3))} mm is coarser than the {MAX_SPACING} mm the model expects."
+        )
+    if spacing.max() / spacing.min() > MAX_SPACING_RATIO:
+        report.add(
+            Severity.WARNING, "anisotropy",
+            f"Voxel spacing {tuple(spacing.round(3))} mm is strongly anisotropic, CBCT volumes are isotropic."
+        )
+    if min(shape) < MIN_SLICES:
+        report.add(Severity.ERROR, "slices", f"Volume of {tuple(shape)} voxels has too few slices to be segmented.")
+
+    if directions is None:
+        return
+
+    directions = np.asarray(directions, dtype=float)
+    if not np.all(np.isfinite(directions)) or abs(abs(np.linalg.det(directions)) - 1.0) > 1e-3 or \
+            not np.allclose(directions.T @ directions, np.eye(3), atol=1e-3):
+        report.add(Severity.ERROR, "orientation", "Volume axes are not orthonormal, the orientation is broken.")
+    elif np.abs(directions).max(axis=0).min() < MAX_OBLIQUE_COSINE:
+        report.add(Severity.WARNING, "oblique", "Volume is acquired obliquely, segmentation may be less accurate.")
+
+
+def checkIntensities(report, sampled):
+    """
+    Checks that the intensity histogram looks like a CT / CBCT : a wide intensity range with a low intensity air
+    population. MR and normalized volumes have a narrow range and no Hounsfield air values.
+    """
+    if not np.all(np.isfinite(sampled)):
+        report.add(Severity.ERROR, "intensity", "Volume contains invalid (NaN or infinite) intensities.")
+        return None
+
+    low, high = np.percentile(sampled, [0.5, 99.5])
+    if high <= low:
+        report.add(Severity.ERROR, "intensity", "Volume has a constant intensity.")
+        return None
+
+    isHounsfield = sampled.min() <= HOUNSFIELD_AIR
+    if not isHounsfield and high - low < MIN_INTENSITY_RANGE:
+        report.add(
+            Severity.WARNING, "modality",
+            f"Intensity range [{low:.0f}, {high:.0f}] doesn't look like a CT or CBCT. The model only segments CT and"
+            " CBCT volumes, MR volumes aren't supported."
+        )
+    return low, high
+
+
+def checkFieldOfView(report, sampled, spacing, directions, intensityRange):
+    """
+    Checks that the field of view is tall enough and contains air surrounded by tissue to plausibly include the
+    pharynx. Dental only fields of view are shorter than the pharynx.
+    """
+    superiorAxis = _superiorAxis(directions)
+    extent = sampled.shape[superiorAxis] * spacing[superiorAxis]
+    if extent < MIN_PHARYNX_EXTENT:
+        report.add(
+            Severity.WARNING, "fieldOfView",
+            f"Superior - inferior field of view of {extent:.0f} mm is too short to contain the pharynx"
+            f" (at least {MIN_PHARYNX_EXTENT:.0f} mm expected)."
+        )
+
+    if intensityRange is None:
+        return
+
+    # Air voxels of the central region : the pharynx is inside the head while the air around the head is outside
+    low, high = intensityRange
+    central = sampled[tuple(slice(size // 4, size - size // 4) for size in sampled.shape)]
+    airFraction = float(np.mean(central < low + 0.2 * (high - low))) if central.size else 0.0
+    if airFraction < MIN_INTERNAL_AIR_FRACTION:
+        report.add(
+            Severity.WARNING, "airway",
+            "No air was found in the center of the field of view, the volume may not contain the airway."
+        )
+
+
+def analyzeVolume(array, spacing, directions=None, maxSampledVoxels=MAX_SAMPLED_VOXELS):
+    """
+    Fast pre-flight check of an input volume, run on the array subsampled to at most maxSampledVoxels voxels.
+
+    :param array: volume array
+    :param spacing: spacing in the array axis order
+    :param directions: 3x3 matrix which columns are the RAS directions of the array axes, None if unknown
+    :returns: PreflightReport
+    """
+    start = time.time()
+    report = PreflightReport()
+    if np.asarray(array).ndim != 3 or np.asarray(array).size == 0:
+        report.add(Severity.ERROR, "shape", f"Expected a 3D volume, got an array of shape {np.shape(array)}.")
+        return report
+
+    checkGeometry(report, array.shape, spacing, directions)
+    if any(issue.code == "spacing" for issue in report.errors):
+        report.elapsed_s = time.time() - start
+        return report
+
+    stride = max(1, math.ceil((array.size / maxSampledVoxels) ** (1 / 3)))
+    sampled = np.asarray(array[::stride, ::stride, ::stride], dtype=np.float32)
+    sampledSpacing = [sp * stride for sp in spacing]
+
+    intensityRange = checkIntensities(report, sampled)
+    checkFieldOfView(report, sampled, sampledSpacing, directions, intensityRange)
+    report.elapsed_s = time.time() - start
+    return report
+
+
+def analyzeFile(path):
+    """
+    Pre-flight check of a volume file read with SimpleITK.
+    """
+    import SimpleITK as sitk
+
+    image = sitk.ReadImage(str(path))
+    # SimpleITK arrays are in (k, j, i) order, reverse the spacing and direction columns accordingly. ITK directions are
+    # in LPS, flip the first two rows to RAS.
+    lpsToRas = np.diag([-1.0, -1.0, 1.0])
+    directions = lpsToRas @ np.asarray(image.GetDirection(), dtype=float).reshape(3, 3)
+    return analyzeVolume(
+        sitk.GetArrayViewFromImage(image),
+        list(reversed(image.GetSpacing())),
+        directions[:, ::-1],
+    )
+
+
+def acceptedInputs(paths, strict=False, progressCallback=None):
+    """
+    :param strict: if True, inputs with warnings are also rejected
+    :returns: input files passing the pre-flight check. Rejected files are reported with their issues.
+    """
+    progressCallback = progressCallback or print
+    accepted = []
+    for path in paths:
+        try:
+            report = analyzeFile(path)
+        except Exception as e:  # noqa
+            progressCallback(f"Skipping {path}, failed to read the volume : {e}")
+            continue
+
+        if report.isAccepted(strict):
+            accepted.append(path)
+        else:
+            progressCallback(f"Skipping {path} :\n{report.summary()}")
+    return accepted
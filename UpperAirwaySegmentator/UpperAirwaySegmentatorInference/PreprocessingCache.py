@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+def fileHash(filePath, chunkSize=16 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(filePath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunkSize), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+PREPROCESSING_CONFIGURATION_KEYS = [
+    "spacing",
+    "normalization_schemes",
+    "use_mask_for_norm",
+    "resampling_fn_data",
+    "resampling_fn_data_kwargs",
+    "preprocessor_name",
+]
+
+
+def preprocessingFingerprint(plansManager, configurationManager, datasetJson):
+    """
+    Hash of the plans.json and dataset.json entries which affect preprocessing.
+    Updating the model weights without changing the preprocessing keeps the cached entries valid.
+    """
+    plans = plansManager.plans
+    configuration = configurationManager.configuration
+    fingerprint = {
+        "configuration": {key: configuration.get(key) for key in PREPROCESSING_CONFIGURATION_KEYS},
+        "transpose_forward": plans.get("transpose_forward"),
+        "foreground_intensity_properties_per_channel": plans.get("foreground_intensity_properties_per_channel"),
+        "image_reader_writer": plans.get("image_reader_writer"),
+        "channel_names": datasetJson.get("channel_names", datasetJson.get("modality")),
+    }
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class PreprocessingCache:
+    """
+    Disk cache of the nnU-Net preprocessed arrays.
+
+    Each entry is a folder named after the input volume hash and the model preprocessing fingerprint. It contains the
+    preprocessed array saved as an uncompressed .npy file, loaded memory mapped on cache hits, and the nnU-Net
+    properties needed to export the prediction. The least recently used entries are removed when the cache exceeds its
+    maximum size.
+    """
+
+    dataFileName = "data.npy"
+    propertiesFileName = "properties.pkl"
+
+    def __init__(self, cacheFolder, maxSize_GB=20.0):
+        self.cacheFolder = Path(cacheFolder)
+        self.maxSize_bytes = int(maxSize_GB * 1024 ** 3)
+
+    @staticmethod
+    def cacheKey(volumeHash, fingerprint):
+        return f"{volumeHash[:32]}_{fingerprint[:16]}"
+
+    def entryFolder(self, key):
+        return self.cacheFolder / key
+
+    def load(self, key):
+        """
+        :returns: (memory mapped array, properties) or None if the key is not cached
+        """
+        entryFolder = self.entryFolder(key)
+        try:
+            data = np.load(entryFolder / self.dataFileName, mmap_mode="c")
+            with open(entryFolder / self.propertiesFileName, "rb") as f:
+                properties = pickle.load(f)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return None
+
+        # Access time is used for the LRU eviction and may not be updated by the file system
+        os.utime(entryFolder)
+        return data, properties
+
+    def save(self, key, data, properties):
+        """
+        Write the entry to a temporary folder first to never expose partially written entries to other processes.
+        """
+        entryFolder = self.entryFolder(key)
+        if entryFolder.exists():
+            return
+
+        tmpFolder = self.cacheFolder / f".{key}_{os.getpid()}_{time.time_ns()}"
+        try:
+            tmpFolder.mkdir(parents=True)
+            np.save(tmpFolder / self.dataFileName, np.ascontiguousarray(data))
+            with open(tmpFolder / self.propertiesFileName, "wb") as f:
+                pickle.dump(properties, f)
+            os.replace(tmpFolder, entryFolder)
+        except OSError:
+            # Entry was concurrently written by another process or the disk is full. Caching is best effort.
+            shutil.rmtree(tmpFolder, ignore_errors=True)
+            return
+        self.evict()
+
+    def entries(self):
+        if not self.cacheFolder.exists():
+            return []
+        return [path for path in self.cacheFolder.iterdir() if path.is_dir() and not path.name.startswith(".")]
+
+    @staticmethod
+    def entrySize(entryFolder):
+        return sum(path.stat().st_size for path in entryFolder.iterdir() if path.is_file())
+
+    def size(self):
+        return sum(self.entrySize(entry) for entry in self.entries())
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits its maximum size.
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry.stat().st_mtime)
+        totalSize = sum(self.entrySize(entry) for entry in entries)
+        for entry in entries:
+            if totalSize <= self.maxSize_bytes:
+                break
+            totalSize -= self.entrySize(entry)
+            shutil.rmtree(entry, ignore_errors=True)
+
+    def clear(self):
+        shutil.rmtree(self.cacheFolder, ignore_errors=True)
@@ -0,0 +1,38 @@
+from pathlib import Path
+
+import numpy as np
+
+PROBABILITY_MAP_SUFFIX = "_probabilities.npy"
+MAX_LEVEL = 255
+
+
+def quantizeProbabilities(probabilities):
+    """
+    Converts probabilities in [0, 1] to uint8 levels in [0, 255].
+    """
+    return np.rint(np.clip(probabilities, 0, 1) * MAX_LEVEL).astype(np.uint8)
+
+
+def probabilityLevel(threshold):
+    """
+    Smallest uint8 level considered inside the segmentation for the input probability threshold.
+    """
+    return int(np.clip(np.ceil(threshold * MAX_LEVEL - 1e-6), 1, MAX_LEVEL))
+
+
+def probabilityMapPath(segmentationFile, fileEnding):
+    """
+    Path of the probability map saved next to the segmentation file.
+    """
+    segmentationFile = Path(segmentationFile)
+    name = segmentationFile.name
+    if name.endswith(fileEnding):
+        name = name[:-len(fileEnding)]
+    return segmentationFile.with_name(name + PROBABILITY_MAP_SUFFIX)
+
+
+def saveProbabilityMap(path, probabilities):
+    """
+    Saves the probabilities as an uncompressed uint8 .npy file which can be memory mapped when loaded.
+    """
+    np.save(path, quantizeProbabilities(probabilities))
@@ -0,0 +1,228 @@
+import json
+import math
+import re
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+# Progress messages of the AirwayPredictor used to refine the estimate during the inference
+PREDICTING_PATTERN = re.compile(r"Predicting \(([0-9, ]+)\) voxels")
+FOLD_DONE_PATTERN = re.compile(r"Fold \S+ done in ([0-9.]+) s \(([0-9]+) / ([0-9]+)\)")
+
+
+def resampledShape(shape, spacing, targetSpacing):
+    """
+    Shape of the volume once resampled to the model target spacing. Shape and spacings use the same axis order.
+    """
+    return [max(1, round(size * sp / target)) for size, sp, target in zip(shape, spacing, targetSpacing)]
+
+
+def slidingWindowTileCount(shape, patchSize, stepSize):
+    """
+    Number of tiles of the nnU-Net sliding window over a volume of the input shape.
+    """
+    nTiles = 1
+    for size, patch in zip(shape, patchSize):
+        if size <= patch:
+            continue
+        nTiles *= math.ceil((size - patch) / (patch * stepSize)) + 1
+    return nTiles
+
+
+def formatDuration(duration_s):
+    duration_s = max(0, int(round(duration_s)))
+    if duration_s < 60:
+        return f"{duration_s} s"
+    minutes, seconds = divmod(duration_s, 60)
+    if minutes < 60:
+        return f"{minutes} min {seconds:02d} s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} h {minutes:02d} min"
+
+
+@dataclass
+class RuntimeEstimate:
+    """
+    Predicted wall time of one segmentation : model loading and volume pre / post processing overhead plus the
+    sliding window tiles of each fold.
+    """
+    nTiles: int
+    nFolds: int
+    secondsPerTile: float
+    overhead_s: float
+    patchSize: list
+
+    @property
+    def inference_s(self):
+        return self.nTiles * self.nFolds * self.secondsPerTile
+
+    @property
+    def total_s(self):
+        return self.overhead_s + self.inference_s
+
+    def summary(self):
+        return (
+            f"Estimated segmentation time : {formatDuration(self.total_s)}"
+            f" ({self.nTiles} tile(s) x {self.nFolds} fold(s) at {self.secondsPerTile:.2f} s / tile)."
+        )
+
+
+class RuntimeEstimator:
+    """
+    Predicts the segmentation wall time on this machine from the input voxel count and spacing.
+
+    The time per tile of the network is measured once per host and inference settings by the worker benchmark and
+    cached in the calibration file. Pre and post processing scale with the number of voxels with fixed coefficients.
+    Predicted and actual times of each run are appended to a history file next to the calibration file.
+    """
+
+    startup_s = 15.0
+    secondsPerMegaVoxel = 0.5
+
+    def __init__(self, calibrationFile):
+        self.calibrationFile = Path(calibrationFile)
+
+    @property
+    def historyFile(self):
+        return self.calibrationFile.with_name("runtime_history.jsonl")
+
+    @staticmethod
+    def calibrationKey(parameter):
+        from .Precision import readCpuInfo
+
+        cpuModel, _ = readCpuInfo()
+        return "|".join([
+            cpuModel,
+            Path(parameter.modelPath).as_posix(),
+            parameter.checkPointName,
+            parameter.device,
+            parameter.precision,
+            "adaptive_tta" if parameter.adaptiveTta else "no_tta" if parameter.disableTta else "tta",
+        ])
+
+    def calibration(self, parameter):
+        """
+        :returns: cached benchmark of the inference settings or None if the settings were never calibrated
+        """
+        return self._readCalibrations().get(self.calibrationKey(parameter))
+
+    def setCalibration(self, parameter, benchmark):
+        calibrations = self._readCalibrations()
+        calibrations[self.calibrationKey(parameter)] = benchmark
+        self.calibrationFile.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.calibrationFile, "w") as f:
+            json.dump(calibrations, f, indent=2)
+
+    def estimate(self, parameter, shape, spacing):
+        """
+        :param shape: input volume shape
+        :param spacing: input volume spacing in the same axis order as the shape
+        :returns: RuntimeEstimate or None if the settings were never calibrated
+        """
+        calibration = self.calibration(parameter)
+        if calibration is None:
+            return None
+
+        targetSpacing = calibration.get("spacing") or spacing
+        return self.estimateResampled(parameter, calibration, resampledShape(shape, spacing, targetSpacing))
+
+    def estimateResampled(self, parameter, calibration, shape):
+        """
+        Estimate for a volume already resampled to the model target spacing.
+        """
+        from .Predictor import parseFolds
+
+        nTiles = slidingWindowTileCount(shape, calibration["patch_size"], parameter.stepSize)
+        nVoxels = math.prod(shape)
+        return RuntimeEstimate(
+            nTiles=nTiles,
+            nFolds=len(parseFolds(parameter.folds)),
+            secondsPerTile=calibration["seconds_per_tile"],
+            overhead_s=self.startup_s + self.secondsPerMegaVoxel * nVoxels / 1e6,
+            patchSize=list(calibration["patch_size"]),
+        )
+
+    def logRun(self, parameter, shape, spacing, estimate, actual_s):
+        record = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "key": self.calibrationKey(parameter),
+            "folds": str(parameter.folds),
+            "shape": list(shape),
+            "spacing": list(spacing),
+            "estimate": asdict(estimate) if estimate else None,
+            "predicted_s": estimate.total_s if estimate else None,
+            "actual_s": actual_s,
+        }
+        self.historyFile.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.historyFile, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _readCalibrations(self):
+        try:
+            with open(self.calibrationFile, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+
+class RuntimeTracker:
+    """
+    Tracks the remaining time of a running segmentation.
+    The initial estimate is refined with the worker progress messages : the preprocessed volume shape gives the exact
+    number of tiles and each finished fold gives the measured time per fold.
+    """
+
+    def __init__(self, estimator, parameter, estimate, shape, spacing, startTime=None):
+        self.estimator = estimator
+        self.parameter = parameter
+        self.estimate = estimate
+        self.shape = shape
+        self.spacing = spacing
+        self.startTime = time.time() if startTime is None else startTime
+        self.predicted_s = estimate.total_s if estimate else None
+
+    @property
+    def elapsed_s(self):
+        return time.time() - self.startTime
+
+    @property
+    def remaining_s(self):
+        if self.predicted_s is None:
+            return None
+        return max(0.0, self.predicted_s - self.elapsed_s)
+
+    def onProgress(self, message):
+        """
+        Updates the predicted total time from a worker progress message.
+        """
+        if self.estimate is None:
+            return
+
+        match = PREDICTING_PATTERN.search(message)
+        if match:
+            shape = [int(size) for size in match.group(1).split(",") if size.strip()]
+            calibration = {"patch_size": self.estimate.patchSize, "seconds_per_tile": self.estimate.secondsPerTile}
+            refined = self.estimator.estimateResampled(self.parameter, calibration, shape)
+            self.predicted_s = self.elapsed_s + refined.inference_s + self._exportOverhead_s()
+
+        for match in FOLD_DONE_PATTERN.finditer(message):
+            fold_s, iFold, nFolds = float(match.group(1)), int(match.group(2)), int(match.group(3))
+            self.predicted_s = self.elapsed_s + (nFolds - iFold) * fold_s + self._exportOverhead_s()
+
+    def logRun(self):
+        """
+        Logs the elapsed time as the actual time of the run.
+        """
+        self.estimator.logRun(self.parameter, self.shape, self.spacing, self.estimate, self.elapsed_s)
+
+    def summary(self):
+        if self.predicted_s is None:
+            return f"Elapsed : {formatDuration(self.elapsed_s)}"
+        return (
+            f"Elapsed : {formatDuration(self.elapsed_s)} / estimated : {formatDuration(self.predicted_s)}"
+            f" (remaining : {formatDuration(self.remaining_s)})"
+        )
+
+    def _exportOverhead_s(self):
+        # Roughly half of the voxel dependent overhead is spent exporting the segmentation
+        return 0.5 * (self.estimate.overhead_s - self.estimator.startup_s)
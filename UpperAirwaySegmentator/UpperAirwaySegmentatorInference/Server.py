@@ -0,0 +1,529 @@
+"""
+HTTP inference service shared by several Slicer workstations.
+
+Usage :
+    PythonSlicer -m UpperAirwaySegmentatorInference.Server --model <ML folder> [--host 127.0.0.1] [--port 8765]
+        [--workers 1] [--max-batch-size 4]
+
+Protocol :
+    POST   /jobs                   Compressed NIfTI volume as body, inference parameter JSON in the
+                                   X-Inference-Parameter header. Returns {"id": <job id>}.
+    GET    /jobs/<id>              Job state.
+    GET    /jobs/<id>/events       Stream of JSON lines, {"progress": <message>} until {"state": <final state>}.
+    GET    /jobs/<id>/result       Segmentation of a finished job.
+    GET    /jobs/<id>/probabilities  Probability map of a finished job if it was requested.
+    DELETE /jobs/<id>              Cancels the job and removes its files.
+    GET    /health                 Server status.
+
+Jobs are queued and run by the inference worker. Queued jobs sharing the same parameters are segmented by a single
+worker process to load the model once per batch.
+"""
+import argparse
+import json
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from UpperAirwaySegmentatorInference.Parameter import InferenceParameter
+
+PARAMETER_HEADER = "X-Inference-Parameter"
+INPUT_SUFFIX = "_0000.nii.gz"
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINAL_STATES = (DONE, FAILED, CANCELLED)
+
+# Absolute file system paths in the worker output, replaced by their file name
+WORKER_PATH_PATTERN = re.compile(r"(?<![^\s'\"(])(?:[A-Za-z]:)?[\\/][^\s'\"]*[\\/]([^\s'\"\\/]*)")
+
+
+def _requestedValue(requested, name, default, types):
+    value = requested.get(name, default)
+    # bool is a subclass of int and is only accepted for boolean settings
+    if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+        raise ValueError(f"Invalid {name} {value!r}.")
+    return value
+
+
+def parameterFromRequest(requested, modelPath, device):
+    """
+    Builds the inference parameter of a job from the client request.
+    Only the settings which don't give access to the server files can be chosen by the clients.
+
+    :raises ValueError: for invalid settings
+    """
+    from .Precision import PRECISIONS
+
+    if not isinstance(requested, dict):
+        raise ValueError("Inference parameter must be a JSON object.")
+
+    folds = str(_requestedValue(requested, "folds", "0", (str, int)))
+    if not re.fullmatch(r"(all|[0-9]+)(,(all|[0-9]+))*", folds):
+        raise ValueError(f"Invalid folds {folds}.")
+
+    precision = _requestedValue(requested, "precision", "fp32", (str,))
+    if precision not in PRECISIONS:
+        raise ValueError(f"Invalid precision {precision}.")
+
+    checkPointName = _requestedValue(requested, "checkPointName", "checkpoint_final.pth", (str,))
+    if Path(checkPointName).name != checkPointName:
+        raise ValueError(f"Invalid checkpoint name {checkPointName}.")
+
+    stepSize = float(_requestedValue(requested, "stepSize", 0.5, (int, float)))
+    if stepSize != stepSize:
+        raise ValueError("Invalid stepSize nan.")
+
+    return InferenceParameter(
+        modelPath=modelPath,
+        device=device,
+        folds=folds,
+        stepSize=min(1.0, max(0.1, stepSize)),
+        disableTta=_requestedValue(requested, "disableTta", True, (bool,)),
+        adaptiveTta=_requestedValue(requested, "adaptiveTta", False, (bool,)),
+        checkPointName=checkPointName,
+        saveProbabilities=_requestedValue(requested, "saveProbabilities", False, (bool,)),
+        precision=precision,
+    )
+
+
+@dataclass(eq=False)
+class Job:
+    id: str
+    folder: Path
+    parameter: InferenceParameter
+    state: str = QUEUED
+    error: str = ""
+    messages: List[str] = field(default_factory=list)
+    finishedTime: Optional[float] = None
+    process: Optional[subprocess.Popen] = None
+    batchId: Optional[str] = None
+
+    @property
+    def inputPath(self):
+        return self.folder / f"{self.id}{INPUT_SUFFIX}"
+
+    @property
+    def outputFolder(self):
+        return self.folder / "output"
+
+    def resultPath(self):
+        return next(iter(sorted(self.outputFolder.glob(f"{self.id}.nii*"))), None)
+
+    def probabilitiesPath(self):
+        from .ProbabilityMap import PROBABILITY_MAP_SUFFIX
+        path = self.outputFolder / f"{self.id}{PROBABILITY_MAP_SUFFIX}"
+        return path if path.exists() else None
+
+    @property
+    def batchKey(self):
+        return tuple(self.parameter.toWorkerArgs())
+
+
+class InferenceServer:
+    """
+    Queues the inference jobs and runs them in batches on worker processes.
+    Each worker thread runs one batch at a time on its share of the CPUs.
+    """
+
+    def __init__(self, modelPath, workFolder=None, device="cpu", nWorkers=1, maxBatchSize=4, retention_s=3600.0,
+                 progressCallback=None):
+        from .WorkerPool import splitCpus
+
+        self.modelPath = Path(modelPath)
+        self.workFolder = Path(workFolder or tempfile.mkdtemp(prefix="UpperAirwaySegmentatorServer_"))
+        self.device = device
+        self.maxBatchSize = maxBatchSize
+        self.retention_s = retention_s
+        self.progressCallback = progressCallback or (lambda *_: None)
+        self.slots = splitCpus(nWorkers)
+        self._jobs = {}
+        self._queue = []
+        self._condition = threading.Condition()
+        self._isStopped = False
+        self._threads = []
+
+    def start(self):
+        self._isStopped = False
+        self._threads = [
+            threading.Thread(target=self._workerLoop, args=(slot,), daemon=True, name=f"InferenceWorker{iSlot}")
+            for iSlot, slot in enumerate(self.slots)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._isStopped = True
+            for job in self._jobs.values():
+                if job.process is not None:
+                    job.process.kill()
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def submit(self, inputStream, contentLength, requestedParameter):
+        """
+        Stores the uploaded volume and queues its job.
+
+        :returns: job
+        """
+        parameter = parameterFromRequest(requestedParameter, self.modelPath, self.device)
+        jobId = uuid.uuid4().hex
+        job = Job(jobId, self.workFolder / "jobs" / jobId, parameter)
+        job.folder.mkdir(parents=True)
+        try:
+            with open(job.inputPath, "wb") as f:
+                remaining = contentLength
+                while remaining > 0:
+                    chunk = inputStream.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        raise ValueError("Incomplete upload.")
+                    f.write(chunk)
+                    remaining -= len(chunk)
+        except (OSError, ValueError):
+            shutil.rmtree(job.folder, ignore_errors=True)
+            raise
+
+        with self._condition:
+            self._jobs[jobId] = job
+            self._queue.append(job)
+            self._addMessage(job, f"Queued ({len(self._queue) - 1} job(s) ahead).")
+        self.progressCallback(f"Job {jobId} queued.")
+        return job
+
+    def job(self, jobId):
+        with self._condition:
+            return self._jobs.get(jobId)
+
+    def status(self, job):
+        with self._condition:
+            position = self._queue.index(job) if job in self._queue else None
+            return {"id": job.id, "state": job.state, "error": job.error, "position": position}
+
+    def events(self, job, timeout_s=1.0):
+        """
+        Yields the job progress messages and the job final state once it is done.
+        """
+        offset = 0
+        while True:
+            with self._condition:
+                while offset >= len(job.messages) and job.state not in FINAL_STATES and not self._isStopped:
+                    self._condition.wait(timeout_s)
+                messages, offset = job.messages[offset:], len(job.messages)
+                state = job.state if job.state in FINAL_STATES or self._isStopped else None
+
+            for message in messages:
+                yield {"progress": message}
+            if state is not None:
+                yield {"state": state, "error": job.error}
+                return
+
+    def cancel(self, job):
+        """
+        Cancels the job and removes its files. The worker is killed if it only runs this job. Jobs of a running batch
+        keep their files until the batch worker exits as it may still read their input.
+        """
+        with self._condition:
+            if job in self._queue:
+                self._queue.remove(job)
+            isRunning = job.state == RUNNING
+            if job.state not in FINAL_STATES:
+                self._setState(job, CANCELLED)
+            isSharedBatch = any(
+                other.batchId == job.batchId and other.state == RUNNING
+                for other in self._jobs.values() if other is not job
+            )
+            process = job.process
+            self._jobs.pop(job.id, None)
+
+        if isRunning:
+            if process is not None and not isSharedBatch:
+                process.kill()
+            return
+        shutil.rmtree(job.folder, ignore_errors=True)
+
+    def _takeBatch(self):
+        """
+        Pops the oldest queued job and the queued jobs sharing its parameters.
+        """
+        first = self._queue[0]
+        batch = [job for job in self._queue if job.batchKey == first.batchKey][:self.maxBatchSize]
+        batchId = uuid.uuid4().hex
+        for job in batch:
+            self._queue.remove(job)
+            job.batchId = batchId
+            self._setState(job, RUNNING)
+        return batch
+
+    def _workerLoop(self, slot):
+        while True:
+            with self._condition:
+                while not self._queue and not self._isStopped:
+                    self._condition.wait(60.0)
+                    self._removeExpiredJobs()
+                if self._isStopped:
+                    return
+                # Also removed on each dequeue for expired jobs not to pile up while the queue is never empty
+                self._removeExpiredJobs()
+                batch = self._takeBatch()
+
+            self._runBatch(batch, slot)
+
+    def workerCommand(self, batch, outputFolder, slot):
+        from .WorkerPool import pythonExecutable
+
+        inputArgs = [arg for job in batch for arg in ("--input", job.inputPath.as_posix())]
+        return [
+            pythonExecutable(), "-m", "UpperAirwaySegmentatorInference.Worker",
+            *batch[0].parameter.toWorkerArgs(),
+            *slot.workerArgs(pinCpus=False),
+            *inputArgs,
+            "--output", Path(outputFolder).as_posix(),
+        ]
+
+    def _runBatch(self, batch, slot):
+        batchFolder = self.workFolder / "batches" / batch[0].batchId
+        batchFolder.mkdir(parents=True)
+        self.progressCallback(f"Running {len(batch)} job(s) : {', '.join(job.id for job in batch)}.")
+        try:
+            process = subprocess.Popen(
+                self.workerCommand(batch, batchFolder, slot),
+                env=slot.environment(),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True
+            )
+            with self._condition:
+                for job in batch:
+                    job.process = process
+                    self._addMessage(job, f"Running in a batch of {len(batch)} job(s).")
+                # Jobs cancelled before the worker started
+                if all(job.state == CANCELLED for job in batch):
+                    process.kill()
+
+            currentJob = None
+            for line in process.stdout:
+                currentJob, jobs, message = self._routeWorkerLine(batch, currentJob, line.rstrip())
+                with self._condition:
+                    for job in jobs:
+                        self._addMessage(job, message)
+            returnCode = process.wait()
+
+            with self._condition:
+                for job in batch:
+                    job.process = None
+                    if job.state in FINAL_STATES:
+                        continue
+                    self._collectOutputs(job, batchFolder)
+                    if job.resultPath() is not None:
+                        self._setState(job, DONE)
+                    else:
+                        job.error = f"Inference failed with exit code {returnCode}."
+                        self._setState(job, FAILED)
+        except OSError as e:
+            with self._condition:
+                for job in batch:
+                    job.error = str(e)
+                    self._setState(job, FAILED)
+        finally:
+            shutil.rmtree(batchFolder, ignore_errors=True)
+            # Files of the jobs cancelled while the batch was running are removed once the worker has exited
+            for job in batch:
+                if job.state == CANCELLED:
+                    shutil.rmtree(job.folder, ignore_errors=True)
+
+    @staticmethod
+    def _routeWorkerLine(batch, currentJob, line):
+        """
+        Routes a worker output line to the job whose input is being segmented. The worker segments its inputs one after
+        the other and logs the input path when starting each input. Lines logged before the first input are sent to
+        all the jobs of the batch. Job ids and file system paths are removed from the messages as job ids give access
+        to the job results.
+
+        :returns: current job, jobs receiving the line and the message
+        """
+        for job in batch:
+            if job.id in line:
+                currentJob = job
+        jobs = [currentJob] if currentJob is not None else batch
+
+        for job in batch:
+            line = line.replace(job.id, "input")
+        message = WORKER_PATH_PATTERN.sub(r"\1", line)
+        return currentJob, jobs, message
+
+    @staticmethod
+    def _collectOutputs(job, batchFolder):
+        job.outputFolder.mkdir(parents=True, exist_ok=True)
+        for path in batchFolder.glob(f"{job.id}*"):
+            shutil.move(path.as_posix(), job.outputFolder / path.name)
+
+    def _addMessage(self, job, message):
+        job.messages.append(message)
+        self._condition.notify_all()
+
+    def _setState(self, job, state):
+        job.state = state
+        if state in FINAL_STATES:
+            job.finishedTime = time.time()
+        self._condition.notify_all()
+
+    def _removeExpiredJobs(self):
+        """
+        Removes the finished jobs which were not deleted by their client after the retention time.
+        """
+        now = time.time()
+        for job in list(self._jobs.values()):
+            if job.finishedTime is not None and now - job.finishedTime > self.retention_s:
+                self._jobs.pop(job.id, None)
+                shutil.rmtree(job.folder, ignore_errors=True)
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    server_version = "UpperAirwaySegmentatorServer/1.0"
+
+    @property
+    def inference(self) -> InferenceServer:
+        return self.server.inferenceServer
+
+    def log_message(self, format, *args):
+        self.inference.progressCallback(f"{self.address_string()} - {format % args}")
+
+    def do_GET(self):
+        parts = self._pathParts()
+        if parts == ["health"]:
+            with self.inference._condition:
+                nQueued = len(self.inference._queue)
+            return self._sendJson({"status": "ok", "queued": nQueued})
+
+        job = self._job(parts)
+        if job is None:
+            return
+        if len(parts) == 2:
+            return self._sendJson(self.inference.status(job))
+        if parts[2] == "events":
+            return self._sendEvents(job)
+        if parts[2] == "result":
+            return self._sendFile(job.resultPath() if job.state == DONE else None)
+        if parts[2] == "probabilities":
+            return self._sendFile(job.probabilitiesPath() if job.state == DONE else None)
+        self.send_error(404)
+
+    def do_POST(self):
+        if self._pathParts() != ["jobs"]:
+            return self.send_error(404)
+
+        try:
+            requested = json.loads(self.headers.get(PARAMETER_HEADER) or "{}")
+            contentLength = int(self.headers.get("Content-Length", 0))
+            if contentLength <= 0:
+                raise ValueError("Missing volume.")
+            job = self.inference.submit(self.rfile, contentLength, requested)
+        except ValueError as e:
+            return self.send_error(400, str(e))
+        self._sendJson({"id": job.id}, code=201)
+
+    def do_DELETE(self):
+        job = self._job(self._pathParts())
+        if job is None:
+            return
+        self.inference.cancel(job)
+        self._sendJson({"id": job.id, "state": job.state})
+
+    def _pathParts(self):
+        return [part for part in urlparse(self.path).path.split("/") if part]
+
+    def _job(self, parts):
+        job = self.inference.job(parts[1]) if len(parts) >= 2 and parts[0] == "jobs" else None
+        if job is None:
+            self.send_error(404, "Unknown job.")
+        return job
+
+    def _sendJson(self, content, code=200):
+        body = json.dumps(content).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _sendEvents(self, job):
+        """
+        Streams the job events as JSON lines until the job is done. The connection is closed at the end of the stream.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            for event in self.inference.events(job):
+                self.wfile.write((json.dumps(event) + "\n").encode())
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+    def _sendFile(self, path):
+        if path is None:
+            return self.send_error(404, "Result is not available.")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(path.stat().st_size))
+        self.send_header("Content-Disposition", f'attachment; filename="{path.name}"')
+        self.end_headers()
+        with open(path, "rb") as f:
+            shutil.copyfileobj(f, self.wfile)
+
+
+def createHttpServer(inferenceServer, host="127.0.0.1", port=8765):
+    """
+    :returns: HTTP server serving the inference server. Port 0 picks a free port.
+    """
+    httpServer = ThreadingHTTPServer((host, port), InferenceRequestHandler)
+    httpServer.daemon_threads = True
+    httpServer.inferenceServer = inferenceServer
+    return httpServer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UpperAirwaySegmentator inference server.")
+    parser.add_argument("--model", required=True, help="Folder containing the nnU-Net model.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address the server listens on. 0.0.0.0 for all.")
+    parser.add_argument("--port", type=int, default=8765, help="Port the server listens on.")
+    parser.add_argument("--device", default="cpu", help="Torch device used for inference.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of batches run in parallel.")
+    parser.add_argument("--max-batch-size", type=int, default=4, help="Maximum number of jobs run by one worker.")
+    parser.add_argument("--work-folder", default="", help="Folder of the uploaded volumes and results.")
+    args = parser.parse_args(argv)
+
+    log = lambda msg: print(msg, flush=True)
+    inferenceServer = InferenceServer(
+        args.model, args.work_folder or None, args.device, args.workers, args.max_batch_size, progressCallback=log
+    )
+    httpServer = createHttpServer(inferenceServer, args.host, args.port)
+    inferenceServer.start()
+    log(f"Serving on http://{args.host}:{httpServer.server_address[1]}")
+    if args.host not in ["127.0.0.1", "localhost", "::1"]:
+        log("WARNING : the server has no authentication, any client reaching it can upload volumes and download the"
+            " segmentations. Only listen on a trusted network.")
+    try:
+        httpServer.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpServer.server_close()
+        inferenceServer.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
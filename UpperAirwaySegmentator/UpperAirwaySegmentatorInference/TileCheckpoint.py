@@ -0,0 +1,254 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+
+def arrayHash(array, chunkSize=64 * 1024 * 1024):
+    """
+    Hash of the array shape, dtype and content, read in chunks to avoid copying memory mapped arrays.
+    """
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha256(json.dumps([list(array.shape), str(array.dtype)]).encode())
+    flat = array.reshape(-1).view(np.uint8)
+    for start in range(0, flat.size, chunkSize):
+        digest.update(flat[start:start + chunkSize])
+    return digest.hexdigest()
+
+
+def parametersHash(parameters):
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def tileRegion(bounds):
+    """
+    :param bounds: (start, stop) of the tile along each spatial axis
+    :returns: index of the tile in the channels first logits
+    """
+    return (slice(None), *(slice(int(start), int(stop)) for start, stop in bounds))
+
+
+class TileAccumulator:
+    """
+    In memory accumulation of the sliding window tile predictions, used when the tiles aren't checkpointed. Same
+    interface as the TileCheckpoint.
+    """
+
+    def __init__(self, shape, nTiles):
+        self.shape = tuple(int(size) for size in shape)
+        self.nTiles = nTiles
+        self.completed = set()
+        self.logits = np.zeros(self.shape, dtype=np.float32)
+
+    def accumulate(self, tile, bounds, prediction):
+        self.logits[tileRegion(bounds)] += prediction
+        self.completed.add(tile)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.logits = None
+
+
+class TileCheckpoint:
+    """
+    Partial sliding window prediction of one model fold, kept on disk to resume interrupted inferences.
+
+    The gaussian weighted tile predictions are accumulated in a memory mapped float32 logits file. The completed tiles
+    are recorded in a state file rewritten atomically at each commit. Before a tile is accumulated, the logits it
+    overwrites are appended to an undo log which restores the last committed logits if the process stops between two
+    commits. Tiles accumulated after the last commit are predicted again when resuming.
+    """
+
+    logitsFileName = "logits.npy"
+    stateFileName = "state.json"
+    undoPrefix = "undo_"
+
+    def __init__(self, folder, shape, nTiles):
+        """
+        :param shape: accumulated logits shape, channels first
+        :param nTiles: number of sliding window tiles
+        """
+        self.folder = Path(folder)
+        self.shape = tuple(int(size) for size in shape)
+        self.nTiles = nTiles
+        self.generation = 0
+        self.completed = set()
+        self._undoFile = None
+        self._open()
+
+    @property
+    def logitsPath(self):
+        return self.folder / self.logitsFileName
+
+    @property
+    def statePath(self):
+        return self.folder / self.stateFileName
+
+    @property
+    def isComplete(self):
+        return len(self.completed) == self.nTiles
+
+    def undoPath(self, generation):
+        return self.folder / f"{self.undoPrefix}{generation}.log"
+
+    def _open(self):
+        state = self._readState()
+        if state is None or tuple(state["shape"]) != self.shape or state["nTiles"] != self.nTiles:
+            self._reset()
+            return
+
+        self.generation = state["generation"]
+        self.completed = set(state["completed"])
+        self.logits = np.lib.format.open_memmap(self.logitsPath, mode="r+")
+        self._rollback()
+
+    def _readState(self):
+        try:
+            with open(self.statePath, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _reset(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+        self.folder.mkdir(parents=True)
+        self.logits = np.lib.format.open_memmap(self.logitsPath, mode="w+", dtype=np.float32, shape=self.shape)
+        self.generation = 0
+        self.completed = set()
+        self._writeState()
+
+    def _rollback(self):
+        """
+        Restores the logits overwritten after the last commit from the undo logs, in reverse order.
+        Undo logs of committed generations are stale and only removed.
+        """
+        for path in sorted(self.folder.glob(f"{self.undoPrefix}*.log")):
+            if int(path.stem[len(self.undoPrefix):]) > self.generation:
+                for bounds, values in reversed(self._readUndoLog(path)):
+                    self.logits[tileRegion(bounds)] = values
+                self.logits.flush()
+            path.unlink()
+
+    @staticmethod
+    def _readUndoLog(path):
+        entries = []
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    entries.append((np.load(f), np.load(f)))
+                except (ValueError, EOFError, OSError):
+                    # End of the log or last entry partially written, its tile was not accumulated yet
+                    return entries
+
+    def accumulate(self, tile, bounds, prediction):
+        """
+        Adds the weighted prediction of the tile to the logits.
+
+        :param bounds: (start, stop) of the tile along each spatial axis
+        """
+        bounds = np.asarray(bounds, dtype=np.int64)
+        region = tileRegion(bounds)
+        if self._undoFile is None:
+            self._undoFile = open(self.undoPath(self.generation + 1), "wb")
+        np.save(self._undoFile, bounds)
+        np.save(self._undoFile, np.asarray(self.logits[region]))
+        self._undoFile.flush()
+
+        self.logits[region] += prediction
+        self.completed.add(tile)
+
+    def commit(self):
+        """
+        Flushes the logits and records the tiles accumulated so far.
+        """
+        if self._undoFile is None:
+            return
+
+        self.logits.flush()
+        self.generation += 1
+        self._writeState()
+        self._undoFile.close()
+        self._undoFile = None
+        self.undoPath(self.generation).unlink(missing_ok=True)
+
+    def _writeState(self):
+        tmpPath = self.statePath.with_name(f"{self.stateFileName}.{os.getpid()}.tmp")
+        with open(tmpPath, "w") as f:
+            json.dump({
+                "shape": list(self.shape),
+                "nTiles": self.nTiles,
+                "generation": self.generation,
+                "completed": sorted(self.completed),
+            }, f)
+        os.replace(tmpPath, self.statePath)
+
+    def close(self):
+        if self._undoFile is not None:
+            self._undoFile.close()
+            self._undoFile = None
+        self.logits = None
+
+
+class TileCheckpointStore:
+    """
+    Folder of the tile checkpoints of interrupted inferences. Entries are named after the preprocessed volume hash and
+    the hash of the inference parameters, removed once the volume segmentation is exported, and evicted least recently
+    used first when the store exceeds its maximum size.
+    """
+
+    def __init__(self, folder, maxSize_GB=20.0):
+        self.folder = Path(folder)
+        self.maxSize_bytes = int(maxSize_GB * 1024 ** 3)
+
+    @staticmethod
+    def entryKey(volumeHash, parameters):
+        return f"{volumeHash[:32]}_{parametersHash(parameters)[:16]}"
+
+    def open(self, volumeHash, parameters, shape, nTiles):
+        """
+        :returns: TileCheckpoint resuming the previous progress of the volume and parameters if any
+        """
+        key = self.entryKey(volumeHash, parameters)
+        self.evict(keep=volumeHash[:32])
+        checkpoint = TileCheckpoint(self.folder / key, shape, nTiles)
+        # Modification time is used for the LRU eviction
+        os.utime(checkpoint.folder)
+        return checkpoint
+
+    def entries(self):
+        if not self.folder.exists():
+            return []
+        return [path for path in self.folder.iterdir() if path.is_dir()]
+
+    @staticmethod
+    def entrySize(entryFolder):
+        return sum(path.stat().st_size for path in entryFolder.iterdir() if path.is_file())
+
+    def remove(self, volumeHash):
+        """
+        Removes the checkpoints of the volume, for all parameters.
+        """
+        for entry in self.entries():
+            if entry.name.startswith(volumeHash[:32]):
+                shutil.rmtree(entry, ignore_errors=True)
+
+    def evict(self, keep=""):
+        """
+        Removes the least recently used entries, except the ones starting with keep, until the store fits its maximum
+        size.
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry.stat().st_mtime)
+        totalSize = sum(self.entrySize(entry) for entry in entries)
+        for entry in entries:
+            if totalSize <= self.maxSize_bytes:
+                break
+            if keep and entry.name.startswith(keep):
+                continue
+            totalSize -= self.entrySize(entry)
+            shutil.rmtree(entry, ignore_errors=True)
+
@@ -0,0 +1,215 @@
+"""
+Standalone inference worker process.
+
+Usage :
+    PythonSlicer -m UpperAirwaySegmentatorInference.Worker --model <ML folder> --input <volume.nii.gz> --output <folder>
+
+Progress is reported on the standard output, one message per line. The worker doesn't depend on Slicer or Qt and can
+run on machines without Slicer as long as torch and nnunetv2 are installed.
+"""
+import argparse
+import json
+import os
+import sys
+
+# Environment variables read by the OpenMP, MKL and BLAS runtimes when torch is first imported, and by nnU-Net which
+# otherwise caps the number of torch threads to 8 during inference
+THREAD_ENVIRONMENT_VARIABLES = [
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "nnUNet_def_n_proc",
+]
+
+BENCHMARK_PREFIX = "BENCHMARK "
+
+
+def log(msg):
+    print(msg, flush=True)
+
+
+def parseBenchmark(outputLines):
+    """
+    :returns: benchmark dict reported in the worker output lines or None if the output contains no benchmark
+    """
+    for line in reversed(list(outputLines)):
+        if line.startswith(BENCHMARK_PREFIX):
+            return json.loads(line[len(BENCHMARK_PREFIX):])
+    return None
+
+
+def parseCpuList(cpus):
+    """
+    Converts a CPU list string such as "0-3,8,9" to a list of CPU indices.
+    """
+    cpuList = []
+    for part in filter(None, (cpus or "").split(",")):
+        if "-" in part:
+            first, last = part.split("-")
+            cpuList.extend(range(int(first), int(last) + 1))
+        else:
+            cpuList.append(int(part))
+    return cpuList
+
+
+def formatCpuList(cpus):
+    return ",".join(str(cpu) for cpu in cpus)
+
+
+def applyThreadSettings(intraOpThreads=None, interOpThreads=None, cpus=None):
+    """
+    Pin the process to the input CPUs and configure the torch / BLAS thread pools.
+    Must be called before torch is imported for the BLAS environment variables to be taken into account.
+    """
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    if intraOpThreads:
+        for variable in THREAD_ENVIRONMENT_VARIABLES:
+            os.environ[variable] = str(intraOpThreads)
+
+    import torch
+    if intraOpThreads:
+        torch.set_num_threads(intraOpThreads)
+    if interOpThreads:
+        torch.set_num_interop_threads(interOpThreads)
+    log(f"Using {torch.get_num_threads()} intra-op thread(s) and {torch.get_num_interop_threads()} inter-op"
+        f" thread(s)" + (f" pinned to CPUs {formatCpuList(cpus)}." if cpus else "."))
+
+
+def writePartialSum(predictor, preprocessedFile, partialSumFile):
+    import numpy as np
+    import torch
+
+    data = torch.from_numpy(np.load(preprocessedFile, mmap_mode="c"))
+    logitSum, nFolds = predictor.predictLogitSum(data)
+    # Partial sums are always part of a multi-fold ensemble
+    np.save(partialSumFile, logitSum.half().numpy())
+    log(f"Saved logit sum of {nFolds} fold(s).")
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description="UpperAirwaySegmentator inference worker.")
+    parser.add_argument("--model", required=True, help="Folder containing the nnU-Net model.")
+    parser.add_argument("--input", action="append", default=[], help="Input volume. Can be repeated.")
+    parser.add_argument("--output", help="Output folder of the segmentations.")
+    parser.add_argument("--folds", default="0", help="Comma separated model folds.")
+    parser.add_argument("--device", default="cpu", help="Torch device used for inference.")
+    parser.add_argument("--step-size", type=float, default=0.5, help="Sliding window step size.")
+    parser.add_argument("--disable-tta", action="store_true", help="Disable mirroring test time augmentation.")
+    parser.add_argument("--adaptive-tta", action="store_true",
+                        help="Predict the tiles without mirroring first and only mirror the uncertain tiles.")
+    parser.add_argument("--tta-margin", type=float, default=0.5,
+                        help="Adaptive TTA : voxels whose softmax margin between the two most probable labels is below"
+                             " this margin are uncertain.")
+    parser.add_argument("--tta-uncertain-fraction", type=float, default=0.001,
+                        help="Adaptive TTA : tiles with a larger fraction of uncertain voxels are mirrored.")
+    parser.add_argument("--checkpoint", default="checkpoint_final.pth", help="Model checkpoint file name.")
+    parser.add_argument("--model-cache", default="",
+                        help="Folder of the files derived from the model, such as the memory mapped weights. Defaults"
+                             " to the user cache folder.")
+    parser.add_argument("--preprocessing-cache", default="", help="Folder of the preprocessing cache.")
+    parser.add_argument("--preprocessing-cache-size", type=float, default=20.0,
+                        help="Maximum size of the preprocessing cache in GB.")
+    parser.add_argument("--save-probabilities", action="store_true",
+                        help="Save the airway probability map next to each segmentation as a uint8 .npy file.")
+    parser.add_argument("--precision", default="fp32", choices=["fp32", "bf16", "fp16", "auto"],
+                        help="CPU inference precision. Reduced precisions fall back to fp32 when the CPU doesn't"
+                             " support them natively.")
+    parser.add_argument("--minimum-precision-dice", type=float, default=0.98,
+                        help="Minimum Dice of reduced precision segmentations against fp32, checked on the first"
+                             " input and cached per host. 0 to disable the check.")
+    parser.add_argument("--low-memory", action="store_true",
+                        help="Export the segmentation from the airway logit margin, reducing the export peak memory.")
+    parser.add_argument("--tile-checkpoints", default="",
+                        help="Folder of the sliding window checkpoints. Interrupted inferences of the same volume"
+                             " resume from their last checkpoint.")
+    parser.add_argument("--tile-checkpoints-size", type=float, default=20.0,
+                        help="Maximum size of the sliding window checkpoints folder in GB.")
+    parser.add_argument("--tile-checkpoint-interval", type=float, default=30.0,
+                        help="Seconds between two sliding window checkpoints.")
+    parser.add_argument("--cancel-file", default="",
+                        help="The worker stops between two sliding window tiles once this file exists.")
+    parser.add_argument("--fold-processes", type=int, default=1,
+                        help="Number of processes the folds are split across. Peak memory grows with each process.")
+    parser.add_argument("--preprocessed", default="", help="Preprocessed .npy array used instead of the inputs.")
+    parser.add_argument("--partial-sum", default="",
+                        help="Output .npy file of the folds logit sum computed from the --preprocessed array.")
+    parser.add_argument("--intra-op-threads", type=int, default=0, help="Torch / BLAS threads. 0 for default.")
+    parser.add_argument("--inter-op-threads", type=int, default=0, help="Torch inter-op threads. 0 for default.")
+    parser.add_argument("--cpus", default="", help="CPUs the worker is pinned to. For instance 0-3,8.")
+    parser.add_argument("--benchmark", type=float, default=0.0,
+                        help="Run forward passes for this number of seconds and report the timings instead of"
+                             " segmenting the inputs.")
+    args = parser.parse_args(argv)
+    if bool(args.preprocessed) != bool(args.partial_sum):
+        parser.error("--preprocessed and --partial-sum must be used together.")
+    if not args.benchmark and not args.partial_sum and (not args.input or not args.output):
+        parser.error("--input and --output are required unless running a benchmark or a partial sum.")
+    return args
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    applyThreadSettings(args.intra_op_threads, args.inter_op_threads, parseCpuList(args.cpus))
+
+    from UpperAirwaySegmentatorInference.Cancellation import CANCELLED_EXIT_CODE, CancelFile, InferenceCancelled
+    from UpperAirwaySegmentatorInference.MemoryPlanner import PeakMemorySampler
+    from UpperAirwaySegmentatorInference.Predictor import AirwayPredictor
+    from UpperAirwaySegmentatorInference.PreprocessingCache import PreprocessingCache
+    from UpperAirwaySegmentatorInference.TileCheckpoint import TileCheckpointStore
+
+    preprocessingCache = None
+    if args.preprocessing_cache:
+        preprocessingCache = PreprocessingCache(args.preprocessing_cache, args.preprocessing_cache_size)
+
+    tileCheckpointStore = None
+    if args.tile_checkpoints:
+        tileCheckpointStore = TileCheckpointStore(args.tile_checkpoints, args.tile_checkpoints_size)
+
+    predictor = AirwayPredictor(
+        args.model,
+        folds=args.folds,
+        device=args.device,
+        stepSize=args.step_size,
+        disableTta=args.disable_tta,
+        checkpointName=args.checkpoint,
+        preprocessingCache=preprocessingCache,
+        foldProcesses=args.fold_processes,
+        saveProbabilities=args.save_probabilities,
+        precision=args.precision,
+        minimumPrecisionDice=args.minimum_precision_dice,
+        lowMemory=args.low_memory,
+        tileCheckpointStore=tileCheckpointStore,
+        tileCheckpointInterval_s=args.tile_checkpoint_interval,
+        cancelFile=CancelFile(args.cancel_file) if args.cancel_file else None,
+        adaptiveTta=args.adaptive_tta,
+        ttaMargin=args.tta_margin,
+        ttaUncertainFraction=args.tta_uncertain_fraction,
+        modelCacheFolder=args.model_cache,
+        progressCallback=log
+    )
+
+    try:
+        if args.benchmark:
+            log(BENCHMARK_PREFIX + json.dumps(predictor.benchmark(args.benchmark)))
+            return 0
+
+        if args.partial_sum:
+            writePartialSum(predictor, args.preprocessed, args.partial_sum)
+            return 0
+
+        # Fold processes are sampled as children of this worker. The peak is reported while running and on failures.
+        with PeakMemorySampler(log):
+            for inputFile in args.input:
+                predictor.predictFile(inputFile, args.output)
+    except InferenceCancelled:
+        log("Inference cancelled.")
+        return CANCELLED_EXIT_CODE
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
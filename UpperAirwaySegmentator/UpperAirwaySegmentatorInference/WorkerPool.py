@@ -0,0 +1,341 @@
+"""
+Core aware pool of inference worker processes for CPU batch inference.
+
+Usage :
+    PythonSlicer -m UpperAirwaySegmentatorInference.WorkerPool --model <ML folder> --input-folder <folder>
+        --output-folder <folder> [--workers auto]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from queue import Empty, Queue
+from typing import List
+
+from UpperAirwaySegmentatorInference.Worker import THREAD_ENVIRONMENT_VARIABLES, formatCpuList, parseBenchmark
+
+
+def availableCpus():
+    """
+    CPUs the current process is allowed to run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def pythonExecutable():
+    """
+    Slicer's Python launcher when available, the current interpreter otherwise.
+    """
+    return shutil.which("PythonSlicer") or sys.executable
+
+
+@dataclass
+class WorkerSlot:
+    """
+    Set of CPUs and thread counts assigned to one worker process.
+    """
+    cpus: List[int]
+    interOpThreads: int = 1
+
+    @property
+    def intraOpThreads(self):
+        return len(self.cpus)
+
+    def environment(self, baseEnvironment=None):
+        environment = dict(baseEnvironment if baseEnvironment is not None else os.environ)
+        for variable in THREAD_ENVIRONMENT_VARIABLES:
+            environment[variable] = str(self.intraOpThreads)
+
+        packageFolder = Path(__file__).parent.parent.as_posix()
+        environment["PYTHONPATH"] = os.pathsep.join(filter(None, [packageFolder, environment.get("PYTHONPATH")]))
+        return environment
+
+    def workerArgs(self, pinCpus=True):
+        args = ["--intra-op-threads", str(self.intraOpThreads), "--inter-op-threads", str(self.interOpThreads)]
+        if pinCpus:
+            args += ["--cpus", formatCpuList(self.cpus)]
+        return args
+
+
+def splitCpus(nWorkers, cpus=None):
+    """
+    Split the CPUs in nWorkers contiguous groups of (almost) equal size.
+    Contiguous groups keep the workers threads on neighbouring cores which usually share caches.
+    """
+    cpus = list(cpus or availableCpus())
+    nWorkers = max(1, min(nWorkers, len(cpus)))
+    groupSize, remainder = divmod(len(cpus), nWorkers)
+
+    slots = []
+    start = 0
+    for iWorker in range(nWorkers):
+        end = start + groupSize + (1 if iWorker < remainder else 0)
+        slots.append(WorkerSlot(cpus=cpus[start:end]))
+        start = end
+    return slots
+
+
+def candidateWorkerCounts(nCpus):
+    """
+    Powers of two up to the number of CPUs, keeping at least two CPUs per worker.
+    """
+    candidates = []
+    nWorkers = 1
+    while nWorkers * 2 <= nCpus or nWorkers == 1:
+        candidates.append(nWorkers)
+        nWorkers *= 2
+    return candidates
+
+
+@dataclass
+class BatchReport:
+    nWorkers: int
+    wallTime_s: float = 0.0
+    caseDurations_s: dict = field(default_factory=dict)
+    failedCases: list = field(default_factory=list)
+
+    @property
+    def nCases(self):
+        return len(self.caseDurations_s)
+
+    @property
+    def casesPerHour(self):
+        if not self.nCases or self.wallTime_s <= 0:
+            return 0.0
+        return self.nCases * 3600.0 / self.wallTime_s
+
+    def summary(self):
+        return (
+            f"{self.nCases} case(s) done, {len(self.failedCases)} failed in {self.wallTime_s:.0f} s with "
+            f"{self.nWorkers} worker(s) : {self.casesPerHour:.1f} cases/h"
+        )
+
+
+class CpuWorkerPool:
+    """
+    Runs cases in parallel worker processes, each restricted to its share of the CPU cores.
+
+    Each nnU-Net run scales poorly past a handful of threads. Running several cases in parallel gives a better
+    throughput on many core machines as long as the workers don't compete for the same cores. The number of workers
+    can be chosen automatically by a short calibration run measuring the throughput of each candidate worker count.
+    """
+
+    def __init__(self, modelPath, nWorkers=None, pinCpus=True, cpus=None, workerArgs=None, progressCallback=None,
+                 calibrationFile=None, modelCacheFolder=None):
+        """
+        :param calibrationFile: worker count calibration file. Defaults to a file of the model cache folder.
+        :param modelCacheFolder: folder of the files derived from the model, forwarded to the workers. Defaults to the
+            user cache folder.
+        """
+        from .Checkpoint import userCacheFolder
+
+        self.modelPath = Path(modelPath)
+        self.cpus = list(cpus or availableCpus())
+        self.pinCpus = pinCpus and hasattr(os, "sched_setaffinity")
+        self.workerArgs = list(workerArgs or [])
+        self.progressCallback = progressCallback or print
+        self.modelCacheFolder = Path(modelCacheFolder) if modelCacheFolder else userCacheFolder()
+        self.calibrationFile = (
+            Path(calibrationFile) if calibrationFile else self.modelCacheFolder / "worker_calibration.json"
+        )
+        self.nWorkers = nWorkers
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def workerCommand(self, slot, extraArgs):
+        return [
+            pythonExecutable(), "-m", "UpperAirwaySegmentatorInference.Worker",
+            "--model", self.modelPath.as_posix(),
+            "--model-cache", self.modelCacheFolder.as_posix(),
+            *slot.workerArgs(self.pinCpus),
+            *self.workerArgs,
+            *extraArgs
+        ]
+
+    def run(self, cases):
+        """
+        Segments the cases in parallel.
+
+        :param cases: list of (input file, output folder)
+        :returns: BatchReport
+        """
+        nWorkers = self.nWorkers or self.calibrate()
+        slots = splitCpus(nWorkers, self.cpus)
+        report = BatchReport(nWorkers=len(slots))
+        caseQueue = Queue()
+        for case in cases:
+            caseQueue.put(case)
+
+        self.progressCallback(
+            f"Running {len(cases)} case(s) on {len(slots)} worker(s) with "
+            f"{', '.join(str(slot.intraOpThreads) for slot in slots)} thread(s)."
+        )
+
+        def workerLoop(iWorker, slot):
+            while True:
+                try:
+                    inputFile, outputFolder = caseQueue.get_nowait()
+                except Empty:
+                    return
+
+                start = time.time()
+                args = ["--input", Path(inputFile).as_posix(), "--output", Path(outputFolder).as_posix()]
+                returnCode, _ = self._runWorker(iWorker, slot, args)
+                with self._lock:
+                    if returnCode == 0:
+                        report.caseDurations_s[Path(inputFile).as_posix()] = time.time() - start
+                    else:
+                        report.failedCases.append(Path(inputFile).as_posix())
+                    self.progressCallback(f"{len(report.caseDurations_s) + len(report.failedCases)} / {len(cases)}"
+                                          f" case(s) processed.")
+
+        start = time.time()
+        self._runThreads(workerLoop, slots)
+        report.wallTime_s = time.time() - start
+        self.progressCallback(report.summary())
+        return report
+
+    def calibrate(self, candidates=None, duration_s=20.0, forceCalibration=False):
+        """
+        Measure the tile throughput of each candidate worker count by running all the workers simultaneously on
+        random patches. The best count is cached per host, CPU set and model.
+
+        :returns: number of workers with the best throughput
+        """
+        key = self._calibrationKey()
+        cached = self._readCalibration()
+        if not forceCalibration and key in cached:
+            return cached[key]["nWorkers"]
+
+        throughputs = {}
+        for nWorkers in candidates or candidateWorkerCounts(len(self.cpus)):
+            slots = splitCpus(nWorkers, self.cpus)
+            results = [None] * len(slots)
+
+            def benchmarkLoop(iWorker, slot):
+                _, output = self._runWorker(iWorker, slot, ["--benchmark", str(duration_s)])
+                results[iWorker] = parseBenchmark(output)
+
+            self._runThreads(benchmarkLoop, slots)
+            if any(result is None for result in results):
+                self.progressCallback(f"Calibration with {nWorkers} worker(s) failed.")
+                continue
+
+            throughputs[nWorkers] = sum(1.0 / result["seconds_per_tile"] for result in results)
+            self.progressCallback(f"Calibration with {nWorkers} worker(s) : {throughputs[nWorkers]:.2f} tiles/s.")
+
+        if not throughputs:
+            return 1
+
+        # Prefer fewer workers when the gain is marginal as each worker holds a full case in memory
+        bestThroughput = max(throughputs.values())
+        nWorkers = min(n for n, throughput in throughputs.items() if throughput >= 0.95 * bestThroughput)
+        cached[key] = {"nWorkers": nWorkers, "tilesPerSecond": {str(n): t for n, t in throughputs.items()}}
+        self._writeCalibration(cached)
+        self.progressCallback(f"Selected {nWorkers} worker(s).")
+        return nWorkers
+
+    def stop(self):
+        with self._lock:
+            for process in self._processes:
+                process.kill()
+
+    def _calibrationKey(self):
+        # The cache folder is shared by the models
+        modelPath = self.modelPath.resolve().as_posix()
+        return f"{platform.node()}|{modelPath}|{formatCpuList(self.cpus)}|{' '.join(self.workerArgs)}"
+
+    def _readCalibration(self):
+        try:
+            with open(self.calibrationFile, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _writeCalibration(self, calibration):
+        try:
+            self.calibrationFile.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.calibrationFile, "w") as f:
+                json.dump(calibration, f, indent=2)
+        except OSError as e:
+            self.progressCallback(f"Failed to save the worker calibration to {self.calibrationFile} : {e}")
+
+    @staticmethod
+    def _runThreads(target, slots):
+        threads = [threading.Thread(target=target, args=(iWorker, slot)) for iWorker, slot in enumerate(slots)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _runWorker(self, iWorker, slot, args):
+        """
+        Runs one worker process and forwards its output to the progress callback.
+
+        :returns: process return code and list of output lines
+        """
+        process = subprocess.Popen(
+            self.workerCommand(slot, args),
+            env=slot.environment(),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True
+        )
+        with self._lock:
+            self._processes.add(process)
+
+        output = []
+        for line in process.stdout:
+            line = line.rstrip()
+            output.append(line)
+            self.progressCallback(f"[worker {iWorker}] {line}")
+        process.wait()
+
+        with self._lock:
+            self._processes.discard(process)
+        return process.returncode, output
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UpperAirwaySegmentator CPU batch inference.")
+    parser.add_argument("--model", required=True, help="Folder containing the nnU-Net model.")
+    parser.add_argument("--input-folder", required=True, help="Folder containing the input NIfTI volumes.")
+    parser.add_argument("--output-folder", required=True, help="Output folder of the segmentations.")
+    parser.add_argument("--workers", default="auto", help="Number of workers or 'auto' to calibrate.")
+    parser.add_argument("--no-pin", action="store_true", help="Don't pin the workers to their CPUs.")
+    parser.add_argument("--recalibrate", action="store_true", help="Ignore the cached calibration.")
+    parser.add_argument("--model-cache", default="",
+                        help="Folder of the files derived from the model, such as the worker calibration and the"
+                             " memory mapped weights. Defaults to the user cache folder.")
+    parser.add_argument("--skip-invalid-inputs", choices=["off", "errors", "warnings"], default="off",
+                        help="Skip the inputs failing the pre-flight check with errors, or with errors and warnings.")
+    args, workerArgs = parser.parse_known_args(argv)
+
+    inputFiles = sorted(
+        path for path in Path(args.input_folder).iterdir() if path.name.endswith((".nii", ".nii.gz"))
+    )
+    if args.skip_invalid_inputs != "off":
+        from UpperAirwaySegmentatorInference.Preflight import acceptedInputs
+        inputFiles = acceptedInputs(inputFiles, strict=args.skip_invalid_inputs == "warnings")
+
+    pool = CpuWorkerPool(args.model, pinCpus=not args.no_pin, workerArgs=workerArgs, modelCacheFolder=args.model_cache)
+    if args.workers == "auto":
+        pool.nWorkers = pool.calibrate(forceCalibration=args.recalibrate)
+    else:
+        pool.nWorkers = int(args.workers)
+
+    report = pool.run([(inputFile, args.output_folder) for inputFile in inputFiles])
+    return 1 if report.failedCases else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
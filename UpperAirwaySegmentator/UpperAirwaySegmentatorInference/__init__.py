@@ -0,0 +1 @@
+# Inference package running the nnU-Net model in worker processes. Must not depend on Slicer or Qt.
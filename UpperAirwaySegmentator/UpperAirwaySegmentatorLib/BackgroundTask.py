@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .Signal import QueuedSignal, Signal
+
+
+class BackgroundTask:
+    """
+    Runs a callable in a worker thread and reports its result on the Qt main thread.
+
+    PythonQt signals cannot be emitted from Python threads. Completion is reported by the worker thread through a
+    QueuedSignal, the finished / errorOccurred signals are hence always emitted on the main thread.
+    The callable must not access the MRML scene or any Qt widget.
+    """
+
+    _executor = None
+    _maxWorkers = 2
+
+    def __init__(self, function, *args, **kwargs):
+        self.finished = Signal("object")
+        self.errorOccurred = Signal("str")
+        self._function = function
+        self._args = args
+        self._kwargs = kwargs
+        self._future = None
+        self.isCancelled = False
+
+        # Results are always delivered from the event loop, even when the task is done before start returns
+        self._futureDone = QueuedSignal("object", isDirectOnMainThread=False)
+        self._futureDone.connect(self._deliver)
+
+    @classmethod
+    def executor(cls):
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(max_workers=cls._maxWorkers, thread_name_prefix="UpperAirwaySegmentator")
+        return cls._executor
+
+    def start(self):
+        self.isCancelled = False
+        self._future = self.executor().submit(self._function, *self._args, **self._kwargs)
+        self._future.add_done_callback(self._futureDone)
+        return self
+
+    def cancel(self):
+        """
+        Cancels the task. Tasks which are already running are not interrupted but their results are discarded.
+        """
+        self.isCancelled = True
+        if self._future is not None:
+            self._future.cancel()
+
+    def isRunning(self):
+        return self._future is not None and not self._future.done() and not self.isCancelled
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the task is done and delivers its result synchronously.
+        """
+        if self._future is None or self.isCancelled:
+            return
+        wait([self._future], timeout=timeout)
+        self._deliver(self._future)
+
+    def _deliver(self, future):
+        # The queued delivery of a task already delivered by wait is ignored
+        if future is not self._future or not future.done():
+            return
+
+        self._future = None
+        if self.isCancelled or future.cancelled():
+            return
+
+        error = future.exception()
+        if error is not None:
+            self.errorOccurred(str(error))
+        else:
+            self.finished(future.result())
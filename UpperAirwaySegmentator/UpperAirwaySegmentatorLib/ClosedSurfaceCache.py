@@ -0,0 +1,138 @@
+from collections import OrderedDict
+
+import slicer
+
+from .BackgroundTask import BackgroundTask
+from .Signal import Signal
+
+
+class ClosedSurfaceCache:
+    """
+    Builds segment closed surfaces in the background and caches them per labelmap content and smoothing factor.
+
+    Surfaces are computed on a copy of the segment labelmap in a worker thread. Once ready, they are attached to the
+    segment as its closed surface representation on the main thread, which avoids blocking the UI during conversion.
+    Coming back to a previously used smoothing factor reuses the cached surface without any conversion.
+    """
+
+    smoothingFactorParameter = "Smoothing factor"
+
+    def __init__(self, maxEntries=16):
+        self.surfaceApplied = Signal("str", "str")
+        self.errorOccurred = Signal("str")
+        self._maxEntries = maxEntries
+        self._surfaces = OrderedDict()
+        self._tasks = {}
+
+    @staticmethod
+    def closedSurfaceName():
+        return slicer.vtkSegmentationConverter.GetSegmentationClosedSurfaceRepresentationName()
+
+    @staticmethod
+    def cacheKey(segmentationNode, segmentId, smoothingFactor):
+        """
+        Key identifying a surface. The labelmap modification time changes whenever the segment is edited, which
+        invalidates surfaces computed from the previous content.
+        """
+        segmentation = segmentationNode.GetSegmentation()
+        segment = segmentation.GetSegment(segmentId)
+        if segment is None:
+            return None
+
+        labelmap = segment.GetRepresentation(segmentation.GetSourceRepresentationName())
+        if labelmap is None:
+            return None
+        return segmentationNode.GetID(), segmentId, labelmap.GetMTime(), f"{float(smoothingFactor):.2f}"
+
+    def __len__(self):
+        return len(self._surfaces)
+
+    def clear(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        self._surfaces.clear()
+
+    def isPending(self):
+        return any(task.isRunning() for task in self._tasks.values())
+
+    def waitForPending(self):
+        for task in list(self._tasks.values()):
+            task.wait()
+
+    def requestSurface(self, segmentationNode, segmentId, smoothingFactor):
+        """
+        Attach the closed surface matching the smoothing factor to the segment.
+        Cached surfaces are applied immediately, missing surfaces are computed in the background.
+        Previous requests for the same segment are discarded.
+        """
+        key = self.cacheKey(segmentationNode, segmentId, smoothingFactor)
+        if key is None:
+            return
+
+        self._cancelTask(segmentationNode, segmentId)
+        if key in self._surfaces:
+            self._surfaces.move_to_end(key)
+            self._applySurface(segmentationNode, segmentId, smoothingFactor, self._surfaces[key])
+            return
+
+        task = BackgroundTask(self._computeSurface, self._copySegment(segmentationNode, segmentId), segmentId,
+                              smoothingFactor)
+        task.finished.connect(lambda surface: self._onSurfaceComputed(segmentationNode, segmentId, smoothingFactor,
+                                                                      key, surface))
+        task.errorOccurred.connect(self.errorOccurred)
+        self._tasks[(segmentationNode.GetID(), segmentId)] = task
+        task.start()
+
+    def _cancelTask(self, segmentationNode, segmentId):
+        task = self._tasks.pop((segmentationNode.GetID(), segmentId), None)
+        if task is not None:
+            task.cancel()
+
+    @staticmethod
+    def _copySegment(segmentationNode, segmentId):
+        """
+        Deep copy the segment into a standalone segmentation sharing the conversion parameters of the source.
+        """
+        sourceSegmentation = segmentationNode.GetSegmentation()
+        segmentation = slicer.vtkSegmentation()
+        segmentation.SetSourceRepresentationName(sourceSegmentation.GetSourceRepresentationName())
+        segmentation.CopyConversionParameters(sourceSegmentation)
+
+        segment = slicer.vtkSegment()
+        segment.DeepCopy(sourceSegmentation.GetSegment(segmentId))
+        segment.RemoveRepresentation(ClosedSurfaceCache.closedSurfaceName())
+        segmentation.AddSegment(segment, segmentId)
+        return segmentation
+
+    @classmethod
+    def _computeSurface(cls, segmentation, segmentId, smoothingFactor):
+        segmentation.SetConversionParameter(cls.smoothingFactorParameter, str(smoothingFactor))
+        segmentation.CreateRepresentation(cls.closedSurfaceName(), True)
+        return segmentation.GetSegment(segmentId).GetRepresentation(cls.closedSurfaceName())
+
+    def _onSurfaceComputed(self, segmentationNode, segmentId, smoothingFactor, key, surface):
+        self._tasks.pop((segmentationNode.GetID(), segmentId), None)
+        if surface is None or segmentationNode.GetScene() is None:
+            return
+
+        # Skip the result if the segment was edited while the surface was being computed
+        if self.cacheKey(segmentationNode, segmentId, smoothingFactor) != key:
+            return
+
+        self._surfaces[key] = surface
+        while len(self._surfaces) > self._maxEntries:
+            self._surfaces.popitem(last=False)
+        self._applySurface(segmentationNode, segmentId, smoothingFactor, surface)
+
+    def _applySurface(self, segmentationNode, segmentId, smoothingFactor, surface):
+        segmentation = segmentationNode.GetSegmentation()
+        segment = segmentation.GetSegment(segmentId)
+        if segment is None:
+            return
+
+        wasModified = segmentationNode.StartModify()
+        segmentation.SetConversionParameter(self.smoothingFactorParameter, str(smoothingFactor))
+        segment.AddRepresentation(self.closedSurfaceName(), surface)
+        segmentationNode.EndModify(wasModified)
+        self.surfaceApplied(segmentationNode.GetID(), segmentId)
@@ -0,0 +1,113 @@
+from pathlib import Path
+
+import numpy as np
+import slicer
+import vtk
+
+from UpperAirwaySegmentatorInference.CompactLabelmap import COMPACT_LABELMAP_EXTENSION, CompactLabelmap
+
+
+def compactSegmentationName(path):
+    name = Path(path).name
+    return name[:-len(COMPACT_LABELMAP_EXTENSION)] if name.endswith(COMPACT_LABELMAP_EXTENSION) else Path(path).stem
+
+
+def _arrayToVtkMatrix(array):
+    matrix = vtk.vtkMatrix4x4()
+    for row in range(4):
+        for column in range(4):
+            matrix.SetElement(row, column, array[row][column])
+    return matrix
+
+
+def saveCompactSegmentation(segmentationNode, path, referenceVolumeNode=None, runLength=True):
+    """
+    Saves the segments of the segmentation node as a compact labelmap, cropped to the segments bounding box.
+    The labelmap geometry is the reference volume geometry or the segmentation reference geometry if None.
+    Each segment is stored with its own label value, overlapping voxels keep the label of the last segment.
+
+    :returns: saved CompactLabelmap
+    """
+    segmentation = segmentationNode.GetSegmentation()
+    segmentIds = vtk.vtkStringArray()
+    segments = []
+    for iSegment in range(segmentation.GetNumberOfSegments()):
+        segmentId = segmentation.GetNthSegmentID(iSegment)
+        segment = segmentation.GetSegment(segmentId)
+        segmentIds.InsertNextValue(segmentId)
+        segments.append({
+            "id": segmentId,
+            "name": segment.GetName(),
+            "color": list(segment.GetColor()),
+            "label": iSegment + 1,
+        })
+
+    labelmapNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
+    try:
+        slicer.modules.segmentations.logic().ExportSegmentsToLabelmapNode(
+            segmentationNode,
+            segmentIds,
+            labelmapNode,
+            referenceVolumeNode,
+            slicer.vtkSegmentation.EXTENT_REFERENCE_GEOMETRY
+        )
+        ijkToRas = vtk.vtkMatrix4x4()
+        labelmapNode.GetIJKToRASMatrix(ijkToRas)
+        array = slicer.util.arrayFromVolume(labelmapNode)
+        dtype = np.uint8 if len(segments) < 256 else np.uint16
+        labelmap = CompactLabelmap.fromArray(
+            array.astype(dtype, copy=False),
+            [[ijkToRas.GetElement(row, column) for column in range(4)] for row in range(4)],
+            segments,
+            runLength=runLength,
+        )
+    finally:
+        slicer.mrmlScene.RemoveNode(labelmapNode)
+
+    labelmap.save(path)
+    return labelmap
+
+
+def loadCompactSegmentation(path, name=None):
+    """
+    Loads a compact labelmap saved by saveCompactSegmentation in a new segmentation node.
+    The segmentation reference geometry is restored to the saved labelmap geometry.
+    """
+    labelmap = CompactLabelmap.load(path)
+    array = labelmap.toArray()
+
+    labelmapNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLabelMapVolumeNode")
+    segmentationNode = slicer.mrmlScene.AddNewNodeByClass(
+        "vtkMRMLSegmentationNode", name or compactSegmentationName(path)
+    )
+    try:
+        labelmapNode.SetIJKToRASMatrix(_arrayToVtkMatrix(labelmap.ijkToRas))
+        slicer.util.updateVolumeFromArray(labelmapNode, array)
+        segmentationNode.SetReferenceImageGeometryParameterFromVolumeNode(labelmapNode)
+        segmentationNode.CreateDefaultDisplayNodes()
+
+        segmentation = segmentationNode.GetSegmentation()
+        for segmentInfo in labelmap.segments:
+            segmentId = segmentation.AddEmptySegment(segmentInfo["id"], segmentInfo["name"], segmentInfo["color"])
+            slicer.util.updateSegmentBinaryLabelmapFromArray(
+                (array == segmentInfo["label"]).astype(np.uint8), segmentationNode, segmentId, labelmapNode
+            )
+    finally:
+        slicer.mrmlScene.RemoveNode(labelmapNode)
+    return segmentationNode
+
+
+def useCompactSceneStorage(segmentationNode):
+    """
+    Saves the segmentation node to .seg.nrrd cropped to the extent of its segments when the scene is saved.
+    The reference geometry is saved with the segmentation and the full extent is restored when loading.
+    """
+    storageNode = segmentationNode.GetStorageNode()
+    if storageNode is None:
+        segmentationNode.CreateDefaultStorageNode()
+        storageNode = segmentationNode.GetStorageNode()
+    if storageNode is None:
+        return
+
+    storageNode.SetCropToMinimumExtent(True)
+    storageNode.SetUseCompression(True)
@@ -0,0 +1,104 @@
+from dataclasses import dataclass
+from typing import Callable
+
+from .BackgroundTask import BackgroundTask
+from .Signal import Signal
+
+
+@dataclass
+class PipelineStage:
+    name: str
+    function: Callable
+    runInWorker: bool = False
+
+
+class Pipeline:
+    """
+    Sequence of stages where each stage receives the output of the previous one.
+
+    Worker stages run in a background thread and must not access the MRML scene or Qt widgets. Main thread stages are
+    used to marshal the results of the worker stages to the scene. Stages are run strictly in order and the pipeline
+    can be cancelled between stages. A cancelled worker stage still runs to completion but its result is discarded.
+    """
+
+    def __init__(self):
+        self.progressInfo = Signal("str")
+        self.finished = Signal("object")
+        self.errorOccurred = Signal("str")
+        self.cancelled = Signal()
+        self._stages = []
+        self._iStage = 0
+        self._task = None
+        self._isRunning = False
+        self.isCancelled = False
+
+    def addStage(self, name, function, runInWorker=False):
+        self._stages.append(PipelineStage(name, function, runInWorker))
+        return self
+
+    def isRunning(self):
+        return self._isRunning
+
+    def start(self, value=None):
+        self._iStage = 0
+        self._isRunning = True
+        self.isCancelled = False
+        self._runNextStage(value)
+        return self
+
+    def cancel(self):
+        if not self._isRunning:
+            return
+
+        self.isCancelled = True
+        self._isRunning = False
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.cancelled()
+
+    def wait(self):
+        """
+        Blocks until all the stages have been run. Worker stages results are delivered synchronously.
+        """
+        while self._isRunning and self._task is not None:
+            self._task.wait()
+
+    def _runNextStage(self, value):
+        if not self._isRunning:
+            return
+
+        if self._iStage >= len(self._stages):
+            self._isRunning = False
+            self.finished(value)
+            return
+
+        stage = self._stages[self._iStage]
+        self._iStage += 1
+        self.progressInfo(f"{stage.name}...")
+
+        if self.isCancelled:
+            return
+
+        if stage.runInWorker:
+            self._task = BackgroundTask(stage.function, value)
+            self._task.finished.connect(self._onWorkerStageFinished)
+            self._task.errorOccurred.connect(self._onError)
+            self._task.start()
+            return
+
+        try:
+            value = stage.function(value)
+        except Exception as e:  # noqa
+            self._onError(str(e))
+            return
+        self._runNextStage(value)
+
+    def _onWorkerStageFinished(self, value):
+        self._task = None
+        self._runNextStage(value)
+
+    def _onError(self, errorMsg):
+        self._task = None
+        self._isRunning = False
+        self.errorOccurred(errorMsg)
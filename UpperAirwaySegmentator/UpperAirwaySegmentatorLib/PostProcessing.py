@@ -0,0 +1,36 @@
+import numpy as np
+
+
+def minimumIslandSizeInVoxels(minimumIslandSize_mm3, spacing):
+    """
+    Converts an island volume in mm³ to a number of voxels for the input voxel spacing.
+    """
+    voxelSize_mm3 = float(np.prod(spacing))
+    return int(np.ceil(minimumIslandSize_mm3 / voxelSize_mm3))
+
+
+def removeSmallIslands(labelArray, minimumSize, label=1, fullyConnected=False):
+    """
+    Removes the connected components of the input label which are smaller than minimumSize voxels.
+    Matches the segment editor Islands effect "Remove small islands" operation but runs on numpy arrays and can hence
+    be used outside the main thread.
+
+    :param labelArray: numpy array of labels
+    :param minimumSize: Islands with less voxels than this size are removed
+    :param label: Value of the label to process
+    :param fullyConnected: If True, voxels sharing a corner are considered connected. Otherwise, only faces.
+    :returns: copy of the input array with the small islands set to 0
+    """
+    import SimpleITK as sitk
+
+    mask = labelArray == label
+    if not mask.any():
+        return labelArray.copy()
+
+    components = sitk.ConnectedComponent(sitk.GetImageFromArray(mask.astype(np.uint8)), fullyConnected)
+    keptComponents = sitk.RelabelComponent(components, minimumObjectSize=int(minimumSize))
+    removedVoxels = mask & (sitk.GetArrayViewFromImage(keptComponents) == 0)
+
+    result = labelArray.copy()
+    result[removedVoxels] = 0
+    return result
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from UpperAirwaySegmentatorInference.ProbabilityMap import probabilityLevel
+from .PostProcessing import removeSmallIslands
+
+
+class ProbabilityMap:
+    """
+    Airway probability map quantized to uint8 levels and memory mapped from disk.
+
+    Labelmaps are re-derived from the array for any threshold. Thresholding and island removal only run on the
+    bounding box of the voxels above the threshold, found from per axis maximum projections computed once. Results are
+    cached per level for the most recent thresholds.
+    """
+
+    def __init__(self, path, maxCachedLevels=8):
+        self.path = Path(path)
+        self.array = np.load(self.path, mmap_mode="r")
+        self.maxCachedLevels = maxCachedLevels
+        self._cache = OrderedDict()
+        self._projections = self._maxProjections(self.array)
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    @staticmethod
+    def _maxProjections(array):
+        """
+        Maximum level along each axis, computed slice by slice to read the memory mapped array only once.
+        """
+        projections = [np.zeros(size, dtype=np.uint8) for size in array.shape]
+        for iSlice in range(array.shape[0]):
+            arraySlice = np.asarray(array[iSlice])
+            projections[0][iSlice] = arraySlice.max()
+            np.maximum(projections[1], arraySlice.max(axis=1), out=projections[1])
+            np.maximum(projections[2], arraySlice.max(axis=0), out=projections[2])
+        return projections
+
+    def boundingBox(self, level):
+        """
+        :returns: tuple of slices containing all the voxels at or above level or None if there are no such voxels
+        """
+        bounds = []
+        for projection in self._projections:
+            indices = np.flatnonzero(projection >= level)
+            if not len(indices):
+                return None
+            bounds.append(slice(indices[0], indices[-1] + 1))
+        return tuple(bounds)
+
+    def labelmap(self, threshold, minimumIslandSize=0):
+        """
+        :returns: uint8 labelmap of the voxels with a probability above threshold, without the islands smaller than
+            minimumIslandSize voxels
+        """
+        level = probabilityLevel(threshold)
+        key = (level, minimumIslandSize)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+        else:
+            self._cache[key] = self._croppedLabelmap(level, minimumIslandSize)
+            while len(self._cache) > self.maxCachedLevels:
+                self._cache.popitem(last=False)
+
+        labelmap = np.zeros(self.shape, dtype=np.uint8)
+        boundingBox, croppedLabelmap = self._cache[key]
+        if boundingBox is not None:
+            labelmap[boundingBox] = croppedLabelmap
+        return labelmap
+
+    def _croppedLabelmap(self, level, minimumIslandSize):
+        boundingBox = self.boundingBox(level)
+        if boundingBox is None:
+            return None, None
+
+        croppedLabelmap = (self.array[boundingBox] >= level).astype(np.uint8)
+        if minimumIslandSize > 0:
+            croppedLabelmap = removeSmallIslands(croppedLabelmap, minimumIslandSize)
+        return boundingBox, croppedLabelmap
+
+    def remove(self):
+        """
+        Release the memory mapped array and delete its file.
+        """
+        self._cache.clear()
+        del self.array
+        self.path.unlink(missing_ok=True)
@@ -1,5 +1,7 @@
 import json
+import os
 import sys
+import tempfile
 import zipfile
 from pathlib import Path
 
@@ -13,11 +15,43 @@ class PythonDependencyChecker:
     Class responsible for installing the Modules dependencies
     """
 
-    def __init__(self, repoPath=None, destWeightFolder=None):
+    # Packages whose installed version invalidates the dependency verification record when changed
+    verifiedPackages = ["torch", "nnunetv2", "numpy", "SimpleITK", "acvl-utils", "dynamic-network-architectures"]
+
+    modelStoreSettingsKey = "UpperAirwaySegmentator/ModelStoreFolder"
+    modelStoreEnvironmentVariable = "UPPER_AIRWAY_SEGMENTATOR_MODEL_STORE"
+
+    def __init__(self, repoPath=None, destWeightFolder=None, verificationRecordPath=None, modelStoreFolder=None):
         from .SegmentationWidget import SegmentationWidget
         self.dependencyChecked = False
         self.destWeightFolder = Path(destWeightFolder or SegmentationWidget.nnUnetFolder())
         self.repo_path = repoPath or "alejandro-matos/SlicerUpperAirwaySegmentator"
+        self.verificationRecordPath = Path(
+            verificationRecordPath or
+            Path(slicer.app.cachePath).joinpath("UpperAirwaySegmentator", "dependency_verification.json")
+        )
+        self._modelStoreFolder = modelStoreFolder
+
+    @classmethod
+    def modelStoreFolder(cls):
+        """
+        Shared model store folder. Defaults to a per user folder shared by all the Slicer installs and can be set to a
+        folder shared by the workstation users with the environment variable or the module settings.
+        """
+        folder = os.environ.get(cls.modelStoreEnvironmentVariable) or qt.QSettings().value(cls.modelStoreSettingsKey)
+        if folder:
+            return Path(folder)
+
+        dataLocation = qt.QStandardPaths.writableLocation(qt.QStandardPaths.GenericDataLocation)
+        return Path(dataLocation).joinpath("UpperAirwaySegmentator", "ModelStore")
+
+    @classmethod
+    def setModelStoreFolder(cls, folder):
+        qt.QSettings().setValue(cls.modelStoreSettingsKey, Path(folder).as_posix() if folder else "")
+
+    def getModelStore(self):
+        from UpperAirwaySegmentatorInference.ModelStore import ModelStore
+        return ModelStore(self._modelStoreFolder or self.modelStoreFolder())
 
     @classmethod
     def areDependenciesSatisfied(cls):
@@ -28,11 +62,66 @@ class PythonDependencyChecker:
         except ImportError:
             return False
 
-    def downloadWeightsIfNeeded(self, progressCallback):
+    def verifyDependenciesIfNeeded(self, verifyCallback, forceCheck=False):
+        """
+        Runs the verifyCallback only if the Slicer version, Python executable or installed package versions changed
+        since the last successful verification.
+
+        :param verifyCallback: callable installing / checking the dependencies and returning True on success
+        :param forceCheck: ignore the verification record
+        """
+        if not forceCheck and (self.dependencyChecked or self.isVerificationRecordValid()):
+            self.dependencyChecked = True
+            return True
+
+        self.dependencyChecked = bool(verifyCallback())
+        if self.dependencyChecked:
+            self.writeVerificationRecord()
+        else:
+            self.clearVerificationRecord()
+        return self.dependencyChecked
+
+    @classmethod
+    def installedPackageVersions(cls):
+        from importlib.metadata import PackageNotFoundError, version
+
+        versions = {}
+        for package in cls.verifiedPackages:
+            try:
+                versions[package] = version(package)
+            except PackageNotFoundError:
+                versions[package] = None
+        return versions
+
+    @classmethod
+    def verificationKey(cls):
+        return {
+            "slicerVersion": f"{slicer.app.applicationVersion}-{slicer.app.repositoryRevision}",
+            "pythonExecutable": sys.executable,
+            "packages": cls.installedPackageVersions(),
+        }
+
+    def isVerificationRecordValid(self):
+        try:
+            with open(self.verificationRecordPath, "r") as f:
+                return json.load(f) == self.verificationKey()
+        except (OSError, ValueError):
+            return False
+
+    def writeVerificationRecord(self):
+        self.verificationRecordPath.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.verificationRecordPath, "w") as f:
+            json.dump(self.verificationKey(), f, indent=2)
+
+    def clearVerificationRecord(self):
+        self.dependencyChecked = False
+        self.verificationRecordPath.unlink(missing_ok=True)
+
+    def downloadWeightsIfNeeded(self, progressCallback, askForUpdate=True):
         if self.areWeightsMissing():
             return self.downloadWeights(progressCallback)
 
-        elif self.areWeightsOutdated():
+        elif askForUpdate and self.areWeightsOutdated():
             if qt.QMessageBox.question(
                     None,
                     "New weights are available",
@@ -63,8 +152,9 @@ class PythonDependencyChecker:
         return self.destWeightFolder
 
     def getDatasetPath(self):
+        from UpperAirwaySegmentatorInference.ModelStore import resolveModelFolder
         try:
-            return next(self.destWeightFolder.rglob("dataset.json"))
+            return next(resolveModelFolder(self.destWeightFolder).rglob("dataset.json"))
         except StopIteration:
             return None
 
@@ -79,28 +169,27 @@ class PythonDependencyChecker:
             return json.loads(f.read()).get("download_url")
 
     def downloadWeights(self, progressCallback):
-        import shutil
-        import requests
-
-        progressCallback("Downloading model weights...")
-        if self.destWeightFolder.exists():
-            shutil.rmtree(self.destWeightFolder)
-        self.destWeightFolder.mkdir(parents=True, exist_ok=True)
-
+        """
+        Weights are downloaded once to the shared model store and linked to the module weight folder.
+        Installs downloading the same release concurrently wait for the first download to finish.
+        """
         try:
             download_url = self.getLatestReleaseUrl()
-            session = requests.Session()
-            response = session.get(download_url, stream=True)
-            response.raise_for_status()
-
-            file_name = download_url.split("/")[-1]
-            destZipPath = self.destWeightFolder / file_name
-            with open(destZipPath, "wb") as f:
-                for chunk in response.iter_content(1024 * 1024):
-                    f.write(chunk)
+            store = self.getModelStore()
+            with store.downloadLock(download_url):
+                if store.installFromUrl(download_url, self.destWeightFolder):
+                    progressCallback("Using model weights from the shared model store.")
+                else:
+                    progressCallback("Downloading model weights...")
+                    with tempfile.TemporaryDirectory(dir=store.storeFolder) as tmpDir:
+                        destZipPath = Path(tmpDir) / download_url.split("/")[-1]
+                        self.downloadArchive(download_url, destZipPath)
+                        store.install(destZipPath, self.destWeightFolder, download_url)
 
-            self.extractWeightsToWeightsFolder(destZipPath)
             self.writeDownloadInfoURL(download_url)
+            removed = store.collectGarbage()
+            if removed:
+                progressCallback(f"Removed {len(removed)} unused model(s) from the shared model store.")
             return True
         except Exception:  # noqa
             import traceback
@@ -112,6 +201,17 @@ class PythonDependencyChecker:
             )
             return False
 
+    @staticmethod
+    def downloadArchive(download_url, destZipPath):
+        import requests
+
+        session = requests.Session()
+        response = session.get(download_url, stream=True)
+        response.raise_for_status()
+        with open(destZipPath, "wb") as f:
+            for chunk in response.iter_content(1024 * 1024):
+                f.write(chunk)
+
     def extractWeightsToWeightsFolder(self, zipPath):
         with zipfile.ZipFile(zipPath, "r") as f:
             f.extractall(self.destWeightFolder)
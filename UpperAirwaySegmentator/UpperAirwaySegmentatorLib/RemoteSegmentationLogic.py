@@ -0,0 +1,161 @@
+from pathlib import Path
+
+import qt
+import slicer
+
+from .BackgroundTask import BackgroundTask
+from .Signal import QueuedSignal, Signal
+
+
+class RemoteJob:
+    """
+    State of one server job, shared by the main thread and the background thread running the job. Each job has its own
+    state for a stopped job to still cancel its server job after a new job was started.
+    """
+
+    def __init__(self):
+        self.id = None
+        self.isStopped = False
+        self.task = None
+
+
+class RemoteSegmentationLogic:
+    """
+    Runs the segmentation on a shared UpperAirwaySegmentator inference server.
+    Same interface as the WorkerSegmentationLogic which lets the widget use either logic.
+
+    The volume is uploaded as compressed NIfTI. Upload, progress streaming and download run in a background thread and
+    the server progress is forwarded to progressInfo on the main thread.
+    """
+
+    inputFileName = "input_0000.nii.gz"
+
+    def __init__(self, serverUrl):
+        from UpperAirwaySegmentatorInference.Client import InferenceClient
+
+        self.inferenceFinished = Signal()
+        self.errorOccurred = Signal("str")
+        self.progressInfo = Signal("str")
+
+        self.client = InferenceClient(serverUrl)
+        self._serverProgress = QueuedSignal("str")
+        self._serverProgress.connect(self.progressInfo)
+        self._parameter = None
+        self._tmpDir = qt.QTemporaryDir()
+        self._job = None
+
+    def __del__(self):
+        self.stopSegmentation()
+
+    def setParameter(self, parameter):
+        self._parameter = parameter
+
+    @property
+    def outputFolder(self):
+        return Path(self._tmpDir.path()).joinpath("output")
+
+    def startSegmentation(self, volumeNode):
+        self.stopSegmentation()
+        self._tmpDir = qt.QTemporaryDir()
+        self.outputFolder.mkdir(parents=True)
+
+        inputFile = Path(self._tmpDir.path()).joinpath(self.inputFileName)
+        self.progressInfo("Compressing volume...\n")
+        if not slicer.util.exportNode(volumeNode, inputFile.as_posix(), {"useCompression": 1}):
+            self.errorOccurred(f"Failed to export {volumeNode.GetName()} for the inference server.")
+            return
+
+        self.progressInfo(f"Sending volume to {self.client.serverUrl}...\n")
+        job = RemoteJob()
+        task = BackgroundTask(self._runJob, job, inputFile, self._parameter, self.outputFolder)
+        task.finished.connect(lambda state: self._onJobFinished(job, state))
+        task.errorOccurred.connect(lambda errorMsg: self._onJobError(job, errorMsg))
+        job.task = task.start()
+        self._job = job
+
+    def _runJob(self, job, inputFile, parameter, outputFolder):
+        """
+        Uploads the volume, forwards the server progress until the job is done and downloads its results.
+        Runs in a worker thread.
+
+        :returns: final job state
+        """
+        from UpperAirwaySegmentatorInference.ProbabilityMap import PROBABILITY_MAP_SUFFIX
+        from UpperAirwaySegmentatorInference.Server import DONE, FAILED
+
+        job.id = jobId = self.client.submit(inputFile, parameter)
+        if job.isStopped:
+            self.client.cancel(jobId)
+            return None
+
+        state, error = None, ""
+        for event in self.client.events(jobId):
+            if "progress" in event:
+                self._serverProgress.emit(event["progress"])
+            state, error = event.get("state", state), event.get("error", error)
+
+        try:
+            if state == DONE:
+                self.client.download(jobId, outputFolder / "input.nii.gz")
+                if parameter.saveProbabilities:
+                    self.client.download(jobId, outputFolder / f"input{PROBABILITY_MAP_SUFFIX}", "probabilities")
+        finally:
+            self.client.cancel(jobId)
+
+        if state == FAILED:
+            raise RuntimeError(error or "Inference failed on the server.")
+        return state
+
+    def _onJobFinished(self, job, state):
+        from UpperAirwaySegmentatorInference.Server import DONE
+
+        # Jobs stopped before a new job was started are ignored
+        if job is not self._job:
+            return
+        self._job = None
+        if state == DONE and not job.isStopped:
+            self.inferenceFinished()
+
+    def _onJobError(self, job, errorMsg):
+        if job is not self._job:
+            return
+        self._job = None
+        if not job.isStopped:
+            self.errorOccurred(f"Inference server error : {errorMsg}")
+
+    def stopSegmentation(self):
+        """
+        Cancels the server job. The background request ends once the server closes the job progress stream.
+        """
+        job = self._job
+        if job is None or job.isStopped:
+            return
+
+        self.progressInfo("Cancelling server inference...\n")
+        job.isStopped = True
+        if job.id is not None:
+            try:
+                self.client.cancel(job.id)
+            except OSError as e:
+                self.progressInfo(f"Failed to cancel the server inference : {e}\n")
+
+    def waitForSegmentationFinished(self):
+        if self._job is not None:
+            self._job.task.wait()
+
+    def probabilityMapPath(self):
+        """
+        :returns: path of the downloaded probability map or None if it wasn't saved
+        """
+        from UpperAirwaySegmentatorInference.ProbabilityMap import PROBABILITY_MAP_SUFFIX
+        path = self.outputFolder.joinpath("input" + PROBABILITY_MAP_SUFFIX)
+        return path if path.exists() else None
+
+    def loadSegmentation(self):
+        """
+        :returns: segmentation node loaded from the downloaded result
+        """
+        outputFiles = sorted(self.outputFolder.glob("input.nii*")) if self.outputFolder.exists() else []
+        if not outputFiles:
+            raise RuntimeError(f"Failed to load the segmentation downloaded from {self.client.serverUrl}.")
+        return slicer.util.loadSegmentation(outputFiles[0].as_posix())
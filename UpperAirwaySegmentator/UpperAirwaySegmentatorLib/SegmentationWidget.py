@@ -1,3 +1,5 @@
+import json
+import shutil
 from enum import Flag, auto
 from pathlib import Path
 from typing import Optional
@@ -7,9 +9,22 @@ import ctk
 import numpy as np
 import qt
 import slicer
+import vtk
 
+from UpperAirwaySegmentatorInference.CompactLabelmap import COMPACT_LABELMAP_EXTENSION
+from UpperAirwaySegmentatorInference.FieldOfView import findFieldOfView
+from UpperAirwaySegmentatorInference.MemoryPlanner import MemoryPlanner, parsePeakMemory
+from UpperAirwaySegmentatorInference.Preflight import analyzeVolume
+from UpperAirwaySegmentatorInference.RuntimeEstimator import RuntimeEstimator, RuntimeTracker, formatDuration
+
+from .ClosedSurfaceCache import ClosedSurfaceCache
+from .CompactSegmentation import saveCompactSegmentation, useCompactSceneStorage
 from .IconPath import icon, iconPath
+from .Pipeline import Pipeline
+from .PostProcessing import minimumIslandSizeInVoxels, removeSmallIslands
+from .ProbabilityMap import ProbabilityMap
 from .PythonDependencyChecker import PythonDependencyChecker
+from .Signal import Signal
 from .Utils import (
     createButton,
     addInCollapsibleLayout,
@@ -23,9 +38,17 @@ class ExportFormat(Flag):
     STL = auto()
     OBJ = auto()
     NIFTI = auto()
+    COMPACT = auto()
 
 
 class SegmentationWidget(qt.QWidget):
+    airwaySegmentId = "Segment_1"
+    inferenceServerSettingsKey = "UpperAirwaySegmentator/InferenceServerUrl"
+    inferenceBackendSettingsKey = "UpperAirwaySegmentator/InferenceBackend"
+    slicerNNUNetBackend = "SlicerNNUNet"
+    workerBackend = "Worker"
+    probabilityThresholdAttribute = "UpperAirwaySegmentator.ProbabilityThreshold"
+
     def __init__(self, logic=None, parent=None):
         super().__init__(parent)
         self.logic = logic or self._createSlicerSegmentationLogic()
@@ -76,7 +99,145 @@ class SegmentationWidget(qt.QWidget):
         self.surfaceSmoothingSlider.setValue(0)  # Set default value to 0 tk
         smoothingSlider.setValue(0)  # Set the 3D button's smoothing slider to 0 as well tk
         self.surfaceSmoothingSlider.tracking = False
-        self.surfaceSmoothingSlider.valueChanged.connect(smoothingSlider.setValue)
+        self.surfaceSmoothingSlider.valueChanged.connect(self.onSurfaceSmoothingChanged)
+        self._show3DSmoothingSlider = smoothingSlider
+
+        # Airway threshold re-derived from the stored probability map of the current volume
+        self.probabilityThresholdSlider = ctk.ctkSliderWidget(self)
+        self.probabilityThresholdSlider.setToolTip(
+            "Minimum airway probability of the segmented voxels. Higher values give a more conservative boundary.\n"
+            "Available when the segmentation was run with 'Keep probability map' checked."
+        )
+        self.probabilityThresholdSlider.decimals = 2
+        self.probabilityThresholdSlider.minimum = 0.05
+        self.probabilityThresholdSlider.maximum = 0.95
+        self.probabilityThresholdSlider.singleStep = 0.01
+        self.probabilityThresholdSlider.setValue(0.5)
+        self.probabilityThresholdSlider.setEnabled(False)
+        self.probabilityThresholdSlider.valueChanged.connect(self.onProbabilityThresholdChanged)
+        self._probabilityThresholdTimer = qt.QTimer(self)
+        self._probabilityThresholdTimer.setSingleShot(True)
+        self._probabilityThresholdTimer.setInterval(0)
+        self._probabilityThresholdTimer.timeout.connect(self._applyProbabilityThreshold)
+
+        # Closed surfaces are built in the background and cached per smoothing factor
+        self.surfaceCache = ClosedSurfaceCache()
+        self.surfaceCache.surfaceApplied.connect(self._onClosedSurfaceApplied)
+        self.surfaceCache.errorOccurred.connect(self._onClosedSurfaceError)
+
+        # Display refreshes are batched and flushed once the event loop is idle
+        self._isThreeDViewResetPending = False
+        self._isDisplayUpdateDeferred = False
+        self._displayUpdateTimer = qt.QTimer(self)
+        self._displayUpdateTimer.setSingleShot(True)
+        self._displayUpdateTimer.setInterval(0)
+        self._displayUpdateTimer.timeout.connect(self._flushDisplayUpdate)
+
+        # Inference settings
+        inferenceWidget = qt.QWidget()
+        inferenceLayout = qt.QFormLayout(inferenceWidget)
+        self.foldsLineEdit = qt.QLineEdit(inferenceWidget)
+        self.foldsLineEdit.setText("0")
+        foldsRegExp = qt.QRegExp("(all|[0-9]+)(,(all|[0-9]+))*")
+        self.foldsLineEdit.setValidator(qt.QRegExpValidator(foldsRegExp, self.foldsLineEdit))
+        self.foldsLineEdit.setToolTip(
+            "Comma separated model folds, for instance 0,1,2,3,4, or all for models trained on all the data.\n"
+            "Predictions of the folds are averaged. Each fold adds the duration of one inference."
+        )
+        self.foldProcessesSpinBox = qt.QSpinBox(inferenceWidget)
+        self.foldProcessesSpinBox.setRange(1, 8)
+        self.foldProcessesSpinBox.setToolTip(
+            "Number of processes the folds are split across.\n"
+            "More processes can be faster on CPU but each process holds its own prediction in memory."
+        )
+        self.modelStoreLineEdit = ctk.ctkPathLineEdit(inferenceWidget)
+        self.modelStoreLineEdit.filters = ctk.ctkPathLineEdit.Dirs
+        self.modelStoreLineEdit.currentPath = PythonDependencyChecker.modelStoreFolder().as_posix()
+        self.modelStoreLineEdit.setToolTip(
+            "Folder where the model weights are downloaded once and shared by the Slicer installs.\n"
+            "Set to a folder writable by all the users to share the weights on multi-user workstations."
+        )
+        self.modelStoreLineEdit.connect("currentPathChanged(QString)", PythonDependencyChecker.setModelStoreFolder)
+        self.inferenceServerLineEdit = qt.QLineEdit(inferenceWidget)
+        self.inferenceServerLineEdit.setText(self.inferenceServerUrl())
+        self.inferenceServerLineEdit.setPlaceholderText("Local inference")
+        self.inferenceServerLineEdit.setToolTip(
+            "URL of a shared inference server, for instance http://server:8765.\n"
+            "Leave empty to run the inference on this computer."
+        )
+        self.inferenceServerLineEdit.editingFinished.connect(self.onInferenceServerChanged)
+        self.inferenceBackendComboBox = qt.QComboBox(inferenceWidget)
+        for text, backend in [
+            ("SlicerNNUNet", self.slicerNNUNetBackend),
+            ("Module worker (experimental)", self.workerBackend),
+        ]:
+            self.inferenceBackendComboBox.addItem(text, backend)
+        self.inferenceBackendComboBox.setCurrentIndex(self.inferenceBackendComboBox.findData(self.inferenceBackend()))
+        self.inferenceBackendComboBox.setToolTip(
+            "Local inference backend. The module worker adds the fold processes, CPU precision, adaptive test time\n"
+            "augmentation, probability map, preprocessing cache, resumable inference and memory checks.\n"
+            "It relies on nnU-Net internals tested with nnunetv2 2.8.1 only."
+        )
+        self.inferenceBackendComboBox.currentIndexChanged.connect(self.onInferenceBackendChanged)
+        self.keepProbabilitiesCheckBox = qt.QCheckBox(inferenceWidget)
+        self.keepProbabilitiesCheckBox.setToolTip(
+            "Keep the airway probability map on disk to adjust the segmentation threshold without running the"
+            " inference again."
+        )
+        self.inputCheckCheckBox = qt.QCheckBox(inferenceWidget)
+        self.inputCheckCheckBox.setChecked(True)
+        self.inputCheckCheckBox.setToolTip(
+            "Check the input modality, spacing, orientation and field of view before running the segmentation.\n"
+            "Unsuitable volumes are rejected and doubtful volumes require a confirmation."
+        )
+        self.trimFieldOfViewCheckBox = qt.QCheckBox(inferenceWidget)
+        self.trimFieldOfViewCheckBox.setChecked(True)
+        self.trimFieldOfViewCheckBox.setToolTip(
+            "Remove the empty margins of the volume (outside the CBCT cylinder, empty slices) before the inference.\n"
+            "The segmentation is restored in the full volume geometry."
+        )
+        self.precisionComboBox = qt.QComboBox(inferenceWidget)
+        for text, precision in [
+            ("Float 32", "fp32"),
+            ("Automatic (reduced when supported)", "auto"),
+            ("BFloat 16", "bf16"),
+            ("Float 16", "fp16"),
+        ]:
+            self.precisionComboBox.addItem(text, precision)
+        self.precisionComboBox.setToolTip(
+            "Precision of CPU inference. Reduced precisions are faster on CPUs with native bf16 / fp16 support and\n"
+            "fall back to float 32 otherwise. Their accuracy is checked against float 32 on the first segmentation."
+        )
+        self.ttaComboBox = qt.QComboBox(inferenceWidget)
+        for text, tta in [
+            ("Off", "off"),
+            ("Adaptive (uncertain tiles only)", "adaptive"),
+            ("Full mirroring", "full"),
+        ]:
+            self.ttaComboBox.addItem(text, tta)
+        self.ttaComboBox.setToolTip(
+            "Mirroring test time augmentation. Full mirroring runs up to 8 predictions per sliding window tile.\n"
+            "Adaptive only mirrors the tiles where the prediction is uncertain, for an accuracy close to full mirroring"
+            " at a fraction of its cost."
+        )
+        inferenceLayout.addRow("Inference backend :", self.inferenceBackendComboBox)
+        inferenceLayout.addRow("Model folds :", self.foldsLineEdit)
+        inferenceLayout.addRow("Fold processes :", self.foldProcessesSpinBox)
+        inferenceLayout.addRow("CPU precision :", self.precisionComboBox)
+        inferenceLayout.addRow("Test time augmentation :", self.ttaComboBox)
+        inferenceLayout.addRow("Check input volume :", self.inputCheckCheckBox)
+        inferenceLayout.addRow("Trim field of view :", self.trimFieldOfViewCheckBox)
+        inferenceLayout.addRow("Model store :", self.modelStoreLineEdit)
+        inferenceLayout.addRow("Inference server :", self.inferenceServerLineEdit)
+        inferenceLayout.addRow("Keep probability map :", self.keepProbabilitiesCheckBox)
+        self._updateWorkerSettingsEnabled()
+        inferenceLayout.addRow(createButton(
+            "Re-check dependencies",
+            callback=self.onForceDependencyCheckClicked,
+            toolTip="Verify and install the Python dependencies now.\n"
+                    "Dependencies are otherwise only verified after a Slicer or package update.",
+            parent=inferenceWidget
+        ))
 
         # Export Widget
         exportWidget = qt.QWidget()
@@ -87,10 +248,17 @@ class SegmentationWidget(qt.QWidget):
         self.objCheckBox = qt.QCheckBox(exportWidget)
         self.niftiCheckBox = qt.QCheckBox(exportWidget)
         self.niftiCheckBox.setChecked(True)  # Set NIFTI checkbox to checked by default
+        self.compactCheckBox = qt.QCheckBox(exportWidget)
+        self.compactCheckBox.setToolTip(
+            "Export the labelmap cropped to the segments bounding box and run length encoded"
+            f" ({COMPACT_LABELMAP_EXTENSION}).\n"
+            "Compact labelmaps are loaded back in their original geometry by drag and drop in Slicer."
+        )
 
         exportLayout.addRow("Export STL", self.stlCheckBox)
         exportLayout.addRow("Export OBJ", self.objCheckBox)
         exportLayout.addRow("Export NIFTI", self.niftiCheckBox)
+        exportLayout.addRow("Export compact labelmap", self.compactCheckBox)
         exportLayout.addRow(createButton("Export", callback=self.onExportClicked, parent=exportWidget))
 
         layout = qt.QVBoxLayout(self)
@@ -117,7 +285,12 @@ class SegmentationWidget(qt.QWidget):
         self.stopWidget = qt.QWidget(self)
         stopLayout = qt.QVBoxLayout(self.stopWidget)
         stopLayout.setContentsMargins(0, 0, 0, 0)
+        self.runtimeLabel = qt.QLabel()
+        self.runtimeTimer = qt.QTimer(self)
+        self.runtimeTimer.setInterval(1000)
+        self.runtimeTimer.timeout.connect(self._updateRuntimeLabel)
         stopLayout.addWidget(self.stopButton)
+        stopLayout.addWidget(self.runtimeLabel)
         stopLayout.addWidget(self.currentInfoTextEdit)
         self.stopWidget.setVisible(False)
         self.loading = qt.QMovie(iconPath("loading.gif"))
@@ -140,24 +313,46 @@ class SegmentationWidget(qt.QWidget):
         surfaceSmoothingLayout = qt.QFormLayout()
         surfaceSmoothingLayout.setContentsMargins(0, 0, 0, 0)
         surfaceSmoothingLayout.addRow("Surface smoothing :", self.surfaceSmoothingSlider)
+        surfaceSmoothingLayout.addRow("Airway threshold :", self.probabilityThresholdSlider)
         layout.addLayout(surfaceSmoothingLayout)
+        addInCollapsibleLayout(inferenceWidget, layout, "Inference settings", isCollapsed=True)
         layout.addWidget(exportWidget)
         addInCollapsibleLayout(exportWidget, layout, "Export segmentation", isCollapsed=False)
         layout.addStretch()
 
         self.isStopping = False
+        self.isInteractive = True
+        self._isSegmentationRunning = False
+        self.resultsPipeline = Pipeline()
+        self.segmentationFinished = Signal("object")
+        self.segmentationFailed = Signal("str")
 
         self._dependencyChecker = PythonDependencyChecker()
+        self.runtimeEstimator = RuntimeEstimator(self.runtimeCalibrationFile())
+        self.runtimeCalibrationDuration_s = 5.0
+        self._runtimeTracker = None
+        self.memoryPlanner = MemoryPlanner(self.memoryHistoryFile())
+        self._memoryPlan = None
+        self._peakMemory_MB = None
+        self._fieldOfView = None
+        self._trimmedVolumeNode = None
         self.processedVolumes = {}
+        self.probabilityMaps = {}
 
         self.onInputChanged()
         self.updateSegmentEditorWidget()
         self.sceneCloseObserver = slicer.mrmlScene.AddObserver(slicer.mrmlScene.EndCloseEvent, self.onSceneChanged)
+        self.nodeRemovedObserver = slicer.mrmlScene.AddObserver(
+            slicer.mrmlScene.NodeAboutToBeRemovedEvent, self.onNodeAboutToBeRemoved
+        )
         self.onSceneChanged(doStopInference=False)
         self._connectSegmentationLogic()
 
     def __del__(self):
         slicer.mrmlScene.RemoveObserver(self.sceneCloseObserver)
+        slicer.mrmlScene.RemoveObserver(self.nodeRemovedObserver)
+        self.surfaceCache.clear()
+        self._clearProbabilityMaps()
         super().__del__()
 
     def onSceneChanged(self, *_, doStopInference=True):
@@ -167,8 +362,22 @@ class SegmentationWidget(qt.QWidget):
         self.segmentEditorWidget.setMRMLSegmentEditorNode(self.segmentEditorNode)
         self.processedVolumes = {}
         self._prevSegmentationNode = None
+        self.surfaceCache.clear()
+        self._clearProbabilityMaps()
         self._initSlicerDisplay()
 
+    @vtk.calldata_type(vtk.VTK_OBJECT)
+    def onNodeAboutToBeRemoved(self, _caller, _event, node):
+        """
+        Release the probability map and the processed segmentation entry of volumes removed from the scene.
+        """
+        if node not in self.processedVolumes and node not in self.probabilityMaps:
+            return
+
+        self.processedVolumes.pop(node, None)
+        self._removeProbabilityMap(node)
+        self._updateProbabilityThresholdSlider()
+
     @staticmethod
     def _initSlicerDisplay():
         """
@@ -183,73 +392,334 @@ class SegmentationWidget(qt.QWidget):
 
     def onStopClicked(self):
         """
-        When user kills the execution, don't show any error window and wait for process to be killed in the logic.
-        Once cleanup is done, restore buttons.
+        When user stops the execution, don't show any error window. The logic stops the inference in the background
+        without blocking the GUI and pending results post-processing is cancelled. Buttons are restored right away.
         """
 
+        wasRunning = self._isSegmentationRunning
         self.isStopping = True
+        self.resultsPipeline.cancel()
+        self._stopRuntimeTracking()
         self.logic.stopSegmentation()
-        self.logic.waitForSegmentationFinished()
-        slicer.app.processEvents()
         self.isStopping = False
         self._setApplyVisible(True)
+        if wasRunning:
+            self.segmentationFailed("Segmentation was stopped.")
 
     def onApplyClicked(self, *_):
         """
-        On apply, clear the output log infos, hide apply button, install dependencies and start the segmentation process
+        On apply, clear the output log infos, hide apply button, install dependencies and start the segmentation process.
+        When the widget is not interactive, no confirmation is asked to the user and errors are only logged.
         """
+        # Cleared before the input check for its report to stay in the log
+        self.currentInfoTextEdit.clear()
+        if not self._checkInputVolume(self.getCurrentVolumeNode()):
+            self.segmentationFailed("Input volume check failed.")
+            return
+
+        if self._isRemoteLogic():
+            self._setApplyVisible(False)
+            self._runSegmentation()
+            return
+
         if not self.isNNUNetModuleInstalled() or self.logic is None:
-            slicer.util.errorDisplay(
-                "This module depends on the NNUNet module."
-                " Please install the NNUNet module and restart to proceed."
-            )
+            self._displayMissingNNUNetModuleError()
+            self.segmentationFailed("NNUNet module is not installed.")
             return
 
-        self.currentInfoTextEdit.clear()
         self._setApplyVisible(False)
         if not self._installNNUNetIfNeeded():
-            self._setApplyVisible(True)
+            self._abortSegmentation("Failed to install the module dependencies.")
             return
 
-        if not self._dependencyChecker.downloadWeightsIfNeeded(self.onProgressInfo):
-            self._setApplyVisible(True)
+        if not self._dependencyChecker.downloadWeightsIfNeeded(self.onProgressInfo, askForUpdate=self.isInteractive):
+            self._abortSegmentation("Failed to download the model weights.")
             return
 
         self._runSegmentation()
 
+    @staticmethod
+    def analyzeInputVolume(volumeNode):
+        """
+        Sub second pre-flight check of the volume modality, geometry and field of view.
+        Scripted callers can use the returned PreflightReport to skip unsuitable inputs.
+        """
+        ijkToRasDirections = vtk.vtkMatrix4x4()
+        volumeNode.GetIJKToRASDirectionMatrix(ijkToRasDirections)
+        directions = np.array([[ijkToRasDirections.GetElement(row, column) for column in range(3)] for row in range(3)])
+
+        # Array axes are in (k, j, i) order
+        return analyzeVolume(
+            slicer.util.arrayFromVolume(volumeNode), list(reversed(volumeNode.GetSpacing())), directions[:, ::-1]
+        )
+
+    def _checkInputVolume(self, volumeNode):
+        """
+        Blocks the segmentation of unsuitable volumes. Warnings are confirmed by the user in interactive mode and only
+        logged otherwise.
+
+        :returns: True if the segmentation can proceed
+        """
+        if volumeNode is None or not self.inputCheckCheckBox.checked:
+            return True
+
+        report = self.analyzeInputVolume(volumeNode)
+        self.onProgressInfo(report.summary())
+        if report.isBlocking:
+            self._displayError(f"{volumeNode.GetName()} can't be segmented :\n{report.summary()}")
+            return False
+
+        if report.warnings and self.isInteractive:
+            ret = qt.QMessageBox.question(
+                self,
+                "Input volume check",
+                f"{report.summary()}\n\nWould you like to proceed anyway?"
+            )
+            return ret == qt.QMessageBox.Yes
+        return True
+
+    def _abortSegmentation(self, errorMsg):
+        self._setApplyVisible(True)
+        self.segmentationFailed(errorMsg)
+
+    def _displayError(self, errorMsg):
+        if self.isInteractive:
+            slicer.util.errorDisplay(errorMsg)
+        else:
+            self.onProgressInfo(errorMsg)
+
+    def _displayMissingNNUNetModuleError(self):
+        self._displayError(
+            "This module depends on the NNUNet module."
+            " Please install the NNUNet module and restart to proceed."
+        )
+
     def _setApplyVisible(self, isVisible):
         """
         Toggles visibility of the apply / stop buttons and make sure the selectors are disabled when running
-        segmentation.
+        segmentation. The temporary trimmed volume is removed once the segmentation is done.
         """
+        self._isSegmentationRunning = not isVisible
+        if isVisible:
+            self._removeTrimmedVolume()
         self.applyWidget.setVisible(isVisible)
         self.stopWidget.setVisible(not isVisible)
         self.inputSelector.setEnabled(isVisible)
         self.segmentationNodeSelector.setEnabled(isVisible)
+        self.inferenceServerLineEdit.setEnabled(isVisible)
+        self.inferenceBackendComboBox.setEnabled(isVisible)
 
     def _runSegmentation(self):
         """
-        Make sure the dependencies are available and user is aware CPU process may take time if current install doesn't
-        support CUDA before starting the actual segmentation from the logic object.
+        Make sure the dependencies are available and user is aware of the estimated segmentation time if current install
+        doesn't support CUDA before starting the actual segmentation from the logic object.
         """
-        import torch
-        from SlicerNNUNetLib import Parameter
+        from UpperAirwaySegmentatorInference.Parameter import InferenceParameter, resolveDevice
+
+        parameter = InferenceParameter(
+            folds=self.foldsLineEdit.text or "0",
+            foldProcesses=self.foldProcessesSpinBox.value,
+            saveProbabilities=self.keepProbabilitiesCheckBox.checked,
+            precision=self.precisionComboBox.currentData,
+            disableTta=self.ttaComboBox.currentData != "full",
+            adaptiveTta=self.ttaComboBox.currentData == "adaptive",
+            # Memory and runtime calibrations are keyed by the device the inference actually runs on
+            device=resolveDevice("cuda"),
+            modelPath=self.nnUnetFolder(),
+            modelCacheFolder=self.modelCacheFolder(),
+            preprocessingCacheFolder=self.preprocessingCacheFolder(),
+            tileCheckpointFolder=self.tileCheckpointFolder()
+        )
+        volumeNode = self._trimVolume(self.getCurrentVolumeNode())
+        parameter = self._planMemory(parameter, volumeNode)
+        if parameter is None:
+            return
 
-        if not torch.cuda.is_available():
+        self.logic.setParameter(self._logicParameter(parameter))
+        estimate = self._estimateRuntime(parameter, volumeNode)
+        if not self._isSegmentationRunning:
+            return
+
+        if self.isInteractive and not self._isRemoteLogic() and parameter.device == "cpu":
+            duration = f"about {formatDuration(estimate.total_s)}" if estimate else "up to 1 hour"
             ret = qt.QMessageBox.question(
                 self,
                 "CUDA not available",
                 "CUDA is not currently available on your system.\n"
-                "Running the segmentation may take up to 1 hour.\n"
+                f"Running the segmentation is estimated to take {duration}.\n"
                 "Would you like to proceed?"
             )
             if ret == qt.QMessageBox.No:
-                self._setApplyVisible(True)
+                self._abortSegmentation("Segmentation was cancelled.")
                 return
 
         slicer.app.processEvents()
-        self.logic.setParameter(Parameter(folds="0", modelPath=self.nnUnetFolder()))
-        self.logic.startSegmentation(self.getCurrentVolumeNode())
+        self._startRuntimeTracking(parameter, estimate, volumeNode)
+        self.logic.startSegmentation(volumeNode)
+
+    def _trimVolume(self, volumeNode):
+        """
+        Crops the dead margins of the volume when trimming is enabled.
+
+        :returns: temporary hidden volume node of the informative region or the input volume if it can't be trimmed
+        """
+        self._removeTrimmedVolume()
+        if not self.trimFieldOfViewCheckBox.checked:
+            return volumeNode
+
+        array = slicer.util.arrayFromVolume(volumeNode)
+        fieldOfView = findFieldOfView(array, list(reversed(volumeNode.GetSpacing())))
+        if not fieldOfView.isTrimmed:
+            self.onProgressInfo(f"Field of view of {tuple(array.shape)} voxels kept as is.")
+            return volumeNode
+
+        # Origin of the region is the RAS position of its first voxel, array axes are in (k, j, i) order
+        ijkToRas = vtk.vtkMatrix4x4()
+        volumeNode.GetIJKToRASMatrix(ijkToRas)
+        origin = ijkToRas.MultiplyPoint([*reversed(fieldOfView.start()), 1])[:3]
+
+        trimmedNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", volumeNode.GetName() + "_Trimmed")
+        trimmedNode.SetHideFromEditors(True)
+        trimmedNode.SetIJKToRASMatrix(ijkToRas)
+        trimmedNode.SetOrigin(origin)
+        trimmedNode.SetAndObserveTransformNodeID(volumeNode.GetTransformNodeID())
+        slicer.util.updateVolumeFromArray(trimmedNode, np.ascontiguousarray(array[fieldOfView.region]))
+
+        self.onProgressInfo(fieldOfView.summary())
+        self._fieldOfView = fieldOfView
+        self._trimmedVolumeNode = trimmedNode
+        return trimmedNode
+
+    def _removeTrimmedVolume(self):
+        if self._trimmedVolumeNode is not None and slicer.mrmlScene.IsNodePresent(self._trimmedVolumeNode):
+            slicer.mrmlScene.RemoveNode(self._trimmedVolumeNode)
+        self._trimmedVolumeNode = None
+        self._fieldOfView = None
+
+    def _planMemory(self, parameter, volumeNode):
+        """
+        Checks the estimated peak memory of the segmentation against the available memory and switches to a lower
+        memory inference when needed. Server memory isn't checked.
+
+        :returns: parameter of the inference fitting in memory or None if the segmentation was refused
+        """
+        self._memoryPlan, self._peakMemory_MB = None, None
+        if self._isRemoteLogic() or self._isSlicerNNUNetLogic():
+            return parameter
+
+        shape, spacing = self._volumeShapeAndSpacing(volumeNode)
+        try:
+            plan = self.memoryPlanner.plan(parameter, shape, spacing)
+        except (OSError, KeyError, ValueError, RuntimeError) as e:
+            self.onProgressInfo(f"Failed to estimate the segmentation memory : {e}")
+            return parameter
+
+        self.onProgressInfo(plan.summary())
+        if plan.isRefused:
+            self._displayError(plan.summary())
+            self._abortSegmentation("Not enough memory to run the segmentation.")
+            return None
+
+        self._memoryPlan = plan
+        return plan.parameter
+
+    def _finishMemoryTracking(self, failed=False):
+        """
+        Logs the measured peak memory of the worker and appends it to the memory history to calibrate the next
+        estimates. Failed runs record the last peak the worker reported.
+        """
+        plan, self._memoryPlan = self._memoryPlan, None
+        if plan is None or self._peakMemory_MB is None:
+            return
+
+        measured = "last measured peak memory" if failed else "peak memory"
+        self.onProgressInfo(
+            f"Inference {measured} : {self._peakMemory_MB / 1024:.1f} GB (estimated : {plan.estimate.peak_GB:.1f} GB)."
+        )
+        try:
+            self.memoryPlanner.logRun(plan.parameter, plan.estimate, self._peakMemory_MB, failed)
+        except OSError:
+            pass
+
+    def _estimateRuntime(self, parameter, volumeNode):
+        """
+        Estimates the segmentation time of the volume. The inference speed of the machine is measured first when the
+        inference settings were never calibrated. Calibration is skipped when the widget is not interactive.
+
+        :returns: RuntimeEstimate or None if the inference speed is unknown
+        """
+        # Server runtime depends on the server hardware and load and isn't estimated
+        runBenchmark = getattr(self.logic, "runBenchmark", None)
+        if runBenchmark is None:
+            return None
+
+        if self.runtimeEstimator.calibration(parameter) is None:
+            if not self.isInteractive:
+                return None
+
+            self.onProgressInfo("Measuring the inference speed of this machine (only done once)...")
+            benchmark = runBenchmark(self.runtimeCalibrationDuration_s)
+            if benchmark is None:
+                self.onProgressInfo("Failed to measure the inference speed, segmentation time can't be estimated.")
+                return None
+            self.runtimeEstimator.setCalibration(parameter, benchmark)
+
+        shape, spacing = self._volumeShapeAndSpacing(volumeNode)
+        estimate = self.runtimeEstimator.estimate(parameter, shape, spacing)
+        if estimate is not None:
+            self.onProgressInfo(estimate.summary())
+        return estimate
+
+    @staticmethod
+    def _volumeShapeAndSpacing(volumeNode):
+        """
+        :returns: volume shape and spacing in the array (k, j, i) axis order used by nnU-Net
+        """
+        shape = volumeNode.GetImageData().GetDimensions()
+        spacing = volumeNode.GetSpacing()
+        return list(reversed(shape)), list(reversed(spacing))
+
+    def _startRuntimeTracking(self, parameter, estimate, volumeNode):
+        shape, spacing = self._volumeShapeAndSpacing(volumeNode)
+        self._runtimeTracker = RuntimeTracker(self.runtimeEstimator, parameter, estimate, shape, spacing)
+        self._updateRuntimeLabel()
+        self.runtimeTimer.start()
+
+    def _stopRuntimeTracking(self):
+        self.runtimeTimer.stop()
+        self.runtimeLabel.setText("")
+        tracker, self._runtimeTracker = self._runtimeTracker, None
+        return tracker
+
+    def _finishRuntimeTracking(self):
+        """
+        Logs the predicted and actual inference times and appends them to the runtime history.
+        """
+        tracker = self._stopRuntimeTracking()
+        if tracker is None:
+            return
+
+        estimate = tracker.estimate
+        predicted = f" (estimated : {formatDuration(estimate.total_s)})" if estimate else ""
+        self.onProgressInfo(f"Inference took {formatDuration(tracker.elapsed_s)}{predicted}.")
+        try:
+            tracker.logRun()
+        except OSError:
+            pass
+
+    def _updateRuntimeLabel(self):
+        if self._runtimeTracker is not None:
+            self.runtimeLabel.setText(self._runtimeTracker.summary())
+
+    def _onInferenceProgress(self, infoMsg):
+        # The worker reports its running peak each time it grows
+        peakMemory_MB = parsePeakMemory(infoMsg)
+        if peakMemory_MB is not None:
+            self._peakMemory_MB = max(self._peakMemory_MB or 0.0, peakMemory_MB)
+
+        if self._runtimeTracker is not None:
+            self._runtimeTracker.onProgress(infoMsg)
+            self._updateRuntimeLabel()
 
     def onInputChanged(self, *_):
         """
@@ -260,6 +730,7 @@ class SegmentationWidget(qt.QWidget):
         slicer.util.setSliceViewerLayers(background=volumeNode)
         slicer.util.resetSliceViews()
         self._restoreProcessedSegmentation()
+        self._updateProbabilityThresholdSlider()
 
     def _restoreProcessedSegmentation(self):
         """
@@ -305,8 +776,24 @@ class SegmentationWidget(qt.QWidget):
             slicer.app.processEvents()
 
         segmentationNode.SetDisplayVisibility(True)
+        self.requestDisplayUpdate(resetThreeDViews=True)
 
-        # Reset 3D view to fit current segmentation
+    def requestDisplayUpdate(self, resetThreeDViews=False):
+        """
+        Schedule a display refresh. Consecutive requests are merged and rendered once when the event loop is idle.
+        """
+        self._isThreeDViewResetPending |= resetThreeDViews
+        self._displayUpdateTimer.start()
+
+    def _flushDisplayUpdate(self):
+        """
+        Reset the 3D view to fit the current segmentation if requested since the last flush.
+        The reset is postponed while results are loading or surfaces are being built to fit the view only once.
+        """
+        if self._isDisplayUpdateDeferred or self.surfaceCache.isPending() or not self._isThreeDViewResetPending:
+            return
+
+        self._isThreeDViewResetPending = False
         layoutManager = slicer.app.layoutManager()
         threeDWidget = layoutManager.threeDWidget(0)
         threeDWidget.threeDView().rotateToViewAxis(3)
@@ -320,29 +807,72 @@ class SegmentationWidget(qt.QWidget):
 
     def onInferenceFinished(self, *_):
         """
-        Restore apply button visibility, load the segmentation results if the inference was not manually stopped.
+        Load the segmentation results if the inference was not manually stopped.
+        Loading and post-processing run as a staged pipeline to keep the UI responsive. The apply button visibility is
+        restored once the pipeline is done.
         """
         if self.isStopping:
             self._setApplyVisible(True)
             return
 
-        try:
-            self.onProgressInfo("Loading inference results...")
-            self._loadSegmentationResults()
-            self.onProgressInfo("Inference ended successfully.")
-        except RuntimeError as e:
-            slicer.util.errorDisplay(e)
-            self.onProgressInfo(f"Error loading results :\n{e}")
-        finally:
-            self._setApplyVisible(True)
+        self._finishRuntimeTracking()
+        self._finishMemoryTracking()
+
+        # Make sure results of a previous run are fully processed before processing the new ones
+        self.resultsPipeline.wait()
+        self._isDisplayUpdateDeferred = True
+        self.resultsPipeline = self._createResultsPipeline()
+        self.resultsPipeline.start()
+
+    def waitForPostProcessingFinished(self):
+        self.resultsPipeline.wait()
+
+    def _createResultsPipeline(self):
+        """
+        Only the pipeline array processing runs in a worker thread. Loading the results and writing them back to the
+        segmentation node modify the MRML scene and are run on the main thread.
+        """
+        pipeline = Pipeline()
+        pipeline.addStage("Loading inference results", self._loadSegmentationResults)
+        pipeline.addStage("Post processing results", self._extractAirwayLabelmap)
+        pipeline.addStage("Removing small islands", self._removeSmallIslands, runInWorker=True)
+        pipeline.addStage("Updating segmentation", self._updateAirwayLabelmap)
+        pipeline.addStage("Preparing 3D surface", self._requestClosedSurfaces)
+        pipeline.progressInfo.connect(self.onProgressInfo)
+        pipeline.finished.connect(self._onResultsPipelineFinished)
+        pipeline.errorOccurred.connect(self._onResultsPipelineError)
+        pipeline.cancelled.connect(self._onResultsPipelineCancelled)
+        return pipeline
+
+    def _onResultsPipelineFinished(self, *_):
+        self._storeProcessedSegmentation()
+        self._updateProbabilityThresholdSlider()
+        self.onProgressInfo("Inference ended successfully.")
+        self._onResultsPipelineDone()
+        self.segmentationFinished(self.getCurrentSegmentationNode())
+
+    def _onResultsPipelineError(self, errorMsg):
+        self._displayError(errorMsg)
+        self.onProgressInfo(f"Error loading results :\n{errorMsg}")
+        self._onResultsPipelineDone()
+        self.segmentationFailed(errorMsg)
+
+    def _onResultsPipelineCancelled(self):
+        self.onProgressInfo("Post processing cancelled.")
+        self._onResultsPipelineDone()
+
+    def _onResultsPipelineDone(self):
+        self._isDisplayUpdateDeferred = False
+        self.requestDisplayUpdate()
+        self._setApplyVisible(True)
 
-    def _loadSegmentationResults(self):
+    def _loadSegmentationResults(self, *_):
         """
-        Load the segmentation results from the logic segmentation folder. Update the segmentation display names and
-        run some simple post-processing on the segmentation.
+        Load the segmentation results from the logic segmentation folder and update the segmentation display names.
         """
         currentSegmentation = self.getCurrentSegmentationNode()
         segmentationNode = self.logic.loadSegmentation()
+        self._storeProbabilityMap(segmentationNode)
         segmentationNode.SetName(self.getCurrentVolumeNode().GetName() + "_Segmentation")
         if currentSegmentation is not None:
             self._copySegmentationResultsToExistingNode(currentSegmentation, segmentationNode)
@@ -350,8 +880,7 @@ class SegmentationWidget(qt.QWidget):
             self.segmentationNodeSelector.setCurrentNode(segmentationNode)
         slicer.app.processEvents()
         self._updateSegmentationDisplay()
-        self._postProcessSegments()
-        self._storeProcessedSegmentation()
+        return self.getCurrentSegmentationNode()
 
     @staticmethod
     def _copySegmentationResultsToExistingNode(currentSegmentation, segmentationNode):
@@ -378,11 +907,10 @@ class SegmentationWidget(qt.QWidget):
         if not segmentationNode:
             return
 
-        self._initializeSegmentationNodeDisplay(segmentationNode)
+        if not segmentationNode.GetDisplayNode():
+            segmentationNode.CreateDefaultDisplayNodes()
         segmentation = segmentationNode.GetSegmentation()
-        # Turn off surface smoothing
-        segmentation.SetConversionParameter("Smoothing factor","0.0")
-        
+
         # Single label setup
         label = "Airway"
         color = [130/255, 177/255, 255/255]  # Light blue color in RGB format
@@ -396,17 +924,165 @@ class SegmentationWidget(qt.QWidget):
             segment.SetColor(color[0], color[1], color[2])  # Set color using RGB values
             segmentationDisplayNode.SetSegmentOpacity3D(segmentId, opacity)
 
-        self.show3DButton.setChecked(True)
-        slicer.util.resetThreeDViews()
+        self.requestDisplayUpdate(resetThreeDViews=True)
+
+    def onSurfaceSmoothingChanged(self, smoothingFactor):
+        """
+        Keep the segment editor 3D button in sync without triggering its synchronous surface rebuild and show the
+        surface matching the new smoothing factor.
+        """
+        wasBlocked = self._show3DSmoothingSlider.blockSignals(True)
+        self._show3DSmoothingSlider.setValue(smoothingFactor)
+        self._show3DSmoothingSlider.blockSignals(wasBlocked)
+        if self.show3DButton.isChecked():
+            self._requestClosedSurfaces(self.getCurrentSegmentationNode())
+
+    def _requestClosedSurfaces(self, segmentationNode):
+        """
+        Request the closed surfaces of every segment for the current smoothing factor.
+        """
+        if not segmentationNode:
+            return
+
+        smoothingFactor = self.surfaceSmoothingSlider.value
+        segmentation = segmentationNode.GetSegmentation()
+        for iSegment in range(segmentation.GetNumberOfSegments()):
+            self.surfaceCache.requestSurface(segmentationNode, segmentation.GetNthSegmentID(iSegment), smoothingFactor)
+
+    def _onClosedSurfaceApplied(self, segmentationNodeId, _segmentId):
+        """
+        Show the 3D representation once its surface is available. The closed surface already exists at this point,
+        checking the 3D button only switches the display without any conversion.
+        """
+        segmentationNode = self.getCurrentSegmentationNode()
+        if not segmentationNode or segmentationNode.GetID() != segmentationNodeId:
+            return
+
+        if not self.show3DButton.isChecked():
+            self.show3DButton.setChecked(True)
+        self.requestDisplayUpdate()
+
+    def _onClosedSurfaceError(self, errorMsg):
+        self.onProgressInfo(f"Failed to build closed surface :\n{errorMsg}")
+        self.requestDisplayUpdate()
+
+    def _extractAirwayLabelmap(self, segmentationNode):
+        """
+        Copy the Airway segment labelmap to a numpy array in the input volume geometry for array post-processing.
+        """
+        segmentId = self.airwaySegmentId
+        if not segmentationNode or segmentationNode.GetSegmentation().GetSegment(segmentId) is None:
+            return None
+
+        volumeNode = self.getCurrentVolumeNode()
+        return {
+            "segmentationNode": segmentationNode,
+            "segmentId": segmentId,
+            "labelmap": slicer.util.arrayFromSegmentBinaryLabelmap(segmentationNode, segmentId, volumeNode),
+            "minimumIslandSize": minimumIslandSizeInVoxels(self._minimumIslandSize_mm3, volumeNode.GetSpacing()),
+        }
+
+    def _storeProbabilityMap(self, segmentationNode):
+        """
+        Move the probability map saved by the logic, if any, out of the logic folder and associate it with the current
+        volume. The segmentation is first derived by the model at the default threshold.
+        """
+        volumeNode = self.getCurrentVolumeNode()
+        self._removeProbabilityMap(volumeNode)
+        getProbabilityMapPath = getattr(self.logic, "probabilityMapPath", None)
+        probabilityMapPath = getProbabilityMapPath() if getProbabilityMapPath else None
+        if probabilityMapPath is None or volumeNode is None:
+            segmentationNode.RemoveAttribute(self.probabilityThresholdAttribute)
+            return
+
+        storageFolder = Path(slicer.app.temporaryPath).joinpath("UpperAirwaySegmentator", "ProbabilityMaps")
+        storageFolder.mkdir(parents=True, exist_ok=True)
+        storedPath = storageFolder.joinpath(f"{volumeNode.GetID()}_{qt.QUuid.createUuid().toString()[1:-1]}.npy")
+        if self._fieldOfView is not None:
+            # Voxels outside the trimmed region have a zero airway probability
+            self._fieldOfView.restoreNpy(probabilityMapPath, storedPath)
+            Path(probabilityMapPath).unlink()
+        else:
+            shutil.move(probabilityMapPath, storedPath)
+        self.probabilityMaps[volumeNode] = ProbabilityMap(storedPath)
 
-    def _postProcessSegments(self):
+        wasBlocked = self.probabilityThresholdSlider.blockSignals(True)
+        self.probabilityThresholdSlider.setValue(0.5)
+        self.probabilityThresholdSlider.blockSignals(wasBlocked)
+        segmentationNode.SetAttribute(self.probabilityThresholdAttribute, "0.50")
+
+    def _removeProbabilityMap(self, volumeNode):
+        probabilityMap = self.probabilityMaps.pop(volumeNode, None)
+        if probabilityMap is not None:
+            probabilityMap.remove()
+
+    def _clearProbabilityMaps(self):
+        for volumeNode in list(self.probabilityMaps.keys()):
+            self._removeProbabilityMap(volumeNode)
+        self._updateProbabilityThresholdSlider()
+
+    def _updateProbabilityThresholdSlider(self):
+        self.probabilityThresholdSlider.setEnabled(self.getCurrentVolumeNode() in self.probabilityMaps)
+
+    def onProbabilityThresholdChanged(self, *_):
+        self._probabilityThresholdTimer.start()
+
+    def _applyProbabilityThreshold(self):
+        """
+        Re-derive the airway labelmap of the current segmentation from the stored probability map and the slider
+        threshold, then remove the small islands.
+        """
+        volumeNode = self.getCurrentVolumeNode()
+        segmentationNode = self.getCurrentSegmentationNode()
+        probabilityMap = self.probabilityMaps.get(volumeNode)
+        if probabilityMap is None or segmentationNode is None or self._isSegmentationRunning:
+            return
+
+        if segmentationNode.GetSegmentation().GetSegment(self.airwaySegmentId) is None:
+            return
+
+        if probabilityMap.shape != tuple(reversed(volumeNode.GetImageData().GetDimensions())):
+            self.onProgressInfo("Probability map doesn't match the input volume anymore and was discarded.")
+            self._removeProbabilityMap(volumeNode)
+            self._updateProbabilityThresholdSlider()
+            return
+
+        threshold = self.probabilityThresholdSlider.value
+        minimumIslandSize = minimumIslandSizeInVoxels(self._minimumIslandSize_mm3, volumeNode.GetSpacing())
+        labelmap = probabilityMap.labelmap(threshold, minimumIslandSize)
+
+        # Closed surfaces are rebuilt in the background rather than synchronously when the labelmap changes
+        segmentationNode.GetSegmentation().RemoveRepresentation(ClosedSurfaceCache.closedSurfaceName())
+        slicer.util.updateSegmentBinaryLabelmapFromArray(labelmap, segmentationNode, self.airwaySegmentId, volumeNode)
+        segmentationNode.SetAttribute(self.probabilityThresholdAttribute, f"{threshold:.2f}")
+        self._requestClosedSurfaces(segmentationNode)
+
+    @staticmethod
+    def _removeSmallIslands(segment):
         """
-        Runs remove small islands on Airway segment
+        Removes small islands from the extracted segment labelmap. Runs in a worker thread.
         """
+        if segment is None:
+            return None
 
-        self.onProgressInfo("Post processing results...")
-        self._removeSmallIsland("Segment_1")
-        self.onProgressInfo("Post processing done.")
+        segment["labelmap"] = removeSmallIslands(segment["labelmap"], segment["minimumIslandSize"])
+        return segment
+
+    def _updateAirwayLabelmap(self, segment):
+        """
+        Write the post-processed labelmap back to its segment and return the updated segmentation node.
+        """
+        if segment is None:
+            return self.getCurrentSegmentationNode()
+
+        # Segmentations of a trimmed volume are restored in the full volume geometry
+        segmentationNode = segment["segmentationNode"]
+        segmentationNode.SetReferenceImageGeometryParameterFromVolumeNode(self.getCurrentVolumeNode())
+        slicer.util.updateSegmentBinaryLabelmapFromArray(
+            segment["labelmap"], segmentationNode, segment["segmentId"], self.getCurrentVolumeNode()
+        )
+        useCompactSceneStorage(segmentationNode)
+        return segmentationNode
 
     # def _keepLargestIsland(self, segmentId):
     #     """
@@ -422,23 +1098,6 @@ class SegmentationWidget(qt.QWidget):
     #     effect.setParameter("Operation", SegmentEditorEffects.KEEP_LARGEST_ISLAND)
     #     effect.self().onApply()
 
-    def _removeSmallIsland(self, segmentId):
-        """
-        Removes small islands for input segmentId.
-        """
-        segment = self._getSegment(segmentId)
-        if not segment:
-            return
-
-        self.onProgressInfo(f"Remove small voxels for {segment.GetName()}...")
-        self.segmentEditorWidget.setCurrentSegmentID(segmentId)
-        voxelSize_mm3 = np.cumprod(self.getCurrentVolumeNode().GetSpacing())[-1]
-        minimumIslandSize = int(np.ceil(self._minimumIslandSize_mm3 / voxelSize_mm3))
-        effect = self.segmentEditorWidget.effectByName("Islands")
-        effect.setParameter("Operation", SegmentEditorEffects.REMOVE_SMALL_ISLANDS)
-        effect.setParameter("MinimumSize", minimumIslandSize)
-        effect.self().onApply()
-
     def _getSegment(self, segmentId):
         segmentationNode = self.getCurrentSegmentationNode()
         if not segmentationNode:
@@ -452,8 +1111,11 @@ class SegmentationWidget(qt.QWidget):
         if self.isStopping:
             return
 
+        self._stopRuntimeTracking()
+        self._finishMemoryTracking(failed=True)
         self._setApplyVisible(True)
-        slicer.util.errorDisplay("Encountered error during inference :\n" + errorMsg)
+        self._displayError("Encountered error during inference :\n" + errorMsg)
+        self.segmentationFailed(errorMsg)
 
     def onProgressInfo(self, infoMsg):
         """
@@ -503,6 +1165,7 @@ class SegmentationWidget(qt.QWidget):
             self.objCheckBox: ExportFormat.OBJ,
             self.stlCheckBox: ExportFormat.STL,
             self.niftiCheckBox: ExportFormat.NIFTI,
+            self.compactCheckBox: ExportFormat.COMPACT,
         }
 
         for checkBox, exportFormat in checkBoxes.items():
@@ -552,6 +1215,17 @@ class SegmentationWidget(qt.QWidget):
                 "nii.gz"
             )
 
+        if selectedFormats & ExportFormat.COMPACT:
+            compactPath = Path(folderPath).joinpath(segmentationNode.GetName() + COMPACT_LABELMAP_EXTENSION)
+            saveCompactSegmentation(segmentationNode, compactPath)
+
+        # Record the probability threshold the exported segmentation was derived with
+        threshold = segmentationNode.GetAttribute(SegmentationWidget.probabilityThresholdAttribute)
+        if threshold is not None:
+            infoPath = Path(folderPath).joinpath(f"{segmentationNode.GetName()}_info.json")
+            with open(infoPath, "w") as f:
+                json.dump({"segmentation": segmentationNode.GetName(), "probabilityThreshold": float(threshold)}, f)
+
     @staticmethod
     def isNNUNetModuleInstalled():
         try:
@@ -560,24 +1234,141 @@ class SegmentationWidget(qt.QWidget):
         except ImportError:
             return False
 
-    def _installNNUNetIfNeeded(self) -> bool:
+    def _installNNUNetIfNeeded(self, forceCheck=False) -> bool:
+        """
+        Dependencies are only verified again when the Slicer version, Python executable or package versions changed
+        since the last successful verification, unless forceCheck is True.
+        """
+        return self._dependencyChecker.verifyDependenciesIfNeeded(self._setupPythonRequirements, forceCheck)
+
+    def onForceDependencyCheckClicked(self, *_):
+        if not self.isNNUNetModuleInstalled():
+            self._displayMissingNNUNetModuleError()
+            return
+
+        self.currentInfoTextEdit.clear()
+        self._setApplyVisible(False)
+        try:
+            isValid = self._installNNUNetIfNeeded(forceCheck=True)
+        finally:
+            self._setApplyVisible(True)
+
+        if isValid:
+            self.onProgressInfo("Dependencies are correctly installed.")
+        else:
+            self._displayError("Failed to install the module dependencies.")
+
+    def _setupPythonRequirements(self) -> bool:
         from SlicerNNUNetLib import InstallLogic
         logic = InstallLogic()
         logic.progressInfo.connect(self.onProgressInfo)
         return logic.setupPythonRequirements()
 
+    @classmethod
+    def inferenceServerUrl(cls):
+        return (qt.QSettings().value(cls.inferenceServerSettingsKey) or "").strip()
+
+    def onInferenceServerChanged(self, *_):
+        """
+        Switch between the local and the server inference logic. The change applies to the next segmentation.
+        """
+        serverUrl = self.inferenceServerLineEdit.text.strip()
+        if serverUrl == self.inferenceServerUrl():
+            return
+
+        qt.QSettings().setValue(self.inferenceServerSettingsKey, serverUrl)
+        if self.logic is not None:
+            self.logic.stopSegmentation()
+        self.logic = self._createSlicerSegmentationLogic()
+        self._connectSegmentationLogic()
+
+    @classmethod
+    def inferenceBackend(cls):
+        return qt.QSettings().value(cls.inferenceBackendSettingsKey) or cls.slicerNNUNetBackend
+
+    def onInferenceBackendChanged(self, *_):
+        """
+        Switch between the SlicerNNUNet and the module worker logic. The change applies to the next segmentation.
+        """
+        backend = self.inferenceBackendComboBox.currentData
+        self._updateWorkerSettingsEnabled()
+        if backend == self.inferenceBackend():
+            return
+
+        qt.QSettings().setValue(self.inferenceBackendSettingsKey, backend)
+        if self._isRemoteLogic():
+            return
+
+        if self.logic is not None:
+            self.logic.stopSegmentation()
+        self.logic = self._createSlicerSegmentationLogic()
+        self._connectSegmentationLogic()
+
+    def _updateWorkerSettingsEnabled(self):
+        """
+        Settings only supported by the module worker are disabled for the SlicerNNUNet backend.
+        Adaptive test time augmentation runs without mirroring on SlicerNNUNet.
+        """
+        isWorker = self.inferenceBackendComboBox.currentData == self.workerBackend
+        for widget in [
+            self.foldProcessesSpinBox,
+            self.precisionComboBox,
+            self.keepProbabilitiesCheckBox,
+        ]:
+            widget.setEnabled(isWorker)
+
+    def _isRemoteLogic(self):
+        from .RemoteSegmentationLogic import RemoteSegmentationLogic
+        return isinstance(self.logic, RemoteSegmentationLogic)
+
+    def _isSlicerNNUNetLogic(self):
+        if not self.isNNUNetModuleInstalled():
+            return False
+
+        from SlicerNNUNetLib import SegmentationLogic
+        return isinstance(self.logic, SegmentationLogic)
+
+    def _logicParameter(self, parameter):
+        """
+        Converts the inference parameter to the SlicerNNUNet parameter when segmenting with SlicerNNUNet.
+        Settings specific to the module worker are dropped.
+        """
+        if not self._isSlicerNNUNetLogic():
+            return parameter
+
+        from SlicerNNUNetLib import Parameter
+        return Parameter(
+            folds=parameter.folds,
+            modelPath=parameter.modelPath,
+            device=parameter.device,
+            stepSize=parameter.stepSize,
+            disableTta=parameter.disableTta,
+            checkPointName=parameter.checkPointName
+        )
+
     def _createSlicerSegmentationLogic(self):
+        serverUrl = self.inferenceServerUrl()
+        if serverUrl:
+            from .RemoteSegmentationLogic import RemoteSegmentationLogic
+            return RemoteSegmentationLogic(serverUrl)
+
         if not self.isNNUNetModuleInstalled():
             return None
 
-        from SlicerNNUNetLib import SegmentationLogic
-        return SegmentationLogic()
+        # The module worker relies on nnU-Net internals and is opt-in
+        if self.inferenceBackend() != self.workerBackend:
+            from SlicerNNUNetLib import SegmentationLogic
+            return SegmentationLogic()
+
+        from .WorkerSegmentationLogic import WorkerSegmentationLogic
+        return WorkerSegmentationLogic()
 
     def _connectSegmentationLogic(self):
         if self.logic is None:
             return
 
         self.logic.progressInfo.connect(self.onProgressInfo)
+        self.logic.progressInfo.connect(self._onInferenceProgress)
         self.logic.errorOccurred.connect(self.onInferenceError)
         self.logic.inferenceFinished.connect(self.onInferenceFinished)
 
@@ -585,3 +1376,23 @@ class SegmentationWidget(qt.QWidget):
     def nnUnetFolder(cls):
         fileDir = Path(__file__).parent
         return fileDir.joinpath("..", "Resources", "ML").resolve()
+
+    @staticmethod
+    def memoryHistoryFile():
+        return Path(slicer.app.cachePath).joinpath("UpperAirwaySegmentator", "memory_history.jsonl")
+
+    @staticmethod
+    def runtimeCalibrationFile():
+        return Path(slicer.app.cachePath).joinpath("UpperAirwaySegmentator", "runtime_calibration.json")
+
+    @staticmethod
+    def modelCacheFolder():
+        return Path(slicer.app.cachePath).joinpath("UpperAirwaySegmentator", "Models")
+
+    @staticmethod
+    def preprocessingCacheFolder():
+        return Path(slicer.app.cachePath).joinpath("UpperAirwaySegmentator", "Preprocessing")
+
+    @staticmethod
+    def tileCheckpointFolder():
+        return Path(slicer.app.cachePath).joinpath("UpperAirwaySegmentator", "TileCheckpoints")
@@ -1,4 +1,6 @@
-from copy import copy
+import socket
+import threading
+from collections import deque
 from itertools import count
 
 
@@ -11,6 +13,7 @@ class Signal(object):
     def __init__(self, *typeInfo):
         self._id = count(0, 1)
         self._connectDict = {}
+        self._slots = ()
         self._typeInfo = str(typeInfo)
         self._isSignalBlocked = False
 
@@ -18,7 +21,8 @@ class Signal(object):
         if self._isSignalBlocked:
             return
 
-        for slot in copy(self._connectDict).values():
+        # Slots are snapshotted on connect / disconnect instead of copied on each emit
+        for slot in self._slots:
             slot(*args, **kwargs)
 
     def __call__(self, *args, **kwargs):
@@ -28,11 +32,13 @@ class Signal(object):
         assert slot, "Chosen slot should be a callable"
         nextId = next(self._id)
         self._connectDict[nextId] = slot
+        self._slots = tuple(self._connectDict.values())
         return nextId
 
     def disconnect(self, connectId):
         if connectId in self._connectDict:
             del self._connectDict[connectId]
+            self._slots = tuple(self._connectDict.values())
             return True
         return False
 
@@ -42,3 +48,121 @@ class Signal(object):
 
     def blockSignals(self, isBlocked):
         self._isSignalBlocked = isBlocked
+
+
+class SignalDispatcher:
+    """
+    Delivers the QueuedSignal emissions on the Qt main thread.
+    Signals with pending emissions are queued by the emitting threads and drained by a QTimer living on the main thread,
+    which only runs while signals are pending. QTimers can't be started from other threads, emitting threads wake the
+    main thread through a socket pair watched by a QSocketNotifier.
+    """
+
+    _instance = None
+
+    def __init__(self, intervalMs=20):
+        import qt
+
+        self._pendingSignals = deque()
+        self._mainThreadId = threading.get_ident()
+        self._lock = threading.Lock()
+        self._isWakeRequested = False
+        self._timer = qt.QTimer()
+        self._timer.setInterval(intervalMs)
+        self._timer.timeout.connect(self.drain)
+        self._wakeReader, self._wakeWriter = socket.socketpair()
+        self._wakeReader.setblocking(False)
+        self._wakeNotifier = qt.QSocketNotifier(self._wakeReader.fileno(), qt.QSocketNotifier.Read)
+        self._wakeNotifier.connect("activated(int)", self._onWake)
+
+    @classmethod
+    def instance(cls):
+        """
+        Must first be called from the main thread for the drain timer to live on the main thread.
+        """
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def isActive(self):
+        return self._timer.isActive()
+
+    def schedule(self, signal):
+        self._pendingSignals.append(signal)
+        if threading.get_ident() == self._mainThreadId:
+            self._startTimer()
+            return
+
+        # A single wake up is pending at a time, signals scheduled meanwhile are drained by the same timer run
+        with self._lock:
+            if self._isWakeRequested:
+                return
+            self._isWakeRequested = True
+        self._wakeWriter.send(b"\0")
+
+    def _onWake(self, *_):
+        with self._lock:
+            self._isWakeRequested = False
+        try:
+            self._wakeReader.recv(4096)
+        except BlockingIOError:
+            pass
+        self._startTimer()
+
+    def _startTimer(self):
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def drain(self):
+        while True:
+            try:
+                signal = self._pendingSignals.popleft()
+            except IndexError:
+                break
+            signal.deliverPending()
+
+        # Signals scheduled from now on start the timer again
+        self._timer.stop()
+
+
+class QueuedSignal(Signal):
+    """
+    Signal which can be emitted from any thread.
+
+    Emissions from the main thread are delivered synchronously as with Signal unless isDirectOnMainThread is False.
+    Emissions from other threads are queued and delivered in order on the main thread by the SignalDispatcher.
+
+    Must be created on the main thread.
+    """
+
+    def __init__(self, *typeInfo, isDirectOnMainThread=True):
+        super().__init__(*typeInfo)
+        self._isDirectOnMainThread = isDirectOnMainThread
+        self._queue = deque()
+        self._mainThreadId = threading.get_ident()
+        self._dispatcher = SignalDispatcher.instance()
+
+    def emit(self, *args, **kwargs):
+        if self._isSignalBlocked:
+            return
+
+        # Emissions already queued are delivered first to keep the emission order
+        if self._isDirectOnMainThread and threading.get_ident() == self._mainThreadId and not self.hasPending():
+            return super().emit(*args, **kwargs)
+
+        self._queue.append((args, kwargs))
+        self._dispatcher.schedule(self)
+
+    def hasPending(self):
+        return bool(self._queue)
+
+    def deliverPending(self):
+        """
+        Delivers the pending emissions on the calling thread. Called by the dispatcher on the main thread.
+        """
+        while True:
+            try:
+                args, kwargs = self._queue.popleft()
+            except IndexError:
+                return
+            super().emit(*args, **kwargs)
@@ -0,0 +1,422 @@
+import hashlib
+import json
+import time
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from enum import Enum
+from pathlib import Path
+
+import qt
+import slicer
+
+from .Signal import Signal
+
+
+class JobState(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass
+class Job:
+    jobId: str
+    inputPath: str
+    isDicom: bool
+    state: JobState = JobState.QUEUED
+    attempts: int = 0
+    queuedTime: float = field(default_factory=time.time)
+    startTime: float = 0.0
+    endTime: float = 0.0
+    error: str = ""
+
+    @property
+    def duration_s(self):
+        return max(0.0, self.endTime - self.startTime)
+
+    @property
+    def caseName(self):
+        name = Path(self.inputPath).name
+        for suffix in [".nii.gz", ".nii"]:
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+        return f"{name}_{self.jobId[:8]}"
+
+    def toDict(self):
+        values = asdict(self)
+        values["state"] = self.state.value
+        return values
+
+    @classmethod
+    def fromDict(cls, values):
+        values = dict(values)
+        values["state"] = JobState(values["state"])
+        return cls(**values)
+
+
+class JobJournal:
+    """
+    Append only journal of the watch folder jobs.
+    Each state change is written as one JSON line and flushed to disk. Reading the journal replays the lines and keeps
+    the latest state of each job, which makes it possible to resume the queue after a restart or a crash.
+    """
+
+    def __init__(self, journalPath):
+        self.journalPath = Path(journalPath)
+
+    def write(self, job: Job):
+        self.journalPath.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.journalPath, "a") as f:
+            f.write(json.dumps(job.toDict()) + "\n")
+            f.flush()
+
+    def read(self):
+        """
+        :returns: dict of job id to latest job value
+        """
+        jobs = {}
+        if not self.journalPath.exists():
+            return jobs
+
+        with open(self.journalPath, "r") as f:
+            for line in f:
+                try:
+                    job = Job.fromDict(json.loads(line))
+                except (ValueError, TypeError, KeyError):
+                    # Partially written line when the application was killed during the write
+                    continue
+                jobs[job.jobId] = job
+        return jobs
+
+
+class FolderScanner:
+    """
+    Finds complete NIfTI files and DICOM series in the input folders.
+
+    An input is considered complete once its size and modification time have not changed for settleTime_s seconds.
+    Inputs written before the settle time are considered complete when first seen.
+    """
+
+    niftiSuffixes = (".nii", ".nii.gz")
+
+    def __init__(self, inputFolders, settleTime_s=10.0, excludedFolders=None, clock=time.time):
+        self.inputFolders = [Path(folder) for folder in inputFolders]
+        self.excludedFolders = [Path(folder).resolve() for folder in (excludedFolders or [])]
+        self.settleTime_s = settleTime_s
+        self._clock = clock
+        self._lastSignatures = {}
+
+    def scan(self):
+        """
+        :returns: list of (path, isDicom, signature) for the inputs which are complete
+        """
+        now = self._clock()
+        readyInputs = []
+        seenPaths = set()
+        for path, isDicom in self._findInputs():
+            signature = self.inputSignature(path, isDicom)
+            if signature is None:
+                continue
+
+            seenPaths.add(path)
+            prevSignature, lastChangeTime = self._lastSignatures.get(path, (None, now))
+            if signature != prevSignature:
+                lastChangeTime = now
+            self._lastSignatures[path] = (signature, lastChangeTime)
+
+            lastWriteTime = signature[-1]
+            isUnchanged = signature == prevSignature and now - lastChangeTime >= self.settleTime_s
+            if isUnchanged or now - lastWriteTime >= self.settleTime_s:
+                readyInputs.append((path, isDicom, signature))
+
+        for path in set(self._lastSignatures) - seenPaths:
+            del self._lastSignatures[path]
+        return readyInputs
+
+    def _findInputs(self):
+        for inputFolder in self.inputFolders:
+            if not inputFolder.exists():
+                continue
+
+            for path in sorted(inputFolder.rglob("*")):
+                if self._isExcluded(path):
+                    continue
+                if path.is_file() and path.name.endswith(self.niftiSuffixes):
+                    yield path, False
+                elif path.is_dir() and self.isDicomSeriesFolder(path):
+                    yield path, True
+
+    def _isExcluded(self, path):
+        resolved = path.resolve()
+        return any(resolved == folder or folder in resolved.parents for folder in self.excludedFolders)
+
+    @staticmethod
+    def isDicomFile(path):
+        if path.suffix.lower() == ".dcm":
+            return True
+        try:
+            with open(path, "rb") as f:
+                f.seek(128)
+                return f.read(4) == b"DICM"
+        except OSError:
+            return False
+
+    @classmethod
+    def isDicomSeriesFolder(cls, path):
+        return any(cls.isDicomFile(child) for child in path.iterdir() if child.is_file())
+
+    @staticmethod
+    def inputSignature(path, isDicom):
+        """
+        :returns: (number of files, total size, last modification time) or None if the input disappeared.
+        """
+        try:
+            files = [child for child in path.iterdir() if child.is_file()] if isDicom else [path]
+            stats = [file.stat() for file in files]
+        except OSError:
+            return None
+
+        if not stats:
+            return None
+        return len(stats), sum(stat.st_size for stat in stats), max(stat.st_mtime for stat in stats)
+
+    @staticmethod
+    def jobId(path, signature):
+        return hashlib.sha1(f"{Path(path).resolve().as_posix()}|{signature}".encode()).hexdigest()
+
+
+class WatchFolderService:
+    """
+    Unattended segmentation of the volumes dropped in one or more input folders.
+
+    Complete inputs are queued and segmented one at a time through the input SegmentationWidget, using the same
+    pipeline as when clicking Apply. The selected export formats and a status.json file are written for each case to a
+    dedicated folder of the output folder. Job state changes are recorded in a journal stored in the output folder to
+    resume the queue after a restart.
+    """
+
+    journalFileName = "journal.jsonl"
+    statusFileName = "status.json"
+    maxAttempts = 2
+
+    def __init__(self, segmentationWidget, inputFolders, outputFolder, exportFormats, settleTime_s=10.0,
+                 scanInterval_s=5.0):
+        self.progressInfo = Signal("str")
+        self.statusChanged = Signal()
+
+        self.widget = segmentationWidget
+        self.outputFolder = Path(outputFolder)
+        self.exportFormats = exportFormats
+        self.scanner = FolderScanner(inputFolders, settleTime_s, excludedFolders=[outputFolder])
+        self.journal = JobJournal(self.outputFolder / self.journalFileName)
+
+        self.jobs = {}
+        self.queue = deque()
+        self.currentJob = None
+        self._loadedNodes = []
+        self._connections = []
+        self._wasInteractive = None
+        self._startTime = 0.0
+
+        self._scanTimer = qt.QTimer()
+        self._scanTimer.setInterval(int(scanInterval_s * 1000))
+        self._scanTimer.timeout.connect(self.scan)
+
+    def isRunning(self):
+        return self._scanTimer.isActive()
+
+    def start(self):
+        """
+        Restore the queue from the journal and start watching the input folders.
+        Jobs which were running when the service was stopped are queued again up to maxAttempts times.
+        """
+        if self.isRunning():
+            return
+
+        self._startTime = time.time()
+        self.jobs = self.journal.read()
+        for job in sorted(self.jobs.values(), key=lambda j: j.queuedTime):
+            if job.state == JobState.RUNNING and job.attempts >= self.maxAttempts:
+                self._setJobState(job, JobState.FAILED, error="Interrupted too many times.")
+            elif job.state in [JobState.QUEUED, JobState.RUNNING]:
+                self._setJobState(job, JobState.QUEUED)
+                self.queue.append(job)
+
+        self.progressInfo(f"Watch folder service started. {len(self.queue)} job(s) restored from journal.")
+        self._scanTimer.start()
+        self.scan()
+
+    def stop(self):
+        """
+        Stop watching the folders. The running job is stopped and queued again on next start.
+        """
+        self._scanTimer.stop()
+        if self.currentJob is not None:
+            job = self.currentJob
+            self._disconnectWidget()
+            self.widget.onStopClicked()
+            self._cleanupLoadedNodes()
+            self.currentJob = None
+            self._setJobState(job, JobState.QUEUED)
+        self.queue.clear()
+        self.progressInfo("Watch folder service stopped.")
+        self.statusChanged()
+
+    def scan(self):
+        for path, isDicom, signature in self.scanner.scan():
+            jobId = self.scanner.jobId(path, signature)
+            if jobId in self.jobs:
+                continue
+
+            job = Job(jobId=jobId, inputPath=path.as_posix(), isDicom=isDicom)
+            self.jobs[jobId] = job
+            self.journal.write(job)
+            self.queue.append(job)
+            self.progressInfo(f"Queued {job.inputPath}")
+
+        self.statusChanged()
+        self._startNextJob()
+
+    def queueDepth(self):
+        return len(self.queue)
+
+    def countJobs(self, state):
+        return sum(1 for job in self.jobs.values() if job.state == state)
+
+    def throughput_casesPerHour(self):
+        """
+        Number of cases processed per hour since the service was started.
+        """
+        doneJobs = [job for job in self.jobs.values() if job.state == JobState.DONE and job.endTime >= self._startTime]
+        elapsed_s = time.time() - self._startTime
+        if not doneJobs or elapsed_s <= 0:
+            return 0.0
+        return len(doneJobs) * 3600.0 / elapsed_s
+
+    def statusString(self):
+        return (
+            f"Queue : {self.queueDepth()} | Running : {1 if self.currentJob else 0} | "
+            f"Done : {self.countJobs(JobState.DONE)} | Failed : {self.countJobs(JobState.FAILED)} | "
+            f"Throughput : {self.throughput_casesPerHour():.1f} cases/h"
+        )
+
+    def _startNextJob(self):
+        if self.currentJob is not None or not self.queue or not self.isRunning():
+            return
+
+        job = self.queue.popleft()
+        self.currentJob = job
+        job.attempts += 1
+        job.startTime = time.time()
+        self._setJobState(job, JobState.RUNNING)
+        self.progressInfo(f"Segmenting {job.inputPath} ({self.queueDepth()} job(s) remaining in queue)")
+
+        try:
+            volumeNode = self._loadInput(job)
+        except Exception as e:  # noqa
+            self._onJobFailed(f"Failed to load input : {e}")
+            return
+
+        self._wasInteractive = self.widget.isInteractive
+        self.widget.isInteractive = False
+        self._connections = [
+            (self.widget.segmentationFinished, self.widget.segmentationFinished.connect(self._onJobFinished)),
+            (self.widget.segmentationFailed, self.widget.segmentationFailed.connect(self._onJobFailed)),
+        ]
+        self.widget.inputSelector.setCurrentNode(volumeNode)
+        self.widget.segmentationNodeSelector.setCurrentNode(None)
+        self.widget.onApplyClicked()
+
+    def _loadInput(self, job):
+        if not job.isDicom:
+            volumeNode = slicer.util.loadVolume(job.inputPath)
+            self._loadedNodes.append(volumeNode)
+            return volumeNode
+
+        from DICOMLib import DICOMUtils
+        loadedNodeIds = []
+        with DICOMUtils.TemporaryDICOMDatabase() as db:
+            DICOMUtils.importDicom(job.inputPath, db)
+            for patientUID in db.patients():
+                loadedNodeIds.extend(DICOMUtils.loadPatientByUID(patientUID))
+
+        loadedNodes = [slicer.mrmlScene.GetNodeByID(nodeId) for nodeId in loadedNodeIds]
+        self._loadedNodes.extend(node for node in loadedNodes if node is not None)
+        volumeNodes = [node for node in loadedNodes if node is not None and node.IsA("vtkMRMLScalarVolumeNode")]
+        if not volumeNodes:
+            raise RuntimeError("No scalar volume found in DICOM series.")
+
+        # Use the series with the most voxels if the folder contains more than one series
+        return max(volumeNodes, key=lambda node: node.GetImageData().GetNumberOfPoints())
+
+    def _onJobFinished(self, segmentationNode):
+        job = self.currentJob
+        self._disconnectWidget()
+        if job is None:
+            return
+
+        caseFolder = self._caseFolder(job)
+        try:
+            caseFolder.mkdir(parents=True, exist_ok=True)
+            self.widget.exportSegmentation(segmentationNode, caseFolder.as_posix(), self.exportFormats)
+        except Exception as e:  # noqa
+            self._onJobFailed(f"Failed to export results : {e}")
+            return
+
+        self._loadedNodes.append(segmentationNode)
+        self._finishJob(job, JobState.DONE)
+        self.progressInfo(f"Done {job.inputPath} in {job.duration_s:.0f} s. {self.statusString()}")
+
+    def _onJobFailed(self, errorMsg):
+        job = self.currentJob
+        self._disconnectWidget()
+        if job is None:
+            return
+
+        self._finishJob(job, JobState.FAILED, error=errorMsg)
+        self.progressInfo(f"Failed {job.inputPath} : {errorMsg}")
+
+    def _finishJob(self, job, state, error=""):
+        job.endTime = time.time()
+        self._setJobState(job, state, error)
+        self._writeStatusFile(job)
+        self._cleanupLoadedNodes()
+        self.currentJob = None
+        self.statusChanged()
+        qt.QTimer.singleShot(0, self._startNextJob)
+
+    def _setJobState(self, job, state, error=""):
+        job.state = state
+        job.error = error
+        self.journal.write(job)
+
+    def _caseFolder(self, job):
+        return self.outputFolder / job.caseName
+
+    def _writeStatusFile(self, job):
+        caseFolder = self._caseFolder(job)
+        caseFolder.mkdir(parents=True, exist_ok=True)
+        status = job.toDict()
+        status["duration_s"] = job.duration_s
+        status["exportFormats"] = [exportFormat.name for exportFormat in type(self.exportFormats)
+                                   if exportFormat & self.exportFormats]
+        with open(caseFolder / self.statusFileName, "w") as f:
+            json.dump(status, f, indent=2)
+
+    def _disconnectWidget(self):
+        """
+        Disconnect the widget from the current job and restore its interactive mode.
+        """
+        for signal, connectId in self._connections:
+            signal.disconnect(connectId)
+        self._connections = []
+        if self._wasInteractive is not None:
+            self.widget.isInteractive = self._wasInteractive
+            self._wasInteractive = None
+
+    def _cleanupLoadedNodes(self):
+        for node in self._loadedNodes:
+            if node is not None and node.GetScene() is not None:
+                slicer.mrmlScene.RemoveNode(node)
+        self._loadedNodes = []
@@ -0,0 +1,130 @@
+import ctk
+import qt
+
+from .Utils import createButton
+from .WatchFolderService import WatchFolderService
+
+
+class WatchFolderWidget(qt.QWidget):
+    """
+    Configuration and status panel of the watch folder service.
+    The folders and settle time are stored in the application settings to be restored on next launch.
+    """
+
+    settingsKey = "UpperAirwaySegmentator/WatchFolder"
+
+    def __init__(self, segmentationWidget, parent=None):
+        super().__init__(parent)
+        self.segmentationWidget = segmentationWidget
+        self.service = None
+
+        self.inputFoldersLineEdit = qt.QLineEdit(self)
+        self.inputFoldersLineEdit.setPlaceholderText("Input folders separated by ';'")
+        addInputButton = createButton("...", callback=self.onAddInputFolderClicked, toolTip="Add input folder.")
+        inputLayout = qt.QHBoxLayout()
+        inputLayout.setContentsMargins(0, 0, 0, 0)
+        inputLayout.addWidget(self.inputFoldersLineEdit, 1)
+        inputLayout.addWidget(addInputButton)
+
+        self.outputFolderLineEdit = ctk.ctkPathLineEdit(self)
+        self.outputFolderLineEdit.filters = ctk.ctkPathLineEdit.Dirs
+
+        self.settleTimeSpinBox = qt.QSpinBox(self)
+        self.settleTimeSpinBox.setRange(1, 3600)
+        self.settleTimeSpinBox.setSuffix(" s")
+        self.settleTimeSpinBox.setToolTip("Inputs are processed once they have not been modified for this duration.")
+
+        self.startButton = createButton(
+            "Start service",
+            callback=self.onStartStopClicked,
+            isCheckable=True,
+            toolTip="Watch the input folders and segment new volumes until stopped."
+        )
+        self.statusLabel = qt.QLabel("Service stopped.", self)
+        self.statusLabel.setWordWrap(True)
+
+        layout = qt.QFormLayout(self)
+        layout.addRow("Input folders :", inputLayout)
+        layout.addRow("Output folder :", self.outputFolderLineEdit)
+        layout.addRow("Settle time :", self.settleTimeSpinBox)
+        layout.addRow(self.startButton)
+        layout.addRow(self.statusLabel)
+
+        # Throughput decreases between job completions, refresh it periodically
+        self._statusTimer = qt.QTimer(self)
+        self._statusTimer.setInterval(10000)
+        self._statusTimer.timeout.connect(self.updateStatus)
+        self.loadSettings()
+
+    def inputFolders(self):
+        return [folder.strip() for folder in self.inputFoldersLineEdit.text.split(";") if folder.strip()]
+
+    def onAddInputFolderClicked(self):
+        folderPath = qt.QFileDialog.getExistingDirectory(self, "Please select the input folder")
+        if folderPath:
+            self.inputFoldersLineEdit.setText(";".join(self.inputFolders() + [folderPath]))
+
+    def onStartStopClicked(self, isChecked):
+        if isChecked:
+            self.startService()
+        else:
+            self.stopService()
+
+    def startService(self):
+        import slicer
+        from .SegmentationWidget import ExportFormat
+
+        outputFolder = self.outputFolderLineEdit.currentPath
+        exportFormats = self.segmentationWidget.getSelectedExportFormats()
+        if not self.inputFolders() or not outputFolder or exportFormats == ExportFormat(0):
+            slicer.util.warningDisplay(
+                "Please select at least one input folder, the output folder and one export format before starting the"
+                " service."
+            )
+            self.startButton.setChecked(False)
+            return
+
+        self.saveSettings()
+        self.service = WatchFolderService(
+            self.segmentationWidget,
+            self.inputFolders(),
+            outputFolder,
+            exportFormats,
+            settleTime_s=self.settleTimeSpinBox.value
+        )
+        self.service.progressInfo.connect(self.segmentationWidget.onProgressInfo)
+        self.service.statusChanged.connect(self.updateStatus)
+        self._setConfigurationEnabled(False)
+        self.startButton.setText("Stop service")
+        self.service.start()
+        self._statusTimer.start()
+
+    def stopService(self):
+        if self.service is not None:
+            self.service.stop()
+            self.service = None
+        self._statusTimer.stop()
+        self._setConfigurationEnabled(True)
+        self.startButton.setText("Start service")
+        self.statusLabel.setText("Service stopped.")
+
+    def updateStatus(self):
+        if self.service is not None:
+            self.statusLabel.setText(self.service.statusString())
+
+    def _setConfigurationEnabled(self, isEnabled):
+        self.inputFoldersLineEdit.setEnabled(isEnabled)
+        self.outputFolderLineEdit.setEnabled(isEnabled)
+        self.settleTimeSpinBox.setEnabled(isEnabled)
+
+    def loadSettings(self):
+        settings = qt.QSettings()
+        self.inputFoldersLineEdit.setText(settings.value(f"{self.settingsKey}/InputFolders", ""))
+        self.outputFolderLineEdit.currentPath = settings.value(f"{self.settingsKey}/OutputFolder", "")
+        self.settleTimeSpinBox.setValue(int(settings.value(f"{self.settingsKey}/SettleTime", 10)))
+
+    def saveSettings(self):
+        settings = qt.QSettings()
+        settings.setValue(f"{self.settingsKey}/InputFolders", self.inputFoldersLineEdit.text)
+        settings.setValue(f"{self.settingsKey}/OutputFolder", self.outputFolderLineEdit.currentPath)
+        settings.setValue(f"{self.settingsKey}/SettleTime", self.settleTimeSpinBox.value)
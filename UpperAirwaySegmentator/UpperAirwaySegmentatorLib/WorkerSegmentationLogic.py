@@ -0,0 +1,244 @@
+import shutil
+from pathlib import Path
+
+import qt
+import slicer
+
+from UpperAirwaySegmentatorInference.Cancellation import CancelFile
+
+from .BackgroundTask import BackgroundTask
+from .Signal import Signal
+
+
+class WorkerSegmentationLogic:
+    """
+    Runs the segmentation in the module inference worker process.
+    Same interface as the SlicerNNUNet SegmentationLogic which lets the widget use either logic.
+    """
+
+    inputFileName = "input_0000.nii"
+    cancelFileName = "cancel"
+
+    # Seconds given to a stopped worker to finish its current tile and exit before it is killed
+    stopTimeout_s = 5.0
+
+    def __init__(self):
+        self.inferenceFinished = Signal()
+        self.errorOccurred = Signal("str")
+        self.progressInfo = Signal("str")
+
+        self.inferenceProcess = None
+        self._stoppingProcesses = []
+        self._cleanupTasks = []
+        self._parameter = None
+        self._tmpDir = qt.QTemporaryDir()
+        self._benchmarkProcess = None
+
+    def __del__(self):
+        for process in [self.inferenceProcess, self._benchmarkProcess, *self._stoppingProcesses]:
+            if process is not None and process.state() != qt.QProcess.NotRunning:
+                process.kill()
+
+    def setParameter(self, parameter):
+        self._parameter = parameter
+
+    @property
+    def inputFolder(self):
+        return Path(self._tmpDir.path()).joinpath("input")
+
+    @property
+    def outputFolder(self):
+        return Path(self._tmpDir.path()).joinpath("output")
+
+    @property
+    def cancelFile(self):
+        return Path(self._tmpDir.path()).joinpath(self.cancelFileName)
+
+    def startSegmentation(self, volumeNode):
+        """
+        Export the volume to the worker input folder and start the worker process.
+        The volume is saved uncompressed which is faster and gives identical files for identical volumes, allowing the
+        worker to reuse its cached preprocessing when segmenting the same volume again.
+        """
+        self.stopSegmentation()
+        # Stopped workers still running would write the tile checkpoints resumed by the new worker
+        self._killStoppedWorkers()
+        self._tmpDir = qt.QTemporaryDir()
+        self.inputFolder.mkdir(parents=True)
+        self.outputFolder.mkdir(parents=True)
+
+        inputFile = self.inputFolder.joinpath(self.inputFileName)
+        self.progressInfo("Transferring volume to the inference process...\n")
+        if not slicer.util.exportNode(volumeNode, inputFile.as_posix()):
+            self.errorOccurred(f"Failed to export {volumeNode.GetName()} to the inference process.")
+            return
+
+        args = self._workerArgs(
+            "--input", inputFile.as_posix(),
+            "--output", self.outputFolder.as_posix(),
+            "--cancel-file", self.cancelFile.as_posix(),
+        )
+        self.progressInfo("Starting inference process...\n")
+        self._startWorker(args)
+
+    def _startWorker(self, args):
+        from UpperAirwaySegmentatorInference.WorkerPool import pythonExecutable
+
+        process = qt.QProcess()
+        process.setProcessChannelMode(qt.QProcess.MergedChannels)
+        process.setProcessEnvironment(self._workerEnvironment())
+        process.finished.connect(lambda *_: self.onFinished(process))
+        process.errorOccurred.connect(lambda error: self.onErrorOccurred(process, error))
+        process.readyRead.connect(lambda: self.onCheckProcessOutput(process))
+        self.inferenceProcess = process
+        process.start(pythonExecutable(), args, qt.QProcess.Unbuffered | qt.QProcess.ReadOnly)
+
+    def runBenchmark(self, duration_s=5.0):
+        """
+        Runs the worker benchmark with the current parameter. Qt events are processed while the benchmark runs and the
+        benchmark is stopped by stopSegmentation.
+
+        :returns: benchmark dict or None if the benchmark failed or was stopped
+        """
+        from UpperAirwaySegmentatorInference.Worker import parseBenchmark
+        from UpperAirwaySegmentatorInference.WorkerPool import pythonExecutable
+
+        process = qt.QProcess()
+        process.setProcessChannelMode(qt.QProcess.MergedChannels)
+        process.setProcessEnvironment(self._workerEnvironment())
+        process.start(pythonExecutable(), self._workerArgs("--benchmark", str(duration_s)))
+        self._benchmarkProcess = process
+
+        output = []
+        while not process.waitForFinished(100) and process.state() != qt.QProcess.NotRunning:
+            output.append(process.readAll().data().decode())
+            slicer.app.processEvents()
+        output.append(process.readAll().data().decode())
+        self._benchmarkProcess = None
+
+        if process.exitStatus() == qt.QProcess.CrashExit or process.exitCode() != 0:
+            return None
+        return parseBenchmark("".join(output).splitlines())
+
+    def _workerEnvironment(self):
+        environment = qt.QProcessEnvironment.systemEnvironment()
+        packageFolder = Path(__file__).parent.parent.as_posix()
+        pythonPath = environment.value("PYTHONPATH")
+        environment.insert("PYTHONPATH", qt.QDir.listSeparator().join(filter(None, [packageFolder, pythonPath])))
+        return environment
+
+    def _workerArgs(self, *extraArgs):
+        return ["-m", "UpperAirwaySegmentatorInference.Worker", *self._parameter.toWorkerArgs(), *extraArgs]
+
+    def stopSegmentation(self):
+        """
+        Requests the worker to stop and returns without waiting for it. The worker stops after its current sliding
+        window tile and is killed if it is still running after stopTimeout_s. Its temporary files are removed in the
+        background once it has exited. Stopped workers don't emit the logic signals.
+        """
+        if self._benchmarkProcess is not None and self._benchmarkProcess.state() == qt.QProcess.Running:
+            self._benchmarkProcess.kill()
+
+        process = self.inferenceProcess
+        if process is None or process.state() == qt.QProcess.NotRunning:
+            return
+
+        self.inferenceProcess = None
+        tmpDir, self._tmpDir = self._tmpDir, qt.QTemporaryDir()
+        tmpDir.setAutoRemove(False)
+        self.progressInfo("Stopping inference process...\n")
+        CancelFile(Path(tmpDir.path()).joinpath(self.cancelFileName)).request()
+        self._stoppingProcesses.append(process)
+        process.finished.connect(lambda *_: self._onStoppedWorkerFinished(process, tmpDir.path()))
+        qt.QTimer.singleShot(int(self.stopTimeout_s * 1000), lambda: self._killStoppedWorker(process))
+
+    def _killStoppedWorker(self, process):
+        if process in self._stoppingProcesses and process.state() != qt.QProcess.NotRunning:
+            process.kill()
+
+    def _killStoppedWorkers(self):
+        for process in list(self._stoppingProcesses):
+            self._killStoppedWorker(process)
+            process.waitForFinished(int(self.stopTimeout_s * 1000))
+
+    def _onStoppedWorkerFinished(self, process, tmpPath):
+        if process in self._stoppingProcesses:
+            self._stoppingProcesses.remove(process)
+        self._removeInBackground(tmpPath)
+
+    def _removeInBackground(self, path):
+        self._cleanupTasks = [task for task in self._cleanupTasks if task.isRunning()]
+        self._cleanupTasks.append(BackgroundTask(shutil.rmtree, path, ignore_errors=True).start())
+
+    def hasStoppingWorkers(self):
+        """
+        :returns: True while stopped workers are still running or their temporary files are being removed
+        """
+        return bool(self._stoppingProcesses) or any(task.isRunning() for task in self._cleanupTasks)
+
+    def waitForSegmentationFinished(self):
+        """
+        Blocks until the worker and the stopped workers have exited.
+        """
+        if self.inferenceProcess is not None:
+            self.inferenceProcess.waitForFinished(-1)
+        self._killStoppedWorkers()
+
+    def onCheckProcessOutput(self, process):
+        report = process.readAll().data().decode()
+        if report and process is self.inferenceProcess:
+            self.progressInfo(report)
+
+    def onFinished(self, process):
+        if process is not self.inferenceProcess:
+            return
+
+        if process.exitStatus() == qt.QProcess.CrashExit:
+            self._reportCrash(process)
+            return
+
+        if process.exitCode() != 0:
+            self.errorOccurred(f"Inference process failed with exit code {process.exitCode()}.")
+            return
+
+        self.inferenceFinished()
+
+    def onErrorOccurred(self, process, error):
+        # Stopped workers are detached before being killed, their crash isn't reported
+        if process is not self.inferenceProcess:
+            return
+
+        if error == qt.QProcess.Crashed:
+            self._reportCrash(process)
+            return
+
+        self.errorOccurred(process.errorString())
+
+    def _reportCrash(self, process):
+        """
+        Reports the crash of the worker, for instance when it was killed by the system after running out of memory.
+        Qt signals crashes with both errorOccurred and finished, the process is detached once reported for the crash to
+        be reported once.
+        """
+        self.onCheckProcessOutput(process)
+        self.inferenceProcess = None
+        self.errorOccurred("Inference process crashed. The computer may have run out of memory.")
+
+    def probabilityMapPath(self):
+        """
+        :returns: path of the probability map saved by the worker or None if it wasn't saved
+        """
+        from UpperAirwaySegmentatorInference.ProbabilityMap import PROBABILITY_MAP_SUFFIX
+        path = self.outputFolder.joinpath("input" + PROBABILITY_MAP_SUFFIX)
+        return path if path.exists() else None
+
+    def loadSegmentation(self):
+        """
+        :returns: segmentation node loaded from the worker output
+        """
+        outputFiles = sorted(self.outputFolder.glob("input.nii*")) if self.outputFolder.exists() else []
+        if not outputFiles:
+            raise RuntimeError(
+                f"Failed to load the segmentation.\nCheck the inference folder content {self.outputFolder}"
+            )
+        return slicer.util.loadSegmentation(outputFiles[0].as_posix())
@@ -3,3 +3,5 @@ from .PythonDependencyChecker import PythonDependencyChecker
 from .SegmentationWidget import SegmentationWidget, ExportFormat
 from .Utils import createButton
 from .IconPath import iconPath, icon
+from .WatchFolderService import WatchFolderService, FolderScanner, JobJournal, Job, JobState
+from .WatchFolderWidget import WatchFolderWidget